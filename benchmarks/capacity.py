@@ -0,0 +1,407 @@
+"""
+Capacity of the API across server sizes, dataset sizes and payload sizes
+
+Runs the same workload of RestTester operations against every cell of a
+matrix of:
+
+    * workers:  server processes sharing the port (app.py --workers)
+    * threads:  threads answering requests in each process (app.py
+                --threads), 0 for a thread per connection
+    * posts:    posts added to the default database by make_dataset(), in
+                categories of --posts-per-category posts
+    * payload:  characters of the post bodies, in the database and in the
+                posts created, and of the names of the categories created,
+                as in the *_big_payload tests
+
+Each cell gets a fresh copy of its dataset and a server launched on it by
+RestTester.launch_server. --clients threads then run --ops operations each,
+drawn from MIX with --seed, so every cell runs the same operations in the
+same order. Nothing is retried, so any status other than the expected one
+counts as an error.
+
+Prints a table of throughput, latency and errors per cell, then the knees
+found along each axis, with the other axes fixed, and in how many of those
+series each was found:
+
+    * scaling: the last workers or threads value after which adding more
+      raised throughput by less than --min-gain
+    * latency: the first value at which p99 grew more than --max-p99-growth
+      times over the previous one
+    * errors:  the first value at which more than --max-error-rate of the
+      operations failed
+
+Usage:
+    python benchmarks/capacity.py [--workers 1 2 4] [--threads 0 8]
+        [--posts 0 2000 20000] [--payload 100 300] [--clients 8] [--ops 50]
+        [--seed 1] [--config config.json] [--json out.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from math import ceil
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+from tester_interface.histogram import Histogram  # noqa: E402
+from tester_interface.loadgen import DIGITS  # noqa: E402
+from tester_interface.rest_tester import RestTester  # noqa: E402
+from tester_interface.templates import random_text  # noqa: E402
+
+AXES = ('workers', 'threads', 'posts', 'payload')
+# Axes adding capacity, along which throughput should scale
+CAPACITY_AXES = ('workers', 'threads')
+
+DEFAULT_DB = os.path.join(ROOT, 'default_database', 'db.sqlite')
+
+# Operation -> weight
+MIX = {
+    'posts':           30,  # GET /blog/posts/, first page
+    'summary':         20,  # GET /blog/categories/<id>/summary
+    'archive':         10,  # GET /blog/posts/archive/<year>/
+    'category':        10,  # GET /blog/categories/<id>, with all its posts
+    'categories':      10,  # GET /blog/categories/
+    'create_post':     15,  # POST /blog/posts/
+    'create_category':  5,  # POST /blog/categories/
+}
+
+# Operation -> function sending it with a RestTester, and its arguments
+OPERATIONS = {
+    'posts':           lambda t, a: t.get_blog_posts({'per_page': 10}),
+    'summary':         lambda t, a: t.get_category_summary(a['id'], 10),
+    'archive':         lambda t, a: t.get_blog_posts_archive(a['year']),
+    'category':        lambda t, a: t.get_category_by_id(a['id']),
+    'categories':      lambda t, a: t.get_categories(),
+    'create_post':     lambda t, a: t.post_blog_posts(a['post']),
+    'create_category': lambda t, a: t.post_categories(name=a['name']),
+}
+
+FIRST_YEAR = 2016
+YEARS = 5
+
+
+def make_dataset(path, n_posts, body_chars, posts_per_category=100, seed=0):
+    """
+    Copies the default database to path, and adds n_posts posts to it, in
+    new categories of posts_per_category posts, published over YEARS years.
+    The category summaries are dropped, the API builds them when it starts.
+
+    Returns:
+        list: Ids of all the categories
+    """
+    shutil.copyfile(DEFAULT_DB, path)
+    rng = random.Random(seed)
+    _start = datetime(FIRST_YEAR, 1, 1)
+    _span = (datetime(FIRST_YEAR + YEARS, 1, 1) - _start).total_seconds()
+    _conn = sqlite3.connect(path)
+    with _conn:
+        _first = _conn.execute("SELECT MAX(id) FROM category").fetchone()[0] + 1
+        _n_categories = ceil(n_posts / posts_per_category)
+        _conn.executemany("INSERT INTO category (id, name, version) VALUES (?, ?, 1)",
+                          ((_first + _i, f"Capacity {_i}") for _i in range(_n_categories)))
+        _conn.executemany(
+            "INSERT INTO post (title, body, pub_date, category_id, version) VALUES (?, ?, ?, ?, 1)",
+            ((f"Post {_i}", random_text(body_chars, rng=rng),
+              (_start + timedelta(seconds=rng.random() * _span)).strftime('%Y-%m-%d %H:%M:%S.%f'),
+              _first + _i // posts_per_category) for _i in range(n_posts)))
+        _conn.execute("DELETE FROM category_summary")
+    _conn.close()
+    return list(range(1, _first + _n_categories))
+
+
+def plan(rng, n_ops, category_ids, payload):
+    """
+    Returns:
+        list: (operation, arguments) to run, drawn from MIX
+    """
+    _names = list(MIX)
+    _weights = [MIX[_n] for _n in _names]
+    ops = []
+    for _op in rng.choices(_names, _weights, k=n_ops):
+        _args = {'id': rng.choice(category_ids), 'year': FIRST_YEAR + rng.randrange(YEARS)}
+        if _op == 'create_post':
+            _args['post'] = {'title': f"Capacity {random_text(10, rng=rng)}",
+                             'body': random_text(payload, rng=rng), 'category_id': _args['id']}
+        elif _op == 'create_category':
+            _args['name'] = random_text(payload, rng=rng)
+        ops.append((_op, _args))
+    return ops
+
+
+def _free_port():
+    with socket.socket() as _s:
+        _s.bind(('127.0.0.1', 0))
+        return _s.getsockname()[1]
+
+
+def _cell_config(config_file, path, db_path):
+    """
+    Writes a copy of config_file to path, for a server on a free port serving
+    db_path, and quiet clients that don't retry
+    """
+    _dir = os.path.dirname(os.path.abspath(config_file))
+    with open(config_file, 'r') as _f:
+        config = json.load(_f)
+    _server_name = f"localhost:{_free_port()}"
+    _server = config.setdefault('server', {})
+    _server['launch_server_name'] = _server_name
+    _server['app_path'] = os.path.join(_dir, _server.get('app_path',
+                                                         './rest_api_demo-techtest1.2/rest_api_demo/app.py'))
+    config.update({
+        'base_url': f"http://{_server_name}/",
+        'default_db_path': os.path.join(_dir, config['default_db_path']),
+        'database_path': db_path,
+        'retry': {'max_retries': 0},
+        'output': {'level': 'error'},
+    })
+    with open(path, 'w') as _f:
+        json.dump(config, _f)
+
+
+def measure(config_file, plans, workers, threads, server_args=()):
+    """
+    Launches a server and runs one plan per client against it, at once
+
+    Returns:
+        dict: 'throughput' in operations per second, 'p50_ms' and 'p99_ms'
+            latency, 'errors' and 'error_rate' of the operations, and the
+            'statuses' they got
+    """
+    launcher = RestTester(config_file)
+    proc, _ttfr = launcher.launch_server(extra_args=['--workers', str(workers), '--threads', str(threads)]
+                                         + list(server_args))
+    if _ttfr is None:
+        launcher.stop_server(proc)
+        raise RuntimeError(f"The API didn't start with {workers} workers and {threads} threads")
+    testers = [RestTester(config_file) for _ in plans]
+    latencies = []
+    statuses = {}
+    _lock = threading.Lock()
+    _barrier = threading.Barrier(len(plans) + 1)
+    _expected = {_op: RestTester.SUC_HTTP_CREATED if _op.startswith('create') else RestTester.SUC_HTTP_OK
+                 for _op in OPERATIONS}
+    errors = [0]
+
+    def _client(tester, ops):
+        # Opens the connection pool of the thread before the start
+        tester.get_categories()
+        _latencies = []
+        _statuses = {}
+        _errors = 0
+        _barrier.wait()
+        for _op, _args in ops:
+            _start = time.perf_counter()
+            try:
+                _key = OPERATIONS[_op](tester, _args).status_code
+            except Exception as e:
+                _key = type(e).__name__
+            _latencies.append((time.perf_counter() - _start) * 1000)
+            _statuses[_key] = _statuses.get(_key, 0) + 1
+            _errors += _key != _expected[_op]
+        with _lock:
+            latencies.extend(_latencies)
+            for _key, _n in _statuses.items():
+                statuses[_key] = statuses.get(_key, 0) + _n
+            errors[0] += _errors
+
+    _threads = [threading.Thread(target=_client, args=_a) for _a in zip(testers, plans)]
+    try:
+        for _t in _threads:
+            _t.start()
+        _barrier.wait()
+        _start = time.perf_counter()
+        for _t in _threads:
+            _t.join()
+        _elapsed = time.perf_counter() - _start
+    finally:
+        launcher.stop_server(proc)
+
+    _n = len(latencies)
+    _histogram = _latency_histogram(latencies)
+    return {
+        'throughput': _n / _elapsed,
+        'p50_ms': _histogram.percentile(50) / 1000,
+        'p99_ms': _histogram.percentile(99) / 1000,
+        'errors': errors[0],
+        'error_rate': errors[0] / _n,
+        'statuses': {str(_k): _v for _k, _v in sorted(statuses.items(), key=str)},
+        'ttfr_ms': _ttfr,
+    }
+
+
+def _latency_histogram(latencies):
+    "Histogram of latencies in ms, recorded in microseconds as by the tester"
+    _histogram = Histogram(DIGITS)
+    for _ms in latencies:
+        _histogram.record(_ms * 1000)
+    return _histogram
+
+
+def _order(axis, value):
+    # 0 threads is a thread per connection, the most there can be
+    return float('inf') if axis == 'threads' and value == 0 else value
+
+
+def _row_knees(axis, row, min_gain, max_p99_growth, max_error_rate):
+    """
+    Knees along axis of a series of cells sorted by it, see find_knees()
+
+    Returns:
+        list: (kind, value of the axis it is at, detail) of each knee
+    """
+    knees = []
+    _pairs = list(zip(row, row[1:]))
+    if axis in CAPACITY_AXES:
+        for _prev, _cur in _pairs:
+            _gain = _cur['throughput'] / _prev['throughput'] - 1
+            if _gain < min_gain:
+                knees.append(('scaling', _prev[axis], f"{axis}={_cur[axis]} adds {_gain:+.0%} throughput"))
+                break
+    for _prev, _cur in _pairs:
+        _growth = _cur['p99_ms'] / max(_prev['p99_ms'], 1e-3)
+        if _growth > max_p99_growth:
+            knees.append(('latency', _cur[axis], f"p99 x{_growth:.1f} over {axis}={_prev[axis]}"))
+            break
+    for _cur in row:
+        if _cur['error_rate'] > max_error_rate:
+            knees.append(('errors', _cur[axis], f"{_cur['error_rate']:.1%} of operations failed"))
+            break
+    return knees
+
+
+def find_knees(cells, min_gain=0.1, max_p99_growth=2.0, max_error_rate=0.01):
+    """
+    Walks each axis with the others fixed, see the module docstring
+
+    Returns:
+        list: dicts with the 'axis', the 'kind' of knee ('scaling', 'latency'
+            or 'errors'), the value of the axis it is 'at', the values of the
+            other axes it was found with ('fixed') and a 'detail'
+    """
+    knees = []
+    for axis in AXES:
+        _others = [_a for _a in AXES if _a != axis]
+        series = {}
+        for _cell in cells:
+            series.setdefault(tuple(_cell[_a] for _a in _others), []).append(_cell)
+        for _fixed, _row in series.items():
+            if len(_row) < 2:
+                continue
+            _row.sort(key=lambda _c: _order(axis, _c[axis]))
+            _fixed = dict(zip(_others, _fixed))
+            for _kind, _at, _detail in _row_knees(axis, _row, min_gain, max_p99_growth, max_error_rate):
+                knees.append({'axis': axis, 'kind': _kind, 'at': _at, 'fixed': _fixed, 'detail': _detail})
+    return knees
+
+
+def _run_matrix(args):
+    """
+    Measures every cell of the matrix of args, each on a copy of its dataset
+
+    Returns:
+        list: The cells measured, dicts of the value of each axis and the
+            figures of measure()
+    """
+    _dir = tempfile.mkdtemp(dir=args.dir)
+    _config = os.path.join(_dir, 'config.json')
+    _db = os.path.join(_dir, 'served.sqlite')
+    cells = []
+    try:
+        for _posts, _payload in itertools.product(args.posts, args.payload):
+            _dataset = os.path.join(_dir, f"dataset_{_posts}_{_payload}.sqlite")
+            _ids = make_dataset(_dataset, _posts, _payload, args.posts_per_category, args.seed)
+            plans = [plan(random.Random(f"{args.seed}-{_i}"), args.ops, _ids, _payload) for _i in range(args.clients)]
+            for _workers, _threads in itertools.product(args.workers, args.threads):
+                shutil.copyfile(_dataset, _db)
+                _cell_config(args.config, _config, _db)
+                _cell = {'workers': _workers, 'threads': _threads, 'posts': _posts, 'payload': _payload}
+                try:
+                    _cell.update(measure(_config, plans, _workers, _threads, args.server_args))
+                except RuntimeError as e:
+                    # Left out of the table, the rest of the matrix still runs
+                    print(f"Skipped {_cell}: {e}", file=sys.stderr)
+                    continue
+                cells.append(_cell)
+                # Progress, a matrix can take a while
+                print(f"workers={_workers} threads={_threads} posts={_posts} payload={_payload}:"
+                      f" {_cell['throughput']:.1f} ops/s, {_cell['statuses']}", file=sys.stderr)
+    finally:
+        shutil.rmtree(_dir, ignore_errors=True)
+    return cells
+
+
+def _print_knees(knees, cells):
+    """
+    Prints, per kind and axis, the values knees were found at, and in how
+    many of the series along that axis
+    """
+    _grouped = {}
+    for _k in knees:
+        _at = _grouped.setdefault((_k['kind'], _k['axis']), {})
+        _at[_k['at']] = _at.get(_k['at'], 0) + 1
+    for (_kind, _axis), _at in _grouped.items():
+        _n_series = 1
+        for _a in AXES:
+            if _a != _axis:
+                _n_series *= len({_c[_a] for _c in cells})
+        _where = ', '.join(f"{_v} in {_n}/{_n_series}" for _v, _n in sorted(_at.items(), key=lambda _i: -_i[1]))
+        print(f"  {_kind:<9}{_axis + ':':<9}{_where}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Server processes')
+    parser.add_argument('--threads', type=int, nargs='+', default=[0, 8],
+                        help='Threads per server process, 0 for one per connection')
+    parser.add_argument('--posts', type=int, nargs='+', default=[0, 2000, 20000],
+                        help='Posts added to the default database')
+    parser.add_argument('--payload', type=int, nargs='+', default=[100, 300],
+                        help='Characters of post bodies and category names')
+    parser.add_argument('--posts-per-category', type=int, default=100,
+                        help='Posts of each category the dataset adds')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--ops', type=int, default=50, help='Operations per client and cell')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the datasets and the operations')
+    parser.add_argument('--min-gain', type=float, default=0.1,
+                        help='Least throughput gain of more workers or threads to count as scaling')
+    parser.add_argument('--max-p99-growth', type=float, default=2.0,
+                        help='Most p99 may grow from one value of an axis to the next')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='Most operations of a cell that may fail')
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help='More arguments for app.py, such as --background-jobs. Goes last')
+    parser.add_argument('--config', default=os.path.join(ROOT, 'config.json'))
+    parser.add_argument('--dir', help='Where to create the database files (default: a temporary directory)')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    cells = _run_matrix(args)
+    knees = find_knees(cells, args.min_gain, args.max_p99_growth, args.max_error_rate)
+
+    print(f"{args.clients} clients x {args.ops} operations per cell:")
+    print(f"  {'Workers':>7}{'Threads':>8}{'Posts':>8}{'Payload':>8}{'Ops/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'Errors':>8}")
+    for _c in sorted(cells, key=lambda _c: tuple(_order(_a, _c[_a]) for _a in AXES)):
+        print(f"  {_c['workers']:>7}{_c['threads']:>8}{_c['posts']:>8}{_c['payload']:>8}{_c['throughput']:>9.1f}"
+              f"{_c['p50_ms']:>9.1f}{_c['p99_ms']:>9.1f}{_c['error_rate']:>8.1%}")
+    print("Knees:" if knees else "Knees: none found")
+    _print_knees(knees, cells)
+
+    result = {'clients': args.clients, 'ops': args.ops, 'seed': args.seed, 'cells': cells, 'knees': knees}
+    if args.json:
+        with open(args.json, 'w') as _f:
+            json.dump(result, _f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
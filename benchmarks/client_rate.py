@@ -0,0 +1,175 @@
+"""
+Client side request rate of the tester
+
+Measures how many requests one core can build and send, with the URL and
+body building of the tester before and after tester_interface/templates.py:
+
+    * build:   URL and prepared PUT request, without sending it
+    * payload: random payloads of a few sizes
+    * send:    PUT requests sent one after the other on a pooled session, to
+               a local server that answers at once, so the client is what
+               limits the rate
+
+Usage:
+    python benchmarks/client_rate.py [--seconds 2] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import string
+import sys
+import time
+from urllib.parse import urljoin
+
+import requests
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), '..')))
+from tester_interface.templates import UrlTemplate, JsonTemplate, Field, random_text  # noqa: E402
+
+API_CATEGORIES = "/api/blog/categories/"
+PAYLOAD_SIZES = (100, 10000, 1000000)
+_CHARS = string.ascii_lowercase + string.ascii_uppercase
+
+
+###############################################################################
+# Server that answers every request at once
+async def _answer(reader, writer):
+    try:
+        while True:
+            _head = await reader.readuntil(b"\r\n\r\n")
+            _length = 0
+            for _line in _head.split(b"\r\n"):
+                if _line[:15].lower() == b"content-length:":
+                    _length = int(_line[15:])
+            if _length:
+                await reader.readexactly(_length)
+            writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+    except (asyncio.IncompleteReadError, ConnectionError):
+        writer.close()
+
+
+def _serve(sock):
+    _loop = asyncio.new_event_loop()
+    _loop.run_until_complete(asyncio.start_server(_answer, sock=sock))
+    _loop.run_forever()
+
+
+def start_sink():
+    """
+    Returns:
+        tuple: (multiprocessing.Process, base_url)
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    proc = multiprocessing.Process(target=_serve, args=(sock,), daemon=True)
+    proc.start()
+    return proc, f"http://127.0.0.1:{sock.getsockname()[1]}/"
+
+
+###############################################################################
+# Before and after
+def _url_before(base_url, id):
+    _url = urljoin(base_url, API_CATEGORIES)
+    return urljoin(_url, str(id))
+
+
+def _request_before(base_url, id, name):
+    return requests.Request('PUT', _url_before(base_url, id), json={'name': name})
+
+
+def _templates(base_url):
+    _url = UrlTemplate(base_url, API_CATEGORIES + "{id}")
+    _body = JsonTemplate({'name': Field('name')})
+    _headers = {'Content-Type': 'application/json'}
+
+    def _request_after(base_url, id, name):
+        return requests.Request('PUT', _url(id), data=_body.render(name=name), headers=_headers)
+    return _request_after
+
+
+def _payload_before(size):
+    return "".join([random.choice(_CHARS) for i in range(size)])
+
+
+def _payload_after(size):
+    return random_text(size, _CHARS)
+
+
+def rate(func, seconds):
+    """
+    Calls func() for about seconds seconds
+
+    Returns:
+        float: Calls per second
+    """
+    n = 0
+    _batch = 1
+    _start = time.perf_counter()
+    _elapsed = 0.0
+    while _elapsed < seconds:
+        for _ in range(_batch):
+            func()
+        n += _batch
+        _batch = min(_batch * 2, 1000)
+        _elapsed = time.perf_counter() - _start
+    return n / _elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0, help='Time spent on each measurement')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    base_url = "http://localhost:8888/"
+    _session = requests.Session()
+    _after = _templates(base_url)
+    result = {'build': {}, 'payload': {}, 'send': {}}
+
+    result['build']['url_before'] = rate(lambda: _url_before(base_url, 4), args.seconds)
+    _url = UrlTemplate(base_url, API_CATEGORIES + "{id}")
+    result['build']['url_after'] = rate(lambda: _url(4), args.seconds)
+    result['build']['request_before'] = rate(
+        lambda: _session.prepare_request(_request_before(base_url, 4, "Tech")), args.seconds)
+    result['build']['request_after'] = rate(
+        lambda: _session.prepare_request(_after(base_url, 4, "Tech")), args.seconds)
+
+    for _size in PAYLOAD_SIZES:
+        result['payload'][_size] = {
+            'before': rate(lambda: _payload_before(_size), args.seconds) * _size,
+            'after': rate(lambda: _payload_after(_size), args.seconds) * _size,
+        }
+
+    proc, sink_url = start_sink()
+    try:
+        _after = _templates(sink_url)
+        for _name, _build in (('before', _request_before), ('after', _after)):
+            with requests.Session() as _sender:
+                result['send'][_name] = rate(
+                    lambda: _sender.send(_sender.prepare_request(_build(sink_url, 4, "Tech"))), args.seconds)
+    finally:
+        proc.terminate()
+
+    _build = result['build']
+    print("Building, per second:")
+    print(f"  URL:              {_build['url_before']:12,.0f} before  {_build['url_after']:12,.0f} after")
+    print(f"  Prepared request: {_build['request_before']:12,.0f} before  {_build['request_after']:12,.0f} after")
+    print("Random payloads, characters per second:")
+    for _size, _rates in result['payload'].items():
+        print(f"  {_size:>9} chars:  {_rates['before']:12,.0f} before  {_rates['after']:12,.0f} after")
+    print("Requests sent by one core, per second:")
+    print(f"  PUT:              {result['send']['before']:12,.0f} before  {result['send']['after']:12,.0f} after")
+
+    if args.json:
+        with open(args.json, 'w') as _f:
+            json.dump(result, _f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Cost of resetting the served database between tests
+
+Times the ways the tester can put the default database back over the one
+the API serves, after a test wrote to it:
+
+    * copy:      copies the default database file over it
+    * skip_unchanged: the same, through the check of PRAGMA data_version
+                 that skips it when nothing wrote (tester_interface/dbreset.py)
+    * skip_unchanged, unchanged: the same when the test only read, so the
+                 copy is skipped
+
+on the default database (small) and on one grown to --posts posts (large),
+with the served file in each of --dirs, such as a disk and tmpfs.
+
+Usage:
+    python benchmarks/db_reset.py [--runs 50] [--posts 20000]
+        [--dirs /tmp /dev/shm] [--json out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+from tester_interface.dbreset import SkippingReset  # noqa: E402
+
+DEFAULT_DB = os.path.join(ROOT, 'default_database', 'db.sqlite')
+
+
+def make_large(path, n_posts, body_chars=500):
+    shutil.copyfile(DEFAULT_DB, path)
+    with sqlite3.connect(path) as _conn:
+        _category = _conn.execute("SELECT id FROM category ORDER BY id LIMIT 1").fetchone()[0]
+        _conn.executemany("INSERT INTO post (title, body, pub_date, category_id, version) VALUES (?, ?, ?, ?, 1)",
+                          ((f"Post {_i}", "x" * body_chars, f"2020-01-01 00:00:{_i % 60:02d}.000000", _category)
+                           for _i in range(n_posts)))
+    _conn.close()
+
+
+def write_row(path):
+    "What a test leaves behind"
+    _conn = sqlite3.connect(path)
+    with _conn:
+        _conn.execute("INSERT INTO category (name, version) VALUES ('Benchmark', 1)")
+    _conn.close()
+
+
+def measure(baseline, dst, runs):
+    """
+    Returns:
+        dict: Per way, 'median_us' and 'p90_us' of a reset
+    """
+    reset = SkippingReset(baseline)
+    reset.restore(dst)
+    _ways = {
+        'copy': (True, lambda: shutil.copyfile(baseline, dst)),
+        'skip_unchanged': (True, lambda: reset.restore(dst)),
+        'skip_unchanged, unchanged': (False, lambda: reset.restore(dst)),
+    }
+    result = {}
+    for _name, (_write, _reset) in _ways.items():
+        _times = []
+        for _ in range(runs):
+            if _write:
+                write_row(dst)
+            _start = time.perf_counter()
+            _reset()
+            _times.append((time.perf_counter() - _start) * 1e6)
+        _times.sort()
+        result[_name] = {'median_us': statistics.median(_times), 'p90_us': _times[int(len(_times) * 0.9)]}
+    reset.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=50, help='Resets timed per way')
+    parser.add_argument('--posts', type=int, default=20000, help='Posts of the large database')
+    parser.add_argument('--dirs', nargs='+',
+                        default=[tempfile.gettempdir()] + (['/dev/shm'] if os.path.isdir('/dev/shm') else []),
+                        help='Where to put the served database')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    result = {}
+    _work = tempfile.mkdtemp(prefix='db_reset_')
+    try:
+        _large = os.path.join(_work, 'large.sqlite')
+        make_large(_large, args.posts)
+        _baselines = {'small': DEFAULT_DB, 'large': _large}
+        for _size, _baseline in _baselines.items():
+            for _dir in args.dirs:
+                _dst = tempfile.mktemp(suffix='.sqlite', prefix='db_reset_', dir=_dir)
+                try:
+                    result[f"{_size} {_dir}"] = measure(_baseline, _dst, args.runs)
+                finally:
+                    os.remove(_dst)
+        _sizes = {_size: os.path.getsize(_path) for _size, _path in _baselines.items()}
+    finally:
+        shutil.rmtree(_work)
+
+    print(f"Small database {_sizes['small']:,} bytes, large {_sizes['large']:,} bytes, {args.runs} resets each:")
+    print(f"  {'Database':<24}{'Way':<28}{'Median us':>11}{'p90 us':>11}")
+    for _case, _ways in result.items():
+        for _name, _r in _ways.items():
+            print(f"  {_case:<24}{_name:<28}{_r['median_us']:>11,.0f}{_r['p90_us']:>11,.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as _f:
+            json.dump(result, _f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
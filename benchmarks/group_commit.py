@@ -0,0 +1,134 @@
+"""
+Write throughput of the API with and without group commit
+
+Creates categories from concurrent clients for a few seconds, once with a
+commit per request and once per group commit window, each on a fresh
+database file, and reports writes per second against the latency of each
+write. The clients call the app in process, through Flask's test client, so
+only the API and SQLite are measured.
+
+The database files go to --dir: a commit costs what an fsync costs there,
+put them on the disk the API would use.
+
+Usage:
+    python benchmarks/group_commit.py [--seconds 3] [--clients 16]
+        [--windows 0 0.001 0.002 0.005 0.01] [--dir DIR] [--json out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+API_DIR = os.path.join(ROOT, 'rest_api_demo-techtest1.2')
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, ROOT)
+from tester_interface.histogram import Histogram  # noqa: E402
+from tester_interface.loadgen import DIGITS  # noqa: E402
+
+API_CATEGORIES = "/api/blog/categories/"
+
+
+def measure(db_path, seconds, n_clients, window=None, max_batch=64):
+    """
+    Args:
+        window (float): Group commit window in seconds, None for a commit
+            per request
+
+    Returns:
+        dict: 'writes' per second, 'p50_ms', 'p99_ms' and 'mean_ms' latency
+            of the writes, 'failed' writes and 'batch' mean writes per commit
+    """
+    import logging
+    from rest_api_demo.app import create_app
+    logging.disable(logging.WARNING)
+
+    app = create_app({
+        'SERVER_NAME': None,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+        'GROUP_COMMIT_ENABLED': window is not None,
+        'GROUP_COMMIT_WINDOW': window or 0.0,
+        'GROUP_COMMIT_MAX_BATCH': max_batch,
+    })
+    latencies = []
+    failed = []
+    _lock = threading.Lock()
+    _stop = time.perf_counter() + seconds
+
+    def _client(index):
+        _latencies = []
+        _failed = 0
+        with app.test_client() as _c:
+            _n = 0
+            while time.perf_counter() < _stop:
+                _start = time.perf_counter()
+                _r = _c.post(API_CATEGORIES, json={'name': f"c{index}x{_n}"})
+                _latencies.append((time.perf_counter() - _start) * 1000)
+                _failed += _r.status_code != 201
+                _n += 1
+        with _lock:
+            latencies.extend(_latencies)
+            failed.append(_failed)
+
+    _threads = [threading.Thread(target=_client, args=(_i,)) for _i in range(n_clients)]
+    _start = time.perf_counter()
+    for _t in _threads:
+        _t.start()
+    for _t in _threads:
+        _t.join()
+    _elapsed = time.perf_counter() - _start
+
+    _histogram = Histogram(DIGITS)
+    for _ms in latencies:
+        _histogram.record(_ms * 1000)
+    _committer = app.extensions.get('group_commit')
+    return {
+        'writes': len(latencies) / _elapsed,
+        'p50_ms': _histogram.percentile(50) / 1000,
+        'p99_ms': _histogram.percentile(99) / 1000,
+        'mean_ms': statistics.mean(latencies),
+        'failed': sum(failed),
+        'batch': _committer.stats['writes'] / max(1, _committer.stats['batches']) if _committer else 1.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3.0, help='Time spent on each measurement')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 0.001, 0.002, 0.005, 0.01],
+                        help='Group commit windows to measure, in seconds')
+    parser.add_argument('--max-batch', type=int, default=64, help='Most writes per group commit')
+    parser.add_argument('--dir', help='Where to create the database files (default: a temporary directory)')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    _dir = tempfile.mkdtemp(dir=args.dir)
+    result = {}
+    try:
+        for _window in [None] + args.windows:
+            _name = 'off' if _window is None else f"{_window * 1000:g} ms"
+            _path = os.path.join(_dir, f"group_commit_{len(result)}.sqlite")
+            result[_name] = measure(_path, args.seconds, args.clients, _window, args.max_batch)
+    finally:
+        shutil.rmtree(_dir, ignore_errors=True)
+
+    print(f"{args.clients} clients creating categories, {args.seconds:g} s each:")
+    print(f"  {'Group commit':<14}{'Writes/s':>10}{'Batch':>8}{'p50 ms':>9}{'p99 ms':>9}{'Failed':>8}")
+    for _name, _r in result.items():
+        print(f"  {_name:<14}{_r['writes']:>10,.0f}{_r['batch']:>8.1f}{_r['p50_ms']:>9.1f}"
+              f"{_r['p99_ms']:>9.1f}{_r['failed']:>8}")
+
+    if args.json:
+        with open(args.json, 'w') as _f:
+            json.dump(result, _f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
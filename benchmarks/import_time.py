@@ -0,0 +1,100 @@
+"""
+Import-time profile of the API
+
+Runs `python -X importtime` on a fresh interpreter a few times and reports
+the median cost of importing rest_api_demo.app, of creating the app with the
+factory, and the modules that contribute the most.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5] [--top 15] [--json out.json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+MODULE = 'rest_api_demo.app'
+API_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'rest_api_demo-techtest1.2'))
+
+# Prints how long create_app() took, after the import has been profiled
+FACTORY_SNIPPET = (
+    "import time\n"
+    "import rest_api_demo.app as _app\n"
+    "_start = time.perf_counter()\n"
+    "_app.create_app()\n"
+    "print('create_app_us', int((time.perf_counter() - _start) * 1e6))\n"
+)
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def parse_importtime(stderr):
+    """
+    Parses `-X importtime` output
+
+    Returns:
+        list: (module, self_us, cumulative_us, depth) tuples
+    """
+    rows = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            _self, _cumulative, _indent, _module = match.groups()
+            rows.append((_module, int(_self), int(_cumulative), len(_indent) // 2))
+    return rows
+
+
+def profile_once(python):
+    proc = subprocess.run([python, '-X', 'importtime', '-c', FACTORY_SNIPPET],
+                          cwd=API_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+    rows = parse_importtime(proc.stderr)
+    create_app_us = int(proc.stdout.split()[-1])
+    return rows, create_app_us
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--python', default=sys.executable, help='Interpreter with the API requirements installed')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    totals, factory, cumulative = [], [], {}
+    for _ in range(args.runs):
+        rows, create_app_us = profile_once(args.python)
+        factory.append(create_app_us)
+        # Its cumulative time covers everything imported by the module itself.
+        # Modules imported later on by create_app() are top level entries
+        totals.append(next(_cum for _mod, _self, _cum, _depth in rows if _mod == MODULE))
+        for _mod, _self, _cum, _depth in rows:
+            cumulative.setdefault(_mod, []).append(_cum)
+
+    result = {
+        'module': MODULE,
+        'runs': args.runs,
+        'import_us': statistics.median(totals),
+        'create_app_us': statistics.median(factory),
+        'top_cumulative_us': sorted(((m, statistics.median(v)) for m, v in cumulative.items()
+                                     if m != MODULE),
+                                    key=lambda item: item[1], reverse=True)[:args.top],
+    }
+
+    print(f"import {MODULE}: {result['import_us'] / 1000:.1f} ms (median of {args.runs})")
+    print(f"create_app():        {result['create_app_us'] / 1000:.1f} ms")
+    print("Slowest imports (cumulative):")
+    for _mod, _us in result['top_cumulative_us']:
+        print(f"  {_us / 1000:8.1f} ms  {_mod}")
+
+    if args.json:
+        with open(args.json, 'w') as _f:
+            json.dump(result, _f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
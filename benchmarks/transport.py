@@ -0,0 +1,198 @@
+"""
+Request rate of the tester's transports against a local API
+
+Sends GETs as fast as possible for a few seconds, once per transport:
+
+    * session:   one requests.Session per thread, --connections threads,
+                 each waiting for its response before the next request
+    * pipelined: a PipelinedClient (tester_interface/pipeline.py) with
+                 --connections connections and up to N requests in flight
+                 on each, for each N of --streams
+
+and reports requests per second, latency and the client CPU time spent per
+request. Workloads are GET /blog/categories/1 (category) and GET
+/blog/posts/ (posts).
+
+The API is started with --keep-alive on a free port, reading the database
+it would serve, unless --base-url points at one already running.
+
+Usage:
+    python benchmarks/transport.py [--seconds 3] [--connections 4]
+        [--streams 1 4 16] [--base-url URL] [--json out.json]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+from tester_interface.histogram import Histogram  # noqa: E402
+from tester_interface.loadgen import DIGITS  # noqa: E402
+from tester_interface.pipeline import PipelinedClient  # noqa: E402
+
+APP = os.path.join(ROOT, 'rest_api_demo-techtest1.2', 'rest_api_demo', 'app.py')
+
+WORKLOADS = {
+    'category': "/api/blog/categories/1",
+    'posts':    "/api/blog/posts/",
+}
+
+
+def start_api():
+    """
+    Returns:
+        tuple: (subprocess.Popen, base_url)
+    """
+    with socket.socket() as _s:
+        _s.bind(('127.0.0.1', 0))
+        _port = _s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, APP, '--server-name', f"127.0.0.1:{_port}", '--no-reload',
+                             '--keep-alive'], cwd=os.path.dirname(APP),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{_port}/"
+    _deadline = time.time() + 30
+    while time.time() < _deadline:
+        try:
+            requests.get(base_url + "api/blog/categories/", timeout=1)
+            return proc, base_url
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("The API didn't start")
+
+
+def _summary(latencies, elapsed, cpu, statuses):
+    _n = len(latencies)
+    _histogram = Histogram(DIGITS)
+    for _ms in latencies:
+        _histogram.record(_ms * 1000)
+    return {
+        'rate': _n / elapsed,
+        'p50_ms': _histogram.percentile(50) / 1000,
+        'p99_ms': _histogram.percentile(99) / 1000,
+        'cpu_ms': cpu * 1000 / _n if _n else 0.0,
+        'requests': _n,
+        'statuses': statuses,
+    }
+
+
+def measure_session(url, seconds, connections):
+    latencies = []
+    statuses = {}
+    _lock = threading.Lock()
+    _cpu = time.process_time()
+    _start = time.perf_counter()
+    _stop = _start + seconds
+
+    def _client():
+        _session = requests.Session()
+        _latencies = []
+        while time.perf_counter() < _stop:
+            _t = time.perf_counter()
+            _status = _session.get(url).status_code
+            _latencies.append((time.perf_counter() - _t) * 1000)
+            with _lock:
+                statuses[_status] = statuses.get(_status, 0) + 1
+        _session.close()
+        with _lock:
+            latencies.extend(_latencies)
+
+    _threads = [threading.Thread(target=_client) for _ in range(connections)]
+    for _t in _threads:
+        _t.start()
+    for _t in _threads:
+        _t.join()
+    return _summary(latencies, time.perf_counter() - _start, time.process_time() - _cpu, statuses)
+
+
+def measure_pipelined(base_url, url, seconds, connections, streams):
+    latencies = []
+    statuses = {}
+    _lock = threading.Lock()
+    client = PipelinedClient(base_url, connections, streams, timeout=30)
+
+    def _done(future, sent):
+        _latency = (time.perf_counter() - sent) * 1000
+        try:
+            _key = future.result().status_code
+        except Exception as e:
+            _key = type(e).__name__
+        with _lock:
+            latencies.append(_latency)
+            statuses[_key] = statuses.get(_key, 0) + 1
+
+    _cpu = time.process_time()
+    _start = time.perf_counter()
+    _stop = _start + seconds
+    _k = 0
+    _last = None
+    while time.perf_counter() < _stop:
+        _sent = time.perf_counter()
+        _last = client.submit('GET', url)
+        _last.add_done_callback(lambda _f, _sent=_sent: _done(_f, _sent))
+        _k += 1
+    while True:
+        with _lock:
+            if len(latencies) >= _k:
+                break
+        time.sleep(0.001)
+    _elapsed = time.perf_counter() - _start
+    result = _summary(latencies, _elapsed, time.process_time() - _cpu, statuses)
+    result['connects'] = client.connects
+    client.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3.0, help='Time spent on each measurement')
+    parser.add_argument('--connections', type=int, default=4, help='Threads, or connections when pipelined')
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 4, 16],
+                        help='Requests in flight per connection to measure pipelining with')
+    parser.add_argument('--workloads', nargs='+', choices=sorted(WORKLOADS), default=sorted(WORKLOADS))
+    parser.add_argument('--base-url', help='API to send to, started with --keep-alive if not given')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    proc = None
+    base_url = args.base_url
+    if base_url is None:
+        proc, base_url = start_api()
+    result = {}
+    try:
+        for _workload in args.workloads:
+            _url = base_url.rstrip('/') + WORKLOADS[_workload]
+            # Warm up connections and the API's caches
+            measure_session(_url, 0.2, args.connections)
+            result[_workload] = {'session': measure_session(_url, args.seconds, args.connections)}
+            for _streams in args.streams:
+                result[_workload][f"pipelined x{_streams}"] = measure_pipelined(
+                    base_url, _url, args.seconds, args.connections, _streams)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    print(f"{args.connections} connections, {args.seconds:g} s each:")
+    print(f"  {'Workload':<10}{'Transport':<15}{'Req/s':>8}{'p50 ms':>9}{'p99 ms':>9}{'CPU ms/req':>12}"
+          f"  Status codes")
+    for _workload, _transports in result.items():
+        for _name, _r in _transports.items():
+            print(f"  {_workload:<10}{_name:<15}{_r['rate']:>8,.0f}{_r['p50_ms']:>9.1f}{_r['p99_ms']:>9.1f}"
+                  f"{_r['cpu_ms']:>12.2f}  {_r['statuses']}")
+
+    if args.json:
+        with open(args.json, 'w') as _f:
+            json.dump(result, _f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
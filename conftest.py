@@ -0,0 +1,148 @@
+"""
+Streams the results of the run to a JSON lines file of its own, in the
+directory given by --results-dir or the 'results' section of config.json,
+see tester_interface/results.py. Every request is recorded too with
+--results-requests
+
+Records what each test depends on, and with --reuse-passed skips the tests
+that passed and whose code and inputs haven't changed since, see
+tester_interface/impact.py
+"""
+import json
+import os
+import time
+import pytest
+from tester_interface import impact
+from tester_interface import results
+from tester_interface.rest_tester import RestTester
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(ROOT, 'config.json')
+
+_sink = None
+_test_start = {}
+_impact = None
+# Tests of the run whose call passed, and with no failure after
+_impact_passed = set()
+
+
+def pytest_addoption(parser):
+    parser.addoption('--results-dir', default=None,
+                     help='Write the results of the run to a new JSON lines file in this directory')
+    parser.addoption('--results-requests', action='store_true',
+                     help='Also record every request sent in the results file, for the latency tables of the report')
+    parser.addoption('--random-seeds', action='store_true',
+                     help='Explore new inputs: draw new seeds for the randomised tests instead of those in config.json')
+    parser.addoption('--reuse-passed', action='store_true',
+                     help="Skip the tests that passed and whose code and inputs haven't changed since")
+
+
+def pytest_configure(config):
+    global _sink
+    with open(CONFIG_FILE, 'r') as _f:
+        _config = json.load(_f)
+    _results = _config.get('results', {})
+    _dir = config.getoption('--results-dir')
+    if _dir is None and _results.get('dir'):
+        _dir = os.path.join(ROOT, _results['dir'])
+    if _dir:
+        _sink = results.open_run(_dir, _results.get('keep', results.DEFAULT_KEEP),
+                                 batch_size=_results.get('batch_size', 500), base_url=_config.get('base_url'),
+                                 requests=config.getoption('--results-requests') or _results.get('requests', False))
+
+    global _impact
+    _impact_cfg = _config.get('impact', {})
+    if _impact_cfg.get('cache_file'):
+        _server_dir = os.path.dirname(os.path.join(
+            ROOT, _config.get('server', {}).get('app_path', './rest_api_demo-techtest1.2/rest_api_demo/app.py')))
+        _sources = impact.Sources(ROOT, _server_dir, CONFIG_FILE, os.path.join(ROOT, _config['default_db_path']),
+                                  _config.get('base_url'))
+        _impact = impact.ImpactCache(os.path.join(ROOT, _impact_cfg['cache_file']), _sources,
+                                     _impact_cfg.get('always_run', []), reuse=config.getoption('--reuse-passed') and not config.getoption('--random-seeds'))
+        impact.instrument(RestTester)
+
+
+def pytest_unconfigure(config):
+    global _sink, _impact
+    if _sink is not None:
+        _sink.close()
+        _sink = None
+    if _impact is not None:
+        _impact.save()
+        _impact = None
+
+
+def _impact_test(item):
+    "(path, class name, function name) of a test item"
+    return (str(item.fspath), item.cls.__name__ if item.cls is not None else None,
+            getattr(item, 'originalname', None) or item.name.split('[')[0])
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item):
+    if _impact is not None and _impact.unchanged(item.nodeid, _impact_test(item)):
+        _impact.stats['skipped'] += 1
+        pytest.skip("Unchanged since it passed, run without --reuse-passed to run it")
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    if _sink is not None:
+        _sink.current_test = item.nodeid
+        _test_start[item.nodeid] = time.perf_counter()
+    if _impact is not None:
+        _skipped = _impact.stats['skipped']
+        _start = time.perf_counter()
+        impact.start()
+    yield
+    if _sink is not None:
+        _sink.current_test = None
+        _test_start.pop(item.nodeid, None)
+    if _impact is not None:
+        record = impact.stop()
+        if item.nodeid in _impact_passed:
+            _impact.passed(item.nodeid, _impact_test(item), record, (time.perf_counter() - _start) * 1000)
+        elif _impact.stats['skipped'] == _skipped:
+            # Ran and didn't pass
+            _impact.forget(item.nodeid)
+
+
+def pytest_runtest_logreport(report):
+    """
+    One record per test: the call phase, or the phase that failed or
+    skipped before it
+    """
+    if report.when == 'call' and report.passed:
+        _impact_passed.add(report.nodeid)
+    elif report.failed:
+        _impact_passed.discard(report.nodeid)
+    if _sink is None:
+        return
+    if report.when == 'call' or (report.when == 'setup' and not report.passed) \
+            or (report.when == 'teardown' and report.failed):
+        message = None
+        if report.failed:
+            _crash = getattr(report.longrepr, 'reprcrash', None)
+            message = _crash.message if _crash is not None else str(report.longrepr)[-500:]
+        _start = _test_start.get(report.nodeid)
+        _elapsed = (time.perf_counter() - _start) * 1000 if _start else report.duration * 1000
+        _sink.record_test(report.nodeid, report.outcome if report.when != 'teardown' else 'error',
+                          _elapsed, message)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if _impact is not None and _impact.stats['skipped']:
+        terminalreporter.write_line(f"{_impact.stats['skipped']} tests skipped as unchanged since they passed,"
+                                    f" run without --reuse-passed to run them")
+
+
+@pytest.fixture(scope='session')
+def results_sink():
+    "ResultsSink of the run, None when results are not streamed"
+    return _sink
+
+
+@pytest.fixture(scope='session')
+def random_seeds(pytestconfig):
+    "If the randomised tests draw new seeds, with --random-seeds"
+    return pytestconfig.getoption('--random-seeds')
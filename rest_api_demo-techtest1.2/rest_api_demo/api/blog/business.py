@@ -1,53 +1,212 @@
-from rest_api_demo.database import db
-from rest_api_demo.database.models import Post, Category
+from rest_api_demo.database import db, group_commit, jobs, summaries
+from rest_api_demo.database.models import Change, Post, Category, VersionClock
 
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
 
-def create_blog_post(data):
+
+class VersionMismatch(Exception):
+    """
+    Raised when a conditional write was based on an outdated version.
+    """
+
+
+def _next_version():
+    """
+    Takes the next version of the VersionClock, for the rows a write
+    changes. Writers commit one at a time in SQLite, so no two writes get
+    the same one.
+    """
+    VersionClock.query.filter(VersionClock.id == 1).update(
+        {VersionClock.last: VersionClock.last + 1}, synchronize_session=False)
+    return db.session.query(VersionClock.last).filter(VersionClock.id == 1).scalar()
+
+
+def _set_category_version(category_id, version):
+    if category_id is not None:
+        Category.query.filter(Category.id == category_id).update(
+            {Category.version: version}, synchronize_session=False)
+
+
+def _log_change(kind, item_id, action):
+    db.session.add(Change(kind, item_id, action))
+
+
+def _log_category_posts_changed(category_id):
+    "Posts show their category, so they change with it"
+    for (post_id,) in db.session.query(Post.id).filter(Post.category_id == category_id):
+        _log_change('post', post_id, UPDATE)
+
+
+def changes_since(since, limit):
+    """
+    Returns:
+        tuple: (up to ``limit`` changes after seq ``since``, in order, last
+            seq of the log or 0 if empty)
+    """
+    changes = Change.query.filter(Change.seq > since).order_by(Change.seq).limit(limit).all()
+    last_seq = db.session.query(db.func.max(Change.seq)).scalar() or 0
+    return changes, last_seq
+
+
+def _filter_version(model, item_id, expected_versions):
+    query = model.query.filter(model.id == item_id)
+    if expected_versions is not None:
+        query = query.filter(model.version.in_(expected_versions))
+    return query
+
+
+def _conditional_update(model, item_id, expected_versions, version, values):
+    """
+    Compare-and-set update: only applies ``values`` and the new ``version``
+    if the row still has one of ``expected_versions``, or unconditionally if it is
+    None. No lock is held, SQLite applies the check and the write in a
+    single statement, so a row deleted concurrently is never written back.
+    """
+    values = dict(values)
+    values[model.version] = version
+    updated = _filter_version(model, item_id, expected_versions).update(values, synchronize_session=False)
+    if not updated:
+        model.query.filter(model.id == item_id).one()
+        raise VersionMismatch()
+
+
+def _conditional_delete(model, item_id, expected_versions):
+    """
+    Deletes in a single statement, so of two concurrent deletes only one
+    succeeds and the other gets NoResultFound.
+    """
+    deleted = _filter_version(model, item_id, expected_versions).delete(synchronize_session=False)
+    if not deleted:
+        model.query.filter(model.id == item_id).one()
+        raise VersionMismatch()
+
+
+@jobs.handler('post_written')
+def _post_written(post_id, action, category_deltas):
+    """
+    Secondary work of a post write: the summaries of its categories, with
+    how their post count changed, and the change log
+    """
+    for category_id, count_delta in category_deltas:
+        # Deleted since the write, with its summary, when run as a job
+        if Category.query.filter(Category.id == category_id).count():
+            summaries.refresh(category_id, count_delta)
+    _log_change('post', post_id, action)
+
+
+def _enqueue_post_written(post_id, action, category_deltas):
+    """
+    Returns:
+        int: Id of the job, None if done right away
+    """
+    return jobs.enqueue('post_written', 'post:%d' % post_id, post_id=post_id, action=action,
+                        category_deltas=category_deltas)
+
+
+def _create_blog_post(data):
     title = data.get('title')
     body = data.get('body')
     category_id = data.get('category_id')
     category = Category.query.filter(Category.id == category_id).one()
+    version = _next_version()
     post = Post(title, body, category)
+    post.version = version
     db.session.add(post)
-    db.session.commit()
+    db.session.flush()
+    _set_category_version(category.id, version)
+    return _enqueue_post_written(post.id, CREATE, [(category.id, 1)])
 
 
-def update_post(post_id, data):
+def _update_post(post_id, data, expected_versions=None):
     post = Post.query.filter(Post.id == post_id).one()
-    post.title = data.get('title')
-    post.body = data.get('body')
+    old_category_id = post.category_id
     category_id = data.get('category_id')
-    post.category = Category.query.filter(Category.id == category_id).one()
-    db.session.add(post)
-    db.session.commit()
+    category = Category.query.filter(Category.id == category_id).one()
+    version = _next_version()
+    # A single statement, so a post deleted concurrently gets a 404 rather
+    # than a stale ORM write
+    _conditional_update(Post, post_id, expected_versions, version, {
+        Post.title: data.get('title'),
+        Post.body: data.get('body'),
+        Post.category_id: category.id,
+    })
+    _set_category_version(old_category_id, version)
+    if category.id != old_category_id:
+        _set_category_version(category.id, version)
+        job_id = _enqueue_post_written(post_id, UPDATE, [(old_category_id, -1), (category.id, 1)])
+    else:
+        job_id = _enqueue_post_written(post_id, UPDATE, [(category.id, 0)])
+    return version, job_id
 
 
-def delete_post(post_id):
+def _delete_post(post_id, expected_versions=None):
     post = Post.query.filter(Post.id == post_id).one()
-    db.session.delete(post)
-    db.session.commit()
+    _conditional_delete(Post, post_id, expected_versions)
+    _set_category_version(post.category_id, _next_version())
+    return _enqueue_post_written(post_id, DELETE, [(post.category_id, -1)])
 
 
-def create_category(data):
+def _create_category(data):
     name = data.get('name')[1:]
     category_id = data.get('id')
 
     category = Category(name)
+    category.version = _next_version()
     if category_id:
         category.id = category_id
 
     db.session.add(category)
-    db.session.commit()
+    db.session.flush()
+    summaries.refresh(category.id)
+    _log_change('category', category.id, CREATE)
 
 
-def update_category(category_id, data):
-    category = Category.query.filter(Category.id == category_id).one()
-    category.name = data.get('name')
-    db.session.add(category)
-    db.session.commit()
+def _update_category(category_id, data, expected_versions=None):
+    version = _next_version()
+    _conditional_update(Category, category_id, expected_versions, version, {Category.name: data.get('name')})
+    _log_change('category', category_id, UPDATE)
+    _log_category_posts_changed(category_id)
+    # Posts show their category's name, so their representation changed too
+    Post.query.filter(Post.category_id == category_id).update(
+        {Post.version: version}, synchronize_session=False)
+    return version
 
 
-def delete_category(category_id):
-    category = Category.query.filter(Category.id == category_id).one()
-    db.session.delete(category)
-    db.session.commit()
+def _delete_category(category_id, expected_versions=None):
+    _conditional_delete(Category, category_id, expected_versions)
+    _log_change('category', category_id, DELETE)
+    _log_category_posts_changed(category_id)
+    summaries.remove(category_id)
+    # Done by the ORM when deleting an instance, but not by a bulk delete
+    Post.query.filter(Post.category_id == category_id).update(
+        {Post.category_id: None, Post.version: _next_version()}, synchronize_session=False)
+
+
+# The writes above don't commit, group_commit.write() commits them on their
+# own or together with the writes of concurrent requests. Post writes return
+# the id of the job left with their secondary work, None if it was done with
+# them
+def create_blog_post(data):
+    return group_commit.write(_create_blog_post, data)
+
+
+def update_post(post_id, data, expected_versions=None):
+    return group_commit.write(_update_post, post_id, data, expected_versions)
+
+
+def delete_post(post_id, expected_versions=None):
+    return group_commit.write(_delete_post, post_id, expected_versions)
+
+
+def create_category(data):
+    return group_commit.write(_create_category, data)
+
+
+def update_category(category_id, data, expected_versions=None):
+    return group_commit.write(_update_category, category_id, data, expected_versions)
+
+
+def delete_category(category_id, expected_versions=None):
+    return group_commit.write(_delete_category, category_id, expected_versions)
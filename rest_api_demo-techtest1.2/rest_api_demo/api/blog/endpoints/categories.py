@@ -1,11 +1,18 @@
+import base64
+import binascii
 import logging
 
 from flask import request
-from flask_restplus import Resource
+from flask_restplus import Resource, marshal
 from rest_api_demo.api.blog.business import create_category, delete_category, update_category
-from rest_api_demo.api.blog.serializers import category, category_with_posts
+from rest_api_demo.api.blog.parsers import MAX_SEQ, category_summary_arguments
+from rest_api_demo.api.blog.serializers import category, category_summary, category_summary_full, \
+    category_with_posts
+from rest_api_demo.api.conditional import etag_headers, expected_versions, not_modified
+from rest_api_demo.api.idempotency import IDEMPOTENCY_HEADER, idempotent
 from rest_api_demo.api.restplus import api
-from rest_api_demo.database.models import Category
+from rest_api_demo.database import replica, summaries
+from rest_api_demo.database.models import Category, Post
 
 log = logging.getLogger(__name__)
 
@@ -20,11 +27,18 @@ class CategoryCollection(Resource):
         """
         Returns list of blog categories.
         """
+        snapshot = replica.current()
+        if snapshot is not None:
+            return snapshot.category_list
         categories = Category.query.all()
         return categories
 
     @api.response(201, 'Category successfully created.')
+    @api.response(409, 'A category with the same id exists, or a request with the same Idempotency-Key is in progress.')
+    @api.response(422, 'Idempotency-Key was already used with a different payload.')
+    @api.param(IDEMPOTENCY_HEADER, 'Optional key that makes retries of this request safe', _in='header')
     @api.expect(category)
+    @idempotent
     def post(self):
         """
         Creates a new blog category.
@@ -37,6 +51,10 @@ class CategoryCollection(Resource):
         }
         ```
 
+        * Send an `Idempotency-Key` header to make retries safe. Repeating the
+        request with the same key returns the original result instead of
+        creating the category twice.
+
         """
         data = request.json
         create_category(data)
@@ -47,15 +65,30 @@ class CategoryCollection(Resource):
 @api.response(404, 'Category not found.')
 class CategoryItem(Resource):
 
-    @api.marshal_with(category_with_posts)
+    @api.response(200, 'Success', category_with_posts)
+    @api.response(304, 'Category not modified since the version in If-None-Match.')
     def get(self, id):
         """
         Returns a category with a list of posts.
+
+        * The response has an `ETag` header with the category's version.
+        Send it back in `If-None-Match` to get an empty 304 response if the
+        category and its posts haven't changed.
         """
-        return Category.query.filter(Category.id == id).one()
+        snapshot = replica.current()
+        posts = snapshot.category_posts(id) if snapshot is not None else None
+        if posts is not None:
+            category = snapshot.category(id)
+            return not_modified(category.version) or \
+                (marshal({'id': category.id, 'name': category.name, 'posts': posts}, category_with_posts), 200,
+                 etag_headers(category.version))
+        category = Category.query.filter(Category.id == id).one()
+        return not_modified(category.version) or \
+            (marshal(category, category_with_posts), 200, etag_headers(category.version))
 
     @api.expect(category)
     @api.response(204, 'Category successfully updated.')
+    @api.response(412, 'Category was modified since the version in If-Match.')
     def put(self, id):
         """
         Updates a blog category.
@@ -71,16 +104,115 @@ class CategoryItem(Resource):
         ```
 
         * Specify the ID of the category to modify in the request URL path.
+
+        * Send the `ETag` from a previous GET in `If-Match` to only update the
+        category if nobody changed it in the meantime. Otherwise 412 is
+        returned and the category is left untouched.
         """
         data = request.json
-        update_category(id, data)
-        return None, 204
+        version = update_category(id, data, expected_versions())
+        return None, 204, etag_headers(version)
 
     @api.response(204, 'Category successfully deleted.')
     @api.response(409, 'Category not deleted, is in use')
+    @api.response(412, 'Category was modified since the version in If-Match.')
     def delete(self, id):
         """
         Deletes blog category.
+
+        * Send the `ETag` from a previous GET in `If-Match` to only delete the
+        category if nobody changed it in the meantime.
         """
-        delete_category(id)
+        delete_category(id, expected_versions())
         return None, 204
+
+
+def encode_cursor(pub_date, post_id):
+    return base64.urlsafe_b64encode('{0}|{1}'.format(summaries.format_date(pub_date), post_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: (pub_date, id) of the last post of the previous page
+    """
+    try:
+        pub_date, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return summaries.parse_date(pub_date), int(post_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        api.abort(400, 'Invalid cursor.')
+
+
+@ns.route('/<int:id>/summary')
+@api.response(404, 'Category not found.')
+class CategorySummaryItem(Resource):
+
+    @api.expect(category_summary_arguments, validate=True)
+    @api.response(200, 'Success', category_summary)
+    @api.response(304, 'Category not modified since the version in If-None-Match.')
+    @api.response(400, 'Invalid cursor.')
+    def get(self, id):
+        """
+        Returns a category with its post count and a page of its posts.
+
+        * Posts come latest first, with their id, title and publication date.
+        Send `projection=full` to get every field.
+        * Send the `next_cursor` of a page as `cursor` to get the next one.
+        It is null on the last page.
+        * The first page comes from a summary kept up to date by every
+        write, so it takes the same time whatever the number of posts.
+        * The response has the same `ETag` as the category.
+        * With the read replica enabled, pages of recent posts are served
+        from memory. Send `Cache-Control: no-cache` to read the database.
+        """
+        if id > MAX_SEQ:
+            # Past what SQLite can store, so no category has it
+            api.abort(404, 'Category not found.')
+        args = category_summary_arguments.parse_args(request)
+        limit = args.get('limit')
+        cursor = args.get('cursor')
+        full = args.get('projection') == 'full'
+        before = decode_cursor(cursor) if cursor is not None else None
+        snapshot = replica.current()
+        category = snapshot.category(id) if snapshot is not None else None
+        posts = snapshot.latest_posts(id, limit + 1, before) if category is not None else None
+        if posts is None:
+            category = Category.query.filter(Category.id == id).one()
+        response = not_modified(category.version)
+        if response is not None:
+            return response
+
+        if posts is not None:
+            post_count = category.post_count
+            page = [post.key for post in posts]
+        else:
+            post_count, entries = summaries.load(id)
+            if len(entries) == post_count or before is None and limit < len(entries):
+                # The page, and whether there is another, can be told from the summary
+                entries = [entry for entry in entries if before is None or (entry['pub_date'], entry['id']) < before]
+                page = [(entry['pub_date'], entry['id']) for entry in entries[:limit + 1]]
+                if full:
+                    by_id = {post.id: post for post in Post.query.filter(Post.id.in_([key[1] for key in page]))}
+                    posts = [by_id[key[1]] for key in page]
+                else:
+                    posts = entries[:limit + 1]
+            else:
+                columns = (Post,) if full else (Post.id, Post.title, Post.pub_date)
+                posts = summaries.latest_posts(id, limit + 1, before, columns)
+                page = [(post.pub_date, post.id) for post in posts]
+                if not full:
+                    posts = [post._asdict() for post in posts]
+
+        next_cursor = None
+        if len(posts) > limit:
+            posts = posts[:limit]
+            next_cursor = encode_cursor(*page[limit - 1])
+        result = {
+            'id': category.id,
+            'name': category.name,
+            'post_count': post_count,
+            'next_cursor': next_cursor,
+            'posts': posts,
+        }
+        return marshal(result, category_summary_full if full else category_summary), 200, \
+            etag_headers(category.version)
@@ -0,0 +1,89 @@
+import logging
+import threading
+import time
+
+from flask import request
+from flask_restplus import Resource
+from rest_api_demo import settings
+from rest_api_demo.api.blog.business import changes_since
+from rest_api_demo.api.blog.parsers import change_arguments
+from rest_api_demo.api.blog.serializers import page_of_changes
+from rest_api_demo.api.restplus import api
+from rest_api_demo.database import db
+from rest_api_demo.database.models import Category, Post
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+ns = api.namespace('blog/changes', description='Log of the changes to blog categories and posts')
+
+# Notified on every commit, to wake up the requests waiting for changes
+_committed = threading.Condition()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_commit(session):
+    with _committed:
+        _committed.notify_all()
+
+
+def _with_items(changes):
+    """
+    Changes with the current state of their category or post, None for the
+    ones deleted since.
+    """
+    ids = {'category': set(), 'post': set()}
+    for change in changes:
+        ids[change.kind].add(change.item_id)
+    categories = {c.id: c for c in Category.query.filter(Category.id.in_(ids['category']))} \
+        if ids['category'] else {}
+    posts = {p.id: p for p in Post.query.filter(Post.id.in_(ids['post']))} if ids['post'] else {}
+    return [{
+        'seq': change.seq,
+        'kind': change.kind,
+        'item_id': change.item_id,
+        'action': change.action,
+        'timestamp': change.timestamp,
+        'category': categories.get(change.item_id) if change.kind == 'category' else None,
+        'post': posts.get(change.item_id) if change.kind == 'post' else None,
+    } for change in changes]
+
+
+@ns.route('/')
+class ChangeCollection(Resource):
+
+    @api.expect(change_arguments, validate=True)
+    @api.marshal_with(page_of_changes)
+    def get(self):
+        """
+        Returns the changes to categories and posts after a seq, in order.
+
+        * Keep the seq of the last change received and send it as `since`
+        to only get the changes made after it.
+        * Each change has the category or post as it is now, so a client
+        applying them in order ends up with the current state. It is null
+        if the item was deleted since.
+        * With `wait`, if there is no change yet the request waits for one,
+        up to that many seconds, then returns what there is.
+        * Changes are only logged from the first start of this version of
+        the API. Fetch the categories and posts once, then follow the log
+        from the `last_seq` read before. If `last_seq` is ever below the
+        `since` sent, the log was reset and the client should start over.
+        """
+        args = change_arguments.parse_args(request)
+        since = args.get('since') or 0
+        limit = args.get('limit')
+        wait = args.get('wait') or 0
+
+        deadline = time.monotonic() + wait
+        changes, last_seq = changes_since(since, limit)
+        while not changes and limit and last_seq == since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Don't hold on to the database connection while waiting
+            db.session.rollback()
+            with _committed:
+                _committed.wait(min(remaining, settings.CHANGES_POLL_INTERVAL))
+            changes, last_seq = changes_since(since, limit)
+        return {'last_seq': last_seq, 'changes': _with_items(changes)}
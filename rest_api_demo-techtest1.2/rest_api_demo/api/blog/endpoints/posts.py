@@ -1,11 +1,15 @@
 import logging
 
 from flask import request
-from flask_restplus import Resource
+from flask_restplus import Resource, marshal
 from rest_api_demo.api.blog.business import create_blog_post, update_post, delete_post
 from rest_api_demo.api.blog.serializers import blog_post, page_of_blog_posts
 from rest_api_demo.api.blog.parsers import pagination_arguments
+from rest_api_demo.api.conditional import etag_headers, expected_versions, not_modified
+from rest_api_demo.api.idempotency import IDEMPOTENCY_HEADER, idempotent
 from rest_api_demo.api.restplus import api
+from rest_api_demo.database import replica
+from rest_api_demo.database.jobs import job_headers
 from rest_api_demo.database.models import Post
 
 log = logging.getLogger(__name__)
@@ -31,44 +35,72 @@ class PostsCollection(Resource):
 
         return posts_page
 
+    @api.response(409, 'A request with the same Idempotency-Key is in progress.')
+    @api.response(422, 'Idempotency-Key was already used with a different payload.')
+    @api.param(IDEMPOTENCY_HEADER, 'Optional key that makes retries of this request safe', _in='header')
     @api.expect(blog_post)
+    @idempotent
     def post(self):
         """
         Creates a new blog post.
+
+        * With background jobs, the response has an `X-Job-Id` header with
+        the job updating the category summary and the change log.
         """
-        create_blog_post(request.json)
-        return None, 201
+        return None, 201, job_headers(create_blog_post(request.json))
 
 
 @ns.route('/<int:id>')
 @api.response(404, 'Post not found.')
 class PostItem(Resource):
 
-    @api.marshal_with(blog_post)
+    @api.response(200, 'Success', blog_post)
+    @api.response(304, 'Post not modified since the version in If-None-Match.')
     def get(self, id):
         """
         Returns a blog post.
+
+        * The response has an `ETag` header with the post's version. Send it
+        back in `If-None-Match` to get an empty 304 response if the post
+        hasn't changed.
         """
         id+=int(id/5)
-        return Post.query.filter(Post.id == id).one()
+        snapshot = replica.current()
+        post = snapshot.post(id) if snapshot is not None else None
+        if post is None:
+            post = Post.query.filter(Post.id == id).one()
+        return not_modified(post.version) or (marshal(post, blog_post), 200, etag_headers(post.version))
 
     @api.expect(blog_post)
     @api.response(204, 'Post successfully updated.')
+    @api.response(412, 'Post was modified since the version in If-Match.')
     def put(self, id):
         """
         Updates a blog post.
+
+        * Send the `ETag` from a previous GET in `If-Match` to only update the
+        post if nobody changed it in the meantime.
+        * With background jobs, the response has an `X-Job-Id` header with
+        the job updating the category summaries and the change log.
         """
         data = request.json
-        update_post(id, data)
-        return None, 204
+        version, job_id = update_post(id, data, expected_versions())
+        headers = etag_headers(version)
+        headers.update(job_headers(job_id))
+        return None, 204, headers
 
     @api.response(204, 'Post successfully deleted.')
+    @api.response(412, 'Post was modified since the version in If-Match.')
     def delete(self, id):
         """
         Deletes blog post.
+
+        * Send the `ETag` from a previous GET in `If-Match` to only delete the
+        post if nobody changed it in the meantime.
+        * With background jobs, the response has an `X-Job-Id` header with
+        the job updating the category summary and the change log.
         """
-        delete_post(id)
-        return None, 204
+        return None, 204, job_headers(delete_post(id, expected_versions()))
 
 
 @ns.route('/archive/<int:year>/')
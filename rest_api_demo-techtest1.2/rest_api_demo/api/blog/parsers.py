@@ -1,7 +1,27 @@
-from flask_restplus import reqparse
+from flask_restplus import inputs, reqparse
+from rest_api_demo import settings
 
 pagination_arguments = reqparse.RequestParser()
 pagination_arguments.add_argument('page', type=int, required=False, default=1, help='Page number')
 pagination_arguments.add_argument('bool', type=bool, required=False, default=1, help='Page number')
 pagination_arguments.add_argument('per_page', type=int, required=False, choices=[2, 10, 20, 30, 40, 50],
                                   default=10, help='Results per page {error_msg}')
+
+# Seqs are SQLite integers, at most 64 bits
+MAX_SEQ = 2 ** 63 - 1
+
+change_arguments = reqparse.RequestParser()
+change_arguments.add_argument('since', type=inputs.int_range(0, MAX_SEQ), required=False, default=0,
+                              help='Only changes after this seq')
+change_arguments.add_argument('limit', type=inputs.int_range(0, settings.CHANGES_MAX_LIMIT), required=False,
+                              default=100, help='Most changes returned')
+change_arguments.add_argument('wait', type=inputs.int_range(0, settings.CHANGES_MAX_WAIT), required=False,
+                              default=0, help='Seconds to wait for a change if there is none yet')
+
+category_summary_arguments = reqparse.RequestParser()
+category_summary_arguments.add_argument('limit', type=inputs.int_range(1, settings.CATEGORY_SUMMARY_MAX_LIMIT),
+                                        required=False, default=10, help='Posts per page')
+category_summary_arguments.add_argument('cursor', type=str, required=False,
+                                        help='next_cursor of the previous page')
+category_summary_arguments.add_argument('projection', type=str, required=False, choices=['titles', 'full'],
+                                        default='titles', help='Post fields returned: id, title and pub_date, or all')
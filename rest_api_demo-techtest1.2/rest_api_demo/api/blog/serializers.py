@@ -29,3 +29,39 @@ category = api.model('Blog category', {
 category_with_posts = api.inherit('Blog category with posts', category, {
     'posts': fields.List(fields.Nested(blog_post))
 })
+
+blog_post_title = api.model('Blog post title', {
+    'id': fields.Integer(readOnly=True, description='The unique identifier of a blog post'),
+    'title': fields.String(description='Article title'),
+    'pub_date': fields.DateTime,
+})
+
+category_summary_fields = {
+    'post_count': fields.Integer(description='Number of posts of the category'),
+    'next_cursor': fields.String(description='Send as cursor to get the next page, null on the last page'),
+}
+
+category_summary = api.inherit('Blog category summary', category, dict(category_summary_fields, **{
+    'posts': fields.List(fields.Nested(blog_post_title), description='A page of posts, latest first'),
+}))
+
+category_summary_full = api.inherit('Blog category summary with full posts', category, dict(category_summary_fields, **{
+    'posts': fields.List(fields.Nested(blog_post), description='A page of posts, latest first'),
+}))
+
+change = api.model('Change', {
+    'seq': fields.Integer(description='Position of the change in the log, increasing'),
+    'kind': fields.String(description="'category' or 'post'"),
+    'id': fields.Integer(attribute='item_id', description='Id of the category or post'),
+    'action': fields.String(description="'create', 'update' or 'delete'"),
+    'timestamp': fields.DateTime,
+    'category': fields.Nested(category, allow_null=True,
+                              description='The category as it is now, null if deleted since or a post'),
+    'post': fields.Nested(blog_post, allow_null=True,
+                          description='The post as it is now, null if deleted since or a category'),
+})
+
+page_of_changes = api.model('Page of changes', {
+    'last_seq': fields.Integer(description='Seq of the last change of the log, 0 if empty'),
+    'changes': fields.List(fields.Nested(change)),
+})
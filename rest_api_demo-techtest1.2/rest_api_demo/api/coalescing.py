@@ -0,0 +1,169 @@
+"""
+Single-flight coalescing of identical concurrent GETs.
+
+With COALESCE_ENABLED, the first GET of a route of COALESCE_NAMESPACES
+computes its response as usual, and identical GETs arriving while it runs
+wait for it, then get a copy of its status, headers and body, with
+``X-Coalesced: true``. Requests are identical when they have the same path,
+query parameters (in any order) and If-None-Match. A burst of the same read
+runs its queries once instead of once per request.
+
+A commit ends the coalescing of every response being computed: requests
+arriving after it start a new computation, so they see the write. Requests
+already waiting still share the response they waited for, they were
+concurrent with the write. Only commits of this process are seen, so with
+several processes a read may miss a write of another one that committed
+while it was being computed, as it would without coalescing.
+
+Requests sent with ``Cache-Control: no-cache`` or ``X-Profile`` are always
+computed on their own. Rate limiting and load shedding apply to every
+request before it waits.
+"""
+import logging
+import threading
+
+from flask import current_app, g, jsonify, request
+from rest_api_demo.database import db
+from sqlalchemy import event
+from werkzeug.wrappers import Response
+
+log = logging.getLogger(__name__)
+
+COALESCED_HEADER = 'X-Coalesced'
+
+
+class Flight(object):
+    """
+    A response being computed, and the requests waiting for it.
+    """
+    __slots__ = ('done', 'response', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None  # (status, headers, body), None if it failed
+        self.waiters = 0
+
+
+class Coalescer(object):
+    """
+    Flights by request key. A request finding a flight for its key waits for
+    it, otherwise it starts one.
+    """
+    def __init__(self, namespaces, max_wait, prefix='/api/'):
+        self.prefixes = tuple(prefix + ns for ns in namespaces)
+        self.max_wait = max_wait
+        # flights: responses computed, coalesced: responses copied to waiting
+        # requests, queries: SQL statements run by this process
+        self.stats = {'flights': 0, 'coalesced': 0, 'failed_flights': 0, 'timeouts': 0, 'invalidations': 0,
+                      'queries': 0}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """
+        Returns:
+            tuple: (Flight, True if the caller computes it)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.stats['flights'] += 1
+            return flight, True
+
+    def land(self, key, flight, response):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if response is None:
+                self.stats['failed_flights'] += 1
+        flight.response = response
+        flight.done.set()
+
+    def invalidate(self):
+        "Requests from now on don't join the flights started so far"
+        with self._lock:
+            if self._flights:
+                self._flights.clear()
+                self.stats['invalidations'] += 1
+
+    def count_query(self):
+        with self._lock:
+            self.stats['queries'] += 1
+
+
+def _key():
+    args = tuple(sorted(request.args.items(multi=True)))
+    return request.path, args, request.headers.get('If-None-Match')
+
+
+def before_request():
+    coalescer = current_app.extensions['coalescer']
+    if request.method != 'GET' or request.url_rule is None or \
+            not request.url_rule.rule.startswith(coalescer.prefixes) or \
+            request.cache_control.no_cache or 'profile' in g:
+        return None
+    key = _key()
+    flight, leader = coalescer.join(key)
+    if leader:
+        g.coalesce_flight = (key, flight)
+        return None
+    if not flight.done.wait(coalescer.max_wait):
+        coalescer.stats['timeouts'] += 1
+        log.warning('Waited %s s for an identical request to %s, computing it again', coalescer.max_wait,
+                    request.full_path)
+        return None
+    if flight.response is None:
+        # The request computing it failed, try on our own
+        return None
+    status, headers, body = flight.response
+    coalescer.stats['coalesced'] += 1
+    response = Response(body, status=status, headers=headers)
+    response.headers[COALESCED_HEADER] = 'true'
+    return response
+
+
+def after_request(response):
+    taken = g.pop('coalesce_flight', None)
+    if taken is not None:
+        key, flight = taken
+        shared = None
+        if response.status_code < 500 and not response.direct_passthrough:
+            shared = (response.status_code, list(response.headers), response.get_data())
+        current_app.extensions['coalescer'].land(key, flight, shared)
+    return response
+
+
+def teardown_request(exc):
+    # after_request doesn't run when the view raised
+    taken = g.pop('coalesce_flight', None)
+    if taken is not None:
+        current_app.extensions['coalescer'].land(taken[0], taken[1], None)
+
+
+def get_stats():
+    return jsonify(current_app.extensions['coalescer'].stats)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _end_flights(session):
+    coalescer = current_app.extensions.get('coalescer')
+    if coalescer is not None:
+        coalescer.invalidate()
+
+
+def init_app(flask_app):
+    config = flask_app.config
+    if config['COALESCE_ENABLED']:
+        coalescer = flask_app.extensions['coalescer'] = Coalescer(config['COALESCE_NAMESPACES'],
+                                                                  config['COALESCE_MAX_WAIT'])
+        flask_app.before_request(before_request)
+        flask_app.after_request(after_request)
+        flask_app.teardown_request(teardown_request)
+        # Outside of the API namespaces, so it isn't part of swagger.json
+        flask_app.add_url_rule('/api/diagnostics/coalescing', 'diagnostics_coalescing', get_stats)
+        with flask_app.app_context():
+            event.listen(db.get_engine(flask_app), 'before_cursor_execute',
+                         lambda *args: coalescer.count_query())
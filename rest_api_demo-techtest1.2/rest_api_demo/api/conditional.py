@@ -0,0 +1,41 @@
+from flask import request
+from werkzeug.wrappers import Response
+
+# Version expected when If-Match has no strong tag that parses. No row
+# has it, so the conditional write fails with 412 as it should
+UNMATCHABLE_VERSION = -1
+
+
+def etag_headers(version):
+    return {'ETag': '"{0}"'.format(version)}
+
+
+def not_modified(version):
+    """
+    Returns a 304 response if the client's If-None-Match already holds this
+    version, None otherwise.
+    """
+    if request.if_none_match.contains_weak(str(version)):
+        return Response(status=304, headers=etag_headers(version))
+    return None
+
+
+def expected_versions():
+    """
+    Versions the client expects to overwrite, taken from If-Match.
+
+    If-Match uses the strong comparison, so weak tags never match and a
+    header with only weak or unparsable tags gives ``[UNMATCHABLE_VERSION]``.
+
+    Returns None when there is no precondition (no header or ``*``).
+    """
+    if_match = request.if_match
+    if if_match.star_tag or not if_match:
+        return None
+    versions = []
+    for tag in if_match.as_set():
+        try:
+            versions.append(int(tag))
+        except ValueError:
+            pass
+    return sorted(versions) or [UNMATCHABLE_VERSION]
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from flask_restplus.utils import unpack
+from rest_api_demo.database import db
+from rest_api_demo.database.models import IdempotencyKey
+from sqlalchemy import select
+
+log = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+class IdempotencyStore(object):
+    """
+    Bounded, thread-safe store of recently seen idempotency keys.
+
+    Keys are kept in insertion order and evicted oldest first once the store
+    is full or once they are older than ``ttl`` seconds.
+    """
+    NEW = 'new'
+    REPLAY = 'replay'
+    IN_FLIGHT = 'in_flight'
+    MISMATCH = 'mismatch'
+
+    def __init__(self, max_keys, ttl):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_keys and now - entry['created'] < self.ttl:
+                break
+            del self._entries[key]
+
+    def begin(self, key, fingerprint):
+        """
+        Claims ``key`` for the current request.
+
+        Returns a (state, response) tuple where ``response`` is only set when
+        state is ``REPLAY``.
+        """
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = {'created': now, 'fingerprint': fingerprint, 'response': None}
+                self._evict(now)
+                return self.NEW, None
+            if entry['fingerprint'] != fingerprint:
+                return self.MISMATCH, None
+            if entry['response'] is None:
+                return self.IN_FLIGHT, None
+            return self.REPLAY, entry['response']
+
+    def complete(self, key, response):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['response'] = response
+
+    def abandon(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DatabaseIdempotencyStore(IdempotencyStore):
+    """
+    IdempotencyStore keeping the keys in the database, so that the worker
+    processes of serving.py share them and a retry reaching another process
+    is still recognised. Each call runs in a transaction of its own, apart
+    from the request's session.
+    """
+    table = IdempotencyKey.__table__
+
+    def __init__(self, max_keys, ttl):
+        self.max_keys = max_keys
+        self.ttl = ttl
+
+    def __len__(self):
+        return db.session.query(IdempotencyKey).count()
+
+    def _evict(self, conn, now):
+        conn.execute(self.table.delete().where(self.table.c.created <= now - self.ttl))
+        newest = select([self.table.c.key]).order_by(self.table.c.created.desc()).offset(self.max_keys)
+        conn.execute(self.table.delete().where(self.table.c.key.in_(newest)))
+
+    def begin(self, key, fingerprint):
+        now = time.time()
+        key = json.dumps(key)
+        with db.engine.begin() as conn:
+            # The deletes take the write lock, so no other process claims
+            # the key between the select and the insert
+            self._evict(conn, now)
+            entry = conn.execute(select([self.table.c.fingerprint, self.table.c.response])
+                                 .where(self.table.c.key == key)).first()
+            if entry is None:
+                conn.execute(self.table.insert().values(key=key, fingerprint=fingerprint, created=now))
+                return self.NEW, None
+        if entry.fingerprint != fingerprint:
+            return self.MISMATCH, None
+        if entry.response is None:
+            return self.IN_FLIGHT, None
+        return self.REPLAY, tuple(json.loads(entry.response))
+
+    def complete(self, key, response):
+        with db.engine.begin() as conn:
+            conn.execute(self.table.update().where(self.table.c.key == json.dumps(key))
+                         .values(response=json.dumps(response)))
+
+    def abandon(self, key):
+        with db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.key == json.dumps(key)))
+
+
+def idempotent(func):
+    """
+    Makes a write method safe to retry when the client sends an
+    ``Idempotency-Key`` header.
+
+    The first request with a given key runs normally and its result is kept.
+    Retries carrying the same key and payload get the original result back
+    instead of repeating the write. Failed requests (exceptions and 5xx) are
+    forgotten so that they can be retried.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return func(*args, **kwargs)
+
+        store = current_app.extensions['idempotency']
+        scoped_key = (request.method, request.path, key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        state, response = store.begin(scoped_key, fingerprint)
+
+        if state == IdempotencyStore.REPLAY:
+            data, code, headers = response
+            headers = dict(headers)
+            headers[REPLAYED_HEADER] = 'true'
+            log.debug('Replaying response for idempotency key %s', key)
+            return data, code, headers
+        if state == IdempotencyStore.IN_FLIGHT:
+            return {'message': 'A request with this Idempotency-Key is still being processed.'}, 409
+        if state == IdempotencyStore.MISMATCH:
+            return {'message': 'Idempotency-Key was already used with a different payload.'}, 422
+
+        try:
+            data, code, headers = unpack(func(*args, **kwargs))
+        except Exception:
+            # The failed write may still hold the database lock
+            db.session.rollback()
+            store.abandon(scoped_key)
+            raise
+        if code >= 500:
+            store.abandon(scoped_key)
+        else:
+            store.complete(scoped_key, (data, code, dict(headers or {})))
+        return data, code, headers
+    return wrapper
+
+
+def init_app(flask_app):
+    config = flask_app.config
+    store_class = DatabaseIdempotencyStore if config['IDEMPOTENCY_SHARED'] else IdempotencyStore
+    flask_app.extensions['idempotency'] = store_class(config['IDEMPOTENCY_MAX_KEYS'], config['IDEMPOTENCY_KEY_TTL'])
@@ -0,0 +1,270 @@
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app, g, jsonify, request
+from rest_api_demo import settings
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.wrappers import Response
+
+log = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# Leaf frames added to the samples taken while a query runs
+SQL_FRAME = '[sql]'
+# Samples with a frame of these modules are counted as marshalling
+MARSHAL_MODULES = ('flask_restplus.marshalling', 'flask_restplus.fields')
+# Frames above the Flask app are the same for every request
+ROOT_FRAME = 'flask.app:wsgi_app'
+
+
+class Profile(object):
+    """
+    Statistical profile of one request: stacks sampled while it ran, folded
+    as flamegraph.pl reads them, weighted by microseconds.
+    """
+    def __init__(self, thread_id, method, path):
+        self.id = uuid.uuid4().hex[:12]
+        self.thread_id = thread_id
+        self.method = method
+        self.path = path
+        self.status = None
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.total_ms = None
+        self.stacks = {}
+        self.samples = 0
+        self.marshal_us = 0
+        self.sql_us = 0
+        self.sql_count = 0
+        self.sql_statements = {}  # statement -> [count, us]
+        self.in_sql = None
+        self.last_sample = self.start
+
+    def add_sample(self, stack, now):
+        # Weighted by the time since the last sample of this request, which
+        # is longer than the interval when the sampler waits for the GIL
+        weight_us = (now - self.last_sample) * 1e6
+        self.last_sample = now
+        if self.in_sql is not None:
+            # Queries run while marshalling (lazy loads) count as SQL only
+            stack = stack + (SQL_FRAME,)
+        elif any(frame.split(':', 1)[0] in MARSHAL_MODULES for frame in stack):
+            self.marshal_us += weight_us
+        self.stacks[stack] = self.stacks.get(stack, 0) + weight_us
+        self.samples += 1
+
+    def add_query(self, statement, elapsed_us):
+        self.sql_us += elapsed_us
+        self.sql_count += 1
+        entry = self.sql_statements.setdefault(statement, [0, 0])
+        entry[0] += 1
+        entry[1] += elapsed_us
+
+    def folded(self):
+        """
+        One 'frame;frame;frame microseconds' line per stack
+        """
+        return '\n'.join('{0} {1}'.format(';'.join(stack), int(weight))
+                         for stack, weight in sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+    def server_timing(self):
+        return 'total;dur={0:.1f}, sql;dur={1:.1f}, marshal;dur={2:.1f}'.format(
+            self.total_ms, self.sql_us / 1000.0, self.marshal_us / 1000.0)
+
+    def to_dict(self, with_stacks=True):
+        data = {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'started': self.started,
+            'total_ms': self.total_ms,
+            'sql_ms': self.sql_us / 1000.0,
+            'sql_count': self.sql_count,
+            'marshal_ms': self.marshal_us / 1000.0,
+            'samples': self.samples,
+            'interval_ms': settings.PROFILING_INTERVAL * 1000,
+            'sql_statements': [
+                {'statement': statement, 'count': count, 'ms': us / 1000.0}
+                for statement, (count, us) in sorted(self.sql_statements.items(), key=lambda item: -item[1][1])[:10]
+            ],
+        }
+        if with_stacks:
+            data['folded'] = self.folded()
+        return data
+
+
+def fold(frame):
+    """
+    Stack of a frame, outermost first, as 'module:function' names. Frames
+    above the Flask app are dropped.
+    """
+    stack = []
+    while frame is not None:
+        name = '{0}:{1}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name)
+        stack.append(name)
+        if name == ROOT_FRAME:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+class Sampler(object):
+    """
+    Thread that samples the stacks of the requests being profiled. It only
+    runs while there are some.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {}  # thread id -> Profile
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, profile):
+        with self._lock:
+            self.active[profile.thread_id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self, profile):
+        with self._lock:
+            self.active.pop(profile.thread_id, None)
+
+    def current(self):
+        "Profile of the calling thread, None if it isn't profiled"
+        return self.active.get(threading.get_ident())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                if not self.active:
+                    self._thread = None
+                    return
+                profiles = list(self.active.values())
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.add_sample(fold(frame), now)
+
+
+class ProfileStore(object):
+    """
+    Most recent ``max_profiles`` profiles, by id.
+    """
+    def __init__(self, max_profiles):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def all(self):
+        with self._lock:
+            return list(self._profiles.values())
+
+
+sampler = Sampler(settings.PROFILING_INTERVAL)
+store = ProfileStore(settings.PROFILING_MAX_PROFILES)
+
+
+def _wants_profile():
+    if request.headers.get(PROFILE_HEADER, '').strip().lower() in ('1', 'true', 'yes'):
+        return True
+    sample_rate = current_app.config['PROFILING_SAMPLE_RATE']
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def before_request():
+    if request.url_rule is None or request.path.startswith('/api/diagnostics/'):
+        return None
+    if _wants_profile():
+        profile = Profile(threading.get_ident(), request.method, request.path)
+        g.profile = profile
+        sampler.start(profile)
+    return None
+
+
+def after_request(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        sampler.stop(profile)
+        profile.total_ms = (time.perf_counter() - profile.start) * 1000
+        profile.status = response.status_code
+        store.add(profile)
+        response.headers[PROFILE_ID_HEADER] = profile.id
+        response.headers['Server-Timing'] = profile.server_timing()
+    return response
+
+
+def teardown_request(exc):
+    # after_request doesn't run when the view raised
+    profile = g.pop('profile', None)
+    if profile is not None:
+        sampler.stop(profile)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = sampler.current()
+    if profile is not None:
+        profile.in_sql = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = sampler.current()
+    if profile is not None and profile.in_sql is not None:
+        profile.add_query(statement, (time.perf_counter() - profile.in_sql) * 1e6)
+        profile.in_sql = None
+
+
+def get_profiles():
+    """
+    Summaries of the profiles kept, newest last.
+    """
+    return jsonify([profile.to_dict(with_stacks=False) for profile in store.all()])
+
+
+def get_profile(profile_id):
+    """
+    A profile as JSON, or only its folded stacks with ?format=folded
+    """
+    profile = store.get(profile_id)
+    if profile is None:
+        return jsonify({'message': 'No profile with this id, it may have been evicted.'}), 404
+    if request.args.get('format') == 'folded':
+        return Response(profile.folded() + '\n', mimetype='text/plain')
+    return jsonify(profile.to_dict())
+
+
+def init_app(flask_app):
+    if not flask_app.config['PROFILING_ENABLED']:
+        return
+    flask_app.before_request(before_request)
+    flask_app.after_request(after_request)
+    flask_app.teardown_request(teardown_request)
+    # Outside of the API namespaces, so they aren't part of swagger.json
+    flask_app.add_url_rule('/api/diagnostics/profiles/', 'diagnostics_profiles', get_profiles)
+    flask_app.add_url_rule('/api/diagnostics/profiles/<profile_id>', 'diagnostics_profile', get_profile)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
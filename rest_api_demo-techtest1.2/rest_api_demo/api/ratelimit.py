@@ -0,0 +1,174 @@
+"""
+Per-client rate limiting and load shedding.
+
+With RATELIMIT_ENABLED, every request to a route of RATELIMIT_NAMESPACES
+takes a token from the bucket of its client, method and route, and gets 429
+with Retry-After when there is none left. The client is the remote address.
+A request from one of RATELIMIT_TRUSTED_PROXIES, such as a reverse proxy in
+front of the API, is counted for the client its X-Client-Id names instead.
+Anyone else could pick a new X-Client-Id per request and never be limited.
+
+With LOADSHED_ENABLED, requests arriving while LOADSHED_MAX_IN_FLIGHT are
+being processed get 503 with Retry-After.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, jsonify, request
+
+log = logging.getLogger(__name__)
+
+CLIENT_ID_HEADER = 'X-Client-Id'
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: holds up to ``burst`` tokens and refills ``rate``
+    tokens per second. Each admitted request takes one token.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now):
+        """
+        Takes a token if one is available.
+
+        Returns 0 when the request is admitted, otherwise the number of
+        seconds until the next token is available.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    """
+    Token buckets keyed by client and route, with limits per namespace.
+
+    ``limits`` maps a namespace path (e.g. ``'blog/posts'``) to a
+    ``(rate, burst)`` tuple. Only the most recently used ``max_buckets``
+    buckets are kept, so idle clients don't grow memory forever.
+    """
+    def __init__(self, limits, default_limit, max_buckets, prefix='/api/'):
+        # Longest prefix first, so nested namespaces win over their parents
+        self.limits = sorted(((prefix + ns, limit) for ns, limit in limits.items()),
+                             key=lambda item: len(item[0]), reverse=True)
+        self.default_limit = default_limit
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def limit_for(self, rule):
+        for path, limit in self.limits:
+            if rule.startswith(path):
+                return limit
+        return self.default_limit
+
+    def acquire(self, client, method, rule):
+        """
+        Returns 0 if the request is admitted, otherwise the seconds the client
+        should wait before trying again.
+        """
+        limit = self.limit_for(rule)
+        if limit is None:
+            return 0
+        key = (client, method, rule)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(limit[0], limit[1], now)
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now)
+
+
+class LoadShedder(object):
+    """
+    Rejects requests once too many are being processed at the same time.
+
+    Refusing work early keeps the latency of admitted requests bounded,
+    instead of letting every request slow down as the workers saturate.
+    """
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def _reject(code, message, retry_after):
+    response = jsonify({'message': message})
+    response.status_code = code
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+
+def client_key(trusted_proxies):
+    "Client a request is counted for"
+    if request.remote_addr in trusted_proxies:
+        return request.headers.get(CLIENT_ID_HEADER) or request.remote_addr
+    return request.remote_addr
+
+
+def shed_load():
+    if request.url_rule is None:
+        return None
+    shedder = current_app.extensions['load_shedder']
+    if not shedder.enter():
+        log.warning('Shedding %s %s, %d requests in flight', request.method, request.path, shedder.in_flight)
+        return _reject(503, 'Server is overloaded, please retry later.', current_app.config['LOADSHED_RETRY_AFTER'])
+    g.load_shedder_entered = True
+    return None
+
+
+def limit_rate():
+    if request.url_rule is None:
+        return None
+    limiter = current_app.extensions['rate_limiter']
+    client = client_key(current_app.config['RATELIMIT_TRUSTED_PROXIES'])
+    retry_after = limiter.acquire(client, request.method, request.url_rule.rule)
+    if retry_after:
+        return _reject(429, 'Rate limit exceeded, please retry later.', retry_after)
+    return None
+
+
+def teardown_request(exc):
+    if g.pop('load_shedder_entered', False):
+        current_app.extensions['load_shedder'].leave()
+
+
+def init_app(flask_app):
+    config = flask_app.config
+    # Shedding first, so requests over both limits get 503
+    if config['LOADSHED_ENABLED']:
+        flask_app.extensions['load_shedder'] = LoadShedder(config['LOADSHED_MAX_IN_FLIGHT'])
+        flask_app.before_request(shed_load)
+        flask_app.teardown_request(teardown_request)
+    if config['RATELIMIT_ENABLED']:
+        flask_app.extensions['rate_limiter'] = RateLimiter(config['RATELIMIT_NAMESPACES'], config['RATELIMIT_DEFAULT'],
+                                                           config['RATELIMIT_MAX_BUCKETS'])
+        flask_app.before_request(limit_rate)
@@ -0,0 +1,101 @@
+"""
+Resource usage of the process, for soak tests to sample.
+
+``/api/diagnostics/resources`` returns what a slow leak would make grow:
+resident memory, open file descriptors, threads, objects tracked by the
+garbage collector, SQLAlchemy sessions alive with the objects in their
+identity maps, pooled connections checked out, and the size of the SQLite
+database with its journal or WAL. Values the platform can't tell, such as
+file descriptors outside Linux, are null.
+
+The garbage collector runs first, so objects only waiting to be collected,
+such as sessions of finished requests caught in reference cycles, aren't
+counted. That stalls the process, so the route is only served with
+RESOURCES_ENABLED.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, jsonify
+from rest_api_demo.database import db
+from sqlalchemy.orm import session as orm_session
+
+log = logging.getLogger(__name__)
+
+_STARTED = time.time()
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _database_sizes(engine):
+    """
+    Returns:
+        tuple: (bytes of the database file, bytes of its WAL and rollback
+            journal), None if it isn't a SQLite file
+    """
+    url = engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None, None
+    path = os.path.abspath(url.database)
+    return _file_size(path), _file_size(path + '-wal') + _file_size(path + '-journal')
+
+
+def _sessions():
+    """
+    Returns:
+        tuple: (SQLAlchemy sessions alive, objects in their identity maps)
+    """
+    # Every Session registers itself there, weakly
+    sessions = list(getattr(orm_session, '_sessions', {}).values())
+    return len(sessions), sum(len(s.identity_map) for s in sessions)
+
+
+def get_resources():
+    gc.collect()
+    engine = db.get_engine(current_app)
+    db_bytes, journal_bytes = _database_sizes(engine)
+    sessions, identity_map = _sessions()
+    pool = engine.pool
+    return jsonify({
+        'pid': os.getpid(),
+        'uptime': round(time.time() - _STARTED, 3),
+        'rss_bytes': _rss_bytes(),
+        'open_fds': _open_fds(),
+        'threads': threading.active_count(),
+        'gc_objects': len(gc.get_objects()),
+        'sessions': sessions,
+        'identity_map': identity_map,
+        'pool_checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+        'db_bytes': db_bytes,
+        'db_journal_bytes': journal_bytes,
+    })
+
+
+def init_app(flask_app):
+    if not flask_app.config['RESOURCES_ENABLED']:
+        return
+    # Outside of the API namespaces, so it isn't part of swagger.json
+    flask_app.add_url_rule('/api/diagnostics/resources', 'diagnostics_resources', get_resources)
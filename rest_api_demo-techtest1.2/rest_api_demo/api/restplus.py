@@ -1,20 +1,104 @@
+import hashlib
+import json
 import logging
 import traceback
 
-from flask_restplus import Api
+from flask import request
+from flask_restplus import Api, Resource
 from rest_api_demo import settings
+from rest_api_demo.api.blog.business import VersionMismatch
+from rest_api_demo.database import db
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.wrappers import Response
 
 log = logging.getLogger(__name__)
 
-api = Api(version='1.0', title='LumiraDX Blog API',
-          description='Prototype Blog API v0.2\n\n[swagger.json](/api/swagger.json)', )
+
+class CachedSpecsApi(Api):
+    """
+    Api that encodes swagger.json once and serves the same bytes with an
+    ETag and Cache-Control, so clients can cache and revalidate it.
+    """
+    def __init__(self, *args, **kwargs):
+        self._encoded_schema = None
+        super(CachedSpecsApi, self).__init__(*args, **kwargs)
+
+    @property
+    def encoded_schema(self):
+        """
+        (body, etag) of the Swagger spec, built on first use.
+        """
+        if self._encoded_schema is None:
+            body = json.dumps(self.__schema__, sort_keys=True).encode('utf-8')
+            self._encoded_schema = (body, hashlib.sha1(body).hexdigest())
+        return self._encoded_schema
+
+    def _register_specs(self, app_or_blueprint):
+        if self._add_specs:
+            endpoint = str('specs')
+            self._register_view(
+                app_or_blueprint,
+                CachedSwaggerView,
+                '/swagger.json',
+                endpoint=endpoint,
+                resource_class_args=(self, )
+            )
+            self.endpoints.add(endpoint)
+
+
+class CachedSwaggerView(Resource):
+    """
+    Render the Swagger specifications as JSON, from the encoded copy.
+    """
+    def get(self):
+        body, etag = self.api.encoded_schema
+        headers = {
+            'ETag': '"{0}"'.format(etag),
+            'Cache-Control': 'public, max-age={0}'.format(settings.SWAGGER_MAX_AGE),
+        }
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype='application/json', headers=headers)
+
+
+api = CachedSpecsApi(version='1.0', title='LumiraDX Blog API',
+                     description='Prototype Blog API v0.2\n\n[swagger.json](/api/swagger.json)', )
+
+
+def _resolve_model(model):
+    for parent in model.__parents__:
+        _resolve_model(parent)
+    for field in model.values():
+        nested = getattr(getattr(field, 'container', field), 'model', None)
+        if nested is not None:
+            _resolve_model(nested)
+    return model.resolved
+
+
+def resolve_models():
+    """
+    Resolves the models before requests marshal with them. Flask-RESTPlus
+    resolves a model on first use, by deep-copying it into a
+    cached_property, and a request copying a model while another one
+    caches the resolved copy of a model nested in it fails with
+    "dictionary changed size during iteration", a 500. Nested models and
+    parents are resolved first, so the copies of them carry their resolved
+    copy along.
+    """
+    for model in list(api.models.values()):
+        _resolve_model(model)
 
 
 @api.errorhandler
 def default_error_handler(e):
     message = 'An unhandled exception occurred.'
     log.exception(message)
+    # A write may have failed after its first statement took the database
+    # lock. In debug mode Flask keeps the context of a failed request
+    # instead of removing its session, so roll it back here, or every
+    # other write waits for the lock until it times out
+    db.session.rollback()
 
     if not settings.FLASK_DEBUG:
         return {'message': message}, 500
@@ -24,3 +108,17 @@ def default_error_handler(e):
 def database_not_found_error_handler(e):
     log.warning(traceback.format_exc())
     return {'message': 'A database result was required but none was found.'}, 404
+
+
+@api.errorhandler(IntegrityError)
+def integrity_error_handler(e):
+    # Such as creating a category with the id of one that exists, maybe
+    # created concurrently
+    db.session.rollback()
+    log.warning(str(e))
+    return {'message': 'The request conflicts with an existing resource.'}, 409
+
+
+@api.errorhandler(VersionMismatch)
+def version_mismatch_error_handler(e):
+    return {'message': 'The resource was modified since the version in If-Match.'}, 412
@@ -1,47 +1,173 @@
-import logging.config
+import argparse
+import logging
 
 import os
-from flask import Flask, Blueprint
 from rest_api_demo import settings
-from rest_api_demo.api.blog.endpoints.posts import ns as blog_posts_namespace
-from rest_api_demo.api.blog.endpoints.categories import ns as blog_categories_namespace
-from rest_api_demo.api.restplus import api
-from rest_api_demo.database import db
 
-app = Flask(__name__)
 logging_conf_path = os.path.normpath(os.path.join(os.path.dirname(__file__), '../logging.conf'))
-logging.config.fileConfig(logging_conf_path)
 log = logging.getLogger(__name__)
 
 
-def configure_app(flask_app):
+def configure_logging():
+    import logging.config
+    logging.config.fileConfig(logging_conf_path)
+
+
+def configure_app(flask_app, config=None):
     flask_app.config['SERVER_NAME'] = settings.FLASK_SERVER_NAME
     flask_app.config['SQLALCHEMY_DATABASE_URI'] = settings.SQLALCHEMY_DATABASE_URI
     flask_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = settings.SQLALCHEMY_TRACK_MODIFICATIONS
+    flask_app.config['RATELIMIT_ENABLED'] = settings.RATELIMIT_ENABLED
+    flask_app.config['RATELIMIT_DEFAULT'] = settings.RATELIMIT_DEFAULT
+    flask_app.config['RATELIMIT_NAMESPACES'] = settings.RATELIMIT_NAMESPACES
+    flask_app.config['RATELIMIT_MAX_BUCKETS'] = settings.RATELIMIT_MAX_BUCKETS
+    flask_app.config['RATELIMIT_TRUSTED_PROXIES'] = settings.RATELIMIT_TRUSTED_PROXIES
+    flask_app.config['LOADSHED_ENABLED'] = settings.LOADSHED_ENABLED
+    flask_app.config['LOADSHED_MAX_IN_FLIGHT'] = settings.LOADSHED_MAX_IN_FLIGHT
+    flask_app.config['LOADSHED_RETRY_AFTER'] = settings.LOADSHED_RETRY_AFTER
+    flask_app.config['PROFILING_ENABLED'] = settings.PROFILING_ENABLED
+    flask_app.config['PROFILING_SAMPLE_RATE'] = settings.PROFILING_SAMPLE_RATE
+    flask_app.config['RESOURCES_ENABLED'] = settings.RESOURCES_ENABLED
+    flask_app.config['GROUP_COMMIT_ENABLED'] = settings.GROUP_COMMIT_ENABLED
+    flask_app.config['GROUP_COMMIT_WINDOW'] = settings.GROUP_COMMIT_WINDOW
+    flask_app.config['GROUP_COMMIT_MAX_BATCH'] = settings.GROUP_COMMIT_MAX_BATCH
+    flask_app.config['REPLICA_ENABLED'] = settings.REPLICA_ENABLED
+    flask_app.config['REPLICA_MAX_STALENESS'] = settings.REPLICA_MAX_STALENESS
+    flask_app.config['REPLICA_REFRESH_INTERVAL'] = settings.REPLICA_REFRESH_INTERVAL
+    flask_app.config['REPLICA_RECENT_POSTS'] = settings.REPLICA_RECENT_POSTS
+    flask_app.config['COALESCE_ENABLED'] = settings.COALESCE_ENABLED
+    flask_app.config['COALESCE_NAMESPACES'] = settings.COALESCE_NAMESPACES
+    flask_app.config['COALESCE_MAX_WAIT'] = settings.COALESCE_MAX_WAIT
+    flask_app.config['JOBS_ENABLED'] = settings.JOBS_ENABLED
+    flask_app.config['JOBS_WORKERS'] = settings.JOBS_WORKERS
+    flask_app.config['JOBS_MAX_BATCH'] = settings.JOBS_MAX_BATCH
+    flask_app.config['JOBS_POLL_INTERVAL'] = settings.JOBS_POLL_INTERVAL
+    flask_app.config['JOBS_MAX_ATTEMPTS'] = settings.JOBS_MAX_ATTEMPTS
+    flask_app.config['JOBS_RETRY_DELAY'] = settings.JOBS_RETRY_DELAY
+    flask_app.config['JOBS_RETENTION'] = settings.JOBS_RETENTION
+    flask_app.config['IDEMPOTENCY_MAX_KEYS'] = settings.IDEMPOTENCY_MAX_KEYS
+    flask_app.config['IDEMPOTENCY_KEY_TTL'] = settings.IDEMPOTENCY_KEY_TTL
+    flask_app.config['IDEMPOTENCY_SHARED'] = settings.IDEMPOTENCY_SHARED
     flask_app.config['SWAGGER_UI_DOC_EXPANSION'] = settings.RESTPLUS_SWAGGER_UI_DOC_EXPANSION
     flask_app.config['RESTPLUS_VALIDATE'] = settings.RESTPLUS_VALIDATE
     flask_app.config['RESTPLUS_MASK_SWAGGER'] = settings.RESTPLUS_MASK_SWAGGER
     flask_app.config['ERROR_404_HELP'] = settings.RESTPLUS_ERROR_404_HELP
+    flask_app.config.update(config or {})
 
 
 def initialize_app(flask_app):
-    configure_app(flask_app)
+    # The API modules pull in Flask-RESTPlus, SQLAlchemy and register the
+    # Swagger models, so they are only imported once an app is created.
+    # Importing this module stays cheap for workers and test fixtures.
+    from flask import Blueprint
+    from rest_api_demo.api.blog.endpoints.posts import ns as blog_posts_namespace
+    from rest_api_demo.api.blog.endpoints.categories import ns as blog_categories_namespace
+    from rest_api_demo.api.blog.endpoints.changes import ns as blog_changes_namespace
+    from rest_api_demo.api import coalescing, idempotency, profiling, ratelimit, resources
+    from rest_api_demo.api.restplus import api, resolve_models
+    from rest_api_demo.database import db, group_commit, jobs, replica, upgrade_database
 
     blueprint = Blueprint('api', __name__, url_prefix='/api')
     api.init_app(blueprint)
     api.add_namespace(blog_posts_namespace)
     api.add_namespace(blog_categories_namespace)
+    api.add_namespace(blog_changes_namespace)
+    resolve_models()
     flask_app.register_blueprint(blueprint)
 
+    ratelimit.init_app(flask_app)
+    idempotency.init_app(flask_app)
+    profiling.init_app(flask_app)
+    resources.init_app(flask_app)
     db.init_app(flask_app)
+    with flask_app.app_context():
+        upgrade_database()
+    group_commit.init_app(flask_app)
+    jobs.init_app(flask_app)
+    replica.init_app(flask_app)
+    coalescing.init_app(flask_app)
+
+
+def create_app(config=None):
+    """
+    Application factory.
+
+    ``config`` overrides the values taken from settings.py.
+    """
+    from flask import Flask
+
+    flask_app = Flask(__name__)
+    configure_app(flask_app, config)
+    initialize_app(flask_app)
+    return flask_app
+
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the blog API development server.')
+    parser.add_argument('--server-name', default=settings.FLASK_SERVER_NAME,
+                        help='Host and port to serve on (default: %(default)s)')
+    parser.add_argument('--no-reload', action='store_true',
+                        help='Disable the reloader, even in debug mode')
+    parser.add_argument('--read-replica', type=float, nargs='?', const=settings.REPLICA_MAX_STALENESS,
+                        metavar='MAX_STALENESS',
+                        help='Serve hot reads from memory, at most MAX_STALENESS seconds behind the database '
+                             '(default: %(const)s)')
+    parser.add_argument('--keep-alive', action='store_true', default=settings.FLASK_KEEP_ALIVE,
+                        help='Keep connections open between requests (HTTP/1.1), so clients can pipeline them')
+    parser.add_argument('--rate-limit', action='store_true', default=settings.RATELIMIT_ENABLED,
+                        help='Limit the request rate of each client on RATELIMIT_NAMESPACES, with 429')
+    parser.add_argument('--shed-load', type=int, nargs='?', const=settings.LOADSHED_MAX_IN_FLIGHT,
+                        metavar='MAX_IN_FLIGHT',
+                        help='Reject requests with 503 while MAX_IN_FLIGHT are being processed (default: %(const)s)')
+    parser.add_argument('--profile', action='store_true', default=settings.PROFILING_ENABLED,
+                        help='Profile requests sending X-Profile: 1, served on /api/diagnostics/profiles/')
+    parser.add_argument('--diagnose-resources', action='store_true', default=settings.RESOURCES_ENABLED,
+                        help='Serve the resource usage of the process on /api/diagnostics/resources')
+    parser.add_argument('--coalesce-reads', action='store_true', default=settings.COALESCE_ENABLED,
+                        help='Identical concurrent GETs share one response')
+    parser.add_argument('--background-jobs', type=int, nargs='?', const=settings.JOBS_WORKERS, metavar='WORKERS',
+                        help='Leave the secondary work of post writes to WORKERS threads (default: %(const)s)')
+    parser.add_argument('--workers', type=int, default=settings.FLASK_WORKERS,
+                        help='Processes serving requests on the same port, each with an app of its own '
+                             '(default: %(default)s)')
+    parser.add_argument('--threads', type=int, default=settings.FLASK_THREADS,
+                        help='Threads answering requests in each process, 0 for a thread per connection '
+                             '(default: %(default)s)')
+    parser.add_argument('--database-uri', default=settings.SQLALCHEMY_DATABASE_URI,
+                        help='Database to serve, such as a file on tmpfs for test runs (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.workers > 1 and not hasattr(os, 'fork'):
+        parser.error('--workers needs a platform with fork()')
+    if args.workers > 1 and args.rate_limit:
+        parser.error('--rate-limit keeps the buckets of clients in each process, it needs --workers 1')
 
-def main():
-    initialize_app(app)
-    log.info('>>>>> Starting development server at http://{}/api/ <<<<<'.format(app.config['SERVER_NAME']))
+    configure_logging()
+    # Switches default to their setting
+    config = {'SERVER_NAME': args.server_name, 'SQLALCHEMY_DATABASE_URI': args.database_uri,
+              'RATELIMIT_ENABLED': args.rate_limit, 'PROFILING_ENABLED': args.profile,
+              'RESOURCES_ENABLED': args.diagnose_resources, 'COALESCE_ENABLED': args.coalesce_reads,
+              'IDEMPOTENCY_SHARED': settings.IDEMPOTENCY_SHARED or args.workers > 1}
+    if args.read_replica is not None:
+        config.update(REPLICA_ENABLED=True, REPLICA_MAX_STALENESS=args.read_replica)
+    if args.shed_load is not None:
+        config.update(LOADSHED_ENABLED=True, LOADSHED_MAX_IN_FLIGHT=args.shed_load)
+    if args.background_jobs is not None:
+        config.update(JOBS_ENABLED=True, JOBS_WORKERS=args.background_jobs)
+    log.info('>>>>> Starting development server at http://{}/api/ <<<<<'.format(args.server_name))
+    options = {}
+    if args.keep_alive:
+        from rest_api_demo.serving import KeepAliveRequestHandler
+        options['request_handler'] = KeepAliveRequestHandler
+    if args.workers > 1 or args.threads:
+        # Each worker makes its app once forked, see serving.py
+        from rest_api_demo.serving import serve
+        host, _, port = args.server_name.partition(':')
+        serve(lambda: create_app(config), host or '127.0.0.1', int(port or 80), args.workers, args.threads,
+              options.get('request_handler'))
+        return
+    app = create_app(config)
+    app.run(debug=settings.FLASK_DEBUG, use_reloader=settings.FLASK_DEBUG and not args.no_reload, **options)
 
-# Run main here so we can use in pythonanywhere
-main()
 
 if __name__ == "__main__":
-    app.run(debug=settings.FLASK_DEBUG)
+    main()
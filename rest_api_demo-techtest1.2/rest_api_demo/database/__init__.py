@@ -1,9 +1,51 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 
 db = SQLAlchemy()
 
+# Columns added after the first release: (table, column, DDL)
+SCHEMA_UPGRADES = [
+    ('category', 'version', 'ALTER TABLE category ADD COLUMN version INTEGER NOT NULL DEFAULT 1'),
+    ('post', 'version', 'ALTER TABLE post ADD COLUMN version INTEGER NOT NULL DEFAULT 1'),
+]
+
+# Indexes added after the first release, create_all() only adds them with
+# their table
+INDEX_UPGRADES = [
+    'CREATE INDEX IF NOT EXISTS ix_post_category_pub_date ON post (category_id, pub_date, id)',
+]
+
+
+def _start_version_clock():
+    "Starts the clock after the versions already given, if it has no row yet"
+    from rest_api_demo.database.models import Post, Category, VersionClock
+    if VersionClock.query.get(1) is None:
+        last = max(db.session.query(db.func.max(Category.version)).scalar() or 0,
+                   db.session.query(db.func.max(Post.version)).scalar() or 0)
+        db.session.add(VersionClock(last))
+        db.session.commit()
+
 
 def reset_database():
     from rest_api_demo.database.models import Post, Category  # noqa
     db.drop_all()
     db.create_all()
+    _start_version_clock()
+
+
+def upgrade_database():
+    """
+    Brings a database created by an older release up to the current schema.
+    Safe to run on every start.
+    """
+    from rest_api_demo.database.models import Post, Category  # noqa
+    from rest_api_demo.database import summaries
+    db.create_all()
+    inspector = inspect(db.engine)
+    for table, column, ddl in SCHEMA_UPGRADES:
+        if column not in [c['name'] for c in inspector.get_columns(table)]:
+            db.engine.execute(ddl)
+    for ddl in INDEX_UPGRADES:
+        db.engine.execute(ddl)
+    _start_version_clock()
+    summaries.build_missing()
@@ -0,0 +1,130 @@
+"""
+Group commit: writes of concurrent requests share one transaction.
+
+Every commit to SQLite waits for the journal to reach the disk. With group
+commit, requests hand their writes to a single writer thread instead of
+committing them. The writer runs the writes it received within
+GROUP_COMMIT_WINDOW seconds of the first one, up to GROUP_COMMIT_MAX_BATCH,
+in one transaction, each in a savepoint of its own so a write that fails
+(a missing row, a constraint) is rolled back alone and its error is raised
+in its request. The requests get their results only once the transaction
+is committed.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from rest_api_demo.database import db
+
+log = logging.getLogger(__name__)
+
+
+class _Write(object):
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitter(object):
+    """
+    Writer thread committing the writes it is given in batches.
+    """
+    def __init__(self, flask_app, window, max_batch):
+        self.flask_app = flask_app
+        self.window = window
+        self.max_batch = max_batch
+        self.stats = {'batches': 0, 'writes': 0, 'failed_writes': 0, 'failed_batches': 0}
+        self._queue = deque()
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        """
+        Runs ``func(*args)`` in the next batch and waits until the batch is
+        committed.
+
+        Returns what func returned, or raises what it raised.
+        """
+        write = _Write(func, args)
+        with self._ready:
+            self._queue.append(write)
+            self._ready.notify()
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _next_batch(self):
+        with self._ready:
+            while not self._queue:
+                self._ready.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._ready.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch))]
+
+    def _run(self):
+        with self.flask_app.app_context():
+            while True:
+                batch = self._next_batch()
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    log.exception('Group commit of %d writes failed', len(batch))
+                    db.session.rollback()
+                    self.stats['failed_batches'] += 1
+                    for write in batch:
+                        if write.error is None:
+                            write.error = e
+                finally:
+                    db.session.remove()
+                    for write in batch:
+                        write.done.set()
+
+    def _commit(self, batch):
+        session = db.session
+        # pysqlite only begins a transaction before DML, and a savepoint
+        # outside of one would commit on its release
+        session.execute('BEGIN IMMEDIATE')
+        for write in batch:
+            savepoint = session.begin_nested()
+            try:
+                write.result = write.func(*write.args)
+                savepoint.commit()
+            except Exception as e:
+                savepoint.rollback()
+                write.error = e
+                self.stats['failed_writes'] += 1
+        session.commit()
+        self.stats['batches'] += 1
+        self.stats['writes'] += len(batch)
+
+
+def write(func, *args):
+    """
+    Runs ``func(*args)``, which changes rows of db.session without
+    committing, and commits it: in the next group commit if enabled, on its
+    own otherwise.
+    """
+    committer = current_app.extensions.get('group_commit')
+    if committer is not None:
+        return committer.submit(func, *args)
+    result = func(*args)
+    db.session.commit()
+    return result
+
+
+def init_app(flask_app):
+    config = flask_app.config
+    if config['GROUP_COMMIT_ENABLED']:
+        flask_app.extensions['group_commit'] = GroupCommitter(
+            flask_app, config['GROUP_COMMIT_WINDOW'], config['GROUP_COMMIT_MAX_BATCH'])
@@ -0,0 +1,347 @@
+"""
+Background jobs: work a write defers until after it commits.
+
+Write functions call enqueue() for the work their request doesn't need to
+wait for. With JOBS_ENABLED, enqueue() adds a row to the job table in the
+transaction of the write, so the job is committed if and only if the write
+is, and survives the process. After each commit a dispatcher thread reads
+the jobs committed since the last ones it saw, in id order, and hands each
+to one of JOBS_WORKERS threads. Jobs with the same key, such as the writes
+to one post, go to the same worker, so they run in the order they were
+enqueued.
+
+A worker runs the jobs it has waiting, up to JOBS_MAX_BATCH, in one
+transaction, which also marks them done, and only runs those still
+pending: their work is applied once, even when jobs of the same table are
+run by several processes. When a batch fails its jobs are run one at a
+time, and a job that fails is retried in place, after JOBS_RETRY_DELAY
+seconds, up to JOBS_MAX_ATTEMPTS times, then marked failed with its error.
+
+Every JOBS_POLL_INTERVAL seconds the dispatcher also picks up jobs pending
+for longer than that which it doesn't have, left by a process that stopped
+or enqueued by another one, and deletes the jobs done more than
+JOBS_RETENTION seconds ago.
+
+Without JOBS_ENABLED, enqueue() runs the job right away, in the transaction
+of the write, as if there was no queue.
+"""
+import json
+import logging
+import math
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app, jsonify
+from rest_api_demo.database import db, group_commit
+from rest_api_demo.database.models import Job
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_HEADER = 'X-Job-Id'
+
+# Kind -> function running jobs of that kind, called with their payload as
+# keyword arguments, within the transaction that marks them done
+HANDLERS = {}
+
+# Most jobs read from the table at once
+DISPATCH_BATCH = 1000
+
+
+def handler(kind):
+    "Registers the decorated function as the handler of a kind of job"
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def _percentile(sorted_values, q):
+    """
+    Nearest rank, the rule of the tester's histogram.Histogram, so the lags
+    reported here compare with the ones it measures
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, int(math.ceil(q / 100.0 * len(sorted_values))) - 1)]
+
+
+class JobQueue(object):
+    """
+    Dispatcher thread reading committed jobs from the table, and the worker
+    threads running them.
+    """
+    def __init__(self, flask_app, workers, max_batch, poll_interval, max_attempts, retry_delay, retention):
+        self.flask_app = flask_app
+        self.max_batch = max_batch
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retention = retention
+        self.stats = {'dispatched': 0, 'done': 0, 'skipped': 0, 'retries': 0, 'failed': 0, 'pruned': 0}
+        # created -> done of the last jobs run, in ms
+        self.lags = deque(maxlen=1000)
+        self.wake = threading.Event()
+        self.workers = max(1, workers)
+        self._queues = [queue.Queue() for _ in range(self.workers)]
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._threads = [threading.Thread(target=self._dispatch, name='jobs-dispatcher', daemon=True)]
+        self._threads += [threading.Thread(target=self._work, args=(jobs,), name='jobs-worker-%d' % i, daemon=True)
+                          for i, jobs in enumerate(self._queues)]
+        for thread in self._threads:
+            thread.start()
+
+    ###########################################################################
+    # Dispatcher
+    def _hand_out(self, jobs):
+        for job_id, key in jobs:
+            with self._lock:
+                if job_id in self._queued:
+                    continue
+                self._queued.add(job_id)
+            self._queues[zlib.crc32(key.encode('utf-8')) % len(self._queues)].put(job_id)
+            self.stats['dispatched'] += 1
+
+    def _pending(self, after=None, created_before=None):
+        query = db.session.query(Job.id, Job.key).filter(Job.status == PENDING)
+        if after is not None:
+            query = query.filter(Job.id > after)
+        if created_before is not None:
+            query = query.filter(Job.created < created_before)
+        return query.order_by(Job.id).limit(DISPATCH_BATCH).all()
+
+    def _sweep(self, startup=False):
+        "Jobs left behind or of other processes, and pruning"
+        now = datetime.utcnow()
+        jobs = self._pending(created_before=None if startup else now - timedelta(seconds=self.poll_interval))
+        if jobs:
+            self._last_id = max(self._last_id, jobs[-1][0])
+            self._hand_out(jobs)
+        pruned = Job.query.filter(Job.status == DONE, Job.finished < now - timedelta(seconds=self.retention)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        self.stats['pruned'] += pruned
+
+    def _dispatch(self):
+        with self.flask_app.app_context():
+            next_sweep = 0
+            startup = True
+            while True:
+                try:
+                    if time.monotonic() >= next_sweep:
+                        self._sweep(startup)
+                        startup = False
+                        next_sweep = time.monotonic() + self.poll_interval
+                    # Writers commit one at a time, so ids are committed in
+                    # order and none is skipped by reading past the last one
+                    jobs = self._pending(after=self._last_id)
+                    db.session.rollback()
+                    if jobs:
+                        self._last_id = jobs[-1][0]
+                        self._hand_out(jobs)
+                    if len(jobs) == DISPATCH_BATCH:
+                        continue
+                except Exception:
+                    log.exception('Dispatching jobs failed')
+                finally:
+                    db.session.remove()
+                self.wake.wait(self.poll_interval)
+                self.wake.clear()
+
+    ###########################################################################
+    # Workers
+    @staticmethod
+    def _run(job_id):
+        """
+        Marks a job done, if it's still pending, and runs it, in the caller's
+        transaction.
+
+        Returns:
+            datetime: When the job was created, None if it wasn't pending
+        """
+        # Written first, so the transaction takes the write lock right away
+        # and the job can't be run by another process meanwhile
+        claimed = Job.query.filter(Job.id == job_id, Job.status == PENDING).update({
+            Job.status: DONE, Job.attempts: Job.attempts + 1, Job.finished: datetime.utcnow(),
+        }, synchronize_session=False)
+        if not claimed:
+            return None
+        kind, payload, created = db.session.query(Job.kind, Job.payload, Job.created).filter(Job.id == job_id).one()
+        HANDLERS[kind](**json.loads(payload))
+        return created
+
+    def _fail(self, job_id, attempts, error):
+        Job.query.filter(Job.id == job_id, Job.status == PENDING).update({
+            Job.status: FAILED, Job.attempts: Job.attempts + attempts, Job.finished: datetime.utcnow(),
+            Job.error: error,
+        }, synchronize_session=False)
+        db.session.commit()
+
+    @classmethod
+    def _run_batch(cls, job_ids):
+        return [cls._run(job_id) for job_id in job_ids]
+
+    def _done(self, created):
+        if created is None:
+            self.stats['skipped'] += 1
+        else:
+            self.stats['done'] += 1
+            self.lags.append((datetime.utcnow() - created).total_seconds() * 1000)
+
+    def _run_alone(self, job_id):
+        "Runs a job in a transaction of its own, retrying it if it fails"
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                created = group_commit.write(self._run, job_id)
+            except Exception as e:
+                db.session.rollback()
+                if attempt == self.max_attempts:
+                    log.exception('Job %s failed %d times, giving up', job_id, attempt)
+                    self._fail(job_id, attempt, '%s: %s' % (type(e).__name__, e))
+                    self.stats['failed'] += 1
+                    return
+                log.warning('Job %s failed, retrying in %s s: %s', job_id, self.retry_delay, e)
+                self.stats['retries'] += 1
+                time.sleep(self.retry_delay)
+                continue
+            self._done(created)
+            return
+
+    def _take(self, jobs):
+        "Waits for a job, and takes the ones waiting behind it, up to max_batch"
+        batch = [jobs.get()]
+        # Jobs waiting behind it share its transaction, so a backlog costs a
+        # commit per batch rather than per job
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_jobs(self, batch):
+        "Runs a batch in one transaction, or its jobs one at a time if it fails"
+        try:
+            for created in group_commit.write(self._run_batch, batch):
+                self._done(created)
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) > 1:
+                log.warning('Batch of %d jobs failed, running them one at a time: %s', len(batch), e)
+            for job_id in batch:
+                self._run_alone(job_id)
+
+    def _work(self, jobs):
+        with self.flask_app.app_context():
+            while True:
+                batch = self._take(jobs)
+                try:
+                    self._run_jobs(batch)
+                except Exception:
+                    log.exception('Recording the failure of jobs %s failed', batch)
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+                    with self._lock:
+                        self._queued.difference_update(batch)
+
+    ###########################################################################
+    # Metrics
+    def depth(self):
+        """
+        Returns:
+            dict: Jobs 'pending' and 'failed' in the table, age in ms of the
+                oldest pending one, and jobs 'queued' in this process
+        """
+        counts = dict(db.session.query(Job.status, db.func.count(Job.id))
+                      .filter(Job.status.in_([PENDING, FAILED])).group_by(Job.status).all())
+        oldest = db.session.query(db.func.min(Job.created)).filter(Job.status == PENDING).scalar()
+        with self._lock:
+            queued = len(self._queued)
+        return {
+            'pending': counts.get(PENDING, 0),
+            'failed': counts.get(FAILED, 0),
+            'oldest_pending_ms': (datetime.utcnow() - oldest).total_seconds() * 1000 if oldest else 0,
+            'queued': queued,
+        }
+
+
+def enqueue(kind, key, **payload):
+    """
+    Runs ``HANDLERS[kind](**payload)`` once the current transaction commits,
+    by the job queue if enabled, or right away in the transaction otherwise.
+
+    Args:
+        key (str): Jobs with the same key run in the order they're enqueued
+    Returns:
+        int: Id of the job, None if it ran right away
+    """
+    if current_app.extensions.get('jobs') is None:
+        HANDLERS[kind](**payload)
+        return None
+    job = Job(kind, key, json.dumps(payload))
+    db.session.add(job)
+    db.session.flush()
+    return job.id
+
+
+def job_headers(job_id):
+    "Headers of a response to a write that enqueued a job"
+    return {JOB_HEADER: str(job_id)} if job_id is not None else {}
+
+
+def get_queue():
+    """
+    Depth of the queue, and what this process ran.
+    """
+    jobs = current_app.extensions['jobs']
+    lags = sorted(jobs.lags)
+    result = jobs.depth()
+    result.update(jobs.stats)
+    result.update({'workers': jobs.workers, 'lag_p50_ms': _percentile(lags, 50),
+                   'lag_p99_ms': _percentile(lags, 99)})
+    return jsonify(result)
+
+
+def get_job(job_id):
+    job = Job.query.filter(Job.id == job_id).one_or_none()
+    if job is None:
+        return jsonify({'message': 'No job with this id, it may have been pruned.'}), 404
+    return jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'key': job.key,
+        'status': job.status,
+        'attempts': job.attempts,
+        'error': job.error,
+        'created': job.created.isoformat(),
+        'finished': job.finished.isoformat() if job.finished else None,
+    })
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_dispatcher(session):
+    jobs = current_app.extensions.get('jobs')
+    if jobs is not None:
+        jobs.wake.set()
+
+
+def init_app(flask_app):
+    config = flask_app.config
+    if config['JOBS_ENABLED']:
+        flask_app.extensions['jobs'] = JobQueue(
+            flask_app, config['JOBS_WORKERS'], config['JOBS_MAX_BATCH'], config['JOBS_POLL_INTERVAL'], config['JOBS_MAX_ATTEMPTS'],
+            config['JOBS_RETRY_DELAY'], config['JOBS_RETENTION'])
+        # Outside of the API namespaces, so they aren't part of swagger.json
+        flask_app.add_url_rule('/api/diagnostics/jobs', 'diagnostics_jobs', get_queue)
+        flask_app.add_url_rule('/api/diagnostics/jobs/<int:job_id>', 'diagnostics_job', get_job)
@@ -8,6 +8,9 @@ from rest_api_demo.database import db
 
 
 class Post(db.Model):
+    # Latest posts of a category first, for GET /blog/categories/<id>/summary
+    __table_args__ = (db.Index('ix_post_category_pub_date', 'category_id', 'pub_date', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(80))
     body = db.Column(db.Text)
@@ -16,6 +19,10 @@ class Post(db.Model):
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     category = db.relationship('Category', backref=db.backref('posts', lazy='dynamic'))
 
+    # Set from the VersionClock on every change, used for ETags and If-Match
+    # checks
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
     def __init__(self, title, body, category, pub_date=None):
         self.title = title
         self.body = body
@@ -32,8 +39,132 @@ class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50))
 
+    # Set from the VersionClock when the category or any of its posts
+    # change, as both are part of the category_with_posts representation
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
     def __init__(self, name):
         self.name = name
 
     def __repr__(self):
         return '<Category %r>' % self.name
+
+
+class VersionClock(db.Model):
+    """
+    Single row holding the last version given to a category or post. Every
+    write takes the next one, rather than adding 1 to the version of the
+    row, so a category or post deleted and created again with the same id
+    never gets the ETag of the one before.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    last = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, last=0):
+        self.id = 1
+        self.last = last
+
+    def __repr__(self):
+        return '<VersionClock %r>' % self.last
+
+
+class Change(db.Model):
+    """
+    Entry of the append-only change log served by GET /blog/changes/.
+    """
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # Writers commit one at a time in SQLite, so entries are committed in
+    # seq order and a reader never sees a seq after one it could miss. It's
+    # the order entries were logged in, which isn't that of the writes with
+    # JOBS_ENABLED: the job of a post write logs it after the write commits,
+    # so later writes can come before it
+    seq = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # 'category' or 'post'
+    item_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)  # 'create', 'update' or 'delete'
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, kind, item_id, action, timestamp=None):
+        self.kind = kind
+        self.item_id = item_id
+        self.action = action
+        if timestamp is None:
+            timestamp = datetime.utcnow()
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return '<Change %r %s %s %s>' % (self.seq, self.action, self.kind, self.item_id)
+
+
+class IdempotencyKey(db.Model):
+    """
+    Idempotency-Key of a write, kept here instead of in memory when
+    IDEMPOTENCY_SHARED is set, see api/idempotency.py.
+    """
+    __table_args__ = (db.Index('ix_idempotency_key_created', 'created'),)
+
+    key = db.Column(db.String(300), primary_key=True)  # JSON [method, path, key]
+    fingerprint = db.Column(db.String(64), nullable=False)
+    created = db.Column(db.Float, nullable=False)  # time.time()
+    response = db.Column(db.Text)  # JSON [data, code, headers], NULL while the write is in flight
+
+    def __init__(self, key, fingerprint, created):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.created = created
+
+    def __repr__(self):
+        return '<IdempotencyKey %r>' % self.key
+
+
+class CategorySummary(db.Model):
+    """
+    Read model of a category's posts: how many there are and the latest
+    ones, kept up to date by every write to them. Serves the first page of
+    GET /blog/categories/<id>/summary without reading the posts.
+    """
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0)
+    # JSON list of {"id", "title", "pub_date"}, latest first
+    latest_posts = db.Column(db.Text, nullable=False, default='[]')
+
+    def __init__(self, category_id, post_count=0, latest_posts='[]'):
+        self.category_id = category_id
+        self.post_count = post_count
+        self.latest_posts = latest_posts
+
+    def __repr__(self):
+        return '<CategorySummary %r: %r posts>' % (self.category_id, self.post_count)
+
+
+class Job(db.Model):
+    """
+    Work deferred by a write, committed with it and run after it by the job
+    queue, see database/jobs.py.
+    """
+    __table_args__ = (db.Index('ix_job_status', 'status', 'id'), {'sqlite_autoincrement': True})
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    # Jobs with the same key run in the order they were enqueued
+    key = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    status = db.Column(db.String(10), nullable=False, default='pending')  # 'pending', 'done' or 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created = db.Column(db.DateTime, nullable=False)
+    finished = db.Column(db.DateTime)
+
+    def __init__(self, kind, key, payload='{}', created=None):
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.status = 'pending'
+        self.attempts = 0
+        if created is None:
+            created = datetime.utcnow()
+        self.created = created
+
+    def __repr__(self):
+        return '<Job %r %s %s %s>' % (self.id, self.kind, self.key, self.status)
@@ -0,0 +1,300 @@
+"""
+In-memory read replica of the categories and the latest posts.
+
+With REPLICA_ENABLED, each API process holds a snapshot of every category
+and of the REPLICA_RECENT_POSTS latest posts, as plain records indexed by id
+and by (pub_date, id). The read endpoints serve what a snapshot can answer
+from it, without the ORM, and read the database otherwise.
+
+A thread brings the snapshot up to date from the change log, every
+REPLICA_REFRESH_INTERVAL seconds and right after each commit of this
+process, reading only the rows the new changes name. A snapshot is never
+served more than REPLICA_MAX_STALENESS seconds after it was last known to
+be current: a read finding it older refreshes it first. Reads sent with
+``Cache-Control: no-cache`` always go to the database.
+"""
+import bisect
+import logging
+import threading
+import time
+
+from flask import current_app, g, request
+from rest_api_demo.database import db
+from rest_api_demo.database.models import Category, CategorySummary, Change, Post
+from sqlalchemy import event, func, select
+
+log = logging.getLogger(__name__)
+
+AGE_HEADER = 'X-Replica-Age'
+SEQ_HEADER = 'X-Replica-Seq'
+
+# More new changes than this and the snapshot is loaded again in full. Also
+# keeps the post ids of a refresh under SQLite's 999 parameters
+MAX_CHANGES = 500
+
+
+class CategoryRecord(object):
+    __slots__ = ('id', 'name', 'version', 'post_count')
+
+    def __init__(self, id, name, version, post_count):
+        self.id = id
+        self.name = name
+        self.version = version
+        self.post_count = post_count
+
+
+class PostRecord(object):
+    # category is the CategoryRecord the post was loaded with. Renaming or
+    # deleting a category logs its posts as changed, so they are loaded
+    # again along with it
+    __slots__ = ('id', 'title', 'body', 'pub_date', 'category', 'version')
+
+    def __init__(self, id, title, body, pub_date, category, version):
+        self.id = id
+        self.title = title
+        self.body = body
+        self.pub_date = pub_date
+        self.category = category
+        self.version = version
+
+    @property
+    def key(self):
+        return self.pub_date, self.id
+
+
+class Snapshot(object):
+    """
+    The categories and latest posts as of change ``seq``. Never changed once
+    built, a refresh builds a new one.
+    """
+    def __init__(self, seq, seq_timestamp, categories, posts, floor):
+        """
+        Args:
+            categories (dict): id -> CategoryRecord
+            posts (dict): id -> PostRecord
+            floor (tuple): (pub_date, id) from which every post is held,
+                None if every post is
+        """
+        self.seq = seq
+        self.seq_timestamp = seq_timestamp
+        self.categories = categories
+        self.posts = posts
+        self.floor = floor
+        self.category_list = [categories[category_id] for category_id in sorted(categories)]
+        # Category id -> (pub_date, id) of its posts held, oldest first
+        self.by_category = {}
+        for post in posts.values():
+            if post.category is not None:
+                self.by_category.setdefault(post.category.id, []).append(post.key)
+        for keys in self.by_category.values():
+            keys.sort()
+
+    def category(self, category_id):
+        return self.categories.get(category_id)
+
+    def post(self, post_id):
+        return self.posts.get(post_id)
+
+    def complete(self, category_id):
+        "If every post of the category is held"
+        return self.floor is None or \
+            len(self.by_category.get(category_id, ())) == self.categories[category_id].post_count
+
+    def category_posts(self, category_id):
+        """
+        Posts of a category by id, None if some aren't held.
+        """
+        if category_id not in self.categories or not self.complete(category_id):
+            return None
+        return sorted((self.posts[key[1]] for key in self.by_category.get(category_id, ())),
+                      key=lambda post: post.id)
+
+    def latest_posts(self, category_id, limit, before=None):
+        """
+        Like summaries.latest_posts(), None if the posts held can't tell the
+        whole page.
+
+        The posts held of a category are always its latest ones, as every
+        post from the floor on is held.
+        """
+        if category_id not in self.categories:
+            return None
+        keys = self.by_category.get(category_id, [])
+        end = len(keys) if before is None else bisect.bisect_left(keys, before)
+        start = max(0, end - limit)
+        if end - start < limit and not self.complete(category_id):
+            return None
+        return [self.posts[key[1]] for key in reversed(keys[start:end])]
+
+
+class Replica(object):
+    """
+    Keeps the snapshot of a process up to date from the change log.
+    """
+    def __init__(self, flask_app, max_staleness, refresh_interval, recent_posts):
+        with flask_app.app_context():
+            self.engine = db.get_engine(flask_app)
+        self.max_staleness = max_staleness
+        self.refresh_interval = refresh_interval
+        self.recent_posts = recent_posts
+        self.stats = {'refreshes': 0, 'full_loads': 0, 'changes': 0, 'read_refreshes': 0, 'failed_refreshes': 0}
+        # (snapshot, monotonic time it was last known current)
+        self._current = (None, None)
+        self._refresh_lock = threading.Lock()
+        self.wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='replica-refresh', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                log.exception('Refreshing the read replica failed')
+                self.stats['failed_refreshes'] += 1
+            self.wake.wait(self.refresh_interval)
+            self.wake.clear()
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple: (Snapshot, its age in seconds), or (None, None) if it
+                is too old and couldn't be refreshed
+        """
+        snapshot, fresh_at = self._current
+        if snapshot is None or time.monotonic() - fresh_at > self.max_staleness:
+            try:
+                self.refresh(time.monotonic() - self.max_staleness)
+                self.stats['read_refreshes'] += 1
+            except Exception:
+                log.exception('Refreshing the read replica failed, reading from the database')
+                self.stats['failed_refreshes'] += 1
+                return None, None
+            snapshot, fresh_at = self._current
+        return snapshot, time.monotonic() - fresh_at
+
+    def refresh(self, unless_fresh_since=None):
+        """
+        Applies the changes logged since the snapshot, or loads it again in
+        full if the log was reset, such as by copying in another database.
+
+        Args:
+            unless_fresh_since (float): Don't refresh if the snapshot was
+                known current at or after this monotonic time, as when
+                another thread refreshed it in the meantime
+        """
+        with self._refresh_lock:
+            snapshot, fresh_at = self._current
+            if unless_fresh_since is not None and snapshot is not None and fresh_at >= unless_fresh_since:
+                return
+            started = time.monotonic()
+            with self.engine.connect() as conn:
+                # A single read transaction, so the rows match the log
+                conn.execute('BEGIN')
+                try:
+                    snapshot = self._refreshed(conn, snapshot)
+                finally:
+                    conn.execute('ROLLBACK')
+            self._current = (snapshot, started)
+            self.stats['refreshes'] += 1
+
+    def _refreshed(self, conn, snapshot):
+        change = Change.__table__
+        last = conn.execute(select([change.c.seq, change.c.timestamp]).order_by(change.c.seq.desc()).limit(1)).first()
+        seq, seq_timestamp = last if last is not None else (0, None)
+        if snapshot is None or seq < snapshot.seq or (snapshot.seq and conn.execute(
+                select([change.c.timestamp]).where(change.c.seq == snapshot.seq)).scalar() != snapshot.seq_timestamp):
+            return self._load(conn, seq, seq_timestamp)
+        if seq == snapshot.seq:
+            return snapshot
+
+        changes = conn.execute(select([change.c.kind, change.c.item_id]).where(change.c.seq > snapshot.seq)
+                               .where(change.c.seq <= seq).limit(MAX_CHANGES + 1)).fetchall()
+        if len(changes) > MAX_CHANGES:
+            return self._load(conn, seq, seq_timestamp)
+        self.stats['changes'] += len(changes)
+        post_ids = {item_id for kind, item_id in changes if kind == 'post'}
+        categories = self._load_categories(conn)
+        posts = dict(snapshot.posts)
+        for post_id in post_ids:
+            posts.pop(post_id, None)
+        floor = snapshot.floor
+        for row in conn.execute(self._select_posts().where(Post.__table__.c.id.in_(post_ids))):
+            if floor is None or (row.pub_date, row.id) >= floor:
+                posts[row.id] = self._post_record(row, categories)
+        if len(posts) > self.recent_posts:
+            keys = sorted(post.key for post in posts.values())
+            evicted = len(keys) - self.recent_posts
+            for key in keys[:evicted]:
+                del posts[key[1]]
+            floor = keys[evicted]
+        return Snapshot(seq, seq_timestamp, categories, posts, floor)
+
+    def _load(self, conn, seq, seq_timestamp):
+        post = Post.__table__
+        categories = self._load_categories(conn)
+        rows = conn.execute(self._select_posts().order_by(post.c.pub_date.desc(), post.c.id.desc())
+                            .limit(self.recent_posts)).fetchall()
+        posts = {row.id: self._post_record(row, categories) for row in rows}
+        floor = (rows[-1].pub_date, rows[-1].id) if len(rows) == self.recent_posts else None
+        self.stats['full_loads'] += 1
+        return Snapshot(seq, seq_timestamp, categories, posts, floor)
+
+    @staticmethod
+    def _load_categories(conn):
+        # Always all of them: there are few, and post writes change their
+        # version and count without logging them
+        category, summary, post = Category.__table__, CategorySummary.__table__, Post.__table__
+        count = func.coalesce(summary.c.post_count, select([func.count(post.c.id)])
+                              .where(post.c.category_id == category.c.id).as_scalar())
+        rows = conn.execute(select([category.c.id, category.c.name, category.c.version, count]).select_from(
+            category.outerjoin(summary, summary.c.category_id == category.c.id)))
+        return {row[0]: CategoryRecord(*row) for row in rows}
+
+    @staticmethod
+    def _select_posts():
+        post = Post.__table__
+        return select([post.c.id, post.c.title, post.c.body, post.c.pub_date, post.c.category_id, post.c.version])
+
+    @staticmethod
+    def _post_record(row, categories):
+        return PostRecord(row.id, row.title, row.body, row.pub_date, categories.get(row.category_id), row.version)
+
+
+def current():
+    """
+    The snapshot to serve the current request from, None to read from the
+    database.
+    """
+    replica = current_app.extensions.get('replica')
+    if replica is None or request.cache_control.no_cache:
+        return None
+    snapshot, age = replica.snapshot()
+    if snapshot is not None:
+        g.replica_read = (snapshot.seq, age)
+    return snapshot
+
+
+def after_request(response):
+    read = g.pop('replica_read', None)
+    if read is not None:
+        seq, age = read
+        response.headers[SEQ_HEADER] = str(seq)
+        response.headers[AGE_HEADER] = '{0:.1f}'.format(age * 1000)
+    return response
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_replica(session):
+    replica = current_app.extensions.get('replica')
+    if replica is not None:
+        replica.wake.set()
+
+
+def init_app(flask_app):
+    config = flask_app.config
+    if config['REPLICA_ENABLED']:
+        flask_app.extensions['replica'] = Replica(
+            flask_app, config['REPLICA_MAX_STALENESS'], config['REPLICA_REFRESH_INTERVAL'],
+            config['REPLICA_RECENT_POSTS'])
+        flask_app.after_request(after_request)
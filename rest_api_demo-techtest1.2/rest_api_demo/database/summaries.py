@@ -0,0 +1,101 @@
+"""
+Per-category summaries: how many posts a category has and its latest ones.
+
+Summaries are updated by the write functions of business.py, in the same
+transaction as the posts. With JOBS_ENABLED they are updated by the job each
+post write leaves instead, after it commits, see database/jobs.py: until the
+job runs, the summary lags behind the posts. Counts change by an increment
+in a single UPDATE. The latest posts are read back
+through ix_post_category_pub_date, which costs the same whatever the size
+of the category.
+"""
+import json
+from datetime import datetime
+
+from rest_api_demo import settings
+from rest_api_demo.database import db
+from rest_api_demo.database.models import Category, CategorySummary, Post
+
+# How pub_date is kept in summaries and cursors, as SQLite stores it
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def format_date(value):
+    return value.strftime(DATE_FORMAT)
+
+
+def parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def latest_posts(category_id, limit, before=None, columns=(Post.id, Post.title, Post.pub_date)):
+    """
+    Posts of a category, latest first.
+
+    ``before`` is the (pub_date, id) of the last post of the previous page.
+    """
+    query = db.session.query(*columns).filter(Post.category_id == category_id)
+    if before is not None:
+        pub_date, post_id = before
+        query = query.filter(db.or_(Post.pub_date < pub_date,
+                                    db.and_(Post.pub_date == pub_date, Post.id < post_id)))
+    return query.order_by(Post.pub_date.desc(), Post.id.desc()).limit(limit).all()
+
+
+def _entries(category_id):
+    return json.dumps([{'id': post_id, 'title': title, 'pub_date': format_date(pub_date)}
+                       for post_id, title, pub_date in latest_posts(category_id, settings.CATEGORY_SUMMARY_LATEST)])
+
+
+def _count(category_id):
+    return db.session.query(db.func.count(Post.id)).filter(Post.category_id == category_id).scalar()
+
+
+def refresh(category_id, count_delta=0):
+    """
+    Updates the summary of a category after its posts changed, adding
+    ``count_delta`` to its post count. Counts the posts if it has no
+    summary yet.
+    """
+    if category_id is None:
+        return
+    entries = _entries(category_id)
+    updated = CategorySummary.query.filter(CategorySummary.category_id == category_id).update({
+        CategorySummary.post_count: CategorySummary.post_count + count_delta,
+        CategorySummary.latest_posts: entries,
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(CategorySummary(category_id, _count(category_id), entries))
+
+
+def remove(category_id):
+    CategorySummary.query.filter(CategorySummary.category_id == category_id).delete(synchronize_session=False)
+
+
+def load(category_id):
+    """
+    Returns:
+        tuple: (post count, latest posts as dicts with pub_date a datetime)
+    """
+    summary = CategorySummary.query.filter(CategorySummary.category_id == category_id).one_or_none()
+    if summary is None:
+        # Such as a database file copied in while the API runs
+        count, entries = _count(category_id), _entries(category_id)
+    else:
+        count, entries = summary.post_count, summary.latest_posts
+    entries = json.loads(entries)
+    for entry in entries:
+        entry['pub_date'] = parse_date(entry['pub_date'])
+    return count, entries
+
+
+def build_missing():
+    """
+    Builds the summaries of the categories that have none, such as in a
+    database of an older release.
+    """
+    missing = db.session.query(Category.id).outerjoin(
+        CategorySummary, CategorySummary.category_id == Category.id).filter(CategorySummary.category_id.is_(None))
+    for (category_id,) in missing.all():
+        refresh(category_id)
+    db.session.commit()
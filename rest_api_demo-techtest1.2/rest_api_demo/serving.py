@@ -0,0 +1,173 @@
+"""
+Development server with persistent connections, worker processes and a
+bounded number of threads.
+
+Werkzeug's handler answers as HTTP/1.0 and closes the connection after each
+response. KeepAliveRequestHandler speaks HTTP/1.1, so a client can send its
+next requests on the same connection, even before the previous responses came
+back (pipelining). They are answered in order, by the connection's thread.
+
+Werkzeug's threaded server starts a thread per connection, however many
+arrive at once. serve() answers them from a fixed number of threads instead,
+and from several processes sharing the listening socket, to size a
+deployment with. Each process makes its own app, so what the app keeps in
+memory, such as replicas and read coalescing, is per process. Idempotency
+keys are kept in the database instead, and app.py refuses --rate-limit with
+more than one worker.
+"""
+import logging
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import LISTEN_QUEUE, BaseWSGIServer, ThreadedWSGIServer, WSGIRequestHandler, \
+    get_sockaddr, select_address_family
+from werkzeug.wsgi import LimitedStream
+
+log = logging.getLogger(__name__)
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def make_environ(self):
+        environ = super(KeepAliveRequestHandler, self).make_environ()
+        if environ.get('wsgi.input_terminated'):
+            # Chunked body, werkzeug reads it up to its end itself
+            self._input = None
+        else:
+            self._input = LimitedStream(self.rfile, int(environ.get('CONTENT_LENGTH') or 0))
+            environ['wsgi.input'] = self._input
+        return environ
+
+    def run_wsgi(self):
+        self._input = None
+        super(KeepAliveRequestHandler, self).run_wsgi()
+        if self._input is not None:
+            # What the app didn't read of the body, such as of a request
+            # rejected early, would be taken for the next request
+            self._input.exhaust()
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Server answering connections from a fixed pool of threads. Connections
+    arriving while every thread is busy wait for one.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, threads, handler=None, fd=None):
+        super(PooledWSGIServer, self).__init__(host, port, app, handler, fd=fd)
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='request')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        # What ThreadingMixIn runs in a thread of its own
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def make_server(host, port, app, threads=0, request_handler=None, fd=None):
+    """
+    Args:
+        threads (int): Threads answering connections, 0 for one per connection
+        fd (int): Listening socket to accept connections from, instead of
+            binding one
+    """
+    if threads:
+        return PooledWSGIServer(host, port, app, threads, request_handler, fd)
+    return ThreadedWSGIServer(host, port, app, request_handler, fd=fd)
+
+
+def _worker(create_app, host, port, threads, request_handler, fd, ready):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    server = make_server(host, port, create_app(), threads, request_handler, fd)
+    os.write(ready, b'1')
+    os.close(ready)
+    server.serve_forever()
+
+
+def _listen(host, port):
+    family = select_address_family(host, port)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(get_sockaddr(host, port, family))
+    sock.listen(LISTEN_QUEUE)
+    return sock
+
+
+def _fork_worker(create_app, host, port, threads, request_handler, sock):
+    """
+    Forks a worker and waits until its app is made.
+
+    Returns:
+        tuple: (pid, whether the worker started serving)
+    """
+    ready, ready_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(ready)
+        try:
+            _worker(create_app, host, port, threads, request_handler, sock.fileno(), ready_w)
+        except BaseException:
+            log.exception('Worker %d stopped', os.getpid())
+        finally:
+            os._exit(1)
+    os.close(ready_w)
+    started = os.read(ready, 1)
+    os.close(ready)
+    return pid, bool(started)
+
+
+def _stop_workers(pids, exit_code):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    raise SystemExit(exit_code)
+
+
+def serve(create_app, host, port, workers=1, threads=0, request_handler=None):
+    """
+    Serves the apps made by create_app() until stopped, without the reloader
+    or debugger.
+
+    With several workers, the listening socket is bound first, then each
+    worker is forked and makes its app, one at a time, so they don't upgrade
+    the database at once. The threads an app starts, such as group commit's,
+    run in its worker. When a worker exits, the others are stopped.
+
+    Args:
+        workers (int): Processes accepting connections from the same socket
+        threads (int): Threads answering connections in each worker, 0 for
+            one per connection
+    """
+    if workers <= 1:
+        make_server(host, port, create_app(), threads, request_handler).serve_forever()
+        return
+
+    sock = _listen(host, port)
+    pids = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: _stop_workers(pids, 0))
+    try:
+        for _ in range(workers):
+            pid, started = _fork_worker(create_app, host, port, threads, request_handler, sock)
+            pids.append(pid)
+            if not started:
+                log.error('Worker %d exited before it could serve', pid)
+                _stop_workers(pids, 1)
+        log.info('Serving from %d workers of %s threads', workers, threads or 'one per connection')
+        pid, status = os.wait()
+        pids.remove(pid)
+        log.error('Worker %d exited with status %d, stopping the others', pid, status)
+        _stop_workers(pids, 1)
+    except KeyboardInterrupt:
+        _stop_workers(pids, 0)
@@ -5,13 +5,96 @@ if 'euweb' in gethostname():
 else:
     FLASK_SERVER_NAME = 'localhost:8888'
 FLASK_DEBUG = True  # Do not use debug mode in production
+FLASK_KEEP_ALIVE = False  # Serve HTTP/1.1 persistent connections, needed to pipeline requests
+FLASK_WORKERS = 1  # Processes serving requests on the same port, each with an app of its own
+FLASK_THREADS = 0  # Threads answering requests in each process, 0 for a thread per connection
 
 # Flask-Restplus settings
 RESTPLUS_SWAGGER_UI_DOC_EXPANSION = 'list'
 RESTPLUS_VALIDATE = True
 RESTPLUS_MASK_SWAGGER = False
 RESTPLUS_ERROR_404_HELP = False
+SWAGGER_MAX_AGE = 300  # Seconds clients may cache swagger.json before revalidating
 
 # SQLAlchemy settings
 SQLALCHEMY_DATABASE_URI = 'sqlite:///db.sqlite'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Group commit settings
+# Writes of concurrent requests are committed together, see
+# database/group_commit.py
+GROUP_COMMIT_ENABLED = False
+GROUP_COMMIT_WINDOW = 0.002  # Seconds to wait for more writes after the first of a batch
+GROUP_COMMIT_MAX_BATCH = 64  # Most writes committed at once
+
+# Read replica settings
+# Each process serves hot reads from a snapshot held in memory, see
+# database/replica.py
+REPLICA_ENABLED = False
+REPLICA_MAX_STALENESS = 0.5  # Most seconds a read may lag behind the database
+REPLICA_REFRESH_INTERVAL = 0.1  # Seconds between checks of the change log
+REPLICA_RECENT_POSTS = 1000  # Latest posts held, older ones are read from the database
+
+# Read coalescing settings
+# Identical GETs arriving while one is computed wait for it and share its
+# response, see api/coalescing.py
+COALESCE_ENABLED = False
+COALESCE_NAMESPACES = ['blog/categories', 'blog/posts']
+COALESCE_MAX_WAIT = 5  # Most seconds a request waits for the identical one before computing its own
+
+# Background job settings
+# Post writes commit their row and leave the category summary and the change
+# log to worker threads, see database/jobs.py
+JOBS_ENABLED = False
+JOBS_WORKERS = 2  # Threads running jobs, jobs of the same post always run on the same one
+JOBS_MAX_BATCH = 50  # Most jobs a worker runs in one transaction
+JOBS_POLL_INTERVAL = 1  # Seconds between checks for jobs left behind or of other processes
+JOBS_MAX_ATTEMPTS = 5  # Runs of a failing job before it is marked failed
+JOBS_RETRY_DELAY = 0.5  # Seconds between them
+JOBS_RETENTION = 600  # Seconds done jobs are kept for, to look up their status
+
+# Category summary settings
+CATEGORY_SUMMARY_LATEST = 20  # Latest posts kept per category, first page served from them
+CATEGORY_SUMMARY_MAX_LIMIT = 50  # Most posts per page
+
+# Change log settings
+CHANGES_MAX_LIMIT = 1000  # Most changes returned per request
+CHANGES_MAX_WAIT = 30  # Most seconds a request waits for changes
+CHANGES_POLL_INTERVAL = 1  # Seconds between checks while waiting, for commits made by other processes
+
+# Idempotency settings
+IDEMPOTENCY_MAX_KEYS = 10000  # Most recent keys remembered
+IDEMPOTENCY_KEY_TTL = 3600  # Seconds a key is remembered for
+IDEMPOTENCY_SHARED = False  # Keep the keys in the database, shared by all processes. Set by --workers above 1
+
+# Rate limiting settings
+# Limits are (requests per second, burst) per client and route. The client is
+# the remote address, or the X-Client-Id header of requests coming from one of
+# RATELIMIT_TRUSTED_PROXIES
+RATELIMIT_ENABLED = False
+RATELIMIT_DEFAULT = None  # Routes outside RATELIMIT_NAMESPACES are not limited
+RATELIMIT_NAMESPACES = {
+    'blog/categories': (100, 200),
+    'blog/posts': (50, 100),
+}
+RATELIMIT_MAX_BUCKETS = 10000
+RATELIMIT_TRUSTED_PROXIES = ()  # Addresses allowed to name the client with X-Client-Id, such as a reverse proxy
+
+# Load shedding settings
+LOADSHED_ENABLED = False
+LOADSHED_MAX_IN_FLIGHT = 32  # Requests processed at once before shedding with 503
+LOADSHED_RETRY_AFTER = 1  # Seconds
+
+# Profiling settings
+# Requests sending X-Profile: 1, and a share of all requests, get a
+# statistical profile. See /api/diagnostics/profiles/. Off by default, as the
+# profiles show the SQL and code of the API to any client
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.0  # Share of requests profiled without asking, 0 to 1
+PROFILING_INTERVAL = 0.001  # Seconds between stack samples
+PROFILING_MAX_PROFILES = 1000  # Most recent profiles kept per process
+
+# Resource usage settings
+# Serves /api/diagnostics/resources for soak tests. Off by default, as every
+# request runs the garbage collector and walks all its objects
+RESOURCES_ENABLED = False
@@ -0,0 +1,6 @@
+# WSGI entry point, e.g. for pythonanywhere or gunicorn:
+#   gunicorn rest_api_demo.wsgi:app
+from rest_api_demo.app import configure_logging, create_app
+
+configure_logging()
+app = create_app()
@@ -1 +1,2 @@
-py.test test_REST_API.py -v --html=automated_tests_report.html --self-contained-html 
\ No newline at end of file
+py.test test_REST_API.py -v --results-requests
+python -m tester_interface.report test_results -o automated_tests_report.html
@@ -1,7 +1,11 @@
 import pytest
 import os
 from tester_interface.rest_tester import RestTester
-from tester_interface.cPrint import cPrint, cprint, cprint_info
+from tester_interface.cPrint import cPrint, cprint_info, cprint_plain
+from tester_interface.retry import RetryStats
+from tester_interface import fuzz
+from tester_interface.templates import random_text
+import json
 import string
 import random
 import time
@@ -9,16 +13,40 @@ import time
 global MAX_CHARS
 MAX_CHARS = 79 # Python standard
 
+# Shared by every RestTester so retries are counted for the whole run
+RETRY_STATS = RetryStats()
+
+# Failing inputs found by the fuzzer, minimised. They are known bugs, so they
+# are expected to fail until fixed
+with open(os.path.abspath('./config.json'), 'r') as _f:
+    _fuzz_config = json.load(_f).get('fuzz', {})
+FUZZ_REPRODUCERS = [pytest.param(_case, id=_case['signature'],
+                                 marks=pytest.mark.xfail(reason="Known bug found by the fuzzer"))
+                    for _key in ('reproducers', 'new_reproducers')
+                    for _case in fuzz.load_reproducers(_fuzz_config.get(_key))]
+
 def print_test_title(test_name):
     title = ' ' + test_name + ' '
     title = title.center(MAX_CHARS, '=')
     title = '\n\n' + title + '\n'
     cPrint.cprint(title, cPrint.YELLOW)
 
+@pytest.fixture(scope="session", autouse=True)
+def _report_retry_stats():
+    yield
+    cprint_info(f"\nRetry stats: {RETRY_STATS.summary()}")
+    cPrint.flush()
+
 class Test_REST():
     @pytest.fixture(autouse=True)
-    def _request_test_interface(self):
-        self.Tester = RestTester(os.path.abspath('./config.json'))
+    def _request_test_interface(self, results_sink, random_seeds):
+        self.Tester = RestTester(os.path.abspath('./config.json'),
+                                 retry_stats=RETRY_STATS,
+                                 results_sink=results_sink,
+                                 random_seeds=random_seeds)
+        yield
+        # Output is buffered, write it out so it is captured with this test
+        cPrint.flush()
 
 # Positive test - Check basic functionality, "happy path"
 # Negative test - Problem scenarios, with valid or invalid input
@@ -29,6 +57,37 @@ class Test_REST():
     def test_RESET_DATABASE_TO_DEFAULT(self):
         self.Tester.reset_database_to_default()
 
+###############################################################################
+# Start up
+    def test_SERVER_TIME_TO_FIRST_RESPONSE(self):
+        """
+        Launch a second API instance and measure how long it takes to answer
+        its first request
+        """
+        print_test_title("Server - Time to first response")
+        ret = self.Tester.test_server_time_to_first_response()
+        _res = self.Tester.results
+        assert _res['ttfr_ms'] is not None, "Server didn't answer its first request"
+        assert _res['ttfr_ms'] <= _res['target_ms'], \
+            f"First response after {_res['ttfr_ms']:.0f} ms, target {_res['target_ms']} ms"
+        assert ret == self.Tester.ERR_NONE, "Server was too slow to start, please check report"
+
+###############################################################################
+# API spec
+    def test_API_SPEC(self):
+        print_test_title("API spec - swagger.json caching")
+        ret = self.Tester.test_api_spec()
+        _res = self.Tester.results
+        assert _res['status'] == 200, f"GET swagger.json returned {_res['status']}"
+        assert _res['etag'] is not None, "swagger.json has no ETag"
+        assert 'max-age' in _res['cache_control'], f"Cache-Control of swagger.json is '{_res['cache_control']}'"
+        assert _res.get('revalidation_status') == 304, \
+            f"GET swagger.json with If-None-Match returned {_res.get('revalidation_status')}"
+        assert _res.get('missing_paths') == [], f"Routes missing from the spec: {_res.get('missing_paths')}"
+        assert _res.get('generated_post_status') == 201, \
+            f"POST of a body generated from the spec returned {_res.get('generated_post_status')}"
+        assert ret == self.Tester.ERR_NONE, "Failed in one of the steps. Please check report for more details"
+
 ###############################################################################
 # Positive test
     def test_Blog_categories_GET(self):
@@ -67,8 +126,8 @@ class Test_REST():
         n_failed = 0
 
         for i in range(n_test_cases):
-            print("")
-            ovrsz_pld = "".join([random.choice(_chars) for i in range(pld_size)])
+            cprint_plain("")
+            ovrsz_pld = random_text(pld_size, _chars)
             cprint_info(f" Testing payload of size {pld_size} ".center(MAX_CHARS, '#'))
             cprint_info(f"\nPayload: {ovrsz_pld}")
             ret = \
@@ -115,8 +174,8 @@ class Test_REST():
         _id = 4 # Initial id, will increase by one with each test case
 
         for i in range(n_test_cases):
-            print("")
-            ovrsz_pld = "".join([random.choice(_chars) for i in range(pld_size)])
+            cprint_plain("")
+            ovrsz_pld = random_text(pld_size, _chars)
             cprint_info(f" Testing payload of size {pld_size} ".center(MAX_CHARS, '#'))
             cprint_info(f"\nPayload: {ovrsz_pld}")
             ret = \
@@ -181,8 +240,8 @@ class Test_REST():
         _id = 4 # Initial id, will increase by one with each test case
 
         for i in range(n_test_cases):
-            print("")
-            ovrsz_pld = "".join([random.choice(_chars) for i in range(pld_size)])
+            cprint_plain("")
+            ovrsz_pld = random_text(pld_size, _chars)
             cprint_info(f" Testing payload of size {pld_size} ".center(MAX_CHARS, '#'))
             cprint_info(f"\nPayload: {ovrsz_pld}")
             ret = \
@@ -196,6 +255,229 @@ class Test_REST():
         
         assert success, f"{n_failed}/{n_test_cases} test cases failed, please check the test report"
 
+###############################################################################
+# Positive test
+    def test_Blog_categories_post_idempotency_key(self):
+        """
+        POST blog category twice with the same Idempotency-Key and check that
+        only one category is created
+        """
+        print_test_title("Blog Categories - POST retry with Idempotency-Key")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_blog_categories_post_idempotent(name="Idempotent category")
+        _res = self.Tester.results
+        assert _res['first_status'] == 201, f"First POST returned {_res['first_status']}"
+        assert _res.get('retry_status') == 201, f"Retry returned {_res.get('retry_status')}, expected 201"
+        assert _res.get('replayed') == 'true', \
+            f"Retry wasn't replayed from the idempotency store, Idempotent-Replayed: {_res.get('replayed')}"
+        assert _res.get('new_categories') == 1, f"{_res.get('new_categories')} categories created, expected 1"
+        assert ret == self.Tester.ERR_NONE, "Failed in one of the steps. Please check report for more details"
+
+###############################################################################
+# Positive test
+    def test_Blog_categories_get_if_none_match(self):
+        """
+        GET a category repeatedly with If-None-Match and check that only the
+        first response carries the full body
+        """
+        print_test_title("Blog Categories - GET with If-None-Match")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_category_revalidation(id=1, n_requests=20)
+        _statuses = self.Tester.results['statuses']
+        assert _statuses[0] == 200, f"First GET returned {_statuses[0]}"
+        assert _statuses[1:] == [304] * 19, f"GETs with If-None-Match returned {_statuses[1:]}, expected 304s"
+        assert ret == self.Tester.ERR_NONE, "Failed in one of the steps. Please check report for more details"
+
+###############################################################################
+# Positive test
+    def test_Blog_categories_concurrent_put_if_match(self):
+        """
+        Concurrent read-modify-write of one category with If-Match. Check that
+        no update is lost
+        """
+        print_test_title("Blog Categories - Concurrent PUT with If-Match")
+        self.Tester.reset_database_to_default()
+        _id = 4
+        assert self.Tester.test_blog_categories_POST(id=_id, name="Null") == self.Tester.ERR_NONE
+        ret = self.Tester.test_category_concurrent_updates(id=_id, n_writers=4, n_updates=5)
+        _res = self.Tester.results
+        self.Tester.test_blog_categories_DELETE(_id)
+        assert _res['errors'] == [], f"Writers failed with {_res['errors']}, other than 204 and 412"
+        assert _res.get('lost_updates') == [], f"Lost updates: {_res.get('lost_updates')}"
+        assert _res['version'] != _res['initial_version'], f"Version is still {_res['version']} after 20 updates"
+        assert ret == self.Tester.ERR_NONE, "Failed in one of the steps. Please check report for more details"
+
+###############################################################################
+# Negative test
+    def test_Blog_categories_recreated_etag(self):
+        """
+        Delete a category and create it again with the same id. Check that the
+        ETag of the deleted one doesn't match the new one
+        """
+        print_test_title("Blog Categories - ETag of a deleted and recreated category")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_category_recreated_etag(id=4, name="Null")
+        _res = self.Tester.results
+        assert _res['create_status'] == 201, f"Creating category 4 returned {_res['create_status']}"
+        assert _res.get('delete_status') == 204, f"Deleting category 4 returned {_res.get('delete_status')}"
+        assert _res.get('recreate_status') == 201, f"Creating category 4 again returned {_res.get('recreate_status')}"
+        assert _res.get('get_status') == 200, \
+            f"GET with the old ETag {_res.get('old_etag')} returned {_res.get('get_status')}, expected 200"
+        assert _res.get('new_etag') != _res.get('old_etag'), \
+            f"The recreated category has the ETag {_res.get('old_etag')} of the deleted one"
+        assert _res.get('put_status') == 412, f"PUT with the old ETag returned {_res.get('put_status')}, expected 412"
+        assert _res.get('conditional_delete_status') == 412, \
+            f"DELETE with the old ETag returned {_res.get('conditional_delete_status')}, expected 412"
+        assert ret == self.Tester.ERR_NONE, \
+            "A conditional request matched the ETag of a deleted category, please check report"
+
+    def test_Blog_categories_if_match_tags(self):
+        """
+        PUT a category with a weak tag and with lists of tags in If-Match.
+        Check that the weak tag gets 412 and the lists holding the current
+        version get 204
+        """
+        print_test_title("Blog Categories - If-Match with weak tags and lists of tags")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_category_if_match_tags(id=4, name="Null")
+        _res = self.Tester.results
+        assert _res['create_status'] == 201, f"Creating category 4 returned {_res['create_status']}"
+        assert _res['statuses'].get('weak') == 412, \
+            f"PUT with a weak tag of the current version returned {_res['statuses'].get('weak')}, expected 412"
+        assert _res['statuses'].get('stale first') == 204 and _res['statuses'].get('current first') == 204, \
+            f"PUT with a stale and the current tag returned {_res['statuses']}, expected 204"
+        assert ret == self.Tester.ERR_NONE, "If-Match compared its tags wrongly, please check report"
+
+###############################################################################
+# 'Destructive' test
+    def test_Blog_categories_concurrent_stress(self):
+        """
+        Concurrent POST, PUT, DELETE and GET on the same few ids. Check that
+        the history of the requests is linearizable
+        """
+        print_test_title("Blog Categories - Concurrent stress, checked for linearizability")
+        ret = self.Tester.test_category_stress()
+        _res = self.Tester.results
+        assert _res['requests'] > 0, "No requests were sent"
+        assert _res['anomalies'] == 0, f"{_res['anomalies']} requests got a server error or no response"
+        assert _res['not_linearizable'] == [], f"Histories of ids {_res['not_linearizable']} are not linearizable"
+        assert ret == self.Tester.ERR_NONE, "Failed in one of the steps. Please check report for more details"
+
+###############################################################################
+# 'Destructive' test
+    def test_Blog_change_feed_sync(self):
+        """
+        Mirror the blog from the change log while concurrent writes go on,
+        then check the mirror against a full scan
+        """
+        print_test_title("Blog - Change log sync, mirror checked against a full scan")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_change_feed_sync()
+        self.Tester.reset_database_to_default()
+        _res = self.Tester.results
+        assert _res['server_errors'] == [], f"Writes got server errors: {_res['server_errors']}"
+        assert _res['mirror_diff'] == [], \
+            f"The mirror differs from a full scan in {len(_res['mirror_diff'])} items, first {_res['mirror_diff'][:3]}"
+        assert ret == self.Tester.ERR_NONE, "Mirror differs from the API, please check report"
+
+###############################################################################
+# 'Destructive' test
+    def test_Blog_category_summary(self):
+        """
+        Grow a category and check its summary against the full category,
+        and that the first page of the summary stays as fast
+        """
+        print_test_title("Blog Categories - Summary checked against the full category")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_category_summary()
+        self.Tester.reset_database_to_default()
+        _res = self.Tester.results
+        assert _res['create_status'] == 201, f"Creating the category returned {_res['create_status']}"
+        assert 'post_status' not in _res, f"Creating a post returned {_res.get('post_status')}"
+        assert 'summary_status' not in _res, f"GET of a summary page returned {_res.get('summary_status')}"
+        assert _res['pages_differ'] == [], \
+            f"Summary pages differ from the full category at {_res['pages_differ']} posts"
+        assert _res['wrong_post_count'] == [], f"Wrong post_count at {_res['wrong_post_count']} posts"
+        assert _res['full_projection_differs'] == [], \
+            f"First page with projection=full differs at {_res['full_projection_differs']} posts"
+        assert _res['growth'] <= _res['max_growth'], \
+            f"The first page got x{_res['growth']:.2f} slower, over x{_res['max_growth']:g}"
+        assert ret == self.Tester.ERR_NONE, "Summary differs from the category or got slower, please check report"
+
+###############################################################################
+# 'Destructive' test
+    def test_Blog_read_replica(self):
+        """
+        Serve hot reads from the in-memory replica of a second API process,
+        check them against the database and measure how far behind they are
+        """
+        print_test_title("Blog - Read replica latency and staleness")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_read_replica()
+        self.Tester.reset_database_to_default()
+        _res = self.Tester.results
+        assert _res['create_status'] == 201, f"Creating the category returned {_res['create_status']}"
+        assert _res.get('server_started'), "Server with the read replica didn't start"
+        assert 'rename_status' not in _res, f"Renaming the category returned {_res.get('rename_status')}"
+        assert _res['routes_differ'] == [], f"The replica and the database differ on {_res['routes_differ']}"
+        assert _res['reads_not_from_replica'] == 0, \
+            f"{_res['reads_not_from_replica']} reads had no X-Replica-Age"
+        assert _res['max_age_ms'] <= _res['max_staleness_ms'], \
+            f"A read was served {_res['max_age_ms']:.0f} ms behind, bound {_res['max_staleness_ms']:.0f} ms"
+        assert _res['stale_reads'] == 0 and _res['renames_not_seen'] == 0, \
+            f"{_res['stale_reads']} reads missed a rename older than the bound," \
+            f" {_res['renames_not_seen']} renames never seen"
+        assert ret == self.Tester.ERR_NONE, \
+            "Replica reads differ from the database or are too stale, please check report"
+
+###############################################################################
+# 'Destructive' test
+    def test_Blog_read_coalescing(self):
+        """
+        Send bursts of identical reads to a second API process coalescing
+        them, and compare the queries and latencies with and without
+        """
+        print_test_title("Blog - Read coalescing")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_read_coalescing()
+        self.Tester.reset_database_to_default()
+        _res = self.Tester.results
+        assert _res['server_started'], "Server coalescing reads didn't start"
+        assert _res['failed_gets'] == {}, f"GETs failed, by status code: {_res['failed_gets']}"
+        assert _res['routes_differ'] == [], f"Bursts returned different bodies on {_res['routes_differ']}"
+        assert _res.get('rename_status') == 204, f"Renaming category 1 returned {_res.get('rename_status')}"
+        assert _res['stale_after_rename'] == 0, f"{_res['stale_after_rename']} GETs after a rename had the old name"
+        assert _res['coalesced'] > 0, "No request was coalesced"
+        assert _res['query_ratio'] <= _res['max_query_ratio'], \
+            f"Coalesced bursts ran {_res['query_ratio']:.0%} of the queries, over {_res['max_query_ratio']:.0%}"
+        assert ret == self.Tester.ERR_NONE, \
+            "Coalesced reads ran too many queries or returned wrong responses, please check report"
+
+###############################################################################
+# 'Destructive' test
+    def test_Blog_posts_background_jobs(self):
+        """
+        Create posts on a second API process with and without background
+        jobs, compare write latencies and measure how long the category
+        summary takes to catch up
+        """
+        print_test_title("Blog posts - Background jobs")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_background_jobs()
+        self.Tester.reset_database_to_default()
+        _res = self.Tester.results
+        assert all(_res['servers_started']), "Server for the inline or the background jobs writes didn't start"
+        assert _res['failed_writes'] == {'inline': [], 'jobs': []}, f"Failed writes: {_res['failed_writes']}"
+        assert _res['missing_job_id'] == 0, f"{_res['missing_job_id']} writes with jobs had no X-Job-Id"
+        assert _res['unfinished_jobs'] == 0, f"{_res['unfinished_jobs']} jobs were still pending"
+        assert _res['failed_jobs'] == 0, f"{_res['failed_jobs']} jobs failed"
+        assert _res['counted'] == _res['created'] and _res['logged'] == _res['created'], \
+            f"Posts created {_res['created']}, counted by the summary {_res['counted']}," \
+            f" in the change log {_res['logged']}"
+        assert _res['lag_p99_ms'] <= _res['max_lag_ms'], \
+            f"Summary lag p99 {_res['lag_p99_ms']:.1f} ms, over {_res['max_lag_ms']} ms"
+        assert ret == self.Tester.ERR_NONE, "Background jobs fell behind or lost writes, please check report"
+
 ###############################################################################
 # Negative test 
     def test_Blog_categories_get_by_invalid_id(self):
@@ -223,9 +505,9 @@ class Test_REST():
         # Non integer ids
         _chars = string.ascii_lowercase + string.ascii_uppercase
         for i in range(n_test_cases//2):
-            print("")
+            cprint_plain("")
             id_len = random.randint(1,5) # Random length between 1 and 5
-            candidate_id = "".join([random.choice(_chars) for i in range(id_len)])
+            candidate_id = random_text(id_len, _chars)
             ret = \
                 self.Tester.test_blog_categories_get_invalid_id(candidate_id)
             if ret != self.Tester.ERR_NONE:
@@ -251,9 +533,9 @@ class Test_REST():
         self.Tester.reset_database_to_default()
 
         for i in range(n_test_cases):
-            print("")
+            cprint_plain("")
             id_len = random.randint(1,5) # Random length between 1 and 5
-            candidate_id = "".join([random.choice(_chars) for i in range(id_len)])
+            candidate_id = random_text(id_len, _chars)
             ret = \
                 self.Tester.test_blog_categories_post_invalid_id_format(candidate_id)
             if ret != self.Tester.ERR_NONE:
@@ -277,7 +559,7 @@ class Test_REST():
         # Integers
         cprint_info("Testing random integers")
         for i in range(n_test_cases//2):
-            print("")
+            cprint_plain("")
             invalid_name = random.randint(0, 100)
             ret = \
                 self.Tester.test_blog_categories_post_invalid_name_format(invalid_name)
@@ -287,7 +569,7 @@ class Test_REST():
         # Floats
         cprint_info("Testing random float numbers")
         for i in range(n_test_cases//2):
-            print("")
+            cprint_plain("")
             invalid_name = random.random() * 100
             ret = \
                 self.Tester.test_blog_categories_post_invalid_name_format(invalid_name)
@@ -327,9 +609,9 @@ class Test_REST():
 
         # Non integer ids
         for i in range(n_test_cases//2):
-            print("")
+            cprint_plain("")
             id_len = random.randint(1,5) # Random length between 1 and 5
-            candidate_id = "".join([random.choice(_chars) for i in range(id_len)])
+            candidate_id = random_text(id_len, _chars)
             ret = \
                 self.Tester.test_blog_categories_put_invalid_id_format(candidate_id)
             if ret != self.Tester.ERR_NONE:
@@ -353,7 +635,7 @@ class Test_REST():
         # Integers
         cprint_info("Testing random integers")
         for i in range(n_test_cases//2):
-            print("")
+            cprint_plain("")
             invalid_name = random.randint(0, 100)
             ret = \
                 self.Tester.test_blog_categories_put_invalid_name_format(invalid_name)
@@ -363,7 +645,7 @@ class Test_REST():
         # Floats
         cprint_info("Testing random float numbers")
         for i in range(n_test_cases//2):
-            print("")
+            cprint_plain("")
             invalid_name = random.random() * 100
             ret = \
                 self.Tester.test_blog_categories_put_invalid_name_format(invalid_name)
@@ -397,15 +679,15 @@ class Test_REST():
         known_ids = set(self.Tester.default_categories.keys())
         possible_ids = list(set(range(n_test_cases//2)) - known_ids)
         for _id in possible_ids:
-            print("")
+            cprint_plain("")
             if self.Tester.test_blog_categories_delete_invalid_id(_id) != self.Tester.ERR_NONE:
                 success = False
                 n_failed += 1
 
         for i in range(n_test_cases):
-            print("")
+            cprint_plain("")
             id_len = random.randint(1,5) # Random length between 1 and 5
-            candidate_id = "".join([random.choice(_chars) for i in range(id_len)])
+            candidate_id = random_text(id_len, _chars)
             ret = \
                 self.Tester.test_blog_categories_delete_invalid_id(candidate_id)
             if ret != self.Tester.ERR_NONE:
@@ -413,6 +695,30 @@ class Test_REST():
                 n_failed += 1
         assert success, f"{n_failed}/{n_test_cases} test cases failed, please check the test report"
 
+###############################################################################
+# Negative test
+    def test_Blog_fuzz_invalid_input(self):
+        """
+        Sends inputs generated from the spec, concurrently. Fails on failures
+        that are not in the reproducers files yet, and adds them to
+        new_reproducers
+        """
+        print_test_title("Blog - Fuzzing with inputs generated from the spec")
+        ret = self.Tester.test_fuzz_invalid_input()
+        _new = self.Tester.results['new_failures']
+        assert _new == [], f"Fuzzer found {len(_new)} new failures, added to the new_reproducers file: {_new}"
+        assert ret == self.Tester.ERR_NONE, "Fuzzer found new failures, they were added to the new_reproducers file"
+
+###############################################################################
+# Negative test
+    @pytest.mark.parametrize("case", FUZZ_REPRODUCERS)
+    def test_Blog_fuzz_reproducer(self, case):
+        print_test_title("Blog - Fuzzer reproducer")
+        ret = self.Tester.test_fuzz_reproducer(case)
+        _res = self.Tester.results
+        assert _res['failure'] is None, f"Still fails: {_res['failure']}, status code {_res['status']}"
+        assert ret == self.Tester.ERR_NONE, "Reproducer still fails, please check report"
+
 
 ###############################################################################
 # Basic Positive Tests for blog posts
@@ -440,3 +746,99 @@ class Test_REST():
         
         assert success, f"{n_failed}/{n_test_cases} test cases failed, please check report"
 
+###############################################################################
+# Load test
+    def test_Blog_posts_archive_rate_limit(self):
+        """
+        Drives traffic past the archive's rate limit and checks that the excess
+        is rejected with Retry-After while admitted requests stay fast
+        """
+        print_test_title("Blog posts - Archive rate limit and load shedding")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_rate_limit_burst()
+        _res = self.Tester.results
+        assert _res['server_started'], "Server with rate limiting didn't start"
+        assert _res['offered'] > _res['budget'], \
+            f"Clients offered {_res['offered']} requests, the limit allows {_res['budget']:.0f}"
+        assert _res['rejected'], f"Traffic went past the limit but all {_res['admitted']} requests were admitted"
+        assert _res['missing_retry_after'] == 0, \
+            f"{_res['missing_retry_after']} rejections without a valid Retry-After"
+        assert _res['other'] == {}, f"Unexpected status codes: {_res['other']}"
+        assert _res['p99_ms'] <= _res['max_p99_ms'], \
+            f"Admitted p99 {_res['p99_ms']:.1f} ms, over {_res['max_p99_ms']} ms"
+        assert ret == self.Tester.ERR_NONE, "Rate limit scenario failed, please check report"
+
+###############################################################################
+# Load test
+    def test_Blog_categories_distributed_load(self):
+        """
+        Sends a fixed rate of requests from several worker processes. Checks
+        that the rate was reached, and the merged p99 latency if max_p99_ms
+        is set
+        """
+        print_test_title("Blog Categories - Distributed load from worker processes")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_distributed_load()
+        _res = self.Tester.results
+        assert _res['connected'] == _res['expected_workers'] and not _res['missing'], \
+            f"{_res['connected']}/{_res['expected_workers']} workers connected, no result from {_res['missing']}"
+        assert _res['failed'] == {} and not _res['errors'], f"Failed requests: {_res['failed']} {_res['errors']}"
+        assert _res['rate'] >= _res['min_rate'], \
+            f"Reached {_res['rate']:.0f} requests per second, under {_res['min_rate']:.0f}"
+        if _res['max_p99_ms'] is not None:
+            assert _res['p99_ms'] <= _res['max_p99_ms'], f"p99 {_res['p99_ms']:.1f} ms, over {_res['max_p99_ms']} ms"
+        assert ret == self.Tester.ERR_NONE, "Load scenario failed, please check report"
+
+###############################################################################
+# 'Destructive' test
+    def test_Blog_soak(self):
+        """
+        Send a steady mixed workload to a second API process, sampling the
+        resources of the server and the client, and check none of them leaks
+        """
+        print_test_title("Blog - Soak with leak detection")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_soak()
+        self.Tester.reset_database_to_default()
+        _res = self.Tester.results
+        assert _res.get('server_started', True), "Server to soak didn't start"
+        assert _res['leaks'] == [], f"Leaking {_res['leaks']}"
+        assert _res['server_sampled'], "The server's resources couldn't be sampled"
+        assert _res['errors'] <= _res['max_errors'], f"{_res['errors']} of {_res['requests']} requests failed"
+        assert ret == self.Tester.ERR_NONE, "Resources leaked or requests failed during the soak, please check report"
+
+###############################################################################
+# Load test
+    def test_Blog_posts_open_loop(self):
+        """
+        Sends GET posts on an open loop schedule. Checks that the schedule
+        was kept, and the p99 latency from the intended send times if
+        max_p99_ms is set
+        """
+        print_test_title("Blog posts - Open loop schedule")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_open_loop_posts()
+        _res = self.Tester.results
+        assert _res['fell_behind'] is None, f"The generator fell behind: {_res['fell_behind']}"
+        assert _res['failed'] == {} and not _res['errors'], f"Failed requests: {_res['failed']} {_res['errors']}"
+        if _res['max_p99_ms'] is not None:
+            assert _res['p99_ms'] <= _res['max_p99_ms'], f"p99 {_res['p99_ms']:.1f} ms, over {_res['max_p99_ms']} ms"
+        assert ret == self.Tester.ERR_NONE, "Open loop scenario failed, please check report"
+
+###############################################################################
+# Load test
+    def test_Blog_posts_archive_profiles(self):
+        """
+        Profiles GET archive requests on the server and fetches the profiles
+        of the slowest ones
+        """
+        print_test_title("Blog posts archive - Server profiles of the slowest requests")
+        self.Tester.reset_database_to_default()
+        ret = self.Tester.test_server_profiles()
+        _res = self.Tester.results
+        assert _res['server_started'], "Server with profiling didn't start"
+        assert _res['profiles'] >= _res['expected_profiles'], \
+            f"Only {_res['profiles']} of the {_res['expected_profiles']} slowest requests have a profile"
+        assert _res['not_folded'] == [], f"Profiles without folded stacks: {_res['not_folded']}"
+        assert _res['over_total'] == [], f"Profiles whose SQL and marshalling exceed the total: {_res['over_total']}"
+        assert ret == self.Tester.ERR_NONE, "Server profiles missing or malformed, please check report"
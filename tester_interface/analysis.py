@@ -0,0 +1,375 @@
+"""
+Vectorised analysis of request results
+
+Loads the request records of a results file (see results.py) into NumPy
+arrays, one per column, and computes from them: latency percentiles,
+breakdowns per endpoint, method or status code, throughput over time
+windows, error bursts, and the comparison of two runs with bootstrap
+confidence intervals.
+
+The comparison doubles as a regression gate:
+    python -m tester_interface.analysis summary test_results [--run RUN_ID]
+    python -m tester_interface.analysis compare base.ndjson new.ndjson
+        [--quantile 99] [--max-regression 0.1]
+exits with 1 when the new run is slower than the allowed margin.
+"""
+import argparse
+import sys
+from array import array
+import numpy as np
+from tester_interface.histogram import Histogram
+from tester_interface.results import read_records, last_run
+from tester_interface.report import DIGITS, endpoint_template
+
+DEFAULT_QUANTILES = (50, 90, 95, 99)
+
+# Status code stored for requests that got no response
+NO_RESPONSE = 0
+
+
+class RequestColumns():
+    """
+    Request records of a run, by column
+
+    Attributes:
+        ts (ndarray): Send time, seconds since the epoch
+        ms (ndarray): Latency, retries included
+        status (ndarray): Status code, NO_RESPONSE when there was none
+        attempts (ndarray)
+        method (ndarray): Index into methods
+        endpoint (ndarray): Index into endpoints, path templates
+        methods (list)
+        endpoints (list)
+    """
+    def __init__(self, ts, ms, status, attempts, method, endpoint, methods, endpoints):
+        self.ts = ts
+        self.ms = ms
+        self.status = status
+        self.attempts = attempts
+        self.method = method
+        self.endpoint = endpoint
+        self.methods = methods
+        self.endpoints = endpoints
+
+    def __len__(self):
+        return len(self.ms)
+
+    @property
+    def errors(self):
+        "Mask of the requests that failed: no response or a 5xx"
+        return (self.status == NO_RESPONSE) | (self.status >= 500)
+
+    def select(self, mask):
+        "Rows where mask is True, as new RequestColumns"
+        return RequestColumns(self.ts[mask], self.ms[mask], self.status[mask], self.attempts[mask],
+                              self.method[mask], self.endpoint[mask], self.methods, self.endpoints)
+
+
+def load_requests(path, run=None):
+    """
+    Reads the request records of a run into RequestColumns. Records are
+    parsed one line at a time into compact typed buffers
+
+    Args:
+        run (str): Run id, the last run of the file by default
+    """
+    if run is None:
+        run = last_run(path)
+    ts, ms = array('d'), array('d')
+    status, attempts, method, endpoint = array('i'), array('i'), array('i'), array('i')
+    methods, endpoints = {}, {}
+    for record in read_records(path, run):
+        if record.get('type') != 'request':
+            continue
+        ts.append(record['ts'])
+        ms.append(record['ms'])
+        status.append(record['status'] or NO_RESPONSE)
+        attempts.append(record.get('attempts') or 1)
+        method.append(methods.setdefault(record['method'], len(methods)))
+        _endpoint = f"{record['method']} {endpoint_template(record['path'])}"
+        endpoint.append(endpoints.setdefault(_endpoint, len(endpoints)))
+    return RequestColumns(np.frombuffer(ts, dtype=np.float64),
+                          np.frombuffer(ms, dtype=np.float64),
+                          np.frombuffer(status, dtype=np.int32),
+                          np.frombuffer(attempts, dtype=np.int32),
+                          np.frombuffer(method, dtype=np.int32),
+                          np.frombuffer(endpoint, dtype=np.int32),
+                          list(methods), list(endpoints))
+
+
+def histogram(ms):
+    """
+    Histogram of latencies in ms, recorded in microseconds as by the tester,
+    so percentiles follow the same rule everywhere
+    """
+    _histogram = Histogram(DIGITS)
+    _values, _counts = np.unique((np.asarray(ms) * 1000).astype(np.int64), return_counts=True)
+    for _us, _n in zip(_values.tolist(), _counts.tolist()):
+        _histogram.record(_us, _n)
+    return _histogram
+
+
+def percentiles(ms, quantiles=DEFAULT_QUANTILES):
+    """
+    Returns:
+        dict: quantile -> latency, NaN when there are no samples
+    """
+    if len(ms) == 0:
+        return {_q: float('nan') for _q in quantiles}
+    _histogram = histogram(ms)
+    return {_q: _histogram.percentile(_q) / 1000 for _q in quantiles}
+
+
+def breakdown(columns, by='endpoint', quantiles=DEFAULT_QUANTILES):
+    """
+    Latency and error figures per group
+
+    Args:
+        by (str): 'endpoint', 'method' or 'status'
+    Returns:
+        list: One dict per group (key, count, errors, error_rate, mean, max,
+            and a 'p<q>' entry per quantile), biggest groups first
+    """
+    if by == 'status':
+        keys, codes = np.unique(columns.status, return_inverse=True)
+        labels = [int(_k) if _k != NO_RESPONSE else 'no response' for _k in keys]
+    else:
+        codes = getattr(columns, by)
+        labels = getattr(columns, by + 's')
+    n_groups = len(labels)
+    if len(columns) == 0 or n_groups == 0:
+        return []
+
+    counts = np.bincount(codes, minlength=n_groups)
+    errors = np.bincount(codes, weights=columns.errors, minlength=n_groups)
+    sums = np.bincount(codes, weights=columns.ms, minlength=n_groups)
+    # Sorting by group then latency leaves every group as a sorted slice
+    order = np.lexsort((columns.ms, codes))
+    sorted_ms = columns.ms[order]
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+
+    rows = []
+    for _group in np.argsort(-counts, kind='stable'):
+        _n = int(counts[_group])
+        if _n == 0:
+            continue
+        _slice = sorted_ms[bounds[_group]:bounds[_group + 1]]
+        _row = {
+            'key': labels[_group],
+            'count': _n,
+            'errors': int(errors[_group]),
+            'error_rate': float(errors[_group] / _n),
+            'mean': float(sums[_group] / _n),
+            'max': float(_slice[-1]),
+        }
+        for _q, _value in percentiles(_slice, quantiles).items():
+            _row[f"p{_q}"] = _value
+        rows.append(_row)
+    return rows
+
+
+def throughput(columns, window=1.0):
+    """
+    Requests and errors per time window, from the first request of the run
+
+    Returns:
+        tuple: (starts, requests, errors) arrays, starts in seconds from the
+            beginning of the run
+    """
+    if len(columns) == 0:
+        empty = np.zeros(0)
+        return empty, empty.astype(np.int64), empty.astype(np.int64)
+    bins = ((columns.ts - columns.ts.min()) // window).astype(np.int64)
+    n_bins = int(bins.max()) + 1
+    requests = np.bincount(bins, minlength=n_bins)
+    errors = np.bincount(bins, weights=columns.errors, minlength=n_bins).astype(np.int64)
+    return np.arange(n_bins) * window, requests, errors
+
+
+def error_bursts(columns, window=1.0, min_errors=3, min_rate=0.5):
+    """
+    Consecutive time windows where errors piled up
+
+    A window is part of a burst when it has at least min_errors errors and
+    at least min_rate of its requests failed
+
+    Returns:
+        list: dicts with start and end, in seconds from the beginning of the
+            run, requests and errors of every burst
+    """
+    starts, requests, errors = throughput(columns, window)
+    if len(starts) == 0:
+        return []
+    hot = (errors >= min_errors) & (errors >= min_rate * np.maximum(requests, 1))
+    # Rising and falling edges of the mask delimit the bursts
+    edges = np.diff(np.concatenate(([0], hot.astype(np.int8), [0])))
+    begins = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    req_cum = np.concatenate(([0], np.cumsum(requests)))
+    err_cum = np.concatenate(([0], np.cumsum(errors)))
+    return [{
+        'start': float(starts[_b]),
+        'end': float(starts[_e - 1] + window),
+        'requests': int(req_cum[_e] - req_cum[_b]),
+        'errors': int(err_cum[_e] - err_cum[_b]),
+    } for _b, _e in zip(begins, ends)]
+
+
+def bootstrap_quantile_diff(base, new, quantile=99, n_resamples=1000, confidence=95,
+                            max_sample=20000, chunk=100, seed=None):
+    """
+    Bootstrap confidence interval of quantile(new) - quantile(base)
+
+    Samples above max_sample values are subsampled first, and resamples are
+    drawn chunk at a time, to bound memory. Quantiles of the resamples are
+    their values at Histogram.rank(), exact rather than bucketed
+
+    Returns:
+        tuple: (difference, low, high), NaN if either side has no samples
+    """
+    if len(base) == 0 or len(new) == 0:
+        nan = float('nan')
+        return nan, nan, nan
+    rng = np.random.default_rng(seed)
+    if len(base) > max_sample:
+        base = rng.choice(base, max_sample, replace=False)
+    if len(new) > max_sample:
+        new = rng.choice(new, max_sample, replace=False)
+    diffs = np.empty(n_resamples)
+    for _start in range(0, n_resamples, chunk):
+        _n = min(chunk, n_resamples - _start)
+        _base = _resampled_quantile(rng, base, _n, quantile)
+        _new = _resampled_quantile(rng, new, _n, quantile)
+        diffs[_start:_start + _n] = _new - _base
+    _tail = (100 - confidence) / 2
+    low, high = _resampled_bounds(diffs, _tail)
+    return percentiles(new, (quantile,))[quantile] - percentiles(base, (quantile,))[quantile], low, high
+
+
+def _resampled_quantile(rng, values, n, quantile):
+    "quantile of each of n resamples of values, by the rank of Histogram"
+    _k = Histogram.rank(quantile, len(values)) - 1
+    return np.partition(values[rng.integers(0, len(values), (n, len(values)))], _k, axis=1)[:, _k]
+
+
+def _resampled_bounds(diffs, tail):
+    "Values of sorted diffs at the tail and 100 - tail percentiles, by the rank of Histogram"
+    diffs = np.sort(diffs)
+    return (float(diffs[Histogram.rank(tail, len(diffs)) - 1]),
+            float(diffs[Histogram.rank(100 - tail, len(diffs)) - 1]))
+
+
+def compare_runs(base, new, quantile=99, max_regression=0.1, min_count=20, **bootstrap_kwargs):
+    """
+    Compares the latency of two runs, overall and per endpoint in both
+
+    An endpoint regressed when the lower bound of the confidence interval of
+    its quantile difference is above max_regression of the base quantile.
+    Endpoints with fewer than min_count requests on either side are left
+    out, their quantiles mean little
+
+    Returns:
+        list: One dict per endpoint, 'all' first, with key, base and new
+            counts and quantiles, diff, low, high and regressed
+    """
+    rows = []
+    groups = [('all', base.ms, new.ms)]
+    for _idx, _endpoint in enumerate(base.endpoints):
+        if _endpoint in new.endpoints:
+            _new_idx = new.endpoints.index(_endpoint)
+            _base, _new = base.ms[base.endpoint == _idx], new.ms[new.endpoint == _new_idx]
+            if min(len(_base), len(_new)) >= min_count:
+                groups.append((_endpoint, _base, _new))
+    for _key, _base, _new in groups:
+        _diff, _low, _high = bootstrap_quantile_diff(_base, _new, quantile, **bootstrap_kwargs)
+        _base_q = percentiles(_base, (quantile,))[quantile]
+        _enough = min(len(_base), len(_new)) >= min_count
+        rows.append({
+            'key': _key,
+            'base_count': len(_base),
+            'new_count': len(_new),
+            'base': _base_q,
+            'new': _base_q + _diff,
+            'diff': _diff,
+            'low': _low,
+            'high': _high,
+            'regressed': bool(_enough and _low > max_regression * _base_q),
+        })
+    return rows
+
+
+###############################################################################
+# Command line
+def _print_table(rows, columns):
+    print("  ".join(f"{_c:>10}" if _i else f"{_c:<40}" for _i, _c in enumerate(columns)))
+    for _row in rows:
+        print("  ".join(
+            (f"{_row[_c]:>10.2f}" if isinstance(_row[_c], float) else f"{_row[_c]!s:>10}") if _i
+            else f"{_row[_c]!s:<40}" for _i, _c in enumerate(columns)))
+
+
+def _summary(args):
+    columns = load_requests(args.results, args.run)
+    if len(columns) == 0:
+        print("No requests in the run")
+        return 0
+    _duration = columns.ts.max() - columns.ts.min()
+    print(f"{len(columns)} requests over {_duration:.1f} s, {int(columns.errors.sum())} errors")
+    _pcts = percentiles(columns.ms)
+    print("Latency: " + ", ".join(f"p{_q} {_v:.1f} ms" for _q, _v in _pcts.items()))
+    for _by in ('endpoint', 'status'):
+        print()
+        _print_table(breakdown(columns, _by)[:args.top], ['key', 'count', 'errors', 'mean', 'p50', 'p95', 'p99', 'max'])
+    _bursts = error_bursts(columns, args.window)
+    print(f"\n{len(_bursts)} error bursts")
+    for _burst in _bursts:
+        print(f"  {_burst['start']:.1f}-{_burst['end']:.1f} s: {_burst['errors']}/{_burst['requests']} failed")
+    return 0
+
+
+def _compare(args):
+    base = load_requests(args.base, args.base_run)
+    new = load_requests(args.new, args.run)
+    rows = compare_runs(base, new, args.quantile, args.max_regression,
+                        n_resamples=args.resamples, seed=args.seed)
+    print(f"p{args.quantile:g} latency in ms, new - base within [low, high], 95% bootstrap interval")
+    _print_table(rows, ['key', 'base_count', 'new_count', 'base', 'new', 'low', 'high', 'regressed'])
+    regressed = [_row['key'] for _row in rows if _row['regressed']]
+    if regressed:
+        print(f"\nREGRESSION: p{args.quantile:g} went up by more than {args.max_regression:.0%} on: "
+              + ", ".join(regressed))
+        return 1
+    print("\nNo regression")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analysis of request results')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    summary = commands.add_parser('summary', help='Percentiles, breakdowns and error bursts of a run')
+    summary.add_argument('results')
+    summary.add_argument('--run', help='Run id, the last run in the file by default')
+    summary.add_argument('--window', type=float, default=1.0, help='Seconds per window for bursts')
+    summary.add_argument('--top', type=int, default=15, help='Groups listed per breakdown')
+    summary.set_defaults(func=_summary)
+
+    compare = commands.add_parser('compare', help='Regression gate between two runs')
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--base-run')
+    compare.add_argument('--run')
+    compare.add_argument('--quantile', type=float, default=99)
+    compare.add_argument('--max-regression', type=float, default=0.1,
+                         help='Allowed increase, as a fraction of the base quantile (default: %(default)s)')
+    compare.add_argument('--resamples', type=int, default=1000)
+    compare.add_argument('--seed', type=int, default=None)
+    compare.set_defaults(func=_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,42 @@
 """
 Library for colourful printouts
+
+Output is buffered: cprint_* append to an in-memory batch, which is
+written to the console in one go by the printout that fills it or that
+comes batch_interval seconds after its first one, by flush() and at exit.
+There's no writer thread, so a batch stays unwritten until then, however
+old it gets. Most printouts only take the lock to append, which matters on
+load runs and on tests printing big payloads. The one writing a batch does
+wait on the terminal, and other threads printing wait for it.
+
+Every printout has a level. Levels below the configured one are dropped,
+e.g. level 'notice' (quiet mode) drops the cprint_info chatter.
+
+Instead of coloured text, printouts can be written as JSON lines to an
+events file, for tooling to pick up.
 """
-from colorama import init, Fore, Back, Style
+import atexit
+import json
+import sys
+import threading
+import time
+from colorama import Fore, Style
+
+# Levels
+DEBUG = 10
+INFO = 20
+NOTICE = 30
+ERROR = 40
+
+LEVELS = {
+    'debug': DEBUG,
+    'info': INFO,
+    'notice': NOTICE,
+    'error': ERROR,
+}
+_LEVEL_NAMES = {_value: _name for _name, _value in LEVELS.items()}
+
 
-init(convert=True)
 class cPrint:
     BRIGHT_RED = Style.BRIGHT + Fore.RED
     RED = Fore.RED
@@ -15,23 +48,130 @@ class cPrint:
     CYAN = Fore.CYAN
     RESET = Style.RESET_ALL
 
+    # Output settings, see configure()
+    level = INFO
+    batch_lines = 200
+    batch_interval = 0.5
+    events_file = None
+
+    __lock = threading.RLock()
+    __batch = []
+    __batch_started = None
+    __events = None
+    __colorama_ready = False
+
+    @classmethod
+    def configure(cls, level=None, batch_lines=None, batch_interval=None, events_file=None):
+        """
+        Args:
+            level (str|int): Lowest level printed, name from LEVELS or value
+            batch_lines (int): Printouts held before writing them out.
+                1 writes every printout straight away
+            batch_interval (float): Seconds after which a batch is written
+                out on the next printout, even if not full
+            events_file (str): Write printouts as JSON lines to this file,
+                instead of coloured text to the console
+        """
+        with cls.__lock:
+            cls.flush()
+            if level is not None:
+                cls.level = LEVELS[level.lower()] if isinstance(level, str) else int(level)
+            if batch_lines is not None:
+                cls.batch_lines = max(1, int(batch_lines))
+            if batch_interval is not None:
+                cls.batch_interval = float(batch_interval)
+            if events_file != cls.events_file:
+                if cls.__events is not None:
+                    cls.__events.close()
+                    cls.__events = None
+                cls.events_file = events_file
+
+    @classmethod
+    def configure_from(cls, config):
+        "Applies the 'output' section of config.json"
+        config = config or {}
+        cls.configure(level=config.get('level'),
+                      batch_lines=config.get('batch_lines'),
+                      batch_interval=config.get('batch_interval'),
+                      events_file=config.get('events_file'))
+
+    @classmethod
+    def enabled(cls, level):
+        "Checks if printouts of a level are kept, to skip building costly ones"
+        return level >= cls.level
+
+    @classmethod
+    def emit(cls, _txt, _color=Fore.WHITE, level=NOTICE, end="\n"):
+        if level < cls.level:
+            return
+        _now = time.time()
+        with cls.__lock:
+            if not cls.__batch:
+                cls.__batch_started = _now
+            cls.__batch.append((_now, level, _color, str(_txt), end))
+            if len(cls.__batch) >= cls.batch_lines \
+                    or _now - cls.__batch_started >= cls.batch_interval:
+                cls.flush()
+
+    @classmethod
+    def flush(cls):
+        "Writes out the printouts held so far"
+        with cls.__lock:
+            _batch, cls.__batch = cls.__batch, []
+            if not _batch:
+                return
+            if cls.events_file is not None:
+                cls.__write_events(_batch)
+            else:
+                cls.__write_console(_batch)
+
+    @classmethod
+    def __write_console(cls, batch):
+        if not cls.__colorama_ready:
+            # Only the Windows console needs the codes converted. Deferred
+            # from import time, as it wraps whatever sys.stdout is then
+            if sys.platform == 'win32':
+                from colorama import init
+                init(convert=True)
+            cls.__colorama_ready = True
+        _out = sys.stdout
+        _out.write(''.join(
+            (_color + _txt + cPrint.RESET if _color else _txt) + _end
+            for _t, _level, _color, _txt, _end in batch))
+        _out.flush()
+
+    @classmethod
+    def __write_events(cls, batch):
+        if cls.__events is None:
+            cls.__events = open(cls.events_file, 'a')
+        cls.__events.write(''.join(
+            json.dumps({'ts': _t, 'level': _LEVEL_NAMES.get(_level, _level), 'msg': _txt}) + '\n'
+            for _t, _level, _color, _txt, _end in batch))
+        cls.__events.flush()
+
     @staticmethod
     def cprint(_txt, _color=Fore.WHITE):
-        print(_color + str(_txt) + cPrint.RESET)
-        # print(_txt)
+        cPrint.emit(_txt, _color, NOTICE)
 
     @staticmethod
     def print_no_line_end(_txt, _color):
-        print(_color + str(_txt) + cPrint.RESET, end=" ")
+        cPrint.emit(_txt, _color, NOTICE, end=" ")
+
+
+atexit.register(cPrint.flush)
+
 
 def cprint(_txt, _color= cPrint.WHITE):
     cPrint.cprint(_txt, _color)
 
+def cprint_plain(_txt, level=INFO):
+    cPrint.emit(_txt, None, level)
+
 def cprint_err(_txt):
-    cPrint.cprint(_txt, cPrint.BRIGHT_RED)
+    cPrint.emit(_txt, cPrint.BRIGHT_RED, ERROR)
 
 def cprint_suc(_txt):
-    cPrint.cprint(_txt, cPrint.GREEN)
+    cPrint.emit(_txt, cPrint.GREEN, NOTICE)
 
 def cprint_info(_txt):
-    cPrint.cprint(_txt, cPrint.BLUE)
\ No newline at end of file
+    cPrint.emit(_txt, cPrint.BLUE, INFO)
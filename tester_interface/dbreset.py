@@ -0,0 +1,79 @@
+"""
+Resets the database the API serves by copying the default database over
+it, unless nothing wrote to it since the last reset
+
+Tests reset before and after they run, and many only read. SQLite tells
+whether another connection committed to a database by PRAGMA data_version
+on a connection that stays open, so a reset that is skipped costs
+microseconds whatever the size of the database. The resets that aren't
+skipped copy the file, as the tester always did.
+
+The connection kept to the served file only reads it, and changes none of
+its settings.
+"""
+import os
+import sqlite3
+import threading
+from shutil import copyfile
+
+COPY = 'copy'
+SKIP_UNCHANGED = 'skip_unchanged'
+
+
+class SkippingReset():
+    """
+    Copies a database file over others, skipping the copy when the other
+    file wasn't written since
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.stats = {'restores': 0, 'skipped': 0}
+        self.__lock = threading.Lock()
+        # Destination path -> [connection, (st_dev, st_ino), data_version
+        # after the last copy, (st_mtime_ns, st_size) of the source copied]
+        self.__targets = {}
+
+    def __unchanged(self, target, path):
+        _source = os.stat(self.path)
+        try:
+            _stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return target[1] == (_stat.st_dev, _stat.st_ino) and \
+            target[3] == (_source.st_mtime_ns, _source.st_size) and \
+            target[0].execute('PRAGMA data_version').fetchone()[0] == target[2]
+
+    def restore(self, path):
+        """
+        Makes the database at path a copy of the source, unless nothing
+        wrote to it since the last restore
+
+        Returns:
+            bool: If it was restored, False if skipped
+        """
+        path = os.path.abspath(path)
+        with self.__lock:
+            target = self.__targets.pop(path, None)
+            if target is not None:
+                if self.__unchanged(target, path):
+                    self.__targets[path] = target
+                    self.stats['skipped'] += 1
+                    return False
+                target[0].close()
+            _source = os.stat(self.path)
+            copyfile(self.path, path)
+            # Opened after the copy, so its data_version only moves when
+            # the API commits
+            _conn = sqlite3.connect(path, check_same_thread=False)
+            _stat = os.stat(path)
+            self.__targets[path] = [_conn, (_stat.st_dev, _stat.st_ino),
+                                    _conn.execute('PRAGMA data_version').fetchone()[0],
+                                    (_source.st_mtime_ns, _source.st_size)]
+            self.stats['restores'] += 1
+            return True
+
+    def close(self):
+        with self.__lock:
+            for _target in self.__targets.values():
+                _target[0].close()
+            self.__targets.clear()
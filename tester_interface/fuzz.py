@@ -0,0 +1,476 @@
+"""
+Property based fuzzing of the API, driven by its Swagger spec
+
+Cases are derived from the routes and models of the spec: path and query
+parameters of the wrong type, ids that don't exist, and bodies missing
+required fields or with fields of the wrong type. Some cases are valid but
+unusual, such as huge integers or long unicode strings.
+
+The properties checked are:
+    * Nothing gets a 5xx or goes unanswered
+    * Input that breaks the spec is rejected with a 4xx
+
+Cases are sent concurrently. Each failing case is shrunk to a minimal input
+that still fails the same way, and saved as a reproducer. Every case is
+built from its own seed, so a run can be repeated exactly.
+"""
+import json
+import os
+import random
+import re
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+# Ids from here on are assumed not to exist
+ID_FLOOR = 10 ** 9
+
+# Expectations
+CLIENT_ERROR = 'client_error'        # 4xx
+NO_SERVER_ERROR = 'no_server_error'  # Anything but a 5xx
+
+# Failure kinds
+SERVER_ERROR = 'server_error'        # 5xx, or no response at all
+ACCEPTED_INVALID = 'accepted_invalid'  # 2xx or 3xx to an invalid input
+
+# Rate limited and load shed responses, the input was never looked at
+THROTTLED = (429, 503)
+
+# Values of the right type for path parameters other than ids
+_PATH_DEFAULTS = {'year': 2016, 'month': 1, 'day': 1}
+_PATH_PARAM = re.compile(r"{(\w+)}")
+
+
+def query_value_valid(_type, value):
+    "Checks if a query string value parses as _type"
+    if _type == 'integer':
+        return re.fullmatch(r"\s*-?\d+\s*", value) is not None
+    if _type == 'boolean':
+        return value.strip().lower() in ('true', 'false', '1', '0', 'yes', 'no', 'on', 'off')
+    return True
+
+
+def path_value_invalid(value):
+    """
+    Checks that a path segment can't match an integer route. The int
+    converter takes any unicode digits, and '.' or '..' are dot segments the
+    client removes
+    """
+    if isinstance(value, int):
+        return False
+    return value.strip() != "" and not value.isdecimal() and value not in ('.', '..')
+
+
+def _random_text(rng, max_len=12, alphabet=string.ascii_letters):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, max_len)))
+
+
+def _huge_int(rng):
+    return rng.randint(ID_FLOOR, 10 ** rng.randint(10, 30))
+
+
+def _wrong_values(rng, _type):
+    """
+    Values that are not of the JSON schema type _type
+    """
+    pool = [None, [], {}, [1, "a"], {"a": {"b": []}}]
+    if _type != 'string':
+        pool += [_random_text(rng), "", "1"]
+    if _type not in ('integer', 'number'):
+        pool += [rng.randint(-10 ** 6, 10 ** 6)]
+    if _type != 'number':
+        pool += [rng.uniform(-1e6, 1e6)]
+    if _type == 'integer':
+        pool += [1.0, 2.5]
+    if _type != 'boolean':
+        pool += [True, False]
+    return pool
+
+
+def _edge_values(rng, _type):
+    """
+    Values of the JSON schema type _type that are still unusual
+    """
+    if _type == 'integer':
+        return [_huge_int(rng), -_huge_int(rng), 0]
+    if _type == 'string':
+        return ["", " " * 50, _random_text(rng, 200, string.printable),
+                "".join(chr(rng.randint(0x80, 0x2fff)) for _ in range(rng.randint(1, 40)))]
+    return []
+
+
+def _wrong_path_values(rng):
+    """
+    Path segments that don't match an integer route converter
+    """
+    _values = [_random_text(rng), "-" + str(rng.randint(1, 1000)), f"{rng.randint(0, 99)}.5",
+               _random_text(rng, 8, string.punctuation), "0x1f", " 1", "1e3",
+               "".join(chr(rng.randint(0x80, 0x2fff)) for _ in range(rng.randint(1, 6)))]
+    return [_value for _value in _values if path_value_invalid(_value)]
+
+
+class Operation():
+    """
+    One method of one route of the spec
+    """
+    def __init__(self, method, route, path_params, query_params, body_model):
+        self.method = method
+        self.route = route
+        self.path_params = path_params    # [(name, type)]
+        self.query_params = query_params  # [(name, type)]
+        self.body_model = body_model      # Model name or None
+
+    @property
+    def targets(self):
+        _targets = []
+        if self.path_params:
+            _targets.append('path')
+        if self.query_params:
+            _targets.append('query')
+        if self.body_model:
+            _targets.append('body')
+        return _targets
+
+
+def operations(spec):
+    """
+    Operations of the spec that take some input
+    """
+    ops = []
+    for _route, _item in spec.paths.items():
+        _shared = _item.get('parameters', [])
+        for _method, _op in _item.items():
+            if _method == 'parameters':
+                continue
+            _params = _shared + _op.get('parameters', [])
+            _path = [(_p['name'], _p.get('type')) for _p in _params if _p.get('in') == 'path']
+            _query = [(_p['name'], _p.get('type')) for _p in _params if _p.get('in') == 'query']
+            _body = [_p['schema']['$ref'].rsplit('/', 1)[-1] for _p in _params
+                     if _p.get('in') == 'body' and '$ref' in _p.get('schema', {})]
+            op = Operation(_method.upper(), _route, _path, _query, _body[0] if _body else None)
+            if op.targets:
+                ops.append(op)
+    return sorted(ops, key=lambda op: (op.route, op.method))
+
+
+class Fuzzer():
+    """
+    Generates cases from the spec, sends them concurrently and shrinks the
+    ones that fail
+
+    A case is a dict, so it can be saved as JSON:
+        method, route, params (path), query (or None), body (absent for no
+        body), expect, target (what was fuzzed), seed
+    """
+    def __init__(self, spec, send, workers=8, seed=None, max_shrink_steps=200, existing_ids=None):
+        """
+        Args:
+            spec (ApiSpec)
+            send (callable): send(method, path, query, body, has_body) ->
+                status code, None when there was no response
+            workers (int): Cases in flight at once
+            seed (int): Seed of the run, random if not given
+            max_shrink_steps (int): Requests spent shrinking each failure
+            existing_ids (dict): Path parameter name -> value of an existing
+                resource, used when the path is not what is being fuzzed
+        """
+        self.spec = spec
+        self.send = send
+        self.workers = workers
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.max_shrink_steps = max_shrink_steps
+        self.existing_ids = existing_ids or {'id': 1}
+        self.operations = operations(spec)
+        self.__lock = threading.Lock()
+
+    ###########################################################################
+    # Generation
+    def case(self, index):
+        "Builds case number index of the run"
+        _seed = self.seed * 1000003 + index
+        rng = random.Random(_seed)
+        op = rng.choice(self.operations)
+        case = {
+            'method': op.method,
+            'route': op.route,
+            'params': {_name: self.existing_ids.get(_name, _PATH_DEFAULTS.get(_name, 1))
+                       for _name, _type in op.path_params},
+            'query': None,
+            'expect': CLIENT_ERROR,
+            'seed': _seed,
+        }
+        if op.body_model:
+            case['model'] = op.body_model
+            case['body'] = self.spec.example(op.body_model)
+        _target = rng.choice(op.targets)
+        getattr(self, f"_fuzz_{_target}")(rng, op, case)
+        return case
+
+    def _fuzz_path(self, rng, op, case):
+        _name, _type = rng.choice(op.path_params)
+        case['target'] = f"path:{_name}"
+        if rng.random() < 0.3:
+            # Right type, but no such resource
+            case['params'][_name] = _huge_int(rng)
+            if _name != 'id':
+                case['expect'] = NO_SERVER_ERROR
+        else:
+            case['params'][_name] = rng.choice(_wrong_path_values(rng))
+
+    def _fuzz_query(self, rng, op, case):
+        _name, _type = rng.choice(op.query_params)
+        case['target'] = f"query:{_name}"
+        case['query_type'] = _type
+        if _type == 'integer' and rng.random() < 0.3:
+            case['query'] = {_name: str(rng.choice(_edge_values(rng, _type)))}
+            case['expect'] = NO_SERVER_ERROR
+        else:
+            _value = rng.choice([_random_text(rng), "", "1.5", "[]", "nan", "-"])
+            case['query'] = {_name: _value}
+
+    def _fuzz_body(self, rng, op, case):
+        _props, _required = self.spec.properties(op.body_model)
+        body = case['body']
+        if rng.random() < 0.3:
+            # Valid, but unusual values. Ids are left alone, a repeated one
+            # is a conflict rather than a bug
+            _fields = [_name for _name, _schema in _props.items()
+                       if _name != 'id' and _edge_values(rng, _schema.get('type'))]
+            for _name in rng.sample(_fields, rng.randint(1, len(_fields))):
+                body[_name] = rng.choice(_edge_values(rng, _props[_name].get('type')))
+            case['target'] = "body:edge"
+            case['expect'] = NO_SERVER_ERROR
+            return
+        if rng.random() < 0.1:
+            case['body'] = rng.choice([None, [], "text", 1, [body]])
+            case['target'] = "body:not_object"
+            return
+        for _ in range(rng.randint(1, 3)):
+            _name = rng.choice(sorted(_props))
+            if _name in _required and _name in body and rng.random() < 0.3:
+                del body[_name]
+            else:
+                body[_name] = rng.choice(_wrong_values(rng, _props[_name].get('type')))
+        case['target'] = "body:fields"
+        if not self.spec.request_errors(op.body_model, body):
+            # Mutations happened to cancel out
+            case['expect'] = NO_SERVER_ERROR
+
+    ###########################################################################
+    # Checking
+    @staticmethod
+    def path(case):
+        "Path of the case, spec base path excluded"
+        return _PATH_PARAM.sub(lambda m: quote(str(case['params'][m.group(1)]), safe=''), case['route'])
+
+    def execute(self, case):
+        """
+        Returns:
+            tuple: (status, failure kind or None). Throttled cases (429 or
+                503 after retries) are not failures
+        """
+        status = self.send(case['method'], self.spec.base_path + self.path(case),
+                           case.get('query'), case.get('body'), 'body' in case)
+        return status, self.failure(case, status)
+
+    @staticmethod
+    def failure(case, status):
+        if status in THROTTLED:
+            return None
+        if status is None or status >= 500:
+            return SERVER_ERROR
+        if case['expect'] == CLIENT_ERROR and not 400 <= status < 500:
+            return ACCEPTED_INVALID
+        return None
+
+    def signature(self, case, kind):
+        """
+        Identifies the bug a failing case hits: where the input was fuzzed,
+        the shape of what was sent there, and how it failed. Shrunk cases of
+        the same bug share it
+        """
+        def _shape(value):
+            if isinstance(value, dict):
+                return "{" + ",".join(f"{_k}:{_shape(_v)}" for _k, _v in sorted(value.items())) + "}"
+            if isinstance(value, str) and re.fullmatch(r"\d+", value):
+                return 'digits'
+            if isinstance(value, int) and not isinstance(value, bool) and abs(value) >= ID_FLOOR:
+                return 'huge_int'
+            return type(value).__name__
+        _target = case.get('target', '')
+        if _target.startswith('path:'):
+            _what = _shape(case['params'][_target[5:]])
+        elif _target.startswith('query:'):
+            _what = _shape(case['query'])
+        else:
+            _what = _shape(case.get('body'))
+        return f"{case['method']} {case['route']} {_target} {_what} {kind}"
+
+    ###########################################################################
+    # Shrinking
+    @staticmethod
+    def _simpler(value):
+        "Simpler values to try in place of value, simplest first"
+        if isinstance(value, bool):
+            return [] if value is False else [False]
+        if isinstance(value, int):
+            _candidates = [0, value // 2] if abs(value) < ID_FLOOR else [value // 2]
+            return [_v for _v in _candidates if _v != value]
+        if isinstance(value, float):
+            return [0.0] if value != 0.0 else []
+        if isinstance(value, str):
+            if not value:
+                return []
+            _half = value[:len(value) // 2]
+            return [_v for _v in ("", value[:1], _half, value[1:], value[:-1]) if _v != value]
+        if isinstance(value, list):
+            return [[]] + [value[:_i] + value[_i + 1:] for _i in range(len(value))] if value else []
+        if isinstance(value, dict):
+            _candidates = [{}] if value else []
+            for _key in value:
+                _candidates.append({_k: _v for _k, _v in value.items() if _k != _key})
+                for _simpler in Fuzzer._simpler(value[_key]):
+                    _candidates.append(dict(value, **{_key: _simpler}))
+            return _candidates
+        return []
+
+    def _candidates(self, case, kind):
+        _target = case.get('target', '')
+        if _target.startswith('path:'):
+            _name = _target[5:]
+            _value = case['params'][_name]
+            for _simpler in self._simpler(_value):
+                if isinstance(_value, int) and _simpler < ID_FLOOR and _name == 'id':
+                    # Could be an id that exists
+                    continue
+                if isinstance(_simpler, str) and not path_value_invalid(_simpler):
+                    # Would match the route
+                    continue
+                yield dict(case, params=dict(case['params'], **{_name: _simpler}))
+        elif _target.startswith('query:'):
+            _name = _target[6:]
+            for _simpler in self._simpler(case['query'][_name]):
+                if kind == ACCEPTED_INVALID and query_value_valid(case.get('query_type'), _simpler):
+                    continue
+                yield dict(case, query=dict(case['query'], **{_name: _simpler}))
+        elif 'body' in case:
+            for _simpler in self._simpler(case['body']):
+                yield dict(case, body=_simpler)
+
+    def shrink(self, case, kind):
+        """
+        Greedily replaces the case with simpler ones that fail the same way
+
+        Returns:
+            tuple: (shrunk case, its status, requests spent)
+        """
+        status = _unset = object()
+        steps = 0
+        improved = True
+        while improved and steps < self.max_shrink_steps:
+            improved = False
+            for _candidate in self._candidates(case, kind):
+                if kind == ACCEPTED_INVALID and 'model' in _candidate and \
+                        not self.spec.request_errors(_candidate['model'], _candidate.get('body')):
+                    # Became valid, being accepted would be right
+                    continue
+                steps += 1
+                _status, _kind = self.execute(_candidate)
+                if _kind == kind:
+                    case, status, improved = _candidate, _status, True
+                    break
+                if steps >= self.max_shrink_steps:
+                    break
+        if status is _unset:
+            status, _kind = self.execute(case)
+        return case, status, steps
+
+    ###########################################################################
+    # Run
+    def run(self, n_cases, known_signatures=(), max_shrinks=20):
+        """
+        Sends n_cases cases, then shrinks the first failing case of every
+        signature not in known_signatures
+
+        Returns:
+            dict: Figures of the run, with 'failures' the new reproducers
+        """
+        stats = {'cases': 0, 'failed': 0, 'throttled': 0, 'statuses': {}}
+        first_failures = {}
+        known = set(known_signatures)
+
+        def _run_one(index):
+            case = self.case(index)
+            status, kind = self.execute(case)
+            with self.__lock:
+                stats['cases'] += 1
+                stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+                if status in THROTTLED:
+                    stats['throttled'] += 1
+                if kind is not None:
+                    stats['failed'] += 1
+                    _sig = self.signature(case, kind)
+                    if _sig not in known and _sig not in first_failures:
+                        first_failures[_sig] = (case, kind)
+
+        _start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as _pool:
+            # Bounded number of cases in flight, instead of a future per case
+            for _chunk in range(0, n_cases, self.workers * 16):
+                list(_pool.map(_run_one, range(_chunk, min(n_cases, _chunk + self.workers * 16))))
+        _elapsed = time.perf_counter() - _start
+
+        failures = []
+        for _sig, (_case, _kind) in list(first_failures.items())[:max_shrinks]:
+            _shrunk, _status, _steps = self.shrink(_case, _kind)
+            _shrunk_sig = self.signature(_shrunk, _kind)
+            if _shrunk_sig in known:
+                # A known bug, reached from a different input
+                continue
+            known.add(_shrunk_sig)
+            failures.append(dict(_shrunk, status=_status, failure=_kind, signature=_shrunk_sig,
+                                 original_signature=_sig, shrink_steps=_steps))
+        stats.update({
+            'seed': self.seed,
+            'elapsed': _elapsed,
+            'cases_per_s': stats['cases'] / _elapsed if _elapsed else 0.0,
+            'failures': failures,
+        })
+        return stats
+
+
+###############################################################################
+# Reproducers
+def load_reproducers(path):
+    """
+    Returns:
+        list: Saved reproducer cases, empty if there is no file
+    """
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r') as _f:
+        return json.load(_f)
+
+
+def save_reproducers(path, failures):
+    """
+    Adds reproducers to the file, skipping signatures already in it
+
+    Returns:
+        int: Reproducers added
+    """
+    saved = load_reproducers(path)
+    _known = {_case.get('signature') for _case in saved} | {_case.get('original_signature') for _case in saved}
+    added = [_case for _case in failures
+             if _case['signature'] not in _known and _case['original_signature'] not in _known]
+    if added:
+        with open(path, 'w') as _f:
+            json.dump(saved + added, _f, indent=2, sort_keys=True)
+            _f.write('\n')
+    return len(added)
+
+
+def known_signatures(reproducers):
+    return {_case.get(_key) for _case in reproducers for _key in ('signature', 'original_signature')}
@@ -0,0 +1,128 @@
+"""
+Log-linear histogram of latencies that merges without losing precision
+
+Values are integers, microseconds for latencies. Below 2 * 10^digits they
+are counted exactly. Above that, each power of two is split into 10^digits
+or more linear buckets, so any value is known within 1 / 10^digits of
+itself, from microseconds to hours. Buckets are the same for every
+histogram with the same digits, so merging histograms from several
+processes only adds their counts: the result is the same as if one
+histogram had recorded every value.
+
+Histograms are sent between processes as plain dicts, see to_dict().
+"""
+import math
+
+
+class Histogram():
+    """
+    Mergeable histogram of non negative integers
+    """
+    def __init__(self, digits=3):
+        """
+        Args:
+            digits (int): Significant decimal digits kept, 1 to 5
+        """
+        if not 1 <= digits <= 5:
+            raise ValueError("digits must be between 1 and 5")
+        self.digits = digits
+        # Exact below 2 * 10^digits, then half of these buckets per doubling
+        self.__sub_bits = math.ceil(math.log2(2 * 10 ** digits))
+        self.__sub_count = 1 << self.__sub_bits
+        self.__half = self.__sub_count >> 1
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        "Bucket of value"
+        if value < self.__sub_count:
+            return value
+        _shift = value.bit_length() - self.__sub_bits
+        return self.__sub_count + (_shift - 1) * self.__half + (value >> _shift) - self.__half
+
+    def bounds(self, index):
+        """
+        Returns:
+            tuple: (lowest, highest) values of a bucket
+        """
+        if index < self.__sub_count:
+            return index, index
+        _shift = (index - self.__sub_count) // self.__half + 1
+        _lowest = ((index - self.__sub_count) % self.__half + self.__half) << _shift
+        return _lowest, _lowest + (1 << _shift) - 1
+
+    def record(self, value, n=1):
+        """
+        Args:
+            value (int): Such as a latency in microseconds. Negative values
+                are counted as 0
+            n (int): Times value was seen
+        """
+        value = max(0, int(value))
+        _idx = self.index(value)
+        self.counts[_idx] = self.counts.get(_idx, 0) + n
+        self.count += n
+        self.total += value * n
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        "Adds the counts of other, which must have the same digits"
+        if other.digits != self.digits:
+            raise ValueError(f"Can't merge histograms of {other.digits} and {self.digits} digits")
+        for _idx, _n in other.counts.items():
+            self.counts[_idx] = self.counts.get(_idx, 0) + _n
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    @staticmethod
+    def rank(q, count):
+        "Rank, from 1, of the q-th percentile of count values: the nearest rank"
+        return max(1, math.ceil(q / 100 * count))
+
+    def percentile(self, q):
+        """
+        Highest value of the bucket holding the q-th percentile, capped at
+        the largest value recorded. 0 if empty
+        """
+        if not self.count:
+            return 0
+        _rank = self.rank(q, self.count)
+        _seen = 0
+        for _idx in sorted(self.counts):
+            _seen += self.counts[_idx]
+            if _seen >= _rank:
+                return min(self.max, self.bounds(_idx)[1])
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        "JSON serializable copy, see from_dict()"
+        return {
+            'digits': self.digits,
+            'counts': [[_idx, _n] for _idx, _n in sorted(self.counts.items())],
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['digits'])
+        histogram.counts = {_idx: _n for _idx, _n in data['counts']}
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
@@ -0,0 +1,352 @@
+"""
+Test impact selection: skips the tests that passed and whose code and
+inputs haven't changed since
+
+While a test runs, every RestTester method it calls and the route of every
+request it sends are recorded. When it passes, the cache file keeps them
+along with a fingerprint of what the test depends on:
+
+    * its own source in the test file, and the rest of the test file,
+      conftest.py, config.json, the default database and the base_url of
+      the server it tested
+    * the source of each RestTester method it called, and of the tester
+      modules those methods use, with what they import in turn
+    * the API modules shared by every route, and the endpoint module of each
+      route it requested. A request to any other path, such as swagger.json,
+      depends on every endpoint
+
+On a run with pytest --reuse-passed, a test is skipped if its fingerprint,
+computed again from what it recorded, is the one cached. Failed tests are
+never skipped. Other runs run everything, and record it again. The tests
+run against a live server, so skipping is opt-in.
+
+Sources are read and parsed once per run, a fraction of a second, and
+fingerprints then cost microseconds per test.
+"""
+import ast
+import fnmatch
+import functools
+import hashlib
+import inspect
+import json
+import os
+from urllib.parse import urlsplit
+
+ALL_ROUTES = '*'
+
+# Path prefix -> module serving it, relative to the API package
+ROUTE_MODULES = {
+    '/api/blog/categories': 'api/blog/endpoints/categories.py',
+    '/api/blog/posts':      'api/blog/endpoints/posts.py',
+    '/api/blog/changes':    'api/blog/endpoints/changes.py',
+}
+
+# RestTester methods and tester modules that reach the API other than through
+# RestTester.__send, such as from worker processes. A test using any of them
+# depends on every route. ApiSpec reads swagger.json on its own too, but only
+# for its models, which serializers.py defines for all routes
+UNTRACKED = {'launch_server', 'loadgen', 'pipeline', 'soak'}
+
+_PACKAGE = 'tester_interface'
+
+
+class Record():
+    "What a test touched"
+    def __init__(self):
+        self.methods = set()
+        self.routes = set()
+
+
+# Record of the test running. Threads of the test record on it too
+_current = None
+
+
+def start():
+    "Starts recording a test"
+    global _current
+    _current = Record()
+
+
+def stop():
+    """
+    Returns:
+        Record: Of the test recorded since start(), None if not recording
+    """
+    global _current
+    record, _current = _current, None
+    return record
+
+
+def route(url):
+    "Route prefix of a URL or path, ALL_ROUTES if not of an endpoint module"
+    _path = urlsplit(url).path
+    for _prefix in ROUTE_MODULES:
+        if _path == _prefix or _path.startswith(_prefix + '/'):
+            return _prefix
+    return ALL_ROUTES
+
+
+def record_request(url):
+    _record = _current
+    if _record is not None:
+        _record.routes.add(route(url))
+
+
+def _recorded(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _record = _current
+        if _record is not None:
+            _record.methods.add(name)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def instrument(cls):
+    """
+    Wraps every method of cls, so calling it records it on the test running.
+    Private methods are recorded by their name in the source, such as __send
+    """
+    if vars(cls).get('_impact_instrumented'):
+        return
+    _mangled = f"_{cls.__name__}__"
+    for _name, _attr in list(vars(cls).items()):
+        _source_name = '__' + _name[len(_mangled):] if _name.startswith(_mangled) else _name
+        if isinstance(_attr, staticmethod):
+            setattr(cls, _name, staticmethod(_recorded(_source_name, _attr.__func__)))
+        elif isinstance(_attr, property):
+            setattr(cls, _name, property(_recorded(_source_name, _attr.fget), _attr.fset, _attr.fdel, _attr.__doc__))
+        elif inspect.isfunction(_attr) and (_name == '__init__' or not _name.startswith('__')):
+            setattr(cls, _name, _recorded(_source_name, _attr))
+    cls._impact_instrumented = True
+
+
+###############################################################################
+# Sources
+def _digest(*parts):
+    _hash = hashlib.sha1()
+    for _part in parts:
+        _hash.update(_part if isinstance(_part, bytes) else str(_part).encode('utf-8'))
+        _hash.update(b"\0")
+    return _hash.hexdigest()
+
+
+def _file_digest(path):
+    try:
+        with open(path, 'rb') as _f:
+            return _digest(_f.read())
+    except OSError:
+        return 'missing'
+
+
+def _start_line(node):
+    "Index of the first line of a statement, decorators included"
+    return min([node.lineno] + [_d.lineno for _d in getattr(node, 'decorator_list', [])]) - 1
+
+
+def _split_class(path, class_name=None):
+    """
+    Splits a module into the methods of a class, or its functions if
+    class_name is None, and the rest
+
+    Returns:
+        tuple: (digest of the rest, {name: (digest, ast node)})
+    """
+    with open(path, 'r') as _f:
+        source = _f.read()
+    lines = source.splitlines(keepends=True)
+    functions = {}
+    tree = ast.parse(source)
+    body, end = tree.body, len(lines)
+    if class_name is not None:
+        body = []
+        for _i, node in enumerate(tree.body):
+            if isinstance(node, ast.ClassDef) and node.name == class_name:
+                body = node.body
+                end = _start_line(tree.body[_i + 1]) if _i + 1 < len(tree.body) else len(lines)
+    _starts = [_start_line(_item) for _item in body]
+    for _j, _item in enumerate(body):
+        if not isinstance(_item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        # Up to the next statement, comments in between go with the
+        # function before them
+        _end = _starts[_j + 1] if _j + 1 < len(body) else end
+        functions[_item.name] = (_digest(''.join(lines[_starts[_j]:_end])), _item)
+        for _k in range(_starts[_j], _end):
+            lines[_k] = ''
+    return _digest(''.join(lines)), functions
+
+
+def _tester_imports(tree):
+    "Local name -> tester module, of the imports of a module"
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom):
+            _module = node.module or ''
+            if node.level == 0 and not (_module == _PACKAGE or _module.startswith(_PACKAGE + '.')):
+                continue
+            _module = _module[len(_PACKAGE) + 1:] if node.level == 0 else _module
+            for _alias in node.names:
+                names[_alias.asname or _alias.name] = _module or _alias.name
+        elif isinstance(node, ast.Import):
+            for _alias in node.names:
+                if _alias.name.startswith(_PACKAGE + '.'):
+                    names[_alias.asname or _alias.name] = _alias.name[len(_PACKAGE) + 1:].split('.')[0]
+    return names
+
+
+class Sources():
+    """
+    Digests of the sources tests depend on, read once
+    """
+    def __init__(self, root, server_dir, config_file, default_db, base_url=None):
+        """
+        Args:
+            root (str): Folder of conftest.py
+            server_dir (str): Folder of the API package, rest_api_demo
+            base_url (str): Of the server tested
+        """
+        self.root = root
+        self.tester_dir = os.path.dirname(os.path.abspath(__file__))
+        self.__test_files = {}
+
+        # Tester modules and what they import of each other
+        self.modules = {}
+        self.module_imports = {}
+        for _file in sorted(os.listdir(self.tester_dir)):
+            if _file.endswith('.py'):
+                _path = os.path.join(self.tester_dir, _file)
+                with open(_path, 'r') as _f:
+                    _tree = ast.parse(_f.read())
+                self.modules[_file[:-3]] = _file_digest(_path)
+                self.module_imports[_file[:-3]] = set(_tester_imports(_tree).values())
+
+        # RestTester methods, and the tester modules each one names
+        _path = os.path.join(self.tester_dir, 'rest_tester.py')
+        with open(_path, 'r') as _f:
+            _names = _tester_imports(ast.parse(_f.read()))
+        _tester_common, _methods = _split_class(_path, 'RestTester')
+        self.methods = {}
+        self.method_modules = {}
+        for _name, (_method_digest, _node) in _methods.items():
+            self.methods[_name] = _method_digest
+            self.method_modules[_name] = {_names[_n.id] for _n in ast.walk(_node)
+                                          if isinstance(_n, ast.Name) and _n.id in _names}
+
+        # API: endpoint modules, and the rest shared by all routes
+        self.endpoints = {_prefix: _file_digest(os.path.join(server_dir, _module))
+                          for _prefix, _module in ROUTE_MODULES.items()}
+        _endpoint_files = {os.path.normpath(os.path.join(server_dir, _m)) for _m in ROUTE_MODULES.values()}
+        _shared = []
+        for _dir, _dirs, _files in sorted(os.walk(server_dir)):
+            _dirs.sort()
+            for _file in sorted(_files):
+                _path = os.path.normpath(os.path.join(_dir, _file))
+                if _file.endswith('.py') and _path not in _endpoint_files:
+                    _shared.append(os.path.relpath(_path, server_dir) + ':' + _file_digest(_path))
+
+        self.common = _digest(base_url, _tester_common, _file_digest(os.path.join(root, 'conftest.py')),
+                              _file_digest(config_file), _file_digest(default_db), *_shared)
+
+    def test_file(self, path, class_name):
+        "(digest of the rest, {test name: digest}) of the tests of a class"
+        if (path, class_name) not in self.__test_files:
+            _common, _tests = _split_class(path, class_name)
+            self.__test_files[path, class_name] = (_common, {_name: _d for _name, (_d, _) in _tests.items()})
+        return self.__test_files[path, class_name]
+
+    def module_closure(self, modules):
+        "Tester modules, with those they import, and so on"
+        closure = set()
+        _todo = list(modules)
+        while _todo:
+            _module = _todo.pop()
+            if _module not in closure:
+                closure.add(_module)
+                _todo.extend(self.module_imports.get(_module, ()))
+        return closure
+
+    def fingerprint(self, test, methods, routes):
+        """
+        Digest of everything a test depends on, from what it touched
+
+        Args:
+            test (tuple): (path, class name or None, name) of the test function
+        """
+        _path, _class_name, test_name = test
+        _file_common, _tests = self.test_file(_path, _class_name)
+        parts = [self.common, _file_common, _tests.get(test_name, 'missing')]
+        _modules = set()
+        for _method in sorted(methods):
+            parts.append(f"{_method}:{self.methods.get(_method, 'missing')}")
+            _modules |= self.method_modules.get(_method, set())
+        _modules = self.module_closure(_modules)
+        for _module in sorted(_modules):
+            parts.append(f"{_module}:{self.modules.get(_module, 'missing')}")
+        routes = set(routes)
+        if ALL_ROUTES in routes or UNTRACKED & (set(methods) | _modules):
+            routes = set(ROUTE_MODULES)
+        for _route in sorted(routes):
+            parts.append(f"{_route}:{self.endpoints.get(_route, 'missing')}")
+        return _digest(*parts)
+
+
+###############################################################################
+# Cache
+class ImpactCache():
+    """
+    Tests that passed, with what they touched and their fingerprint
+    """
+    VERSION = 1
+
+    def __init__(self, path, sources, always_run=(), reuse=False):
+        """
+        Args:
+            always_run (list): Patterns of test names never skipped, such as
+                tests drawing new random inputs every run
+            reuse (bool): True to skip the tests unchanged since they
+                passed, False to skip nothing and only record
+        """
+        self.path = path
+        self.sources = sources
+        self.always_run = list(always_run)
+        self.reuse = reuse
+        self.stats = {'skipped': 0}
+        self.tests = {}
+        try:
+            with open(path, 'r') as _f:
+                _cache = json.load(_f)
+            if _cache.get('version') == self.VERSION:
+                self.tests = _cache.get('tests', {})
+        except (OSError, ValueError):
+            pass
+
+    def unchanged(self, nodeid, test):
+        """
+        If the test passed and nothing it depends on changed since
+
+        Args:
+            test (tuple): As for Sources.fingerprint()
+        """
+        _entry = self.tests.get(nodeid)
+        if not self.reuse or _entry is None or any(fnmatch.fnmatchcase(test[2], _p) for _p in self.always_run):
+            return False
+        return _entry['fingerprint'] == self.sources.fingerprint(test, _entry['methods'], _entry['routes'])
+
+    def passed(self, nodeid, test, record, ms):
+        _methods, _routes = sorted(record.methods), sorted(record.routes)
+        self.tests[nodeid] = {
+            'fingerprint': self.sources.fingerprint(test, _methods, _routes),
+            'methods': _methods,
+            'routes': _routes,
+            'ms': round(ms, 1),
+        }
+
+    def forget(self, nodeid):
+        self.tests.pop(nodeid, None)
+
+    def save(self):
+        _tmp = self.path + '.tmp'
+        with open(_tmp, 'w') as _f:
+            json.dump({'version': self.VERSION, 'tests': self.tests}, _f, indent=1, sort_keys=True)
+        os.replace(_tmp, self.path)
@@ -0,0 +1,486 @@
+"""
+Load generation from several processes, and several hosts
+
+One Python process can't send much faster than a few hundred requests per
+second, see benchmarks/client_rate.py. Load is instead sent by worker
+processes, each with its own interpreter, driven by a coordinator:
+
+    1. Workers connect to the coordinator over TCP and say hello, with a
+       weight, such as their number of cores
+    2. The coordinator waits for all of them, splits the target rate between
+       them by weight, and sends everyone the same start time and duration
+    3. Each worker sends its share of the requests from its threads, stops
+       on time and sends back its latency histogram and status codes
+    4. The coordinator merges the histograms, which loses no precision, see
+       histogram.py
+
+Messages are JSON objects, one per line. Start and stop are wall clock
+times, so workers on other hosts need synced clocks (NTP).
+
+Workers on the same host are started by run_local(). On other hosts, run:
+
+    python -m tester_interface.loadgen worker --coordinator HOST:PORT --config config.json
+"""
+import argparse
+import functools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from tester_interface.histogram import Histogram
+from tester_interface.pipeline import PipelinedClient
+from tester_interface.templates import UrlTemplate
+
+# Read only requests, so any number can be sent
+SCENARIOS = {
+    'categories': ('GET', "/api/blog/categories/"),
+    'category':   ('GET', "/api/blog/categories/1"),
+    'posts':      ('GET', "/api/blog/posts/"),
+    'archive':    ('GET', "/api/blog/posts/archive/2016/"),
+}
+
+# Histograms keep 3 significant digits of latencies in microseconds
+DIGITS = 3
+
+
+###############################################################################
+# Protocol
+class Connection():
+    """
+    JSON lines over a socket
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.__file = sock.makefile('rwb')
+
+    def send(self, message):
+        self.__file.write(json.dumps(message).encode('utf-8') + b"\n")
+        self.__file.flush()
+
+    def receive(self):
+        """
+        Returns:
+            dict: Next message, None if the other side closed the connection
+        """
+        _line = self.__file.readline()
+        if not _line:
+            return None
+        return json.loads(_line)
+
+    def close(self):
+        try:
+            self.__file.close()
+        finally:
+            self.sock.close()
+
+
+def parse_address(address):
+    "'host:port' -> (host, port)"
+    _host, _, _port = address.rpartition(':')
+    return _host or '127.0.0.1', int(_port)
+
+
+###############################################################################
+# Worker
+def shares(total_rate, weights):
+    """
+    Splits a rate by weight
+
+    Returns:
+        list: Rate of each weight, None for all if total_rate is None
+    """
+    if total_rate is None:
+        return [None] * len(weights)
+    _total = sum(weights)
+    return [total_rate * _weight / _total for _weight in weights]
+
+
+def _add_counts(counts, more):
+    "Adds the counts by key of more to counts"
+    for _key, _n in more.items():
+        counts[_key] = counts.get(_key, 0) + _n
+
+
+def generate(base_url, scenario, rate, threads, start_at, duration, timeout=None, streams=1):
+    """
+    Sends the requests of a scenario from threads threads, from start_at for
+    duration seconds
+
+    Args:
+        rate (float): Requests per second from all threads, as fast as
+            possible if None
+        start_at (float): time.time() to start at
+        streams (int): Over 1, requests are pipelined instead, see
+            pipeline.py: threads connections with up to streams requests in
+            flight on each
+
+    Returns:
+        dict: 'histogram' of latencies in microseconds, from when each
+            request was due, 'statuses', 'errors', 'requests' and 'elapsed'
+            seconds
+    """
+    if streams > 1:
+        return _generate_pipelined(base_url, scenario, rate, threads, streams, start_at, duration, timeout)
+    method, route = SCENARIOS[scenario]
+    _url = UrlTemplate(base_url, route)()
+    histogram = Histogram(DIGITS)
+    statuses = {}
+    errors = {}
+    _lock = threading.Lock()
+    _next = [0]
+
+    # Wall clock to agree with the other workers, then a monotonic clock
+    time.sleep(max(0.0, start_at - time.time()))
+    _start = time.perf_counter()
+    _stop = _start + duration
+
+    def _slot():
+        "Time the next request is due, None when the run is over"
+        with _lock:
+            _k = _next[0]
+            _next[0] += 1
+        _due = _start + _k / rate if rate else time.perf_counter()
+        return _due if _due < _stop else None
+
+    def _thread(_):
+        _session = requests.Session()
+        _histogram = Histogram(DIGITS)
+        _statuses = {}
+        _errors = {}
+        while True:
+            _due = _slot()
+            if _due is None or time.perf_counter() >= _stop:
+                break
+            _wait = _due - time.perf_counter()
+            if _wait > 0:
+                time.sleep(_wait)
+            try:
+                _status = _session.request(method, _url, timeout=timeout).status_code
+                _statuses[_status] = _statuses.get(_status, 0) + 1
+            except requests.exceptions.RequestException as e:
+                _errors[type(e).__name__] = _errors.get(type(e).__name__, 0) + 1
+            # From when it was due, so a slow response delaying the next
+            # sends shows in their latency too, see openloop.py
+            _histogram.record((time.perf_counter() - _due) * 1e6)
+        _session.close()
+        with _lock:
+            histogram.merge(_histogram)
+            _add_counts(statuses, _statuses)
+            _add_counts(errors, _errors)
+
+    with ThreadPoolExecutor(max_workers=threads) as _pool:
+        list(_pool.map(_thread, range(threads)))
+    return {
+        'histogram': histogram,
+        'statuses': statuses,
+        'errors': errors,
+        'requests': histogram.count,
+        'elapsed': time.perf_counter() - _start,
+    }
+
+
+def _generate_pipelined(base_url, scenario, rate, connections, streams, start_at, duration, timeout=None):
+    """
+    generate() with a PipelinedClient. A single thread sends the requests
+    when due, or as soon as a stream is free if rate is None, and the
+    connections' reader threads record the responses
+    """
+    method, route = SCENARIOS[scenario]
+    _url = UrlTemplate(base_url, route)()
+    histogram = Histogram(DIGITS)
+    statuses = {}
+    errors = {}
+    _lock = threading.Lock()
+    client = PipelinedClient(base_url, connections, streams, timeout)
+
+    def _done(future, due):
+        try:
+            _status = future.result().status_code
+            _key, _counts = _status, statuses
+        except Exception as e:
+            _key, _counts = type(e).__name__, errors
+        with _lock:
+            _counts[_key] = _counts.get(_key, 0) + 1
+            histogram.record((time.perf_counter() - due) * 1e6)
+
+    time.sleep(max(0.0, start_at - time.time()))
+    _start = time.perf_counter()
+    _stop = _start + duration
+    _futures = []
+    _k = 0
+    while True:
+        _due = _start + _k / rate if rate else time.perf_counter()
+        if _due >= _stop or time.perf_counter() >= _stop:
+            break
+        _wait = _due - time.perf_counter()
+        if _wait > 0:
+            time.sleep(_wait)
+        _future = client.submit(method, _url)
+        _future.add_done_callback(functools.partial(_done, due=_due))
+        _futures.append(_future)
+        _k += 1
+    futures.wait(_futures)
+    client.close()
+    return {
+        'histogram': histogram,
+        'statuses': statuses,
+        'errors': errors,
+        'requests': histogram.count,
+        'elapsed': time.perf_counter() - _start,
+    }
+
+
+def worker(coordinator, base_url, weight=1, timeout=None):
+    """
+    Connects to the coordinator and runs what it asks for, until it closes
+    the connection
+
+    Args:
+        coordinator (str): 'host:port'
+        weight (float): Share of the load to ask for
+    """
+    _name = f"{socket.gethostname()}-{os.getpid()}"
+    conn = Connection(socket.create_connection(parse_address(coordinator)))
+    try:
+        conn.send({'type': 'hello', 'worker': _name, 'weight': weight})
+        while True:
+            message = conn.receive()
+            if message is None or message['type'] == 'bye':
+                break
+            if message['type'] == 'start':
+                result = generate(base_url, message['scenario'], message['rate'], message['threads'],
+                                  message['start_at'], message['duration'], timeout, message.get('streams', 1))
+                result['histogram'] = result['histogram'].to_dict()
+                result['statuses'] = {str(_k): _v for _k, _v in result['statuses'].items()}
+                conn.send(dict(result, type='result', worker=_name))
+    finally:
+        conn.close()
+
+
+###############################################################################
+# Coordinator
+class Coordinator():
+    """
+    Accepts workers and runs scenarios on them
+    """
+    def __init__(self, address='127.0.0.1:0'):
+        """
+        Args:
+            address (str): 'host:port' to listen on, port 0 for any free one
+        """
+        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__server.bind(parse_address(address))
+        self.__server.listen(64)
+        self.workers = []  # (name, weight, Connection)
+
+    @property
+    def address(self):
+        _host, _port = self.__server.getsockname()[:2]
+        return f"{_host}:{_port}"
+
+    def accept(self, n_workers, timeout=30):
+        """
+        Waits for n_workers more workers to say hello
+
+        Returns:
+            int: Workers that connected in time
+        """
+        _deadline = time.time() + timeout
+        _accepted = 0
+        while _accepted < n_workers:
+            _left = _deadline - time.time()
+            if _left <= 0:
+                break
+            self.__server.settimeout(_left)
+            try:
+                _sock, _ = self.__server.accept()
+            except socket.timeout:
+                break
+            _sock.settimeout(timeout)
+            conn = Connection(_sock)
+            hello = conn.receive()
+            if hello is None or hello.get('type') != 'hello':
+                conn.close()
+                continue
+            self.workers.append((hello['worker'], hello.get('weight', 1), conn))
+            _accepted += 1
+        return _accepted
+
+    def run(self, scenario, rate, duration, threads=4, lead=1.0, streams=1):
+        """
+        Runs a scenario on every worker at once
+
+        Args:
+            rate (float): Requests per second from all workers, as fast as
+                possible if None
+            threads (int): Threads per worker, or connections if streams
+                is over 1
+            streams (int): Requests in flight per connection, see generate()
+            lead (float): Seconds between sending the start time and starting,
+                for every worker to get it
+
+        Returns:
+            dict: Merged 'histogram', 'statuses', 'errors', 'requests',
+                'elapsed', 'rate' achieved, and 'workers', one result each.
+                Workers that didn't answer are in 'missing'
+        """
+        _start_at = time.time() + lead
+        _shares = shares(rate, [_weight for _name, _weight, _conn in self.workers])
+        for (_name, _weight, conn), _share in zip(self.workers, _shares):
+            conn.sock.settimeout(lead + duration + 60)
+            conn.send({'type': 'start', 'scenario': scenario, 'rate': _share, 'threads': threads,
+                       'streams': streams, 'start_at': _start_at, 'duration': duration})
+
+        histogram = Histogram(DIGITS)
+        statuses, errors = {}, {}
+        results, missing = [], []
+        for _name, _weight, conn in self.workers:
+            try:
+                result = conn.receive()
+            except (socket.timeout, OSError, ValueError):
+                result = None
+            if result is None or result.get('type') != 'result':
+                missing.append(_name)
+                continue
+            histogram.merge(Histogram.from_dict(result['histogram']))
+            _add_counts(statuses, {int(_status): _n for _status, _n in result['statuses'].items()})
+            _add_counts(errors, result['errors'])
+            results.append(result)
+
+        _elapsed = max([_result['elapsed'] for _result in results] or [0.0])
+        return {
+            'scenario': scenario,
+            'target_rate': rate,
+            'histogram': histogram,
+            'statuses': statuses,
+            'errors': errors,
+            'requests': histogram.count,
+            'elapsed': _elapsed,
+            'rate': histogram.count / _elapsed if _elapsed else 0.0,
+            'workers': results,
+            'missing': missing,
+        }
+
+    def close(self):
+        for _name, _weight, conn in self.workers:
+            try:
+                conn.send({'type': 'bye'})
+            except OSError:
+                pass
+            conn.close()
+        self.workers = []
+        self.__server.close()
+
+
+def start_workers(n_workers, coordinator, base_url, python=None, timeout=None):
+    """
+    Starts worker processes on this host
+
+    Returns:
+        list: subprocess.Popen of each worker
+    """
+    _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    _cmd = [python or sys.executable, '-m', 'tester_interface.loadgen', 'worker',
+            '--coordinator', coordinator, '--base-url', base_url]
+    if timeout is not None:
+        _cmd += ['--timeout', str(timeout)]
+    return [subprocess.Popen(_cmd, cwd=_root) for _ in range(n_workers)]
+
+
+def run_local(base_url, scenario, rate, duration, n_workers=4, threads=4, remote_workers=0,
+              address='127.0.0.1:0', timeout=None, streams=1):
+    """
+    Runs a scenario from n_workers processes on this host, plus
+    remote_workers from other hosts connecting to address
+
+    Returns:
+        dict: Coordinator.run() result, with 'connected' the number of
+            workers that joined
+    """
+    coordinator = Coordinator(address)
+    procs = start_workers(n_workers, coordinator.address, base_url, timeout=timeout)
+    try:
+        if remote_workers:
+            print(f"Waiting for {remote_workers} remote workers on {coordinator.address}")
+        _connected = coordinator.accept(n_workers + remote_workers, timeout=30 + 10 * remote_workers)
+        result = coordinator.run(scenario, rate, duration, threads, streams=streams)
+        result['connected'] = _connected
+        return result
+    finally:
+        coordinator.close()
+        for _proc in procs:
+            try:
+                _proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                _proc.kill()
+
+
+###############################################################################
+# Command line
+def _print_result(result):
+    histogram = result['histogram']
+    print(f"{result['requests']} requests in {result['elapsed']:.1f} s, {result['rate']:.0f}/s"
+          f" (target {result['target_rate']}) from {len(result['workers'])} workers")
+    print(f"Latency ms: p50 {histogram.percentile(50) / 1000:.2f}, p99 {histogram.percentile(99) / 1000:.2f},"
+          f" max {(histogram.max or 0) / 1000:.2f}")
+    print(f"Status codes {result['statuses']}, errors {result['errors']}")
+    if result['missing']:
+        print(f"No result from {result['missing']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    _sub = parser.add_subparsers(dest='command')
+    _sub.required = True
+    _worker = _sub.add_parser('worker', help='Connect to a coordinator and send its load')
+    _worker.add_argument('--coordinator', required=True, help='host:port')
+    _worker.add_argument('--base-url', help='Defaults to base_url of --config')
+    _worker.add_argument('--config', default='config.json')
+    _worker.add_argument('--weight', type=float, default=1.0, help='Share of the load, such as the cores of the host')
+    _worker.add_argument('--timeout', type=float)
+    _run = _sub.add_parser('run', help='Coordinate workers on this host, and remote ones')
+    _run.add_argument('--config', default='config.json')
+    _run.add_argument('--scenario', choices=sorted(SCENARIOS))
+    _run.add_argument('--rate', type=float, help='Requests per second, as fast as possible if not given')
+    _run.add_argument('--duration', type=float)
+    _run.add_argument('--workers', type=int, help='Worker processes on this host')
+    _run.add_argument('--threads', type=int, help='Threads per worker, or connections with --streams')
+    _run.add_argument('--streams', type=int, help='Pipeline up to this many requests per connection')
+    _run.add_argument('--remote-workers', type=int, default=0, help='Workers from other hosts to wait for')
+    _run.add_argument('--address', default=None, help='host:port to listen on for workers')
+    args = parser.parse_args(argv)
+
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r') as _f:
+            config = json.load(_f)
+    if args.command == 'worker':
+        worker(args.coordinator, args.base_url or config['base_url'], args.weight, args.timeout)
+        return None
+
+    _cfg = config.get('load', {})
+    result = run_local(config['base_url'],
+                       args.scenario or _cfg.get('scenario', 'categories'),
+                       args.rate if args.rate is not None else _cfg.get('rate'),
+                       args.duration or _cfg.get('duration', 5),
+                       args.workers or _cfg.get('workers', 4),
+                       args.threads or _cfg.get('threads', 4),
+                       args.remote_workers,
+                       args.address or _cfg.get('address', '127.0.0.1:0'),
+                       config.get('request_timeout'),
+                       args.streams or _cfg.get('streams', 1))
+    _print_result(result)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Open loop load: requests sent on a timeline, whatever the responses do
+
+A closed loop client sends its next request once the last one is answered,
+so a slow response delays every request behind it and the latency they
+would have seen is never measured (coordinated omission). Here every
+request has an intended send time, taken from a schedule fixed before the
+run, and its latency is measured from that time. A request that couldn't
+be sent on time, because the generator was busy or every connection was in
+use, counts the time it waited.
+
+Schedules are lists of send times, in seconds from the start:
+    * constant: evenly spaced at rate per second
+    * poisson: random arrivals, rate per second on average
+    * steps: constant rate for each (rate, duration) step, for ramps
+
+How late requests were actually sent (the lag) is measured too. When it
+is large, the generator fell behind and the figures describe the client
+more than the server.
+
+The slowest requests of a run can be kept by index, to look them up
+afterwards, such as fetching their server side profiles.
+"""
+import heapq
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tester_interface.histogram import Histogram
+
+CONSTANT = 'constant'
+POISSON = 'poisson'
+STEPS = 'steps'
+
+DIGITS = 3
+
+# GIL switch interval while sending, in seconds. The default of 5 ms would
+# let threads reading responses hold up the dispatcher for that long
+SWITCH_INTERVAL = 0.0005
+
+
+###############################################################################
+# Schedules
+def constant(rate, duration):
+    "Send times of rate requests per second, evenly spaced"
+    return [_k / rate for _k in range(int(rate * duration))]
+
+
+def poisson(rate, duration, rng=None):
+    "Send times of a Poisson process of rate requests per second"
+    rng = rng or random.Random()
+    times = []
+    _t = rng.expovariate(rate)
+    while _t < duration:
+        times.append(_t)
+        _t += rng.expovariate(rate)
+    return times
+
+
+def steps(rate_steps):
+    """
+    Send times of constant rates one after the other
+
+    Args:
+        rate_steps (list): (rate, duration) of each step
+    """
+    times = []
+    _offset = 0.0
+    for _rate, _duration in rate_steps:
+        times += [_offset + _t for _t in constant(_rate, _duration)]
+        _offset += _duration
+    return times
+
+
+def ramp(start_rate, end_rate, n_steps, step_duration):
+    "(rate, duration) steps going from start_rate to end_rate"
+    if n_steps < 2:
+        return [(end_rate, step_duration)]
+    _increment = (end_rate - start_rate) / (n_steps - 1)
+    return [(start_rate + _increment * _i, step_duration) for _i in range(n_steps)]
+
+
+def schedule_from_config(config, seed=None):
+    """
+    Builds a schedule from a dict such as
+        {"kind": "poisson", "rate": 40, "duration": 5}
+        {"kind": "steps", "steps": [[20, 2], [40, 2]]}
+        {"kind": "steps", "ramp": {"start": 10, "end": 50, "steps": 5, "duration": 2}}
+
+    Returns:
+        tuple: (send times, step boundaries in seconds, empty if one step)
+    """
+    kind = config.get('kind', CONSTANT)
+    if kind == CONSTANT:
+        return constant(config['rate'], config['duration']), []
+    if kind == POISSON:
+        return poisson(config['rate'], config['duration'], random.Random(seed)), []
+    if kind == STEPS:
+        if 'ramp' in config:
+            _ramp = config['ramp']
+            _steps = ramp(_ramp['start'], _ramp['end'], _ramp['steps'], _ramp['duration'])
+        else:
+            _steps = [tuple(_step) for _step in config['steps']]
+        _bounds, _offset = [], 0.0
+        for _rate, _duration in _steps:
+            _offset += _duration
+            _bounds.append((_rate, _offset))
+        return steps(_steps), _bounds
+    raise ValueError(f"Unknown schedule kind {kind!r}")
+
+
+###############################################################################
+# Runner
+class StepStats():
+    "Figures of the requests intended for one step of a schedule"
+    def __init__(self, rate=None, end=None):
+        self.rate = rate
+        self.end = end
+        self.latency = Histogram(DIGITS)  # From the intended send time, us
+        self.service = Histogram(DIGITS)  # From the actual send time, us
+        self.lag = Histogram(DIGITS)      # Actual minus intended send time, us
+        self.statuses = {}
+        self.errors = {}
+
+    def add(self, latency_us, service_us, lag_us, status, error):
+        self.latency.record(latency_us)
+        self.service.record(service_us)
+        self.lag.record(lag_us)
+        if error is not None:
+            self.errors[error] = self.errors.get(error, 0) + 1
+        else:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.service.merge(other.service)
+        self.lag.merge(other.lag)
+        for _status, _n in other.statuses.items():
+            self.statuses[_status] = self.statuses.get(_status, 0) + _n
+        for _error, _n in other.errors.items():
+            self.errors[_error] = self.errors.get(_error, 0) + _n
+
+
+def _step_of(steps, t):
+    "StepStats of the step t seconds from the start falls in, the last past the end"
+    for _step in steps:
+        if t < _step.end:
+            return _step
+    return steps[-1]
+
+
+def _keep_slowest(heap, n, item):
+    "Keeps the n largest (latency, index) items in the min-heap heap"
+    if len(heap) < n:
+        heapq.heappush(heap, item)
+    elif n and item[0] > heap[0][0]:
+        heapq.heapreplace(heap, item)
+
+
+def run(send, times, max_in_flight=64, step_bounds=(), slowest=0):
+    """
+    Sends a request at each of times, from up to max_in_flight threads
+
+    Args:
+        send (callable): send(index) -> status code. Exceptions are counted
+            as errors by their type name
+        times (list): Send times in seconds from the start, sorted
+        step_bounds (list): (rate, end) of each step, to report them apart
+        slowest (int): How many of the slowest requests to keep
+
+    Returns:
+        dict: 'total' StepStats, 'steps' one StepStats per step,
+            'elapsed' seconds, 'scheduled_elapsed' the length of the
+            schedule, 'blocked' how many requests found every thread busy,
+            and 'slowest' (latency in us, index) of the slowest requests,
+            slowest first
+    """
+    _bounds = list(step_bounds) or [(None, float('inf'))]
+    _steps = [StepStats(_rate, _end) for _rate, _end in _bounds]
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(max_in_flight)
+    blocked = 0
+    _slowest = []  # Min-heap of (latency_us, index)
+
+    def _request(index, intended, step):
+        _sent = time.perf_counter()
+        status = error = None
+        try:
+            status = send(index)
+        except Exception as e:
+            error = type(e).__name__
+        finally:
+            _done = time.perf_counter()
+            _slots.release()
+        _latency = (_done - intended) * 1e6
+        with _lock:
+            step.add(_latency, (_done - _sent) * 1e6, (_sent - intended) * 1e6, status, error)
+            _keep_slowest(_slowest, slowest, (_latency, index))
+
+    _switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(SWITCH_INTERVAL)
+    _start = time.perf_counter() + 0.05
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as _pool:
+            for _index, _t in enumerate(times):
+                _intended = _start + _t
+                _wait = _intended - time.perf_counter()
+                if _wait > 0:
+                    time.sleep(_wait)
+                if not _slots.acquire(blocking=False):
+                    # Every thread busy, the request goes out late and its
+                    # latency still counts from _intended
+                    blocked += 1
+                    _slots.acquire()
+                _pool.submit(_request, _index, _intended, _step_of(_steps, _t))
+    finally:
+        sys.setswitchinterval(_switch_interval)
+    _elapsed = time.perf_counter() - _start
+
+    total = StepStats()
+    for _step in _steps:
+        total.merge(_step)
+    return {
+        'total': total,
+        'steps': _steps if step_bounds else [],
+        'elapsed': _elapsed,
+        'scheduled_elapsed': times[-1] if times else 0.0,
+        'blocked': blocked,
+        'slowest': sorted(_slowest, reverse=True),
+    }
+
+
+def fell_behind(result, max_lag_ms):
+    """
+    Checks if the generator sent requests later than it should have
+
+    Returns:
+        str: Why, None if it kept up
+    """
+    _lag_p99 = result['total'].lag.percentile(99) / 1000
+    if result['blocked']:
+        return f"{result['blocked']} requests waited for a free thread"
+    if _lag_p99 > max_lag_ms:
+        return f"p99 send lag {_lag_p99:.1f} ms is above {max_lag_ms} ms"
+    return None
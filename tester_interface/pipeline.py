@@ -0,0 +1,323 @@
+"""
+HTTP/1.1 client keeping several requests in flight per connection
+
+A requests.Session sends one request at a time on a connection and waits
+for its response before the next, so pushing the server harder takes more
+connections and a thread for each. A PipelinedClient writes up to `streams`
+requests ahead on each of its connections (HTTP/1.1 pipelining). The server
+answers them in order, and a reader thread per connection hands each
+response to the request it belongs to. Requests are encoded straight to
+bytes and responses parsed from the socket, without requests' per call
+overhead.
+
+Only pipeline requests that are safe to repeat: if the server closes a
+connection, the requests sent on it that got no response are sent again on
+a new one. A connection dropped without notice counts as a failed attempt,
+up to max_attempts. The API keeps connections open when
+started with app.py --keep-alive. Without it, every response closes the
+connection and the client gets one request per connection.
+
+HTTP/2 would multiplex streams the same way, with responses in any order,
+but the development server of the API only speaks HTTP/1.x.
+"""
+import json
+import socket
+import threading
+from collections import deque
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+# Longest status or header line read
+_MAX_LINE = 65536
+
+
+class Response():
+    """
+    The parts of a response the tester uses, named as in requests
+    """
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers  # Lower case names
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class _Request():
+    def __init__(self, method, data):
+        self.method = method
+        self.data = data
+        self.future = Future()
+        self.attempts = 0
+
+
+def _read_head(rfile):
+    """
+    Reads the status line and headers of a response
+
+    Returns:
+        tuple: (HTTP version, status code, headers with lower case names)
+    Raises:
+        EOFError: If the connection was closed before the blank line
+    """
+    _line = rfile.readline(_MAX_LINE)
+    if not _line:
+        raise EOFError("Connection closed")
+    _parts = _line.split(None, 2)
+    headers = {}
+    while True:
+        _line = rfile.readline(_MAX_LINE)
+        if _line in (b"\r\n", b"\n"):
+            return _parts[0], int(_parts[1]), headers
+        if not _line:
+            raise EOFError("Connection closed in the headers")
+        _name, _value = _line.split(b":", 1)
+        headers[_name.strip().lower().decode('latin-1')] = _value.strip().decode('latin-1')
+
+
+def _read_chunked(rfile):
+    "Reads a body sent with Transfer-Encoding: chunked, and its trailers"
+    _chunks = []
+    while True:
+        _size = int(rfile.readline(_MAX_LINE).split(b";", 1)[0], 16)
+        if _size == 0:
+            # Trailers, up to the blank line
+            while rfile.readline(_MAX_LINE) not in (b"\r\n", b"\n", b""):
+                pass
+            return b"".join(_chunks)
+        _chunks.append(rfile.read(_size))
+        rfile.readline(_MAX_LINE)
+
+
+def read_response(rfile, method='GET'):
+    """
+    Reads one response from a buffered binary file of the socket
+
+    Returns:
+        tuple: (Response, bool) the response and whether the server closes
+            the connection after it
+    Raises:
+        EOFError: If the connection was closed before a whole response
+    """
+    while True:
+        _version, status, headers = _read_head(rfile)
+        if status >= 200:
+            break
+        # 1xx, such as 100 Continue, the real response follows
+
+    _connection = headers.get('connection', '').lower()
+    close = _connection == 'close' or (_version == b"HTTP/1.0" and _connection != 'keep-alive')
+    if method == 'HEAD' or status in (204, 304):
+        content = b""
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        content = _read_chunked(rfile)
+    elif 'content-length' in headers:
+        _length = int(headers['content-length'])
+        content = rfile.read(_length)
+        if len(content) < _length:
+            raise EOFError("Connection closed in the body")
+    else:
+        content = rfile.read()
+        close = True
+    return Response(status, headers, content), close
+
+
+class PipelinedConnection():
+    """
+    A connection with the requests sent on it still waiting for a response,
+    in order
+    """
+    def __init__(self, host, port, timeout=None, max_attempts=3, on_done=None):
+        """
+        Args:
+            on_done (callable): Called with no arguments each time a request
+                gets its response or fails for good
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.on_done = on_done
+        self.pending = deque()
+        self.connects = 0
+        self.__lock = threading.Lock()
+        self.__sock = None
+
+    def send(self, request):
+        "Writes a request, connecting first if needed"
+        with self.__lock:
+            if self.__sock is None:
+                self.__connect()
+            self.pending.append(request)
+            try:
+                self.__sock.sendall(request.data)
+            except OSError:
+                # The reader sees the connection closed and sends it again
+                pass
+
+    def close(self):
+        with self.__lock:
+            self.__close(self.__sock)
+
+    def __connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__sock = sock
+        self.connects += 1
+        threading.Thread(target=self.__read, args=(sock,), daemon=True).start()
+
+    def __close(self, sock):
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        if self.__sock is sock:
+            self.__sock = None
+
+    def __finish(self, request, response=None, error=None):
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(response)
+        if self.on_done is not None:
+            self.on_done()
+
+    def __read(self, sock):
+        rfile = sock.makefile('rb')
+        while True:
+            with self.__lock:
+                if sock is not self.__sock and not self.pending:
+                    return
+                request = self.pending[0] if self.pending else None
+            try:
+                response, close = read_response(rfile, request.method if request is not None else 'GET')
+            except socket.timeout:
+                with self.__lock:
+                    if not self.pending:
+                        # Idle, not a stalled server. The socket can't be
+                        # read after a timeout, the next request reconnects
+                        self.__close(sock)
+                        return
+                self.__fail(sock, TimeoutError(f"No response within {self.timeout} s"))
+                return
+            except (OSError, EOFError, ValueError, IndexError):
+                self.__resend(sock, dropped=True)
+                return
+            with self.__lock:
+                request = self.pending.popleft()
+            self.__finish(request, response)
+            if close:
+                # The server said it reads no more requests from this
+                # connection, the ones after weren't looked at
+                self.__resend(sock, dropped=False)
+                return
+
+    def __fail(self, sock, error):
+        with self.__lock:
+            self.__close(sock)
+            failed = list(self.pending)
+            self.pending.clear()
+        for request in failed:
+            self.__finish(request, error=error)
+
+    def __resend(self, sock, dropped):
+        """
+        Sends the requests left without a response again, on a new
+        connection
+
+        Args:
+            dropped (bool): If the connection was lost rather than closed as
+                the server said it would. Counts as a failed attempt
+        """
+        with self.__lock:
+            self.__close(sock)
+            retry = list(self.pending)
+            self.pending.clear()
+        for request in retry:
+            request.attempts += dropped
+            if request.attempts >= self.max_attempts:
+                self.__finish(request, error=ConnectionError(
+                    f"Connection closed before a response, {request.attempts} attempts"))
+                continue
+            try:
+                self.send(request)
+            except OSError as e:
+                self.__finish(request, error=e)
+
+
+class PipelinedClient():
+    """
+    Sends requests on `connections` connections, up to `streams` in flight on
+    each
+    """
+    def __init__(self, base_url, connections=4, streams=8, timeout=None, max_attempts=3, headers=None):
+        """
+        Args:
+            base_url (str): Such as "http://localhost:8888/"
+            headers (dict): Sent with every request
+        """
+        _url = urlsplit(base_url)
+        if _url.scheme != 'http':
+            raise ValueError(f"Only http:// is supported, got {base_url}")
+        self.host = _url.hostname
+        self.port = _url.port or 80
+        self.streams = streams
+        self.__host_header = _url.netloc.encode('latin-1')
+        self.__headers = b"".join(f"{_k}: {_v}\r\n".encode('latin-1') for _k, _v in (headers or {}).items())
+        self.__slots = threading.BoundedSemaphore(connections * streams)
+        self.connections = [PipelinedConnection(self.host, self.port, timeout, max_attempts, self.__slots.release)
+                            for _ in range(connections)]
+
+    def encode(self, method, url, headers=None, body=None):
+        "Bytes of a request, url being a full URL or a path"
+        _url = urlsplit(url)
+        _target = (_url.path or "/") + (f"?{_url.query}" if _url.query else "")
+        _lines = [f"{method} {_target} HTTP/1.1\r\n".encode('latin-1'), b"Host: ", self.__host_header, b"\r\n",
+                  self.__headers]
+        for _name, _value in (headers or {}).items():
+            _lines.append(f"{_name}: {_value}\r\n".encode('latin-1'))
+        if body is not None:
+            _lines.append(f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1'))
+            _lines.append(body)
+        else:
+            _lines.append(b"\r\n")
+        return b"".join(_lines)
+
+    def submit(self, method, url, headers=None, body=None):
+        """
+        Sends a request once fewer than connections * streams are in flight,
+        on the connection with the fewest
+
+        Args:
+            body (bytes): Sent as is
+        Returns:
+            concurrent.futures.Future: Of the Response
+        """
+        request = _Request(method, self.encode(method, url, headers, body))
+        self.__slots.acquire()
+        _connection = min(self.connections, key=lambda _c: len(_c.pending))
+        try:
+            _connection.send(request)
+        except OSError as e:
+            request.future.set_exception(e)
+            self.__slots.release()
+        return request.future
+
+    def request(self, method, url, headers=None, body=None):
+        "submit() and wait for the Response"
+        return self.submit(method, url, headers, body).result()
+
+    @property
+    def connects(self):
+        "Connections opened so far, more than one per connection means the server closed some"
+        return sum(_c.connects for _c in self.connections)
+
+    def close(self):
+        for _connection in self.connections:
+            _connection.close()
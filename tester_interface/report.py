@@ -0,0 +1,444 @@
+"""
+Builds an HTML summary from a results file written by ResultsSink
+
+The file is read one line at a time. Only aggregates are kept in memory:
+a latency histogram per endpoint, counters per test and a few samples of
+failed requests per test, so long runs can be summarised too. Server side
+profiles recorded by the tester are listed with their hottest frames and
+their folded stacks, ready for flamegraph.pl. Time series sampled during
+the run, such as the resources of a soak test, are charted with the trends
+fitted to them.
+
+Throughput over time, error bursts and the comparison with a baseline run
+come from analysis.py, which loads the requests of the run in NumPy arrays.
+
+Usage:
+    python -m tester_interface.report test_results [-o report.html]
+        [--run RUN_ID] [--samples 10] [--baseline base.ndjson [--baseline-run RUN_ID]]
+"""
+import argparse
+import html
+import re
+import time
+from collections import Counter, OrderedDict
+from tester_interface.histogram import Histogram
+from tester_interface.results import read_records, last_run
+
+_NUMERIC_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+# Negative tests send lots of made up ids, each one a path of its own. Paths
+# past this many per table are counted together
+MAX_ENDPOINTS = 12
+OTHER_PATHS = "(other paths)"
+
+# Significant digits of the latency histograms, as in loadgen.py
+DIGITS = 3
+
+
+def endpoint_template(path):
+    "'/api/blog/categories/12' -> '/api/blog/categories/{id}'"
+    return _NUMERIC_SEGMENT.sub("/{id}", path)
+
+
+def add_to_endpoints(endpoints, record):
+    """
+    Adds a request record to a (method, path template) -> EndpointStats dict
+    holding at most MAX_ENDPOINTS paths
+    """
+    _key = (record['method'], endpoint_template(record['path']))
+    if _key not in endpoints and len(endpoints) >= MAX_ENDPOINTS:
+        _key = (record['method'], OTHER_PATHS)
+    if _key not in endpoints:
+        endpoints[_key] = EndpointStats()
+    endpoints[_key].add(record)
+
+
+class EndpointStats():
+    def __init__(self):
+        self.latency = Histogram(DIGITS)  # us
+        self.statuses = Counter()
+        self.retried = 0
+
+    def add(self, record):
+        self.latency.record(record['ms'] * 1000)
+        self.statuses[record['status'] if record['status'] is not None else record['error']] += 1
+        if record.get('attempts', 1) > 1:
+            self.retried += 1
+
+
+class TestStats():
+    def __init__(self, samples):
+        self.outcome = 'unknown'
+        self.ms = 0.0
+        self.message = None
+        self.checks = OrderedDict()  # (name, code) -> [count, total ms]
+        self.endpoints = OrderedDict()
+        self.requests = 0
+        self.failed_requests = 0
+        self.samples = []
+        self.max_samples = samples
+
+    def add_request(self, record):
+        self.requests += 1
+        add_to_endpoints(self.endpoints, record)
+        if record['status'] is None or record['status'] >= 500:
+            self.failed_requests += 1
+            if len(self.samples) < self.max_samples:
+                self.samples.append(record)
+
+
+class RunSummary():
+    """
+    Aggregates of one run, built from a stream of records
+    """
+    def __init__(self, samples=10):
+        self.samples = samples
+        self.run = None
+        self.base_url = None
+        self.started = None
+        self.ended = None
+        self.tests = OrderedDict()
+        self.endpoints = OrderedDict()
+        self.check_codes = Counter()
+        self.outcomes = Counter()
+        self.requests = 0
+        self.profiles = []
+        self.series = OrderedDict()  # (test, series) -> [sample values]
+        self.trends = OrderedDict()  # (test, series) -> [trend records]
+
+    def __test(self, nodeid):
+        if nodeid not in self.tests:
+            self.tests[nodeid] = TestStats(self.samples)
+        return self.tests[nodeid]
+
+    def add(self, record):
+        _type = record.get('type')
+        _ts = record.get('ts')
+        if _ts is not None:
+            self.started = _ts if self.started is None else min(self.started, _ts)
+            self.ended = _ts if self.ended is None else max(self.ended, _ts)
+        if _type == 'run':
+            self.run = record['run']
+            self.base_url = record.get('base_url')
+        elif _type == 'request':
+            self.requests += 1
+            add_to_endpoints(self.endpoints, record)
+            self.__test(record.get('test')).add_request(record)
+        elif _type == 'check':
+            self.check_codes[record['code']] += 1
+            _check = self.__test(record.get('test')).checks.setdefault((record['name'], record['code']), [0, 0.0])
+            _check[0] += 1
+            _check[1] += record['ms']
+        elif _type == 'test':
+            _test = self.__test(record['test'])
+            if _test.outcome != 'unknown':
+                self.outcomes[_test.outcome] -= 1
+            _test.outcome = record['outcome']
+            _test.ms = record['ms']
+            _test.message = record.get('message') or _test.message
+            self.outcomes[_test.outcome] += 1
+        elif _type == 'profile':
+            self.profiles.append(record)
+        elif _type == 'sample':
+            self.series.setdefault((record.get('test'), record['series']), []).append(record['values'])
+        elif _type == 'trend':
+            self.trends.setdefault((record.get('test'), record['series']), []).append(record)
+
+
+def summarize(path, run=None, samples=10):
+    """
+    Args:
+        run (str): Run id, the last run of the file by default
+    """
+    if run is None:
+        run = last_run(path)
+    summary = RunSummary(samples)
+    for record in read_records(path, run):
+        summary.add(record)
+    return summary
+
+
+###############################################################################
+# HTML
+_STYLE = """
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin-bottom: 1.5em; }
+th, td { border: 1px solid #ccc; padding: 0.25em 0.6em; text-align: left; }
+td.num { text-align: right; }
+.passed { color: #2a7d2a; } .failed, .error { color: #b22; } .skipped { color: #a70; }
+details { margin: 0.3em 0; } summary { cursor: pointer; }
+pre { background: #f6f6f6; padding: 0.5em; white-space: pre-wrap; }
+"""
+
+
+def _code_name(code):
+    from tester_interface.rest_tester import RestTester
+    return RestTester.status_codes.get(code, '')
+
+
+def _endpoint_rows(endpoints):
+    _rows = []
+    for (_method, _path), _stats in endpoints.items():
+        _lat = _stats.latency
+        _statuses = ", ".join(f"{_k}: {_v}" for _k, _v in sorted(_stats.statuses.items(), key=str))
+        _rows.append(
+            f"<tr><td>{_method}</td><td>{html.escape(_path)}</td><td class='num'>{_lat.count}</td>"
+            f"<td>{html.escape(_statuses)}</td><td class='num'>{_stats.retried}</td>"
+            + "".join(f"<td class='num'>{_v / 1000:.1f}</td>" for _v in (
+                _lat.mean, _lat.percentile(50), _lat.percentile(95), _lat.percentile(99), _lat.max))
+            + "</tr>")
+    return ("<table><tr><th>Method</th><th>Path</th><th>Requests</th><th>Status codes</th>"
+            "<th>Retried</th><th>Mean ms</th><th>p50 ms</th><th>p95 ms</th><th>p99 ms</th>"
+            "<th>Max ms</th></tr>" + "".join(_rows) + "</table>")
+
+
+def _test_details(nodeid, test):
+    _parts = [f"<details><summary><span class='{test.outcome}'>{test.outcome.upper()}</span> "
+              f"{html.escape(str(nodeid))} &mdash; {test.ms:.0f} ms, {test.requests} requests"
+              f"{f', {test.failed_requests} failed' if test.failed_requests else ''}</summary>"]
+    if test.message:
+        _parts.append(f"<pre>{html.escape(test.message)}</pre>")
+    if test.checks:
+        _parts.append("<table><tr><th>Check</th><th>Code</th><th>Meaning</th><th>Times</th>"
+                      "<th>Total ms</th></tr>")
+        for (_name, _code), (_n, _ms) in test.checks.items():
+            _parts.append(f"<tr><td>{html.escape(_name)}</td><td class='num'>{_code}</td>"
+                          f"<td>{html.escape(_code_name(_code))}</td><td class='num'>{_n}</td>"
+                          f"<td class='num'>{_ms:.0f}</td></tr>")
+        _parts.append("</table>")
+    if test.endpoints:
+        _parts.append(_endpoint_rows(test.endpoints))
+    if test.samples:
+        _parts.append("<p>Failed requests (first {}):</p><pre>".format(len(test.samples)))
+        for _req in test.samples:
+            _parts.append(html.escape(f"{_req['method']} {_req['path']} -> "
+                                      f"{_req['status'] or _req['error']} in {_req['ms']:.0f} ms, "
+                                      f"{_req['attempts']} attempts\n"))
+        _parts.append("</pre>")
+    _parts.append("</details>")
+    return "".join(_parts)
+
+
+def hottest_frames(folded, n=5):
+    """
+    Functions the most time was spent in, from folded stacks
+
+    Returns:
+        list: (frame, share of the samples) of the n leaf frames with the
+            largest weight
+    """
+    _weights = Counter()
+    for _line in folded.splitlines():
+        _stack, _, _weight = _line.rpartition(' ')
+        if _stack:
+            _weights[_stack.rsplit(';', 1)[-1]] += int(_weight)
+    _total = sum(_weights.values()) or 1
+    return [(_frame, _w / _total) for _frame, _w in _weights.most_common(n)]
+
+
+def _profile_rows(profiles):
+    if not profiles:
+        return ""
+    _parts = ["<h2>Server profiles</h2>",
+              "<table><tr><th>Test</th><th>Request</th><th>Status</th><th>Client ms</th>"
+              "<th>Server ms</th><th>SQL ms</th><th>Queries</th><th>Marshal ms</th><th>Samples</th></tr>"]
+    _details = []
+    for _p in profiles:
+        _request = f"{_p['method']} {_p['path']}"
+        _parts.append(f"<tr><td>{html.escape(str(_p.get('test')))}</td><td>{html.escape(_request)}</td>"
+                      f"<td class='num'>{_p['status']}</td><td class='num'>{_p['client_ms']:.1f}</td>"
+                      + "".join(f"<td class='num'>{_p[_key]:.1f}</td>" for _key in ('total_ms', 'sql_ms'))
+                      + f"<td class='num'>{_p['sql_count']}</td><td class='num'>{_p['marshal_ms']:.1f}</td>"
+                      f"<td class='num'>{_p['samples']}</td></tr>")
+        _details.append(f"<details><summary>Profile {html.escape(_p['id'])} &mdash; {html.escape(_request)}, "
+                        f"{_p['client_ms']:.0f} ms</summary><p>Hottest frames:</p><pre>")
+        for _frame, _share in hottest_frames(_p['folded']):
+            _details.append(html.escape(f"{_share:6.1%}  {_frame}\n"))
+        _details.append("</pre>")
+        if _p['sql_statements']:
+            _details.append("<p>Queries:</p><pre>")
+            for _q in _p['sql_statements']:
+                _details.append(html.escape(f"{_q['count']} x {_q['ms']:.2f} ms  {' '.join(_q['statement'].split())}\n"))
+            _details.append("</pre>")
+        _details.append(f"<p>Folded stacks, in microseconds:</p><pre>{html.escape(_p['folded'])}</pre></details>")
+    _parts.append("</table>")
+    return "".join(_parts + _details)
+
+
+def _format_metric(metric, value):
+    if value is None:
+        return '-'
+    if metric.endswith('_bytes'):
+        return f"{value / 2 ** 20:.2f} MiB"
+    return f"{value:.1f}" if metric.endswith('_ms') else f"{round(value)}"
+
+
+def _line_svg(ts, values, trend=None, width=360, height=60):
+    "Line chart of a metric over time, with its fitted trend dashed"
+    _points = [(_t, _v) for _t, _v in zip(ts, values) if _v is not None]
+    if not _points:
+        return ""
+    _t0, _t1 = _points[0][0], max(_points[-1][0], _points[0][0] + 1e-9)
+    _values = [_v for _, _v in _points]
+    if trend is not None:
+        _values += [trend['first'], trend['last']]
+    _low, _high = min(_values), max(_values)
+    _high = _high if _high > _low else _low + 1
+
+    def _xy(t, v):
+        return f"{(t - _t0) / (_t1 - _t0) * width:.1f},{height - (v - _low) / (_high - _low) * height:.1f}"
+
+    _parts = [f"<svg width='{width}' height='{height}'>",
+              "<polyline fill='none' stroke='#69c' points='"
+              + " ".join(_xy(_t, _v) for _t, _v in _points) + "'/>"]
+    if trend is not None:
+        _colour = '#b22' if trend['leak'] else '#999'
+        _x1, _y1 = _xy(trend['start'], trend['first']).split(',')
+        _x2, _y2 = _xy(trend['end'], trend['last']).split(',')
+        _parts.append(f"<line x1='{_x1}' y1='{_y1}' x2='{_x2}' y2='{_y2}' stroke='{_colour}' "
+                      f"stroke-dasharray='4 3'/>")
+    _parts.append("</svg>")
+    return "".join(_parts)
+
+
+def _series_rows(series, trends):
+    """
+    A table per time series: each metric charted over time, with the trend
+    fitted to it
+    """
+    if not series:
+        return ""
+    _parts = ["<h2>Time series</h2>"]
+    for (_test, _name), _samples in series.items():
+        _trends = {_t['metric']: _t for _t in trends.get((_test, _name), [])}
+        _leaks = [_m for _m, _t in _trends.items() if _t['leak']]
+        _ts = [_s['t'] for _s in _samples]
+        _parts.append(f"<h3>{html.escape(_name)} &mdash; {html.escape(str(_test))}</h3>"
+                      f"<p>{len(_samples)} samples over {_ts[-1] if _ts else 0:.0f} s"
+                      + (f", <span class='failed'>leaking: {html.escape(', '.join(_leaks))}</span>" if _leaks else "")
+                      + "</p><table><tr><th>Metric</th><th>First</th><th>Last</th><th>Trend per hour</th>"
+                      "<th>r&sup2;</th><th>Leak</th><th>Over time</th></tr>")
+        _metrics = [_m for _m in _samples[0] if _m != 't'] if _samples else []
+        for _metric in _metrics:
+            _values = [_s.get(_metric) for _s in _samples]
+            if all(_v is None for _v in _values):
+                continue
+            _known = [_v for _v in _values if _v is not None]
+            _trend = _trends.get(_metric)
+            _parts.append(
+                f"<tr><td>{html.escape(_metric)}</td>"
+                f"<td class='num'>{_format_metric(_metric, _known[0])}</td>"
+                f"<td class='num'>{_format_metric(_metric, _known[-1])}</td>"
+                + (f"<td class='num'>{_format_metric(_metric, _trend['per_hour'])}</td>"
+                   f"<td class='num'>{_trend['r2']:.2f}</td>"
+                   f"<td class='{'failed' if _trend['leak'] else 'passed'}'>{'yes' if _trend['leak'] else 'no'}</td>"
+                   if _trend is not None else "<td></td><td></td><td></td>")
+                + f"<td>{_line_svg(_ts, _values, _trend)}</td></tr>")
+        _parts.append("</table>")
+    return "".join(_parts)
+
+
+def _throughput_svg(requests, errors, window, height=80, bar=4):
+    "Bar chart of requests per window, errors stacked in red"
+    _top = max(int(requests.max()), 1) if len(requests) else 1
+    _bars = []
+    for _i, (_n, _e) in enumerate(zip(requests.tolist(), errors.tolist())):
+        _h = height * _n / _top
+        _eh = height * _e / _top
+        _bars.append(f"<rect x='{_i * bar}' y='{height - _h:.1f}' width='{bar - 1}' height='{_h:.1f}' fill='#69c'/>")
+        if _e:
+            _bars.append(f"<rect x='{_i * bar}' y='{height - _eh:.1f}' width='{bar - 1}' "
+                         f"height='{_eh:.1f}' fill='#b22'/>")
+    return (f"<svg width='{max(len(requests), 1) * bar}' height='{height}'>" + "".join(_bars) + "</svg>"
+            f"<p>{window:g} s per bar, highest {_top} requests</p>")
+
+
+def render_analysis(columns, baseline=None, window=1.0):
+    """
+    HTML of the sections computed with analysis.py
+
+    Args:
+        columns (RequestColumns): Requests of the run
+        baseline (RequestColumns): Requests of a run to compare against
+    """
+    from tester_interface import analysis
+    _parts = ["<h2>Throughput</h2>"]
+    _starts, _requests, _errors = analysis.throughput(columns, window)
+    _parts.append(_throughput_svg(_requests, _errors, window))
+
+    _bursts = analysis.error_bursts(columns, window)
+    _parts.append(f"<h2>Error bursts</h2><p>{len(_bursts)} found</p>")
+    if _bursts:
+        _parts.append("<table><tr><th>From s</th><th>To s</th><th>Requests</th><th>Errors</th></tr>")
+        for _burst in _bursts:
+            _parts.append(f"<tr><td class='num'>{_burst['start']:.0f}</td><td class='num'>{_burst['end']:.0f}</td>"
+                          f"<td class='num'>{_burst['requests']}</td><td class='num'>{_burst['errors']}</td></tr>")
+        _parts.append("</table>")
+
+    if baseline is not None:
+        _parts.append("<h2>Compared to baseline</h2>"
+                      "<p>p99 latency in ms, with the 95% bootstrap interval of the difference</p>"
+                      "<table><tr><th>Endpoint</th><th>Base n</th><th>New n</th><th>Base p99</th>"
+                      "<th>New p99</th><th>Difference</th><th>Regressed</th></tr>")
+        for _row in analysis.compare_runs(baseline, columns):
+            _parts.append(f"<tr><td>{html.escape(_row['key'])}</td><td class='num'>{_row['base_count']}</td>"
+                          f"<td class='num'>{_row['new_count']}</td><td class='num'>{_row['base']:.1f}</td>"
+                          f"<td class='num'>{_row['new']:.1f}</td>"
+                          f"<td class='num'>{_row['diff']:+.1f} [{_row['low']:+.1f}, {_row['high']:+.1f}]</td>"
+                          f"<td class='{'failed' if _row['regressed'] else 'passed'}'>"
+                          f"{'yes' if _row['regressed'] else 'no'}</td></tr>")
+        _parts.append("</table>")
+    return "".join(_parts)
+
+
+def render_html(summary, analysis_html=""):
+    _started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(summary.started)) if summary.started else '-'
+    _duration = (summary.ended - summary.started) if summary.started else 0
+    _outcomes = ", ".join(f"{_v} {_k}" for _k, _v in summary.outcomes.items() if _v)
+    _codes = "".join(f"<tr><td class='num'>{_code}</td><td>{html.escape(_code_name(_code))}</td>"
+                     f"<td class='num'>{_n}</td></tr>" for _code, _n in sorted(summary.check_codes.items()))
+    _order = {'failed': 0, 'error': 1, 'unknown': 2, 'skipped': 3, 'passed': 4}
+    _tests = sorted(summary.tests.items(), key=lambda item: _order.get(item[1].outcome, 2))
+    return "".join([
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>REST API test results</title>",
+        f"<style>{_STYLE}</style></head><body>",
+        "<h1>REST API test results</h1>",
+        f"<p>Run {html.escape(str(summary.run))} against {html.escape(str(summary.base_url))}, "
+        f"started {_started}, {_duration:.1f} s</p>",
+        f"<p>Tests: {_outcomes or 'none'}. Requests: {summary.requests}</p>",
+        "<h2>Check results</h2>",
+        "<table><tr><th>Code</th><th>Meaning</th><th>Count</th></tr>", _codes, "</table>",
+        "<h2>Endpoints</h2>", _endpoint_rows(summary.endpoints),
+        analysis_html,
+        _profile_rows(summary.profiles),
+        _series_rows(summary.series, summary.trends),
+        "<h2>Tests</h2>",
+        "".join(_test_details(_nodeid, _test) for _nodeid, _test in _tests),
+        "</body></html>",
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds an HTML summary from a results file')
+    parser.add_argument('results', help='JSON lines file written by the test run, or a results directory to read the newest of')
+    parser.add_argument('-o', '--output', default='automated_tests_report.html')
+    parser.add_argument('--run', help='Run id, the last run in the file by default')
+    parser.add_argument('--samples', type=int, default=10,
+                        help='Failed requests listed per test (default: %(default)s)')
+    parser.add_argument('--baseline', help='Results file of a run to compare latencies against')
+    parser.add_argument('--baseline-run', help='Run id in the baseline file, its last run by default')
+    args = parser.parse_args(argv)
+
+    from tester_interface import analysis
+    summary = summarize(args.results, args.run, args.samples)
+    columns = analysis.load_requests(args.results, summary.run)
+    baseline = analysis.load_requests(args.baseline, args.baseline_run) if args.baseline else None
+    with open(args.output, 'w') as _f:
+        _f.write(render_html(summary, render_analysis(columns, baseline)))
+    print(f"Run {summary.run}: {dict(summary.outcomes)}, {summary.requests} requests -> {args.output}")
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,31 @@
 import requests
 import json
+import functools
 from urllib.parse import urljoin
-from tester_interface.cPrint import cPrint, cprint, cprint_err, cprint_suc, cprint_info
+from tester_interface.cPrint import cPrint, cprint, cprint_err, cprint_suc, cprint_info, cprint_plain
+from tester_interface import cPrint as output
+from tester_interface.retry import RetryPolicy, RetryStats, parse_retry_after
+from tester_interface.spec import ApiSpec
+from tester_interface import fuzz
+from tester_interface import stress
+from tester_interface import loadgen
+from tester_interface import openloop
+from tester_interface import soak
+from tester_interface import sync
+from tester_interface import dbreset
+from tester_interface import impact
+from tester_interface.templates import UrlTemplate, JsonTemplate, Field, random_text
+from tester_interface.histogram import Histogram
 import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import random
 from shutil import copyfile
 import os
+import sys
+import signal
+import subprocess
 from math import ceil
 
 class RestTester():
@@ -16,11 +36,15 @@ class RestTester():
     SUC_HTTP_CREATED =  201
     SUC_HTTP_ACCEPTED = 202
     SUC_HTTP_NO_CONTENT = 204 # When successfully deleted or updated
+    SUC_HTTP_NOT_MODIFIED = 304 # Conditional GET, cached copy still valid
     # Error HTTP codes
     ERR_HTTP_BAD_REQUEST = 400
     ERR_HTTP_NOT_FOUND = 404
     ERR_HTTP_TIMEOUT = 408
     ERR_HTTP_CONFLICT = 409
+    ERR_HTTP_PRECONDITION_FAILED = 412
+    ERR_HTTP_TOO_MANY_REQUESTS = 429
+    ERR_HTTP_SERVICE_UNAVAILABLE = 503
 
     # Tests error codes
     ERR_NONE = 0
@@ -46,13 +70,21 @@ class RestTester():
             +" the processing has not been completed",
         SUC_HTTP_NO_CONTENT: "The server successfully processed the request,"\
             +" and is not returning any content",
+        SUC_HTTP_NOT_MODIFIED: "The resource has not been modified since the"\
+            +" version in If-None-Match",
         
         ERR_HTTP_BAD_REQUEST: "The server cannot or will not process the "\
             + "request due to an apparent client error",
         ERR_HTTP_NOT_FOUND: "The requested resource could not be found",
         ERR_HTTP_TIMEOUT: "The server timed out waiting for the request",
         ERR_HTTP_CONFLICT: "Request could not be processed because of conflict"\
-            + " in the current state of the resource"
+            + " in the current state of the resource",
+        ERR_HTTP_PRECONDITION_FAILED: "The resource was modified since the"\
+            + " version in If-Match",
+        ERR_HTTP_TOO_MANY_REQUESTS: "The user has sent too many requests in a"\
+            + " given amount of time",
+        ERR_HTTP_SERVICE_UNAVAILABLE: "The server is overloaded and cannot"\
+            + " handle the request"
     }
 
     # Default categories and their ids
@@ -66,15 +98,105 @@ class RestTester():
     # Paths
     API_CATEGORIES = "/api/blog/categories/"
     API_POSTS      = "/api/blog/posts/"
+    API_ARCHIVE    = "/api/blog/posts/archive/"
+    API_CHANGES    = "/api/blog/changes/"
+    API_PROFILES   = "/api/diagnostics/profiles/"
+    API_COALESCING = "/api/diagnostics/coalescing"
+    API_JOBS       = "/api/diagnostics/jobs"
     
     MAX_CHARS = 79 # Python standard
+
+    IDEMPOTENCY_HEADER = "Idempotency-Key"
+    REPLAYED_HEADER    = "Idempotent-Replayed"
+    CLIENT_ID_HEADER   = "X-Client-Id"
+    PROFILE_HEADER     = "X-Profile"
+    PROFILE_ID_HEADER  = "X-Profile-Id"
+
+    # Bodies encoded once, only their fields are encoded per request
+    CATEGORY_BODY         = JsonTemplate({'name': Field('name')})
+    CATEGORY_BODY_WITH_ID = JsonTemplate({'id': Field('id'), 'name': Field('name')})
+    POST_BODY             = JsonTemplate({'title': Field('title'), 'body': Field('body'),
+                                          'category_id': Field('category_id')})
+
+    # base_url -> ApiSpec, shared by all instances so swagger.json is fetched
+    # and its validators compiled once per run
+    _specs = {}
+    _specs_lock = threading.Lock()
+    # default_db_path -> dbreset.SkippingReset, shared the same way so a
+    # reset by any instance is known to the others
+    _resets = {}
+    _resets_lock = threading.Lock()
     
-    def __init__(self, config_file):
+    def __init__(self, config_file, retry_stats=None, results_sink=None, random_seeds=False):
+        """
+        Args:
+            config_file (str): Path to config.json
+            retry_stats (RetryStats): Counters to share between instances, so
+                retries can be reported for a whole run
+            results_sink (ResultsSink): Where to stream a record of every
+                request and check. Nothing is recorded if not given
+            random_seeds (bool): Draw new seeds for the randomised tests,
+                instead of the ones in config.json, to explore new inputs
+        """
         with open(config_file, 'r') as _f:
             config = json.load(_f)
         self.base_url = config['base_url']
         self.default_db = config['default_db_path']
         self.db_path    = config['database_path']
+        self.db_reset   = config.get('database_reset', dbreset.SKIP_UNCHANGED)
+        self.timeout    = config.get('request_timeout')
+        self.retry_policy = RetryPolicy.from_config(config.get('retry'))
+        self.retry_stats = retry_stats if retry_stats is not None else RetryStats()
+        self.results_sink = results_sink
+        self.random_seeds = random_seeds
+        self.rate_limit_scenario = config.get('rate_limit_scenario', {})
+        self.server_config = config.get('server', {})
+        self.fuzz_config = config.get('fuzz', {})
+        self.stress_config = config.get('stress', {})
+        self.load_config = config.get('load', {})
+        self.open_loop_config = config.get('open_loop', {})
+        self.profiling_config = config.get('profiling', {})
+        self.sync_config = config.get('sync', {})
+        self.summary_config = config.get('summary', {})
+        self.replica_config = config.get('replica', {})
+        self.coalescing_config = config.get('coalescing', {})
+        self.soak_config = config.get('soak', {})
+        self.jobs_config = config.get('jobs', {})
+        cPrint.configure_from(config.get('output'))
+        # URLs of the routes, joined with base_url once
+        self.__url_categories = UrlTemplate(self.base_url, self.API_CATEGORIES)
+        self.__url_category   = UrlTemplate(self.base_url, self.API_CATEGORIES + "{id}")
+        self.__url_posts      = UrlTemplate(self.base_url, self.API_POSTS)
+        self.__url_post       = UrlTemplate(self.base_url, self.API_POSTS + "{id}")
+        # By number of parameters: year, year and month, full date
+        self.__url_archive = {
+            1: UrlTemplate(self.base_url, self.API_ARCHIVE + "{year}/"),
+            2: UrlTemplate(self.base_url, self.API_ARCHIVE + "{year}/{month}/"),
+            3: UrlTemplate(self.base_url, self.API_ARCHIVE + "{year}/{month}/{day}/"),
+        }
+        self.__url_summary = UrlTemplate(self.base_url, self.API_CATEGORIES + "{id}/summary")
+        self.__url_changes = UrlTemplate(self.base_url, self.API_CHANGES)
+        # A requests.Session per thread, so connections are pooled
+        self.__local = threading.local()
+        # URL -> (ETag, body) of the last full response, for revalidation
+        self.__etag_cache = {}
+        self.revalidation_stats = {
+            'requests': 0,
+            'not_modified': 0,
+            'bytes_received': 0,
+            'bytes_saved': 0,
+        }
+        # What the last test_* method saw: status codes, headers, counts,
+        # so a failing check can say what broke
+        self.results = {}
+
+    @property
+    def spec(self):
+        "Swagger spec of the API, loaded on first use"
+        with self._specs_lock:
+            if self.base_url not in self._specs:
+                self._specs[self.base_url] = ApiSpec.load(self.base_url, timeout=self.timeout)
+            return self._specs[self.base_url]
 
     ###########################################################################
     # 'Private' functions
@@ -93,17 +215,266 @@ class RestTester():
         ret = self.ERR_UNKNOWN
         if not req.ok:
             if verbose:
-                print(f"HTTP Status Error: {req.status_code} - {self.__dec_status(req.status_code)}")
+                cprint_plain(f"HTTP Status Error: {req.status_code} - {self.__dec_status(req.status_code)}",
+                             level=output.ERROR)
             ret = req.status_code
         else:
             ret = self.ERR_NONE
         return ret
     
+    def __session(self):
+        "Session of the calling thread"
+        _session = getattr(self.__local, 'session', None)
+        if _session is None:
+            _session = self.__local.session = requests.Session()
+        return _session
+
+    def __seed(self, seed, config):
+        """
+        seed if given, else the one of a section of config.json, else a
+        random one when random_seeds is set or the section has none
+        """
+        if seed is not None:
+            return seed
+        if not self.random_seeds and config.get('seed') is not None:
+            return config['seed']
+        return random.randrange(2 ** 32)
+
+    @staticmethod
+    def __percentile(ms, q):
+        "q-th percentile of latencies in ms, from a histogram.Histogram of them. 0 if empty"
+        _histogram = Histogram(loadgen.DIGITS)
+        for _ms in ms:
+            _histogram.record(_ms * 1000)
+        return _histogram.percentile(q) / 1000
+
+    def __check_model(self, model, value, many=False):
+        """
+        Validates a response body against a model of the spec
+
+        Returns:
+            int: ERR_MISSING_FIELD, ERR_INVALID_FIELD or ERR_NONE
+        """
+        if many:
+            errors = self.spec.validate_list(model, value)
+        else:
+            errors = self.spec.validate(model, value)
+        ret = self.ERR_NONE
+        for _kind, _path, _msg in errors:
+            cprint_err(f"ERROR: {_path}: {_msg}")
+            if _kind == ApiSpec.MISSING:
+                ret = self.ERR_MISSING_FIELD
+            elif ret == self.ERR_NONE:
+                ret = self.ERR_INVALID_FIELD
+        return ret
+
     @staticmethod
     def __is_html_error(status_code):
         "Checks if a status code is between 400-499 - HTML Status error"
         return (status_code//100) == 4
 
+    def __retry_delay(self, attempt, retry_after):
+        """
+        Seconds to wait before retrying a transient failure, as per the retry
+        policy. Records in retry_stats why there is no retry
+
+        Args:
+            attempt (int): Attempts already retried
+            retry_after (float): Seconds asked by the server, or None
+
+        Returns:
+            float: None if the policy allows no more attempts
+        """
+        policy = self.retry_policy
+        if attempt >= policy.max_retries:
+            if policy.max_retries > 0:
+                self.retry_stats.record('exhausted')
+            return None
+        if not policy.budget_allows(self.retry_stats):
+            self.retry_stats.record('budget_denied')
+            return None
+        return policy.delay(attempt, retry_after)
+
+    def __send(self, method, url, retry=True, **kwargs):
+        """
+        Sends a request, retrying transient failures as per the retry policy.
+        Only use it for requests that are safe to repeat: GET, PUT, DELETE
+        and POST with an Idempotency-Key. A Retry-After sent by the server is
+        honoured.
+
+        Args:
+            retry (bool): Set to False to send a single attempt
+
+        Returns:
+            requests.models.Response: Response of the last attempt
+        Raises:
+            requests.exceptions.RequestException: If the last attempt failed
+                to connect or timed out
+        """
+        policy = self.retry_policy
+        stats = self.retry_stats
+        stats.record('requests')
+        impact.record_request(url)
+        kwargs.setdefault('timeout', self.timeout)
+        _start = time.time()
+        _start_perf = time.perf_counter()
+        req = _exc = None
+        attempt = 0
+        try:
+            while True:
+                stats.record('attempts')
+                error = None
+                retry_after = None
+                try:
+                    req = self.__session().request(method, url, **kwargs)
+                    reason = req.status_code if policy.is_transient(req.status_code) else None
+                    retry_after = parse_retry_after(req.headers.get('Retry-After'))
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+                    reason = type(e).__name__
+
+                if reason is None or not retry:
+                    if attempt > 0:
+                        stats.record('recovered')
+                    break
+
+                stats.record_transient(reason)
+                _delay = self.__retry_delay(attempt, retry_after)
+                if _delay is None:
+                    break
+                time.sleep(_delay)
+                attempt += 1
+                stats.record('retries')
+
+            if error is not None:
+                raise error
+            return req
+        except Exception as e:
+            _exc = e
+            raise
+        finally:
+            if self.results_sink is not None:
+                self.results_sink.record_request(
+                    method, url, _start,
+                    req.status_code if _exc is None else None,
+                    (time.perf_counter() - _start_perf) * 1000, attempt + 1,
+                    type(_exc).__name__ if _exc is not None else None)
+
+    def __send_json(self, method, url, body, headers=None, **kwargs):
+        """
+        __send() with a body already encoded as JSON, sent as is
+
+        Args:
+            body (bytes): Such as rendered from a JsonTemplate
+            headers (dict): Extra request headers
+        """
+        _headers = {'Content-Type': 'application/json'}
+        if headers:
+            _headers.update(headers)
+        return self.__send(method, url, data=body, headers=_headers, **kwargs)
+
+    def __fetch_profiles(self, base_url, slowest, profile_ids):
+        """
+        Fetches the server side profiles of the slowest requests of a run,
+        records them on the results sink and writes their folded stacks to
+        the profiling directory of config.json, if any
+
+        Args:
+            base_url (str): Of the API that profiled the requests
+            slowest (list): (latency in us, index) as from openloop.run()
+            profile_ids (dict): index -> X-Profile-Id of the response
+        Returns:
+            list: The profiles found, as dicts. Profiles the server already
+                evicted are left out
+        """
+        _url_profile = UrlTemplate(base_url, self.API_PROFILES + "{id}")
+        _dir = self.profiling_config.get('dir')
+        if _dir:
+            os.makedirs(_dir, exist_ok=True)
+        profiles = []
+        for _latency, _index in slowest:
+            _id = profile_ids.get(_index)
+            if _id is None:
+                cprint_err(f"ERROR: Request {_index} has no {self.PROFILE_ID_HEADER}, it wasn't profiled")
+                continue
+            req = self.__send('GET', _url_profile(_id))
+            if req.status_code != 200:
+                cprint_err(f"ERROR: Profile {_id} not found: {req.status_code}")
+                continue
+            profile = req.json()
+            profile['client_ms'] = _latency / 1000
+            profiles.append(profile)
+            if self.results_sink is not None:
+                self.results_sink.record_profile(profile, profile['client_ms'])
+            if _dir:
+                with open(os.path.join(_dir, f"{_id}.folded"), 'w') as _f:
+                    _f.write(profile['folded'] + '\n')
+            cprint_info(f"INFO: {profile['method']} {profile['path']} took {profile['client_ms']:.1f} ms,"
+                        f" {profile['total_ms']:.1f} ms in the server: SQL {profile['sql_ms']:.1f} ms"
+                        f" ({profile['sql_count']} queries), marshalling {profile['marshal_ms']:.1f} ms."
+                        f" Profile {_id}")
+        return profiles
+
+    def __run_open_loop(self, url, schedule, profile_slowest=0):
+        """
+        Sends GET url on an open loop schedule and prints its figures
+
+        Args:
+            profile_slowest (int): Profile every request, and fetch the
+                profiles of this many of the slowest ones afterwards. The API
+                of url must run with --profile
+        Returns:
+            tuple: (openloop.run() result, profiles fetched)
+        """
+        _cfg = self.open_loop_config
+        _seed = self.__seed(None, _cfg)
+        cprint_info(f"INFO: Seed {_seed}")
+        times, bounds = openloop.schedule_from_config(schedule, _seed)
+        # Which request is slow is only known once answered, so all are profiled
+        _profile = {self.PROFILE_HEADER: "1"} if profile_slowest else {}
+        _profile_ids = {}
+
+        def _send(index):
+            req = self.__send('GET', url, retry=False, headers=_profile)
+            if profile_slowest:
+                _profile_ids[index] = req.headers.get(self.PROFILE_ID_HEADER)
+            return req.status_code
+
+        result = openloop.run(_send, times, _cfg.get('max_in_flight', 64), bounds, profile_slowest)
+        total = result['total']
+        _p50 = total.latency.percentile(50) / 1000
+        _p99 = total.latency.percentile(99) / 1000
+        cprint_info(f"INFO: {schedule.get('kind')} schedule, {total.latency.count} requests in"
+                    f" {result['elapsed']:.1f} s (scheduled {result['scheduled_elapsed']:.1f} s)")
+        cprint_info(f"INFO: Latency from intended send p50 {_p50:.1f} ms, p99 {_p99:.1f} ms."
+                    f" Service time p99 {total.service.percentile(99) / 1000:.1f} ms,"
+                    f" send lag p99 {total.lag.percentile(99) / 1000:.1f} ms")
+        cprint_info(f"INFO: Status codes {total.statuses}, errors {total.errors}")
+        for _step in result['steps']:
+            cprint_info(f"INFO: Step at {_step.rate:.0f}/s: {_step.latency.count} requests,"
+                        f" p99 {_step.latency.percentile(99) / 1000:.1f} ms, status codes {_step.statuses}")
+        profiles = self.__fetch_profiles(urljoin(url, '/'), result['slowest'], _profile_ids) if profile_slowest else []
+        return result, profiles
+
+    def __sync_client(self):
+        "sync.SyncClient on the change log of the API"
+        def _fetch_changes(since, limit, wait):
+            req = self.get_blog_changes(since, limit, wait)
+            req.raise_for_status()
+            return req.json()
+
+        def _fetch_scan():
+            _categories = self.get_categories()
+            _categories.raise_for_status()
+            # GET /blog/posts/ only serves its first page, of up to 50 posts
+            _posts = self.get_blog_posts({'per_page': 50})
+            _posts.raise_for_status()
+            _page = _posts.json()
+            if _page['total'] > len(_page['items']):
+                raise RuntimeError(f"Can't scan {_page['total']} posts, only the first page is served")
+            return _categories.json(), _page['items']
+        return sync.SyncClient(_fetch_changes, _fetch_scan, self.sync_config.get('limit', 100))
+
     def __get_category_from_id(self, id, resp):
         """
         Gets the blog category from GET api/blog/categories/ response 
@@ -120,50 +491,85 @@ class RestTester():
         Returns:
             requests.models.Response: Request object from requests library
         """
-        _url = urljoin(self.base_url, self.API_CATEGORIES)
-        return requests.get(_url)
+        return self.__send('GET', self.__url_categories())
     
-    def post_categories(self, id=None, name="null"):
+    def post_categories(self, id=None, name="null", idempotency_key=None):
         """
         Creates new blog category
         
         Args:
             id (int): Other data types allowed for testing purposes
             name (str): Other data types allowed for testing purposes
+            idempotency_key (str): Sent as Idempotency-Key so retries don't
+                create duplicates. A random one is used if not given
         Returns:
             requests.models.Response: Request object from requests library
         """
-        _url = urljoin(self.base_url, self.API_CATEGORIES)
-        data = {}
         if id != None:
-            data['id'] = id
-        data['name'] = name
+            data = self.CATEGORY_BODY_WITH_ID.render(id=id, name=name)
+        else:
+            data = self.CATEGORY_BODY.render(name=name)
+        if idempotency_key is None:
+            idempotency_key = uuid.uuid4().hex
+        _headers = {self.IDEMPOTENCY_HEADER: idempotency_key}
 
-        return requests.post(_url, json=data)
+        return self.__send_json('POST', self.__url_categories(), data, headers=_headers)
     
-    def delete_categories(self, id):
+    def delete_categories(self, id, if_match=None):
         """
         Deletes blog category
 
         Args:
             id (int)
+            if_match (str): ETag the category must still have to be deleted
         Returns:
             requests.models.Response: Request object from requests library
         """
-        _url = urljoin(self.base_url, self.API_CATEGORIES)
-        return requests.delete(urljoin(_url, str(id)))
+        _headers = {'If-Match': if_match} if if_match is not None else None
+        return self.__send('DELETE', self.__url_category(id), headers=_headers)
     
-    def get_category_by_id(self, id):
-        _url = urljoin(self.base_url, self.API_CATEGORIES)
-        return requests.get(urljoin(_url, str(id)))
-
-    def put_category_by_id(self, id, name):
-        _url = urljoin(self.base_url, self.API_CATEGORIES)
-        _url = urljoin(_url, str(id))
-        _data = {
-            'name': name
-        }
-        return requests.put(url=_url, json=_data)
+    def get_category_by_id(self, id, headers=None):
+        return self.__send('GET', self.__url_category(id), headers=headers)
+
+    def get_category_by_id_cached(self, id):
+        """
+        GETs a category, revalidating the last copy received with
+        If-None-Match. Updates revalidation_stats
+
+        Returns:
+            tuple: (requests.models.Response, dict) the response and the
+                category, taken from the cache when the server answered 304
+        """
+        _url = self.__url_category(id)
+        _cached = self.__etag_cache.get(_url)
+        _headers = {'If-None-Match': _cached[0]} if _cached else None
+        req = self.__send('GET', _url, headers=_headers)
+
+        _stats = self.revalidation_stats
+        _stats['requests'] += 1
+        _stats['bytes_received'] += len(req.content)
+        if req.status_code == self.SUC_HTTP_NOT_MODIFIED and _cached:
+            _stats['not_modified'] += 1
+            _stats['bytes_saved'] += len(_cached[1])
+            return req, json.loads(_cached[1])
+        if req.ok and 'ETag' in req.headers:
+            self.__etag_cache[_url] = (req.headers['ETag'], req.content)
+        return req, req.json() if req.ok else None
+
+    def put_category_by_id(self, id, name, if_match=None):
+        """
+        Updates blog category
+
+        Args:
+            id (int)
+            name (str)
+            if_match (str): ETag the category must still have to be updated
+        Returns:
+            requests.models.Response: Request object from requests library
+        """
+        _headers = {'If-Match': if_match} if if_match is not None else None
+        return self.__send_json('PUT', self.__url_category(id), self.CATEGORY_BODY.render(name=name),
+                                headers=_headers)
     
     def get_blog_posts(self, params=None):
         """
@@ -172,20 +578,38 @@ class RestTester():
         Returns:
             requests.models.Response: Request object from requests library
         """
-        _url = urljoin(self.base_url, self.API_POSTS)
-        return requests.get(_url, params=params)
+        return self.__send('GET', self.__url_posts(), params=params)
     
-    def post_blog_posts(self, payload):
+    def get_blog_posts_archive(self, year, month=None, day=None, params=None,
+                               headers=None, retry=True):
+        """
+        Returns list of blog posts from a specified year, month or day
+
+        Args:
+            headers (dict): Extra request headers
+            retry (bool): Set to False to send a single attempt
+        Returns:
+            requests.models.Response: Request object from requests library
+        """
+        _date = tuple(_ for _ in (year, month, day) if _ is not None)
+        return self.__send('GET', self.__url_archive[len(_date)](*_date), params=params,
+                           headers=headers, retry=retry)
+
+    def post_blog_posts(self, payload, idempotency_key=None):
         """
         Creates new blog post
         
         Args:
             payload (dict)
+            idempotency_key (str): Sent as Idempotency-Key so retries don't
+                create duplicates. A random one is used if not given
         Returns:
             requests.models.Response: Request object from requests library
         """
-        _url = urljoin(self.base_url, self.API_CATEGORIES)
-        return requests.post(_url, json=payload)
+        if idempotency_key is None:
+            idempotency_key = uuid.uuid4().hex
+        _headers = {self.IDEMPOTENCY_HEADER: idempotency_key}
+        return self.__send('POST', self.__url_posts(), json=payload, headers=_headers)
     
     def delete_blog_post(self, id):
         """
@@ -196,8 +620,97 @@ class RestTester():
         Returns:
             requests.models.Response: Request object from requests library
         """
-        _url = urljoin(self.base_url, self.API_CATEGORIES)
-        return requests.delete(urljoin(_url, str(id)))
+        return self.__send('DELETE', self.__url_post(id))
+
+    def get_blog_changes(self, since=0, limit=None, wait=None):
+        """
+        Returns the changes to categories and posts after seq since
+
+        Args:
+            limit (int): Most changes returned
+            wait (int): Seconds the server waits for a change if there is
+                none yet
+        Returns:
+            requests.models.Response: Request object from requests library
+        """
+        _params = {'since': since}
+        if limit is not None:
+            _params['limit'] = limit
+        if wait is not None:
+            _params['wait'] = wait
+        _timeout = self.timeout + wait if self.timeout is not None and wait else self.timeout
+        return self.__send('GET', self.__url_changes(), params=_params, timeout=_timeout)
+
+    def get_category_summary(self, id, limit=None, cursor=None, projection=None, headers=None):
+        """
+        Returns a category with its post count and a page of its posts,
+        latest first
+
+        Args:
+            limit (int): Posts per page
+            cursor (str): next_cursor of the previous page
+            projection (str): 'titles' or 'full'
+            headers (dict): Extra request headers
+        Returns:
+            requests.models.Response: Request object from requests library
+        """
+        _params = {_k: _v for _k, _v in (('limit', limit), ('cursor', cursor), ('projection', projection))
+                   if _v is not None}
+        return self.__send('GET', self.__url_summary(id), params=_params, headers=headers)
+
+    ###########################################################################
+    # Server process
+    def launch_server(self, server_name=None, extra_args=()):
+        """
+        Starts an instance of the API in a subprocess, without the reloader,
+        and waits until it answers a request
+
+        Args:
+            server_name (str): host:port to serve on. Defaults to
+                launch_server_name on the 'server' section of config.json
+            extra_args (list): More command line arguments for app.py
+        Returns:
+            tuple: (subprocess.Popen, float) the server process and its time
+                to first response in ms. The time is None if the server
+                didn't answer within launch_timeout seconds
+        """
+        _cfg = self.server_config
+        server_name = server_name or _cfg.get('launch_server_name', 'localhost:8890')
+        _app = os.path.abspath(_cfg.get('app_path', './rest_api_demo-techtest1.2/rest_api_demo/app.py'))
+        _cmd = [_cfg.get('python') or sys.executable, _app, '--server-name', server_name, '--no-reload',
+                '--database-uri', 'sqlite:///' + os.path.abspath(self.db_path)] + list(extra_args)
+        _url = urljoin(f"http://{server_name}/", self.API_CATEGORIES)
+
+        _start = time.perf_counter()
+        proc = subprocess.Popen(_cmd, cwd=os.path.dirname(_app),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                start_new_session=(os.name == 'posix'))
+        deadline = _start + _cfg.get('launch_timeout', 30)
+        while time.perf_counter() < deadline and proc.poll() is None:
+            try:
+                if requests.get(_url, timeout=1).ok:
+                    return proc, (time.perf_counter() - _start) * 1000
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.01)
+        return proc, None
+
+    @staticmethod
+    def stop_server(proc, timeout=10):
+        """
+        Stops a server started with launch_server, along with any process it
+        spawned
+        """
+        if proc.poll() is not None:
+            return
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGTERM)
+        else:
+            proc.terminate()
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
 
     ###########################################################################
     # Basic Tests
@@ -205,11 +718,19 @@ class RestTester():
     def reset_database_to_default(self):
         """
         Copies default database to the path of the database being used by the
-        API
+        API. Skipped if nothing wrote to it since, unless database_reset is
+        "copy"
         """
         _src = os.path.abspath(self.default_db)
         _dst = os.path.abspath(self.db_path)
-        copyfile(_src, _dst)
+        if self.db_reset == dbreset.COPY:
+            copyfile(_src, _dst)
+            return
+        with self._resets_lock:
+            if _src not in self._resets:
+                self._resets[_src] = dbreset.SkippingReset(_src)
+            _reset = self._resets[_src]
+        _reset.restore(_dst)
     ###########################################################################
     # Basic functional testing
     def test_blog_categories_GET(self):
@@ -219,18 +740,9 @@ class RestTester():
         if ret != self.ERR_NONE:
             return ret
         
-        expected_fields = ['id', 'name']
-        for item in req.json():
-            for _field in expected_fields:
-                if _field not in item:
-                    cprint_err(f"ERROR: Missing {_field} in response")
-                    ret = self.ERR_MISSING_FIELD
-            for _field in item:
-                if _field not in expected_fields:
-                    cprint_err(f"ERROR: Invalid field: {_field}")
-                    ret = self.ERR_INVALID_FIELD
+        ret = self.__check_model('category', req.json(), many=True)
         if ret == self.ERR_NONE:
-            print("No missing or invalid fields detected")
+            cprint_plain("No missing or invalid fields detected")
         return ret
 
     def test_blog_categories_POST(self, name, id=None):
@@ -252,12 +764,14 @@ class RestTester():
         req = self.get_category_by_id(id)
         cprint_info(f"INFO: GET for category id {id}. Status Code is {req.status_code}")
         ret = self.__check_request_status(req)
+        if ret == self.ERR_NONE:
+            ret = self.__check_model('category_with_posts', req.json())
         return ret
     
     ###########################################################################
     # Basic Positive Tests for blog categories
     def test_blog_categories_post__check_post__delete(self, name, id=None):
-        print(f"Posting Category: \"{name}\"")
+        cprint_plain(f"Posting Category: \"{name}\"")
         req = self.post_categories(id=id, name=name)
         cprint_info(f"\nINFO: POST. Status Code is {req.status_code}")
         ret = self.__check_request_status(req)
@@ -296,7 +810,7 @@ class RestTester():
             return ret
 
     def test_blog_categories_post__get_by_id__delete(self, id, name):
-        print(f"Posting Category: \"{name}\"")
+        cprint_plain(f"Posting Category: \"{name}\"")
         req = self.post_categories(id=id, name=name)
         cprint_info(f"\nINFO: POST. Status Code is {req.status_code}")
         ret = self.__check_request_status(req)
@@ -330,12 +844,12 @@ class RestTester():
             return ret
 
     def test_blog_categories_post__delete__get(self, id, name="Null"):
-        print(f"Posting Category: \"{name}\"")
+        cprint_plain(f"Posting Category: \"{name}\"")
         ret = self.test_blog_categories_POST(id=id, name=name)
         if ret != self.ERR_NONE:
             return ret
         
-        print(f"Deleting Category: \"{name}\"")
+        cprint_plain(f"Deleting Category: \"{name}\"")
         ret = self.test_blog_categories_DELETE(id)
         if ret != self.ERR_NONE:
             return ret
@@ -353,17 +867,17 @@ class RestTester():
         return ret
 
     def test_blog_categories_post__put__get__delete(self, id, name, new_name):
-        print(f"Posting category with id {id} and name {name}")
+        cprint_plain(f"Posting category with id {id} and name {name}")
         ret = self.test_blog_categories_POST(id=id, name=name)
         if ret != self.ERR_NONE:
             return ret
         
-        print(f"Updating Category with id {id} to {new_name}")
+        cprint_plain(f"Updating Category with id {id} to {new_name}")
         ret = self.test_blog_categories_PUT(id=id, new_name=new_name)
         if ret != self.ERR_NONE:
             return ret
         
-        print(f"Getting all categories")
+        cprint_plain("Getting all categories")
         req = self.get_categories()
         resp = req.json()
         categ = self.__get_category_from_id(id=id, resp=resp)
@@ -374,15 +888,61 @@ class RestTester():
             cprint_err(f"\nERROR: Updated name does not match: {new_name} != {categ['name']}\n")
             ret = self.ERR_INVALID_FIELD
 
-        print(f"Deleting Category id {id}")
+        cprint_plain(f"Deleting Category id {id}")
         del_ret = self.test_blog_categories_DELETE(id)
         if del_ret != self.ERR_NONE:
             cprint_err(f"\nERROR: Failed to delete blog category with id {id}")
 
         if ret == self.ERR_NONE and del_ret == self.ERR_NONE:
-            cprint_suc(f"Test succesful")
+            cprint_suc("Test succesful")
             return self.ERR_NONE
     
+    def test_blog_categories_post_idempotent(self, name):
+        """
+        POSTs the same category twice with the same Idempotency-Key and checks
+        that the retry is answered from the server's store instead of creating
+        a duplicate
+        """
+        req = self.get_categories()
+        ret = self.__check_request_status(req)
+        if ret != self.ERR_NONE:
+            return ret
+        ids_before = set(_.get('id') for _ in req.json())
+
+        key = uuid.uuid4().hex
+        first = self.post_categories(name=name, idempotency_key=key)
+        cprint_info(f"INFO: POST with key {key}. Status Code is {first.status_code}")
+        self.results['first_status'] = first.status_code
+        ret = self.__check_request_status(first)
+        if ret != self.ERR_NONE:
+            return ret
+        retry = self.post_categories(name=name, idempotency_key=key)
+        cprint_info(f"INFO: POST retry with key {key}. Status Code is {retry.status_code}")
+        self.results.update(retry_status=retry.status_code, replayed=retry.headers.get(self.REPLAYED_HEADER))
+
+        if retry.status_code != first.status_code:
+            cprint_err(f"ERROR: Retry returned {retry.status_code}, original returned {first.status_code}")
+            ret = self.ERR_WRONG_STATUS
+        if retry.headers.get(self.REPLAYED_HEADER) != 'true':
+            cprint_err("ERROR: Retry was not answered from the idempotency store")
+            ret = self.ERR_TEST_FAILED
+
+        req = self.get_categories()
+        get_ret = self.__check_request_status(req)
+        if get_ret != self.ERR_NONE:
+            return get_ret
+        new_ids = set(_.get('id') for _ in req.json()) - ids_before
+        self.results['new_categories'] = len(new_ids)
+        if len(new_ids) != 1:
+            cprint_err(f"ERROR: Expected 1 new category, found {len(new_ids)}: {sorted(new_ids)}")
+            ret = self.ERR_TEST_FAILED
+
+        for _id in new_ids:
+            self.delete_categories(_id)
+        if ret == self.ERR_NONE:
+            cprint_suc("Retry with the same Idempotency-Key did not create a duplicate")
+        return ret
+    
     ###########################################################################
     # Basic Negative Tests for blog categories
 
@@ -453,7 +1013,7 @@ class RestTester():
         _id_list = [_.get('id') for _ in resp]
         id = random.choice(_id_list)
 
-        print(f"Updating Category with id {id} to {invalid_name}")
+        cprint_plain(f"Updating Category with id {id} to {invalid_name}")
         put_ret = self.test_blog_categories_PUT(id=id, new_name=invalid_name)
         if self.__is_html_error(put_ret):
             cprint_suc("Request rejected successfully")
@@ -495,6 +1055,9 @@ class RestTester():
         if ret != self.ERR_NONE:
             return ret
         resp = req.json()
+        ret = self.__check_model('page_of_blog_posts', resp)
+        if ret != self.ERR_NONE:
+            return ret
             
         if resp['page'] != page:
             ret = self.ERR_INVALID_FIELD
@@ -505,7 +1068,7 @@ class RestTester():
         if resp['per_page']*resp['pages'] < resp['total']:
             ret = self.ERR_INVALID_FIELD
             cprint_err("ERROR: Post number calculations are off.")
-            cprint_err(f"Total amount of bigger than can be shown (per_page*pages)")
+            cprint_err("Total amount of bigger than can be shown (per_page*pages)")
         if resp['pages'] != ceil(resp['total']/resp['per_page']):
             ret = self.ERR_INVALID_FIELD
             cprint_err("ERROR: Pages calculations are off.")
@@ -514,3 +1077,1605 @@ class RestTester():
             cprint_err(f"Considering: Total={resp['total']}, per_page={resp['per_page']}")
         return ret
 
+    ###########################################################################
+    # Conditional requests
+    def test_category_revalidation(self, id, n_requests=20):
+        """
+        GETs a category repeatedly, revalidating with If-None-Match, and
+        reports how much of the traffic was saved by 304 responses
+        """
+        ret = self.ERR_NONE
+        _statuses = self.results['statuses'] = []
+        for i in range(n_requests):
+            req, categ = self.get_category_by_id_cached(id)
+            _statuses.append(req.status_code)
+            if req.status_code not in (self.SUC_HTTP_OK, self.SUC_HTTP_NOT_MODIFIED):
+                return self.__check_request_status(req)
+            if i > 0 and req.status_code != self.SUC_HTTP_NOT_MODIFIED:
+                cprint_err(f"ERROR: Unchanged category {id} was sent again in full")
+                ret = self.ERR_WRONG_STATUS
+
+        _stats = self.revalidation_stats
+        _total = _stats['bytes_received'] + _stats['bytes_saved']
+        _saved = 100 * _stats['bytes_saved'] / _total if _total else 0
+        cprint_info(f"INFO: {_stats['not_modified']}/{_stats['requests']} answered with 304. "
+                    f"{_stats['bytes_received']} bytes received, {_stats['bytes_saved']} "
+                    f"saved ({_saved:.1f}% of the traffic)")
+        return ret
+
+    def __append_tokens(self, id, w, n_updates, errors):
+        """
+        Writer w of test_category_concurrent_updates: appends n_updates
+        tokens to the name of category id, one read-modify-write with
+        If-Match at a time, retrying on 412. Stops at the first other status,
+        adding it to errors
+
+        Returns:
+            int: Updates rejected with 412
+        """
+        conflicts = 0
+        for k in range(n_updates):
+            while True:
+                req = self.get_category_by_id(id)
+                if not req.ok:
+                    errors.append(req.status_code)
+                    return conflicts
+                _name = req.json()['name'] + f"|{w}.{k}"
+                put = self.put_category_by_id(id, _name, if_match=req.headers['ETag'])
+                if put.status_code == self.SUC_HTTP_NO_CONTENT:
+                    break
+                if put.status_code != self.ERR_HTTP_PRECONDITION_FAILED:
+                    errors.append(put.status_code)
+                    return conflicts
+                conflicts += 1
+        return conflicts
+
+    def __check_concurrent_updates(self, id, initial_version, expected, conflicts):
+        """
+        Checks that the name of category id has every token in expected and
+        that its version moved from initial_version
+        """
+        req = self.get_category_by_id(id)
+        ret = self.__check_request_status(req)
+        if ret != self.ERR_NONE:
+            return ret
+        _tokens = set(req.json()['name'].split('|')[1:])
+        _version = int(req.headers['ETag'].strip('"'))
+        cprint_info(f"INFO: {len(expected)} updates, {conflicts} rejected with 412 and retried")
+        self.results.update(lost_updates=sorted(expected - _tokens), version=_version,
+                            initial_version=initial_version)
+
+        if expected - _tokens:
+            cprint_err(f"ERROR: Lost updates: {sorted(expected - _tokens)}")
+            ret = self.ERR_TEST_FAILED
+        if _version == initial_version:
+            cprint_err(f"ERROR: Version is still {_version} after {len(expected)} updates")
+            ret = self.ERR_INVALID_FIELD
+        if ret == self.ERR_NONE:
+            cprint_suc("No update was lost")
+        return ret
+
+    def test_category_concurrent_updates(self, id, n_writers=4, n_updates=5):
+        """
+        Several writers append their own token to the same category's name
+        at the same time, using read-modify-write with If-Match. Retries on
+        412. Checks that no update was lost: every token is in the final
+        name, and the version changed. Versions come from a counter shared by
+        every write, so other writes may move it by more than one per update
+
+        Args:
+            id (int): Category to update, must exist
+            n_writers (int): Concurrent writers
+            n_updates (int): Updates made by each writer
+        """
+        req = self.get_category_by_id(id)
+        ret = self.__check_request_status(req)
+        if ret != self.ERR_NONE:
+            return ret
+        initial_version = int(req.headers['ETag'].strip('"'))
+
+        conflicts = 0
+        errors = []
+        with ThreadPoolExecutor(max_workers=n_writers) as _pool:
+            _futures = [_pool.submit(self.__append_tokens, id, w, n_updates, errors) for w in range(n_writers)]
+        for _future in _futures:
+            try:
+                conflicts += _future.result()
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+        self.results.update(errors=errors, conflicts=conflicts)
+        if errors:
+            cprint_err(f"ERROR: Writers failed with {errors}")
+            return self.ERR_REQ_FAILED
+
+        _expected = set(f"{w}.{k}" for w in range(n_writers) for k in range(n_updates))
+        return self.__check_concurrent_updates(id, initial_version, _expected, conflicts)
+
+    def test_category_recreated_etag(self, id, name):
+        """
+        Deletes a category and creates it again with the same id and name,
+        then sends the ETag of the deleted one. Checks that it doesn't match
+        the new category: GET with If-None-Match gets 200 with another ETag,
+        PUT and DELETE with If-Match get 412
+
+        Args:
+            id (int): Free id to create the category with
+        """
+        _res = self.results
+        req = self.post_categories(id, name)
+        _res['create_status'] = req.status_code
+        if req.status_code != self.SUC_HTTP_CREATED:
+            cprint_err(f"ERROR: Creating category {id} returned {req.status_code}")
+            return self.ERR_WRONG_STATUS
+        _old_etag = _res['old_etag'] = self.get_category_by_id(id).headers.get('ETag')
+        req = self.delete_categories(id)
+        _res['delete_status'] = req.status_code
+        if req.status_code != self.SUC_HTTP_NO_CONTENT:
+            cprint_err(f"ERROR: Deleting category {id} returned {req.status_code}")
+            return self.ERR_WRONG_STATUS
+        req = self.post_categories(id, name)
+        _res['recreate_status'] = req.status_code
+        if req.status_code != self.SUC_HTTP_CREATED:
+            cprint_err(f"ERROR: Creating category {id} again returned {req.status_code}")
+            return self.ERR_WRONG_STATUS
+
+        ret = self.ERR_NONE
+        req = self.get_category_by_id(id, headers={'If-None-Match': _old_etag})
+        _res.update(get_status=req.status_code, new_etag=req.headers.get('ETag'))
+        if req.status_code != self.SUC_HTTP_OK:
+            cprint_err(f"ERROR: GET with the ETag {_old_etag} of the deleted category returned {req.status_code}")
+            ret = self.ERR_WRONG_STATUS
+        elif req.headers.get('ETag') == _old_etag:
+            cprint_err(f"ERROR: The new category has the ETag {_old_etag} of the deleted one")
+            ret = self.ERR_INVALID_FIELD
+        req = self.put_category_by_id(id, f"{name} renamed", if_match=_old_etag)
+        _res['put_status'] = req.status_code
+        if req.status_code != self.ERR_HTTP_PRECONDITION_FAILED:
+            cprint_err(f"ERROR: PUT with the ETag of the deleted category returned {req.status_code}")
+            ret = self.ERR_WRONG_STATUS
+        req = self.delete_categories(id, if_match=_old_etag)
+        _res['conditional_delete_status'] = req.status_code
+        if req.status_code != self.ERR_HTTP_PRECONDITION_FAILED:
+            cprint_err(f"ERROR: DELETE with the ETag of the deleted category returned {req.status_code}")
+            ret = self.ERR_WRONG_STATUS
+        self.delete_categories(id)
+        if ret == self.ERR_NONE:
+            cprint_suc(f"The ETag {_old_etag} of the deleted category didn't match the new one")
+        return ret
+
+    def test_category_if_match_tags(self, id, name):
+        """
+        Creates a category and PUTs it with If-Match headers holding a weak
+        tag or several tags. Checks that a weak tag never matches (412) and
+        that a list matches when any of its tags is current (204)
+
+        Args:
+            id (int): Free id to create the category with
+        """
+        _res = self.results
+        req = self.post_categories(id, name)
+        _res['create_status'] = req.status_code
+        if req.status_code != self.SUC_HTTP_CREATED:
+            cprint_err(f"ERROR: Creating category {id} returned {req.status_code}")
+            return self.ERR_WRONG_STATUS
+
+        ret = self.ERR_NONE
+        _statuses = _res['statuses'] = {}
+        for _kind, _expected in (('weak', self.ERR_HTTP_PRECONDITION_FAILED), ('stale first', self.SUC_HTTP_NO_CONTENT),
+                                 ('current first', self.SUC_HTTP_NO_CONTENT)):
+            _etag = self.get_category_by_id(id).headers.get('ETag')
+            _stale = '"{0}"'.format(int(_etag.strip('"')) - 1)
+            _if_match = {'weak': f"W/{_etag}", 'stale first': f"{_stale}, {_etag}",
+                         'current first': f"{_etag}, {_stale}"}[_kind]
+            req = self.put_category_by_id(id, f"{name} {_kind}", if_match=_if_match)
+            _statuses[_kind] = req.status_code
+            cprint_info(f"INFO: PUT with If-Match {_if_match}. Status Code is {req.status_code}")
+            if req.status_code != _expected:
+                cprint_err(f"ERROR: Expected {_expected} for If-Match {_if_match}")
+                ret = self.ERR_WRONG_STATUS
+        self.delete_categories(id)
+        if ret == self.ERR_NONE:
+            cprint_suc("Weak tags didn't match and lists of tags matched their current version")
+        return ret
+
+    ###########################################################################
+    # Start up
+    def test_server_time_to_first_response(self, target_ms=None):
+        """
+        Launches a fresh API process and checks that it answers its first
+        request within target_ms
+        """
+        if target_ms is None:
+            target_ms = self.server_config.get('ttfr_target_ms', 3000)
+        proc, ttfr = self.launch_server()
+        self.stop_server(proc)
+        self.results.update(ttfr_ms=ttfr, target_ms=target_ms)
+        if ttfr is None:
+            cprint_err(f"ERROR: Server didn't answer within {self.server_config.get('launch_timeout', 30)} s")
+            return self.ERR_REQ_FAILED
+        cprint_info(f"INFO: Time to first response {ttfr:.0f} ms, target {target_ms} ms")
+        if ttfr > target_ms:
+            cprint_err("ERROR: Time to first response is above target")
+            return self.ERR_TEST_FAILED
+        cprint_suc("Server answered within target")
+        return self.ERR_NONE
+
+    ###########################################################################
+    # API spec
+    def test_api_spec(self):
+        """
+        Checks that swagger.json is cacheable and revalidates to 304, that the
+        routes used by the tester are in it, and that a body generated from
+        the spec is accepted by the API
+        """
+        _res = self.results
+        _url = urljoin(self.base_url, ApiSpec.SPEC_PATH)
+        req = self.__send('GET', _url)
+        _res.update(status=req.status_code, etag=req.headers.get('ETag'),
+                    cache_control=req.headers.get('Cache-Control', ''))
+        ret = self.__check_request_status(req)
+        if ret != self.ERR_NONE:
+            return ret
+        _etag = req.headers.get('ETag')
+        cprint_info(f"INFO: ETag {_etag}, Cache-Control {req.headers.get('Cache-Control')}")
+        if _etag is None or 'max-age' not in req.headers.get('Cache-Control', ''):
+            cprint_err("ERROR: swagger.json is missing its caching headers")
+            return self.ERR_INVALID_FIELD
+
+        req = self.__send('GET', _url, headers={'If-None-Match': _etag})
+        cprint_info(f"INFO: Revalidation. Status Code is {req.status_code}")
+        _res['revalidation_status'] = req.status_code
+        if req.status_code != self.SUC_HTTP_NOT_MODIFIED:
+            cprint_err(f"ERROR: Expected {self.SUC_HTTP_NOT_MODIFIED} for an unchanged spec")
+            return self.ERR_WRONG_STATUS
+
+        _res['missing_paths'] = []
+        for _path in (self.API_CATEGORIES, self.API_POSTS):
+            if not self.spec.has_path(_path):
+                cprint_err(f"ERROR: {_path} is not in the spec")
+                _res['missing_paths'].append(_path)
+                ret = self.ERR_TEST_FAILED
+        if ret != self.ERR_NONE:
+            return ret
+
+        self.reset_database_to_default()
+        _body = self.spec.example('category')
+        req = self.__send('POST', self.__url_categories(), json=_body,
+                          headers={self.IDEMPOTENCY_HEADER: str(uuid.uuid4())})
+        cprint_info(f"INFO: POST of generated body {_body}. Status Code is {req.status_code}")
+        _res['generated_post_status'] = req.status_code
+        ret = self.__check_request_status(req)
+        self.reset_database_to_default()
+        if ret == self.ERR_NONE:
+            cprint_suc("Spec is cached and matches the routes of the tester")
+        return ret
+
+    ###########################################################################
+    # Fuzzing
+    def __fuzz_send(self):
+        "send() for the Fuzzer, through the retrying, pooled client"
+        def _send(method, path, query, body, has_body):
+            _headers = {}
+            _kwargs = {'params': query}
+            if has_body:
+                # Not json=, None must be sent as null
+                _headers['Content-Type'] = 'application/json'
+                _kwargs['data'] = json.dumps(body)
+            if method == 'POST':
+                _headers[self.IDEMPOTENCY_HEADER] = uuid.uuid4().hex
+            try:
+                return self.__send(method, urljoin(self.base_url, path), headers=_headers, **_kwargs).status_code
+            except requests.exceptions.RequestException:
+                return None
+        return _send
+
+    def fuzzer(self, workers=None, seed=None):
+        "Fuzzer for the API, set up from the fuzz section of config.json"
+        _cfg = self.fuzz_config
+        return fuzz.Fuzzer(self.spec, self.__fuzz_send(),
+                           workers=workers or _cfg.get('workers', 8),
+                           seed=self.__seed(seed, _cfg),
+                           max_shrink_steps=_cfg.get('max_shrink_steps', 200))
+
+    def test_fuzz_invalid_input(self, n_cases=None, workers=None, seed=None):
+        """
+        Sends n_cases generated cases concurrently. Fails if one of them
+        fails in a way not saved in the reproducers or new_reproducers files
+        yet. New failures are shrunk and added to new_reproducers, which is
+        not tracked by git
+
+        Args:
+            n_cases (int): Cases to send
+            workers (int): Cases in flight at once
+            seed (int): Seed of the run, to repeat a previous one
+        """
+        _cfg = self.fuzz_config
+        n_cases = n_cases or _cfg.get('cases', 400)
+        _path = _cfg.get('new_reproducers')
+        _saved = fuzz.load_reproducers(_cfg.get('reproducers')) + fuzz.load_reproducers(_path)
+
+        self.reset_database_to_default()
+        fuzzer = self.fuzzer(workers, seed)
+        result = fuzzer.run(n_cases, fuzz.known_signatures(_saved))
+        self.reset_database_to_default()
+
+        cprint_info(f"INFO: Seed {result['seed']}. {result['cases']} cases in {result['elapsed']:.1f} s,"
+                    f" {result['cases_per_s'] * 60:.0f} cases per minute with {fuzzer.workers} workers")
+        cprint_info(f"INFO: Status codes {result['statuses']}, {result['failed']} failed,"
+                    f" {result['throttled']} throttled")
+        self.results['new_failures'] = [_case['signature'] for _case in result['failures']]
+        for _case in result['failures']:
+            cprint_err(f"ERROR: {_case['signature']} -> {_case['status']},"
+                       f" shrunk in {_case['shrink_steps']} requests")
+            cprint_err(f"    {_case['method']} {fuzzer.path(_case)} query={_case['query']}"
+                       f" body={json.dumps(_case.get('body')) if 'body' in _case else '-'}")
+        if not result['failures']:
+            cprint_suc("No new failures")
+            return self.ERR_NONE
+        if _path:
+            _added = fuzz.save_reproducers(_path, result['failures'])
+            cprint_info(f"INFO: {_added} reproducers saved to {_path}")
+        return self.ERR_TEST_FAILED
+
+    def test_fuzz_reproducer(self, case):
+        """
+        Replays a saved reproducer. Passes once the bug it found is fixed
+        """
+        self.reset_database_to_default()
+        _status, _failure = self.fuzzer(workers=1).execute(case)
+        self.reset_database_to_default()
+        cprint_info(f"INFO: {case['signature']}. Status Code is {_status}")
+        self.results.update(status=_status, failure=_failure)
+        if _failure is not None:
+            cprint_err(f"ERROR: Still fails: {_failure}")
+            return self.ERR_TEST_FAILED
+        cprint_suc("Reproducer passes")
+        return self.ERR_NONE
+
+    ###########################################################################
+    # Concurrency stress
+    def __stress_send(self):
+        """
+        send() for stress.Stress, single attempts without retries, as a
+        retried write could be applied twice
+        """
+        _url = self.__url_categories()
+
+        def _send(client, op, id, name):
+            _item_url = self.__url_category(id)
+            try:
+                if op == stress.CREATE:
+                    req = self.__send_json('POST', _url, self.CATEGORY_BODY_WITH_ID.render(id=id, name=name),
+                                           retry=False)
+                elif op == stress.UPDATE:
+                    req = self.__send_json('PUT', _item_url, self.CATEGORY_BODY.render(name=name),
+                                           retry=False)
+                elif op == stress.DELETE:
+                    req = self.__send('DELETE', _item_url, retry=False)
+                else:
+                    req = self.__send('GET', _item_url, retry=False)
+            except requests.exceptions.RequestException:
+                return None, None
+            value = None
+            if op == stress.READ and req.status_code == self.SUC_HTTP_OK:
+                value = req.json().get('name')
+            return req.status_code, value
+        return _send
+
+    def test_category_stress(self, duration=None, n_clients=None, n_ids=None, seed=None):
+        """
+        Runs concurrent clients sending interleaved POST, PUT, DELETE and GET
+        on the same few category ids, then checks that the history of their
+        requests is linearizable. Fails on any non linearizable id, 5xx or
+        request left unanswered
+
+        Args:
+            duration (float): Seconds to keep sending requests
+            n_clients (int): Concurrent clients
+            n_ids (int): Category ids the clients race on
+            seed (int): Seed of the run, to repeat the choices of the clients
+        """
+        _cfg = self.stress_config
+        duration = duration if duration is not None else _cfg.get('duration', 5)
+        n_clients = n_clients or _cfg.get('n_clients', 8)
+        n_ids = n_ids or _cfg.get('n_ids', 4)
+        seed = self.__seed(seed, _cfg)
+
+        runner = stress.Stress(self.__stress_send(), [], n_clients, seed)
+        # Ids far from the ones in the default database, absent at the start
+        _base = random.Random(runner.seed).randrange(10 ** 6, 10 ** 9)
+        runner.ids = list(range(_base, _base + n_ids))
+
+        self.reset_database_to_default()
+        result = runner.run(duration)
+        self.reset_database_to_default()
+        history = runner.history
+        if _cfg.get('history_file'):
+            stress.save_history(_cfg['history_file'], history, result['start'])
+
+        cprint_info(f"INFO: Seed {result['seed']}. {result['ops']} requests in {result['elapsed']:.1f} s,"
+                    f" {result['ops_per_s']:.0f} per second from {n_clients} clients on ids {runner.ids}")
+        for _op, _figures in sorted(stress.summary(history).items()):
+            _latencies = _figures['latencies']
+            cprint_info(f"INFO: {_op}: {_figures['count']} requests, p50 {self.__percentile(_latencies, 50):.1f} ms,"
+                        f" p99 {self.__percentile(_latencies, 99):.1f} ms, status codes {_figures['statuses']}")
+
+        ret = self.ERR_NONE
+        if not history:
+            cprint_err("ERROR: No requests were sent")
+            ret = self.ERR_TEST_FAILED
+        _anomalies = stress.anomalies(history)
+        self.results.update(requests=len(history), anomalies=len(_anomalies), not_linearizable=[])
+        if _anomalies:
+            cprint_err(f"ERROR: {len(_anomalies)} requests got a server error or no response")
+            for _record in _anomalies[:10]:
+                cprint_err(f"    {stress.format_record(_record, result['start'])}")
+            ret = self.ERR_WRONG_STATUS
+
+        if not self.__check_linearizable(history, result['start']):
+            ret = self.ERR_TEST_FAILED
+        if ret == self.ERR_NONE:
+            cprint_suc("History is linearizable, no server errors")
+        return ret
+
+    def __check_linearizable(self, history, start):
+        """
+        Checks the history of each id of test_category_stress() is
+        linearizable, printing the request that can't be placed otherwise
+
+        Returns:
+            bool: False if some id is not linearizable
+        """
+        ok = True
+        _checked = stress.check_history(history, max_steps=self.stress_config.get('max_search_steps', 1000000))
+        for _id, _check in _checked.items():
+            if _check['ok'] is None:
+                cprint(f"WARNING: History of id {_id} was not fully checked"
+                       f" after {_check['steps']} steps", cPrint.YELLOW)
+            elif not _check['ok']:
+                cprint_err(f"ERROR: History of id {_id} is not linearizable, this request can't be placed:")
+                self.results['not_linearizable'].append(_id)
+                _records = _check['records']
+                for _record in stress.excerpt(_records, _check['stuck']):
+                    _mark = ">>" if _record is _records[_check['stuck']] else "  "
+                    cprint_err(f"  {_mark} {stress.format_record(_record, start)}")
+                ok = False
+        return ok
+
+    def __change_feed_write(self, write, categories, lock, posts):
+        """
+        Sends one write of test_change_feed_sync(), and keeps the list of
+        categories up to date
+
+        Args:
+            write (tuple): (operation, id for a new category, number in
+                [0, 1) picking the category or post written)
+            categories (list): Ids of the categories that exist, guarded by lock
+            posts (list): Ids of the posts that exist, as far as known
+        Returns:
+            requests.models.Response
+        """
+        _op, _new_id, _pick = write
+        with lock:
+            _category = categories[int(_pick * len(categories))] if categories else _new_id
+        _post = posts[int(_pick * len(posts))] if posts else 1
+        _post_body = self.POST_BODY.render(title=random_text(20), body=random_text(100), category_id=_category)
+        _send = {
+            'create_category': lambda: self.__send_json(
+                'POST', self.__url_categories(), self.CATEGORY_BODY_WITH_ID.render(id=_new_id, name=random_text(10)),
+                retry=False),
+            'create_post': lambda: self.__send_json('POST', self.__url_posts(), _post_body, retry=False),
+            'update_post': lambda: self.__send_json('PUT', self.__url_post(_post), _post_body, retry=False),
+            'update_category': lambda: self.__send_json('PUT', self.__url_category(_category),
+                                                        self.CATEGORY_BODY.render(name=random_text(10)), retry=False),
+            'delete_post': lambda: self.__send('DELETE', self.__url_post(_post), retry=False),
+            'delete_category': lambda: self.__send('DELETE', self.__url_category(_category), retry=False),
+        }[_op]
+        req = _send()
+        with lock:
+            if _op == 'create_category' and req.status_code == self.SUC_HTTP_CREATED:
+                categories.append(_new_id)
+            elif _op == 'delete_category' and req.status_code == self.SUC_HTTP_NO_CONTENT:
+                categories.remove(_category)
+        return req
+
+    def __check_change_feed(self, client, statuses):
+        """
+        Checks that no write of test_change_feed_sync() got a server error,
+        and that the mirror of the client matches a full scan
+        """
+        cprint_info(f"INFO: Writes by outcome: {statuses}")
+        cprint_info(f"INFO: Sync client: {client.stats}, at seq {client.mirror.seq}")
+
+        ret = self.ERR_NONE
+        _errors = [_key for _key in statuses if _key[1] >= 500]
+        self.results['server_errors'] = _errors
+        if _errors:
+            cprint_err(f"ERROR: Writes failed with server errors: {_errors}")
+            ret = self.ERR_WRONG_STATUS
+        _categories_scan, _posts_scan = client.fetch_scan()
+        _diff = sync.verify(client.mirror, _categories_scan, _posts_scan)
+        self.results['mirror_diff'] = _diff
+        for _line in _diff[:20]:
+            cprint_err(f"ERROR: {_line}")
+        if _diff:
+            cprint_err(f"ERROR: The mirror differs from a full scan in {len(_diff)} items")
+            ret = self.ERR_TEST_FAILED
+        if ret == self.ERR_NONE:
+            cprint_suc(f"Mirror of {len(_categories_scan)} categories and {len(_posts_scan)} posts"
+                       f" matches a full scan")
+        return ret
+
+    def test_change_feed_sync(self, n_writes=None, n_writers=None, seed=None):
+        """
+        Follows the change log with a sync client while concurrent writers
+        create, update and delete categories and posts. Once they are done
+        and the client caught up, checks that its mirror matches a full scan
+
+        Args:
+            n_writes (int): Writes sent by all writers
+            n_writers (int): Concurrent writers
+            seed (int): Seed of the writes picked
+        """
+        _cfg = self.sync_config
+        n_writes = n_writes or _cfg.get('n_writes', 60)
+        n_writers = n_writers or _cfg.get('n_writers', 4)
+        seed = self.__seed(seed, _cfg)
+        cprint_info(f"INFO: Seed {seed}")
+        _rng = random.Random(seed)
+        _ops = ['create_category'] * 2 + ['create_post'] * 3 + ['update_post'] * 2 + \
+            ['update_category', 'delete_post', 'delete_category']
+        # Categories get ids of their own, as POST doesn't return the id
+        _first_id = 1000 + _rng.randrange(1000) * 100
+        _plan = [(_rng.choice(_ops), _first_id + _i, _rng.random()) for _i in range(n_writes)]
+        _categories = [1, 2, 3]
+        _lock = threading.Lock()
+        statuses = {}
+
+        client = self.__sync_client()
+        client.bootstrap()
+        client.start(_cfg.get('wait', 1))
+
+        def _write(index):
+            req = self.__change_feed_write(_plan[index], _categories, _lock, sorted(client.mirror.items[sync.POST]))
+            with _lock:
+                _key = (_plan[index][0], req.status_code)
+                statuses[_key] = statuses.get(_key, 0) + 1
+
+        try:
+            with ThreadPoolExecutor(max_workers=n_writers) as _pool:
+                list(_pool.map(_write, range(n_writes)))
+        finally:
+            client.stop()
+        client.catch_up()
+        return self.__check_change_feed(client, statuses)
+
+    def __median_ms(self, send, n_requests):
+        "Median latency of n_requests calls of send(), in ms"
+        _latencies = []
+        for _ in range(n_requests):
+            _start = time.perf_counter()
+            send()
+            _latencies.append((time.perf_counter() - _start) * 1000)
+        return self.__percentile(_latencies, 50)
+
+    def __summary_pages(self, id, limit, size):
+        """
+        Walks the summary of category id, of size posts, limit posts per page
+        following next_cursor
+
+        Returns:
+            list: Pages walked, None if one of them failed
+        """
+        pages = []
+        _cursor = None
+        while True:
+            req = self.get_category_summary(id, limit, _cursor)
+            if req.status_code != self.SUC_HTTP_OK:
+                cprint_err(f"ERROR: Summary page {len(pages)} returned {req.status_code}")
+                self.results['summary_status'] = req.status_code
+                return None
+            _page = req.json()
+            pages.append(_page)
+            _cursor = _page['next_cursor']
+            if _cursor is None or len(pages) > size // limit + 1:
+                return pages
+
+    def __check_summary_pages(self, id, limit, size, pages):
+        """
+        Checks the pages of the summary of category id, of size posts, and
+        its first page with projection=full against the full category
+        """
+        ret = self.ERR_NONE
+        _res = self.results
+        _full = self.get_category_by_id(id).json()
+        _expected = sorted(_full['posts'], key=lambda _p: (_p['pub_date'], _p['id']), reverse=True)
+        _walked = [_post for _page in pages for _post in _page['posts']]
+        _titles = [{_k: _p[_k] for _k in ('id', 'title', 'pub_date')} for _p in _expected]
+        if _walked != _titles:
+            cprint_err(f"ERROR: {size} posts: pages of the summary differ from the full category")
+            _res['pages_differ'].append(size)
+            ret = self.ERR_TEST_FAILED
+        if any(_page['post_count'] != len(_expected) for _page in pages):
+            cprint_err(f"ERROR: {size} posts: post_count {pages[0]['post_count']},"
+                       f" the category has {len(_expected)}")
+            _res['wrong_post_count'].append(size)
+            ret = self.ERR_INVALID_FIELD
+        _first_full = self.get_category_summary(id, limit, projection='full').json()
+        if _first_full['posts'] != _expected[:limit]:
+            cprint_err(f"ERROR: {size} posts: first page with projection=full differs from the full"
+                       f" category")
+            _res['full_projection_differs'].append(size)
+            ret = self.ERR_TEST_FAILED
+        return ret
+
+    def test_category_summary(self, sizes=None, limit=None, body_chars=None, n_requests=None,
+                              max_growth=None):
+        """
+        Grows a new category to each of sizes posts and compares its summary
+        with the full category: the post count, and every page walked with
+        next_cursor against the full list of posts sorted latest first. Also
+        checks that the first page of the summary takes about as long at the
+        largest size as at the smallest
+
+        Args:
+            sizes (list): Post counts to check at, increasing
+            limit (int): Posts per page of the summary
+            body_chars (int): Length of the body of each post
+            n_requests (int): GETs timed per size, of each kind
+            max_growth (float): Most the median time of the first page may
+                grow from the smallest size to the largest
+        """
+        _cfg = self.summary_config
+        sizes = sizes or _cfg.get('sizes', [25, 200, 800])
+        limit = limit or _cfg.get('limit', 10)
+        body_chars = body_chars or _cfg.get('body_chars', 2000)
+        n_requests = n_requests or _cfg.get('n_requests', 15)
+        max_growth = max_growth if max_growth is not None else _cfg.get('max_growth', 2.0)
+        _run = uuid.uuid4().hex[:8]
+        _id = 1000 + random.randrange(1000)
+        ret = self.ERR_NONE
+        _res = self.results
+        _res.update(pages_differ=[], wrong_post_count=[], full_projection_differs=[])
+        req = self.post_categories(_id, f"Summary {_run}")
+        _res['create_status'] = req.status_code
+        if req.status_code != self.SUC_HTTP_CREATED:
+            cprint_err(f"ERROR: Creating category {_id} returned {req.status_code}")
+            return self.ERR_WRONG_STATUS
+        timings = []
+        _n_posts = 0
+        for _size in sizes:
+            for _n in range(_n_posts, _size):
+                _body = self.POST_BODY.render(title=f"Post {_n} {random_text(10)}",
+                                              body=random_text(body_chars), category_id=_id)
+                req = self.__send_json('POST', self.__url_posts(), _body, retry=False)
+                if req.status_code != self.SUC_HTTP_CREATED:
+                    cprint_err(f"ERROR: Creating post {_n} returned {req.status_code}")
+                    _res['post_status'] = req.status_code
+                    return self.ERR_WRONG_STATUS
+            _n_posts = _size
+
+            _summary_ms = self.__median_ms(
+                lambda: self.get_category_summary(_id, limit), n_requests)
+            _full_ms = self.__median_ms(lambda: self.get_category_by_id(_id), n_requests)
+            timings.append((_size, _summary_ms, _full_ms))
+            cprint_info(f"INFO: {_size} posts: first page {_summary_ms:.1f} ms, full category {_full_ms:.1f} ms")
+
+            _pages = self.__summary_pages(_id, limit, _size)
+            if _pages is None:
+                return self.ERR_WRONG_STATUS
+            _ret = self.__check_summary_pages(_id, limit, _size, _pages)
+            ret = _ret if _ret != self.ERR_NONE else ret
+
+        _growth = timings[-1][1] / timings[0][1]
+        _res.update(growth=_growth, max_growth=max_growth)
+        cprint_info(f"INFO: From {sizes[0]} to {sizes[-1]} posts the first page took x{_growth:.2f},"
+                    f" the full category x{timings[-1][2] / timings[0][2]:.2f}")
+        if _growth > max_growth:
+            cprint_err(f"ERROR: The first page grew x{_growth:.2f} slower, over x{max_growth:g}")
+            ret = self.ERR_TEST_FAILED
+        if ret == self.ERR_NONE:
+            cprint_suc(f"Summary of up to {sizes[-1]} posts matches the full category")
+        return ret
+
+    def __replica_reads(self, routes, n_requests, ages):
+        """
+        Times n_requests reads of each route from the replica and from the
+        database, with Cache-Control: no-cache, and checks that the first of
+        each return the same. Adds the X-Replica-Age of replica reads to ages
+        """
+        ret = self.ERR_NONE
+        for _name, _url in routes.items():
+            _latencies = {'replica': [], 'database': []}
+            for _i in range(n_requests):
+                _responses = {}
+                for _kind, _headers in (('replica', None), ('database', {'Cache-Control': 'no-cache'})):
+                    _start = time.perf_counter()
+                    _responses[_kind] = self.__send('GET', _url, headers=_headers)
+                    _latencies[_kind].append((time.perf_counter() - _start) * 1000)
+                ages.append(float(_responses['replica'].headers.get('X-Replica-Age', 'nan')))
+                if _i == 0 and _responses['database'].content != _responses['replica'].content:
+                    cprint_err(f"ERROR: {_name}: the replica returned {_responses['replica'].content[:200]},"
+                               f" the database {_responses['database'].content[:200]}")
+                    self.results['routes_differ'].append(_name)
+                    ret = self.ERR_TEST_FAILED
+            _p = {_kind: (self.__percentile(_l, 50), self.__percentile(_l, 99))
+                  for _kind, _l in _latencies.items()}
+            cprint_info(f"INFO: {_name}: replica p50 {_p['replica'][0]:.1f} ms p99 {_p['replica'][1]:.1f} ms,"
+                        f" database p50 {_p['database'][0]:.1f} ms p99 {_p['database'][1]:.1f} ms")
+        return ret
+
+    def __replica_rename_lag(self, id, name, url, written, max_staleness, ages):
+        """
+        Polls the categories at url until category id shows name, given to
+        it at written (time.perf_counter()). Adds the X-Replica-Age of each
+        read to ages
+
+        Returns:
+            tuple: (ms until the name was seen, None if not seen within 10
+                times max_staleness, reads started over max_staleness after
+                written that missed it)
+        """
+        _poll = self.replica_config.get('poll_interval', 0.01)
+        missed = 0
+        while True:
+            _start = time.perf_counter()
+            req = self.__send('GET', url)
+            ages.append(float(req.headers.get('X-Replica-Age', 'nan')))
+            if any(_c['id'] == id and _c['name'] == name for _c in req.json()):
+                return (_start - written) * 1000, missed
+            if _start - written > max_staleness:
+                missed += 1
+            if _start - written > max_staleness * 10:
+                return None, missed
+            time.sleep(_poll)
+
+    def __check_replica(self, ages, lags, violations, max_staleness, ret):
+        """
+        Checks that every read was served by the replica, at most
+        max_staleness behind, and that no read missed a rename older than
+        that. Returns ret unless one of these fails
+        """
+        lags.sort()
+        self.results.update(reads_not_from_replica=sum(1 for _age in ages if _age != _age),
+                            max_age_ms=max((_age for _age in ages if _age == _age), default=0),
+                            max_staleness_ms=max_staleness * 1000, stale_reads=violations)
+        cprint_info(f"INFO: Renames seen by the replica after p50 {self.__percentile(lags, 50):.0f} ms,"
+                    f" max {lags[-1] if lags else 0:.0f} ms, bound {max_staleness * 1000:.0f} ms")
+        if any(_age != _age for _age in ages):
+            cprint_err("ERROR: Some reads weren't served by the replica")
+            ret = self.ERR_TEST_FAILED
+        elif max(ages) > max_staleness * 1000:
+            cprint_err(f"ERROR: A read was served {max(ages):.0f} ms behind the database")
+            ret = self.ERR_TEST_FAILED
+        if violations:
+            cprint_err(f"ERROR: {violations} reads missed a rename made over {max_staleness:g} s before")
+            ret = self.ERR_TEST_FAILED
+        if ret == self.ERR_NONE:
+            cprint_suc(f"Replica reads matched the database, at most {max(ages):.0f} ms behind")
+        return ret
+
+    def test_read_replica(self, n_requests=None, n_writes=None, max_staleness=None):
+        """
+        Launches an API process serving reads from its in-memory replica, on
+        the same database. Times hot reads from the replica against the same
+        reads from the database, with Cache-Control: no-cache, and checks
+        they return the same. Then renames a category through the API under
+        test n_writes times and polls the replica until it shows the new
+        name, checking that every read started more than max_staleness
+        after a rename shows it
+
+        Args:
+            n_requests (int): Requests timed per route, of each kind
+            n_writes (int): Renames to measure staleness with
+            max_staleness (float): Bound given to the replica, in seconds
+        """
+        _cfg = self.replica_config
+        n_requests = n_requests or _cfg.get('n_requests', 200)
+        n_writes = n_writes or _cfg.get('n_writes', 20)
+        max_staleness = max_staleness if max_staleness is not None else _cfg.get('max_staleness', 0.5)
+        _run = uuid.uuid4().hex[:8]
+
+        _res = self.results
+        _res.update(routes_differ=[], renames_not_seen=0)
+        _id = 1000 + random.randrange(1000)
+        req = self.post_categories(_id, f"Replica {_run}")
+        _res['create_status'] = req.status_code
+        if req.status_code != self.SUC_HTTP_CREATED:
+            cprint_err(f"ERROR: Creating category {_id} returned {req.status_code}")
+            return self.ERR_WRONG_STATUS
+
+        proc, _ttfr = self.launch_server(extra_args=['--read-replica', str(max_staleness)])
+        _res['server_started'] = _ttfr is not None
+        if _ttfr is None:
+            self.stop_server(proc)
+            cprint_err("ERROR: Server with the read replica didn't start")
+            return self.ERR_REQ_FAILED
+        _base = f"http://{self.server_config.get('launch_server_name', 'localhost:8890')}/"
+        _routes = {
+            'categories': UrlTemplate(_base, self.API_CATEGORIES)(),
+            'category': UrlTemplate(_base, self.API_CATEGORIES + "{id}")(1),
+            'post': UrlTemplate(_base, self.API_POSTS + "{id}")(1),
+            'summary': UrlTemplate(_base, self.API_CATEGORIES + "{id}/summary")(1),
+        }
+        ages = []
+        lags = []
+        violations = 0
+        try:
+            ret = self.__replica_reads(_routes, n_requests, ages)
+            for _n in range(n_writes):
+                _new_name = f"Replica {_run} {_n}"
+                req = self.put_category_by_id(_id, _new_name)
+                _written = time.perf_counter()
+                if req.status_code != self.SUC_HTTP_NO_CONTENT:
+                    cprint_err(f"ERROR: Renaming category {_id} returned {req.status_code}")
+                    _res['rename_status'] = req.status_code
+                    return self.ERR_WRONG_STATUS
+                _lag, _missed = self.__replica_rename_lag(_id, _new_name, _routes['categories'], _written,
+                                                          max_staleness, ages)
+                violations += _missed
+                if _lag is None:
+                    cprint_err(f"ERROR: Rename {_n} not seen after {max_staleness * 10:g} s")
+                    _res['renames_not_seen'] += 1
+                    ret = self.ERR_TEST_FAILED
+                else:
+                    lags.append(_lag)
+        finally:
+            self.stop_server(proc)
+
+        return self.__check_replica(ages, lags, violations, max_staleness, ret)
+
+    def __burst_gets(self, url, burst, headers=None):
+        """
+        Sends burst identical GETs to url at once
+
+        Returns:
+            list: (ms, response) of each GET
+        """
+        _barrier = threading.Barrier(burst)
+
+        def _one(_):
+            _barrier.wait()
+            _start = time.perf_counter()
+            _req = self.__send('GET', url, headers=headers)
+            return (time.perf_counter() - _start) * 1000, _req
+
+        with ThreadPoolExecutor(max_workers=burst) as _pool:
+            return list(_pool.map(_one, range(burst)))
+
+    def __coalescing_route(self, name, url, url_stats, burst, rounds, queries):
+        """
+        Sends rounds bursts of burst GETs to url, first with Cache-Control:
+        no-cache, then coalesced, adding the queries each kind ran, from the
+        diagnostics at url_stats, to queries. Checks every GET succeeded and
+        returned the same body
+        """
+        ret = self.ERR_NONE
+        _res = self.results
+        _bodies = {}
+        for _kind, _headers in (('computed', {'Cache-Control': 'no-cache'}), ('coalesced', None)):
+            _latencies = []
+            _before = self.__send('GET', url_stats).json()['queries']
+            for _ in range(rounds):
+                for _ms, _req in self.__burst_gets(url, burst, _headers):
+                    _latencies.append(_ms)
+                    if _req.status_code != self.SUC_HTTP_OK:
+                        cprint_err(f"ERROR: {name}: {_kind} GET returned {_req.status_code}")
+                        _failed = _res['failed_gets']
+                        _failed[_req.status_code] = _failed.get(_req.status_code, 0) + 1
+                        ret = self.ERR_WRONG_STATUS
+                    _bodies.setdefault(_kind, set()).add(_req.content)
+            # Less the GET of the stats themselves, which runs none
+            _queries = self.__send('GET', url_stats).json()['queries'] - _before
+            queries[_kind] += _queries
+            _latencies.sort()
+            cprint_info(f"INFO: {name}: {_kind} {rounds} x {burst} GETs ran {_queries} queries,"
+                        f" p50 {self.__percentile(_latencies, 50):.1f} ms"
+                        f" p99 {self.__percentile(_latencies, 99):.1f} ms")
+        if _bodies['coalesced'] != _bodies['computed'] or len(_bodies['computed']) != 1:
+            cprint_err(f"ERROR: {name}: the bursts returned {len(_bodies['computed'] | _bodies['coalesced'])}"
+                       f" different bodies")
+            _res['routes_differ'].append(name)
+            ret = self.ERR_TEST_FAILED
+        return ret
+
+    def __check_coalescing(self, stats, queries, max_query_ratio, ret):
+        """
+        Checks that some requests were coalesced and that the coalesced
+        bursts ran at most max_query_ratio of the queries of the computed
+        ones. Returns ret unless one of these fails
+        """
+        cprint_info(f"INFO: {stats['coalesced']} responses coalesced over {stats['flights']} computed,"
+                    f" {stats['timeouts']} waits timed out")
+        _ratio = queries['coalesced'] / queries['computed'] if queries['computed'] else 1
+        self.results.update(coalesced=stats['coalesced'], query_ratio=_ratio, max_query_ratio=max_query_ratio)
+        if stats['coalesced'] == 0:
+            cprint_err("ERROR: No request was coalesced")
+            ret = self.ERR_TEST_FAILED
+        elif _ratio > max_query_ratio:
+            cprint_err(f"ERROR: Coalesced bursts ran {_ratio:.0%} of the queries, over {max_query_ratio:.0%}")
+            ret = self.ERR_TEST_FAILED
+        if ret == self.ERR_NONE:
+            cprint_suc(f"Coalesced bursts ran {queries['coalesced']} queries instead of {queries['computed']}")
+        return ret
+
+    def test_read_coalescing(self, burst=None, rounds=None, max_query_ratio=None):
+        """
+        Launches an API process coalescing identical concurrent reads, on the
+        same database. Sends rounds bursts of burst identical GETs at once to
+        a page of posts and to a category, first with Cache-Control: no-cache
+        so each one is computed, then coalesced. Compares the database queries
+        each kind ran, from the process' diagnostics, and their latencies, and
+        checks the coalesced responses match. Then renames the category
+        through that process and checks the next burst shows the new name
+
+        Args:
+            burst (int): Identical requests sent at once
+            rounds (int): Bursts per route, of each kind
+            max_query_ratio (float): Most queries the coalesced bursts may run,
+                as a fraction of those of the bursts computed one by one
+        """
+        _cfg = self.coalescing_config
+        burst = burst or _cfg.get('burst', 24)
+        rounds = rounds or _cfg.get('rounds', 5)
+        max_query_ratio = max_query_ratio if max_query_ratio is not None else _cfg.get('max_query_ratio', 0.5)
+        _run = uuid.uuid4().hex[:8]
+
+        _res = self.results
+        _res.update(failed_gets={}, routes_differ=[])
+        proc, _ttfr = self.launch_server(extra_args=['--coalesce-reads'])
+        _res['server_started'] = _ttfr is not None
+        if _ttfr is None:
+            self.stop_server(proc)
+            cprint_err("ERROR: Server coalescing reads didn't start")
+            return self.ERR_REQ_FAILED
+        _base = f"http://{self.server_config.get('launch_server_name', 'localhost:8890')}/"
+        _url_stats = urljoin(_base, self.API_COALESCING)
+        _url_category = UrlTemplate(_base, self.API_CATEGORIES + "{id}")(1)
+        _routes = {
+            'posts': UrlTemplate(_base, self.API_POSTS)() + "?page=1&per_page=10",
+            'category': _url_category,
+        }
+
+        ret = self.ERR_NONE
+        queries = {'computed': 0, 'coalesced': 0}
+        try:
+            for _name, _url in _routes.items():
+                _ret = self.__coalescing_route(_name, _url, _url_stats, burst, rounds, queries)
+                ret = _ret if _ret != self.ERR_NONE else ret
+
+            _new_name = f"Coalesced {_run}"
+            req = self.__send_json('PUT', _url_category, self.CATEGORY_BODY.render(name=_new_name))
+            _res['rename_status'] = req.status_code
+            if req.status_code != self.SUC_HTTP_NO_CONTENT:
+                cprint_err(f"ERROR: Renaming category 1 returned {req.status_code}")
+                return self.ERR_WRONG_STATUS
+            _stale = _res['stale_after_rename'] = sum(1 for _, _req in self.__burst_gets(_url_category, burst)
+                                                      if _req.json().get('name') != _new_name)
+            if _stale:
+                cprint_err(f"ERROR: {_stale} of {burst} GETs after a rename returned the old name")
+                ret = self.ERR_TEST_FAILED
+            stats = self.__send('GET', _url_stats).json()
+        finally:
+            self.stop_server(proc)
+
+        return self.__check_coalescing(stats, queries, max_query_ratio, ret)
+
+    def __jobs_create(self, urls, title):
+        """
+        Creates a post in category 1 through the process at urls
+
+        Returns:
+            tuple: (latency in ms, response)
+        """
+        _body = self.POST_BODY.render(title=title, body=f"Body of {title}", category_id=1)
+        _start = time.perf_counter()
+        _req = self.__send_json('POST', urls['posts'], _body, retry=False)
+        return (time.perf_counter() - _start) * 1000, _req
+
+    def __jobs_drain(self, urls):
+        """
+        Waits up to drain_timeout for the job queue to empty
+
+        Returns:
+            tuple: (queue diagnostics, ms waited)
+        """
+        _timeout = self.jobs_config.get('drain_timeout', 10)
+        _start = time.perf_counter()
+        _queue = self.__send('GET', urls['jobs']).json()
+        while (_queue['pending'] or _queue['queued']) and time.perf_counter() - _start < _timeout:
+            time.sleep(0.01)
+            _queue = self.__send('GET', urls['jobs']).json()
+        return _queue, (time.perf_counter() - _start) * 1000
+
+    def __jobs_burst(self, mode, urls, run, n_writers, n_writes, write_p99):
+        """
+        Creates n_writes posts from each of n_writers clients at once, and
+        checks they all succeeded and, with jobs, returned X-Job-Id. Stores
+        the p99 of their latencies in write_p99[mode]
+
+        Returns:
+            tuple: (error code, posts created)
+        """
+        ret = self.ERR_NONE
+        _res = self.results
+        with ThreadPoolExecutor(max_workers=n_writers) as _pool:
+            _results = list(_pool.map(lambda _i: self.__jobs_create(urls, f"Jobs {run} {mode} {_i}"),
+                                      range(n_writers * n_writes)))
+        _created = sum(1 for _, _req in _results if _req.status_code == self.SUC_HTTP_CREATED)
+        _res['failed_writes'][mode] = sorted(_req.status_code for _, _req in _results
+                                             if _req.status_code != self.SUC_HTTP_CREATED)
+        if _created != len(_results):
+            cprint_err(f"ERROR: {mode}: {len(_results) - _created} of {len(_results)} writes failed,"
+                       f" status codes {sorted({_req.status_code for _, _req in _results})}")
+            ret = self.ERR_WRONG_STATUS
+        if mode == 'jobs':
+            _res['missing_job_id'] = sum(1 for _, _req in _results if 'X-Job-Id' not in _req.headers)
+            if _res['missing_job_id']:
+                cprint_err("ERROR: Writes with background jobs didn't return X-Job-Id")
+                ret = self.ERR_MISSING_FIELD
+        _latencies = sorted(_ms for _ms, _ in _results)
+        write_p99[mode] = self.__percentile(_latencies, 99)
+        cprint_info(f"INFO: {mode}: {len(_results)} posts from {n_writers} clients,"
+                    f" write p50 {self.__percentile(_latencies, 50):.1f} ms p99 {write_p99[mode]:.1f} ms")
+        return ret, _created
+
+    def __jobs_lag(self, urls, run, n_lag, expected, max_lag_ms):
+        """
+        Creates n_lag posts one at a time and polls the category summary
+        until it counts each of them, from expected posts before the first
+
+        Returns:
+            tuple: (error code, posts created, lags in ms, sorted)
+        """
+        _poll = self.jobs_config.get('poll_interval', 0.005)
+        ret = self.ERR_NONE
+        lags = []
+        for _i in range(n_lag):
+            _, _req = self.__jobs_create(urls, f"Jobs {run} lag {_i}")
+            _written = time.perf_counter()
+            if _req.status_code != self.SUC_HTTP_CREATED:
+                cprint_err(f"ERROR: Creating a post returned {_req.status_code}")
+                ret = self.ERR_WRONG_STATUS
+                continue
+            expected += 1
+            while self.__send('GET', urls['summary']).json()['post_count'] < expected:
+                if time.perf_counter() - _written > max_lag_ms * 10 / 1000:
+                    cprint_err(f"ERROR: Post {_i} not counted by the summary after {max_lag_ms * 10} ms")
+                    ret = self.ERR_TEST_FAILED
+                    break
+                time.sleep(_poll)
+            lags.append((time.perf_counter() - _written) * 1000)
+        lags.sort()
+        return ret, len(lags), lags
+
+    def __check_jobs_queue(self, urls, lags, max_lag_ms, ret):
+        """
+        Waits for the job queue to drain, then checks that no job is left or
+        failed and that the p99 of lags is at most max_lag_ms. Returns ret
+        unless one of these fails
+        """
+        _queue, _ = self.__jobs_drain(urls)
+        self.results.update(lag_p99_ms=self.__percentile(lags, 99),
+                            unfinished_jobs=_queue['pending'] + _queue['queued'], failed_jobs=_queue['failed'])
+        cprint_info(f"INFO: Summary caught up with single writes after p50 {self.__percentile(lags, 50):.1f} ms,"
+                    f" p99 {self.__percentile(lags, 99):.1f} ms. Jobs done {_queue['done']},"
+                    f" retried {_queue['retries']}")
+        if _queue['pending'] or _queue['queued']:
+            cprint_err(f"ERROR: {_queue['pending']} jobs still pending after"
+                       f" {self.jobs_config.get('drain_timeout', 10)} s")
+            ret = self.ERR_TEST_FAILED
+        if _queue['failed']:
+            cprint_err(f"ERROR: {_queue['failed']} jobs failed")
+            ret = self.ERR_TEST_FAILED
+        if self.__percentile(lags, 99) > max_lag_ms:
+            cprint_err(f"ERROR: Lag p99 {self.__percentile(lags, 99):.1f} ms is above {max_lag_ms} ms")
+            ret = self.ERR_TEST_FAILED
+        return ret
+
+    def __check_jobs_accounting(self, mode, urls, seq, count, created, ret):
+        """
+        Checks that the category summary and the change log since seq both
+        account for the created posts, from count posts before. Returns ret
+        unless they don't
+        """
+        _res = self.results
+        _counted = self.__send('GET', urls['summary']).json()['post_count'] - count
+        _changes = self.__send('GET', urls['changes'], params={'since': seq, 'limit': 1000}).json()['changes']
+        _logged = sum(1 for _c in _changes if _c['kind'] == 'post' and _c['action'] == 'create')
+        _res['created'][mode], _res['counted'][mode], _res['logged'][mode] = created, _counted, _logged
+        if _counted != created or _logged != created:
+            cprint_err(f"ERROR: {mode}: created {created} posts, the summary counted {_counted}"
+                       f" and the change log has {_logged}")
+            ret = self.ERR_TEST_FAILED
+        return ret
+
+    def test_background_jobs(self, n_writers=None, n_writes=None, n_lag=None, max_lag_ms=None):
+        """
+        Launches an API process doing all the work of post writes in the
+        request, then one leaving their category summary and change log to
+        background jobs, on the same database. In each, n_writers clients
+        create n_writes posts each at once, and the write latencies are
+        compared. With jobs, once the backlog of that burst is drained, then
+        creates n_lag posts one at a time and polls the category summary
+        until it counts each of them: the consistency lag clients see. Checks that the queue drains without failed jobs,
+        and that the summary and the change log account for every post
+
+        Args:
+            n_writers (int): Clients creating posts at once
+            n_writes (int): Posts created by each of them
+            n_lag (int): Posts created one at a time to measure the lag
+            max_lag_ms (float): Highest acceptable p99 of the lag
+        """
+        _cfg = self.jobs_config
+        n_writers = n_writers or _cfg.get('n_writers', 4)
+        n_writes = n_writes or _cfg.get('n_writes', 25)
+        n_lag = n_lag or _cfg.get('n_lag', 20)
+        max_lag_ms = max_lag_ms if max_lag_ms is not None else _cfg.get('max_lag_ms', 1000)
+        _run = uuid.uuid4().hex[:8]
+        _base = f"http://{self.server_config.get('launch_server_name', 'localhost:8890')}/"
+        _urls = {
+            'posts': UrlTemplate(_base, self.API_POSTS)(),
+            'summary': UrlTemplate(_base, self.API_CATEGORIES + "{id}/summary")(1),
+            'changes': UrlTemplate(_base, self.API_CHANGES)(),
+            'jobs': urljoin(_base, self.API_JOBS),
+        }
+
+        ret = self.ERR_NONE
+        write_p99 = {}
+        _res = self.results
+        _res.update(failed_writes={}, missing_job_id=0, created={}, counted={}, logged={}, lag_p99_ms=None,
+                    max_lag_ms=max_lag_ms, unfinished_jobs=0, failed_jobs=0)
+        for _mode, _args in (('inline', []), ('jobs', ['--background-jobs', str(_cfg.get('workers', 2))])):
+            proc, _ttfr = self.launch_server(extra_args=_args)
+            _res.setdefault('servers_started', []).append(_ttfr is not None)
+            if _ttfr is None:
+                self.stop_server(proc)
+                cprint_err(f"ERROR: Server with {_mode} post writes didn't start")
+                return self.ERR_REQ_FAILED
+            try:
+                _seq = self.__send('GET', _urls['changes'], params={'limit': 0}).json()['last_seq']
+                _count = self.__send('GET', _urls['summary']).json()['post_count']
+                _ret, _created = self.__jobs_burst(_mode, _urls, _run, n_writers, n_writes, write_p99)
+                ret = _ret if _ret != self.ERR_NONE else ret
+                if _mode == 'jobs':
+                    _queue, _drained = self.__jobs_drain(_urls)
+                    cprint_info(f"INFO: Backlog of the burst drained in {_drained:.0f} ms,"
+                                f" server lag p99 {_queue['lag_p99_ms'] or 0:.1f} ms")
+                    _ret, _lagged, lags = self.__jobs_lag(_urls, _run, n_lag, _count + _created, max_lag_ms)
+                    ret = _ret if _ret != self.ERR_NONE else ret
+                    _created += _lagged
+                    ret = self.__check_jobs_queue(_urls, lags, max_lag_ms, ret)
+                ret = self.__check_jobs_accounting(_mode, _urls, _seq, _count, _created, ret)
+            finally:
+                self.stop_server(proc)
+
+        cprint_info(f"INFO: Write p99 {write_p99.get('inline', 0):.1f} ms inline,"
+                    f" {write_p99.get('jobs', 0):.1f} ms with background jobs")
+        if ret == self.ERR_NONE:
+            cprint_suc(f"Background jobs caught up with every write, within {max_lag_ms} ms")
+        return ret
+
+    ###########################################################################
+    # Load scenarios
+    def __rate_limit_traffic(self, url, n_clients, duration, budget):
+        """
+        GETs url from n_clients threads, each request as a new client, for
+        duration seconds and then until they offered more than the limit
+        allows, for up to 4 times duration
+
+        Args:
+            budget (callable): Most requests the limit admits in the given
+                seconds from the start
+        Returns:
+            dict: 'admitted' latencies in ms, sorted, 'rejected' and 'other'
+                counts by status code, 'missing_retry_after', 'offered' and
+                'elapsed' seconds
+        """
+        _lock = threading.Lock()
+        counts = {'admitted': [], 'rejected': {}, 'other': {}, 'missing_retry_after': 0}
+        start = time.perf_counter()
+
+        def _offered():
+            return len(counts['admitted']) + sum(counts['rejected'].values()) + sum(counts['other'].values())
+
+        def _keep_going():
+            _elapsed = time.perf_counter() - start
+            with _lock:
+                _past_limit = _offered() > 1.2 * budget(_elapsed)
+            return _elapsed < 4 * duration and (_elapsed < duration or not _past_limit)
+
+        def _client():
+            while _keep_going():
+                _start = time.perf_counter()
+                _headers = {self.CLIENT_ID_HEADER: uuid.uuid4().hex}
+                req = self.__send('GET', url, headers=_headers, retry=False)
+                _elapsed = (time.perf_counter() - _start) * 1000
+                with _lock:
+                    self.__count_rate_limited(counts, req, _elapsed)
+
+        with ThreadPoolExecutor(max_workers=n_clients) as _pool:
+            _futures = [_pool.submit(_client) for _ in range(n_clients)]
+        for _future in _futures:
+            _future.result()
+        counts['admitted'].sort()
+        counts['offered'] = _offered()
+        counts['elapsed'] = time.perf_counter() - start
+        return counts
+
+    def __count_rate_limited(self, counts, req, elapsed_ms):
+        "Adds a response to the counts of __rate_limit_traffic()"
+        if req.ok:
+            counts['admitted'].append(elapsed_ms)
+        elif req.status_code in (self.ERR_HTTP_TOO_MANY_REQUESTS, self.ERR_HTTP_SERVICE_UNAVAILABLE):
+            counts['rejected'][req.status_code] = counts['rejected'].get(req.status_code, 0) + 1
+            if parse_retry_after(req.headers.get('Retry-After')) is None:
+                counts['missing_retry_after'] += 1
+        else:
+            counts['other'][req.status_code] = counts['other'].get(req.status_code, 0) + 1
+
+    def __check_rate_limit(self, counts, budget, max_p99_ms):
+        """
+        Checks the counts of __rate_limit_traffic(): traffic went past the
+        budget, the excess was rejected with Retry-After, and the p99
+        latency of admitted requests is below max_p99_ms
+        """
+        admitted, rejected, other = counts['admitted'], counts['rejected'], counts['other']
+        _p50 = self.__percentile(admitted, 50)
+        _p99 = self.__percentile(admitted, 99)
+        cprint_info(f"INFO: {counts['offered']} requests in {counts['elapsed']:.1f} s, limit allows {budget:.0f}")
+        cprint_info(f"INFO: {len(admitted)} admitted, rejected {rejected}, other {other}")
+        cprint_info(f"INFO: Admitted latency p50 {_p50:.1f} ms, p99 {_p99:.1f} ms")
+        self.results.update(offered=counts['offered'], budget=budget, admitted=len(admitted),
+                            rejected=rejected, missing_retry_after=counts['missing_retry_after'], other=other,
+                            p99_ms=_p99, max_p99_ms=max_p99_ms)
+
+        ret = self.ERR_NONE
+        if counts['offered'] <= budget:
+            cprint_err("ERROR: Clients were too slow to go past the limit")
+            ret = self.ERR_TEST_FAILED
+        elif not rejected:
+            cprint_err("ERROR: Traffic went past the limit but nothing was rejected")
+            ret = self.ERR_TEST_FAILED
+        if counts['missing_retry_after']:
+            cprint_err(f"ERROR: {counts['missing_retry_after']} rejections without a valid Retry-After")
+            ret = self.ERR_TEST_FAILED
+        if other:
+            cprint_err(f"ERROR: Unexpected status codes: {other}")
+            ret = self.ERR_WRONG_STATUS
+        if _p99 > max_p99_ms:
+            cprint_err(f"ERROR: Admitted p99 {_p99:.1f} ms is above {max_p99_ms} ms")
+            ret = self.ERR_TEST_FAILED
+        if ret == self.ERR_NONE:
+            cprint_suc("Excess traffic was shed and admitted latency stayed bounded")
+        return ret
+
+    def test_rate_limit_burst(self, duration=None, n_clients=None, max_p99_ms=None):
+        """
+        Launches an API process with rate limiting and load shedding, and
+        drives traffic at its posts archive past the rate limit from several
+        concurrent clients. Each request names a new client in X-Client-Id,
+        which mustn't get it past the limit: only requests of trusted
+        proxies name their client. Checks that the excess is rejected with
+        429 and Retry-After, and that the requests which were admitted kept a
+        bounded latency
+
+        How fast the clients go depends on the machine, so they keep going
+        past duration until they have offered more than the limit allows,
+        for up to 4 times duration
+
+        Args:
+            duration (float): Seconds to keep sending requests
+            n_clients (int): Concurrent clients
+            max_p99_ms (float): Highest acceptable p99 latency of admitted
+                requests, in milliseconds
+        """
+        _cfg = self.rate_limit_scenario
+        duration = duration if duration is not None else _cfg.get('duration', 3)
+        n_clients = n_clients if n_clients is not None else _cfg.get('n_clients', 8)
+        max_p99_ms = max_p99_ms if max_p99_ms is not None else _cfg.get('max_p99_ms', 250)
+        # Must match RATELIMIT_NAMESPACES['blog/posts'] on the API
+        limit_rate = _cfg.get('limit_rate', 50)
+        limit_burst = _cfg.get('limit_burst', 100)
+
+        proc, _ttfr = self.launch_server(extra_args=['--rate-limit', '--shed-load'])
+        self.results['server_started'] = _ttfr is not None
+        if _ttfr is None:
+            self.stop_server(proc)
+            cprint_err("ERROR: Server with rate limiting didn't start")
+            return self.ERR_REQ_FAILED
+        _base = f"http://{self.server_config.get('launch_server_name', 'localhost:8890')}/"
+        _url = UrlTemplate(_base, self.API_ARCHIVE + "{year}/")(2016)
+
+        def _budget(elapsed):
+            "Most requests the limit admits in elapsed seconds from the start"
+            return limit_rate * elapsed + limit_burst
+
+        try:
+            counts = self.__rate_limit_traffic(_url, n_clients, duration, _budget)
+        finally:
+            self.stop_server(proc)
+        return self.__check_rate_limit(counts, _budget(counts['elapsed']), max_p99_ms)
+
+    def test_open_loop_posts(self, schedule=None, max_p99_ms=None, max_lag_ms=None, profile_slowest=None):
+        """
+        Sends GET /blog/posts/ on an open loop schedule, and reports the p99
+        latency measured from when each request should have been sent. Fails
+        if the generator fell behind, as its figures can't be trusted then
+
+        Args:
+            schedule (dict): See openloop.schedule_from_config()
+            max_p99_ms (float): Highest acceptable p99 latency, in ms. Taken
+                from config.json, where it is null by default: the p99 is
+                then reported but not checked
+            max_lag_ms (float): Highest acceptable p99 of how late requests
+                were sent, in ms
+            profile_slowest (int): Server side profiles of this many of the
+                slowest requests are fetched and recorded. 0 for none
+        """
+        _cfg = self.open_loop_config
+        schedule = schedule or _cfg.get('schedule', {'kind': openloop.POISSON, 'rate': 40, 'duration': 5})
+        max_p99_ms = max_p99_ms if max_p99_ms is not None else _cfg.get('max_p99_ms')
+        max_lag_ms = max_lag_ms if max_lag_ms is not None else _cfg.get('max_lag_ms', 25)
+        profile_slowest = profile_slowest if profile_slowest is not None else _cfg.get('profile_slowest', 0)
+        proc = None
+        _url = self.__url_posts()
+        if profile_slowest:
+            # Profiling is off on the API under test
+            proc, _ttfr = self.launch_server(extra_args=['--profile'])
+            if _ttfr is None:
+                self.stop_server(proc)
+                cprint_err("ERROR: Server with profiling didn't start")
+                return self.ERR_REQ_FAILED
+            _base = f"http://{self.server_config.get('launch_server_name', 'localhost:8890')}/"
+            _url = UrlTemplate(_base, self.API_POSTS)()
+        try:
+            result, _ = self.__run_open_loop(_url, schedule, profile_slowest)
+        finally:
+            if proc is not None:
+                self.stop_server(proc)
+        total = result['total']
+        _p99 = total.latency.percentile(99) / 1000
+
+        ret = self.ERR_NONE
+        _behind = openloop.fell_behind(result, max_lag_ms)
+        self.results.update(fell_behind=_behind, errors=total.errors, p99_ms=_p99, max_p99_ms=max_p99_ms,
+                            failed={_status: _n for _status, _n in total.statuses.items() if _status >= 400})
+        if _behind is not None:
+            cprint_err(f"ERROR: The generator fell behind, latencies are not trustworthy: {_behind}")
+            ret = self.ERR_TEST_FAILED
+        _failed = {_status: _n for _status, _n in total.statuses.items() if _status >= 400}
+        if _failed or total.errors:
+            cprint_err(f"ERROR: Failed requests: {_failed} {total.errors}")
+            ret = self.ERR_WRONG_STATUS
+        if max_p99_ms is not None and _p99 > max_p99_ms:
+            cprint_err(f"ERROR: p99 {_p99:.1f} ms is above {max_p99_ms} ms")
+            ret = self.ERR_TEST_FAILED
+        if ret == self.ERR_NONE:
+            cprint_suc(f"Schedule kept, p99 latency from intended send time {_p99:.1f} ms")
+        return ret
+
+    def test_server_profiles(self, n_slowest=None, schedule=None):
+        """
+        Launches an API process with profiling and sends GET
+        /blog/posts/archive/2016/ to it on an open loop schedule, with every
+        request profiled, then fetches the profiles of the n slowest. Checks that each one was found, has stacks in the
+        folded format of flamegraph.pl, and that its SQL and marshalling
+        times fit in the time the server took
+
+        Args:
+            n_slowest (int): Profiles to fetch
+            schedule (dict): See openloop.schedule_from_config()
+        """
+        _cfg = self.profiling_config
+        n_slowest = n_slowest or _cfg.get('n_slowest', 5)
+        schedule = schedule or _cfg.get('schedule', {'kind': openloop.POISSON, 'rate': 20, 'duration': 3})
+        proc, _ttfr = self.launch_server(extra_args=['--profile'])
+        self.results['server_started'] = _ttfr is not None
+        if _ttfr is None:
+            self.stop_server(proc)
+            cprint_err("ERROR: Server with profiling didn't start")
+            return self.ERR_REQ_FAILED
+        _base = f"http://{self.server_config.get('launch_server_name', 'localhost:8890')}/"
+        try:
+            result, profiles = self.__run_open_loop(UrlTemplate(_base, self.API_ARCHIVE + "{year}/")(2016),
+                                                    schedule, n_slowest)
+        finally:
+            self.stop_server(proc)
+
+        ret = self.ERR_NONE
+        _res = self.results
+        _res.update(profiles=len(profiles), expected_profiles=min(n_slowest, result['total'].latency.count),
+                    not_folded=[], over_total=[])
+        if len(profiles) < min(n_slowest, result['total'].latency.count):
+            cprint_err(f"ERROR: Only {len(profiles)} of the {n_slowest} slowest requests have a profile")
+            ret = self.ERR_TEST_FAILED
+        for profile in profiles:
+            _lines = profile.get('folded', '').splitlines()
+            if not _lines or not all(_line.rpartition(' ')[2].isdigit() for _line in _lines):
+                cprint_err(f"ERROR: Profile {profile['id']} has no folded stacks: {_lines[:3]}")
+                _res['not_folded'].append(profile['id'])
+                ret = self.ERR_INVALID_FIELD
+            # Timers are a little off each other, hence the slack
+            if profile['sql_ms'] + profile['marshal_ms'] > profile['total_ms'] * 1.1 + 1:
+                cprint_err(f"ERROR: Profile {profile['id']}: SQL {profile['sql_ms']:.1f} ms and marshalling"
+                           f" {profile['marshal_ms']:.1f} ms add up to more than {profile['total_ms']:.1f} ms")
+                _res['over_total'].append(profile['id'])
+                ret = self.ERR_INVALID_FIELD
+        if ret == self.ERR_NONE:
+            cprint_suc(f"Profiles of the {len(profiles)} slowest requests fetched")
+        return ret
+
+    def test_distributed_load(self, scenario=None, rate=None, duration=None, n_workers=None,
+                              max_p99_ms=None):
+        """
+        Sends a scenario at a fixed rate from several worker processes, and
+        remote ones if the load section of config.json asks for them. Checks
+        that every worker reported and that the rate was reached. Reports the
+        p99 latency of all requests merged, and checks it only when a bound is
+        given: it depends on the server and host under test
+
+        Args:
+            scenario (str): One of loadgen.SCENARIOS
+            rate (float): Requests per second from all workers
+            duration (float): Seconds to send requests for
+            n_workers (int): Worker processes on this host
+            max_p99_ms (float): Highest acceptable p99 latency, in ms. Taken
+                from the load section of config.json if None, not checked if
+                None there either
+        """
+        _cfg = self.load_config
+        scenario = scenario or _cfg.get('scenario', 'categories')
+        rate = rate if rate is not None else _cfg.get('rate', 100)
+        duration = duration if duration is not None else _cfg.get('duration', 3)
+        n_workers = n_workers or _cfg.get('workers', 4)
+        max_p99_ms = max_p99_ms if max_p99_ms is not None else _cfg.get('max_p99_ms')
+        _remote = _cfg.get('remote_workers', 0)
+
+        result = loadgen.run_local(self.base_url, scenario, rate, duration, n_workers,
+                                   _cfg.get('threads', 4), _remote,
+                                   _cfg.get('address', '127.0.0.1:0'), self.timeout, _cfg.get('streams', 1))
+        histogram = result['histogram']
+        _p50 = histogram.percentile(50) / 1000
+        _p99 = histogram.percentile(99) / 1000
+        cprint_info(f"INFO: {scenario}: {result['requests']} requests in {result['elapsed']:.1f} s,"
+                    f" {result['rate']:.0f} per second (target {rate}) from {len(result['workers'])} workers")
+        cprint_info(f"INFO: Latency p50 {_p50:.1f} ms, p99 {_p99:.1f} ms."
+                    f" Status codes {result['statuses']}, errors {result['errors']}")
+
+        ret = self.ERR_NONE
+        self.results.update(connected=result['connected'], expected_workers=n_workers + _remote,
+                            missing=result['missing'], errors=result['errors'], rate=result['rate'],
+                            min_rate=_cfg.get('min_rate_ratio', 0.9) * rate, p99_ms=_p99, max_p99_ms=max_p99_ms,
+                            failed={_status: _n for _status, _n in result['statuses'].items() if _status >= 400})
+        if result['connected'] < n_workers + _remote or result['missing']:
+            cprint_err(f"ERROR: {result['connected']}/{n_workers + _remote} workers connected,"
+                       f" no result from {result['missing']}")
+            ret = self.ERR_TEST_FAILED
+        _failed = {_status: _n for _status, _n in result['statuses'].items() if _status >= 400}
+        if _failed or result['errors']:
+            cprint_err(f"ERROR: Failed requests: {_failed} {result['errors']}")
+            ret = self.ERR_WRONG_STATUS
+        if rate and result['rate'] < _cfg.get('min_rate_ratio', 0.9) * rate:
+            cprint_err(f"ERROR: Reached {result['rate']:.0f} requests per second out of {rate}")
+            ret = self.ERR_TEST_FAILED
+        if max_p99_ms is not None and _p99 > max_p99_ms:
+            cprint_err(f"ERROR: p99 {_p99:.1f} ms is above {max_p99_ms} ms")
+            ret = self.ERR_TEST_FAILED
+        if ret == self.ERR_NONE:
+            cprint_suc(f"Target rate reached, p99 {_p99:.1f} ms")
+        return ret
+
+    ###########################################################################
+    # Soak
+    def __check_soak_trends(self, trends):
+        """
+        Prints the trend of each resource of test_soak(), and records it on
+        the results sink. Fails on any leak
+        """
+        ret = self.ERR_NONE
+        for _trend in trends:
+            if self.results_sink is not None:
+                self.results_sink.record_trend('soak', _trend)
+            _metric = _trend['metric']
+            _line = (f"{_metric}: {soak.format_value(_metric, _trend['first'])} ->"
+                     f" {soak.format_value(_metric, _trend['last'])},"
+                     f" {soak.format_value(_metric, _trend['per_hour'])} per hour, r2 {_trend['r2']:.2f}")
+            if _trend['leak']:
+                cprint_err(f"ERROR: Leaking {_line}, over {soak.format_value(_metric, _trend['threshold'])}")
+                ret = self.ERR_TEST_FAILED
+            else:
+                cprint_info(f"INFO: {_line}")
+        return ret
+
+    def test_soak(self, duration=None, rate=None, n_workers=None, interval=None):
+        """
+        Sends a steady mix of reads and writes for duration seconds, sampling
+        the resources of the server and of the client every interval seconds,
+        see soak.py. Fits a trend to each resource and checks none of them
+        leaks, and that few requests failed. Samples and trends are streamed
+        with the results, for the report
+
+        By default the soak runs against an API process launched for it,
+        on the same database, so earlier tests don't weigh on its trends.
+        Set launch_server to false on the soak section of config.json to soak
+        the API under test instead, which must run with --diagnose-resources
+
+        Args:
+            duration (float): Seconds to run for, hours for a real soak
+            rate (float): Requests per second
+            n_workers (int): Threads sending them
+            interval (float): Seconds between samples
+        """
+        _cfg = self.soak_config
+        duration = duration if duration is not None else _cfg.get('duration', 20)
+        rate = rate or _cfg.get('rate', 40)
+        n_workers = n_workers or _cfg.get('workers', 8)
+        interval = interval or _cfg.get('interval', 1)
+        _thresholds = dict(soak.DEFAULT_THRESHOLDS, **_cfg.get('thresholds', {}))
+        _max_error_rate = _cfg.get('max_error_rate', 0.01)
+
+        proc = None
+        base_url = self.base_url
+        if _cfg.get('launch_server', True):
+            proc, _ttfr = self.launch_server(extra_args=['--diagnose-resources'] + _cfg.get('server_args', []))
+            self.results['server_started'] = _ttfr is not None
+            if _ttfr is None:
+                self.stop_server(proc)
+                cprint_err("ERROR: Server to soak didn't start")
+                return self.ERR_REQ_FAILED
+            base_url = f"http://{self.server_config.get('launch_server_name', 'localhost:8890')}/"
+
+        def _on_sample(sample):
+            if self.results_sink is not None:
+                self.results_sink.record_sample('soak', sample)
+
+        cprint_info(f"INFO: Soaking {base_url} for {duration:g} s at {rate:g} requests per second")
+        try:
+            result = soak.run(base_url, duration, rate, n_workers, interval, _cfg.get('mix'),
+                              _cfg.get('first_category_id', 90000), self.timeout or 10, on_sample=_on_sample)
+        finally:
+            if proc is not None:
+                self.stop_server(proc)
+
+        trends = soak.find_leaks(result['samples'], _thresholds, _cfg.get('warmup', soak.DEFAULT_WARMUP),
+                                 _cfg.get('min_r2', soak.DEFAULT_MIN_R2))
+        cprint_info(f"INFO: {result['requests']} requests, {result['errors']} errors, {result['late']} late."
+                    f" Status codes {result['statuses']}")
+        self.results.update(leaks=[_trend['metric'] for _trend in trends if _trend['leak']],
+                            server_sampled=any(_trend['metric'] in soak.SERVER_FIELDS for _trend in trends),
+                            requests=result['requests'], errors=result['errors'],
+                            max_errors=_max_error_rate * max(result['requests'], 1))
+        ret = self.__check_soak_trends(trends)
+        if not any(_trend['metric'] in soak.SERVER_FIELDS for _trend in trends):
+            cprint_err(f"ERROR: The server's resources couldn't be sampled from {soak.RESOURCES_PATH}")
+            ret = self.ERR_REQ_FAILED
+        if result['errors'] > _max_error_rate * max(result['requests'], 1):
+            cprint_err(f"ERROR: {result['errors']} of {result['requests']} requests failed")
+            ret = self.ERR_WRONG_STATUS
+        if ret == self.ERR_NONE:
+            cprint_suc(f"No resource grew over {len(result['samples'])} samples")
+        return ret
+
+
+def _recorded_check(func):
+    """
+    Records what a test_* method returned on the tester's results sink, and
+    clears the results of the method before
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        self.results = {}
+        if self.results_sink is None:
+            return func(self, *args, **kwargs)
+        _start = time.perf_counter()
+        ret = func(self, *args, **kwargs)
+        self.results_sink.record_check(func.__name__, ret, (time.perf_counter() - _start) * 1000)
+        return ret
+    return wrapper
+
+# Every check of the tester gets its error code streamed with the results
+for _name, _func in list(vars(RestTester).items()):
+    if _name.startswith('test_') and callable(_func):
+        setattr(RestTester, _name, _recorded_check(_func))
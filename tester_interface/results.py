@@ -0,0 +1,244 @@
+"""
+Streaming results of a test run, as JSON lines
+
+Every RestTester check and every pytest test is written as a single JSON
+object per line, and so is every request sent by the tester when asked to:
+those make most of the file. Records are written out in batches, so the
+file never holds more than a batch in memory and can be followed while the
+run goes on. open_run() gives each run a file of its own in a results
+directory, and removes the oldest ones. A file passed to ResultsSink may
+also be shared by several runs, each record carries the id of its run.
+
+Record types:
+    run:     {"type", "run", "ts", "base_url"}
+    request: {"type", "run", "test", "ts", "method", "path", "status",
+              "ms", "attempts", "error"}
+    check:   {"type", "run", "test", "ts", "name", "code", "ms"}
+    test:    {"type", "run", "test", "ts", "outcome", "ms", "message"}
+    profile: {"type", "run", "test", "ts", "id", "method", "path", "status",
+              "client_ms", "total_ms", "sql_ms", "sql_count", "marshal_ms",
+              "samples", "sql_statements", "folded"}
+    sample:  {"type", "run", "test", "ts", "series", "values"}
+    trend:   {"type", "run", "test", "ts", "series", "metric", "start",
+              "end", "first", "last", "growth", "per_hour", "r2", "threshold", "leak"}
+
+See tester_interface/report.py to turn the file into an HTML summary.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlsplit
+
+# Results files open_run() leaves in a directory, the oldest are removed
+DEFAULT_KEEP = 20
+
+
+class ResultsSink():
+    """
+    Thread-safe, append-only writer of result records
+    """
+    def __init__(self, path, batch_size=500, base_url=None, requests=False, run_id=None):
+        """
+        Args:
+            path (str): File to append records to
+            batch_size (int): Records held before writing them out
+            base_url (str): Recorded on the run record
+            requests (bool): Also record every request, see record_request()
+            run_id (str): Id of the run, a new one by default
+        """
+        self.path = path
+        self.batch_size = max(1, int(batch_size))
+        self.requests = requests
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.current_test = None
+        self.__lock = threading.Lock()
+        self.__batch = []
+        _dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(_dir, exist_ok=True)
+        self.__file = open(path, 'a')
+        self.__append({'type': 'run', 'base_url': base_url})
+
+    def __append(self, record):
+        record['run'] = self.run_id
+        record.setdefault('ts', time.time())
+        _line = json.dumps(record, separators=(',', ':'))
+        with self.__lock:
+            self.__batch.append(_line)
+            if len(self.__batch) >= self.batch_size:
+                self.__flush()
+
+    def __flush(self):
+        if self.__batch and self.__file is not None:
+            self.__file.write('\n'.join(self.__batch) + '\n')
+            self.__file.flush()
+        self.__batch = []
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def close(self):
+        with self.__lock:
+            self.__flush()
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def record_request(self, method, url, start, status, elapsed_ms, attempts, error=None):
+        """
+        Records a request if the sink was created with requests=True, does
+        nothing otherwise
+
+        Args:
+            start (float): time.time() when the request was sent
+            status (int): Status code of the last attempt, None if it failed
+                to connect or timed out
+            elapsed_ms (float): Time taken, retries included
+            error (str): Exception name when there was no response
+        """
+        if not self.requests:
+            return
+        self.__append({
+            'type': 'request',
+            'test': self.current_test,
+            'ts': start,
+            'method': method,
+            'path': urlsplit(url).path,
+            'status': status,
+            'ms': round(elapsed_ms, 3),
+            'attempts': attempts,
+            'error': error,
+        })
+
+    def record_check(self, name, code, elapsed_ms):
+        """
+        Records what a RestTester test_* method returned
+        """
+        self.__append({
+            'type': 'check',
+            'test': self.current_test,
+            'name': name,
+            'code': code,
+            'ms': round(elapsed_ms, 3),
+        })
+
+    def record_test(self, test, outcome, elapsed_ms, message=None):
+        self.__append({
+            'type': 'test',
+            'test': test,
+            'outcome': outcome,
+            'ms': round(elapsed_ms, 3),
+            'message': message,
+        })
+
+    def record_profile(self, profile, client_ms):
+        """
+        Records a server side profile, as served by
+        /api/diagnostics/profiles/<id>
+
+        Args:
+            profile (dict): The profile, with its folded stacks
+            client_ms (float): Latency of the request as the tester saw it
+        """
+        _record = {_key: profile.get(_key) for _key in (
+            'id', 'method', 'path', 'status', 'total_ms', 'sql_ms', 'sql_count', 'marshal_ms',
+            'samples', 'sql_statements', 'folded')}
+        _record.update({'type': 'profile', 'test': self.current_test, 'client_ms': round(client_ms, 3)})
+        self.__append(_record)
+
+    def record_sample(self, series, values):
+        """
+        Records metrics sampled at one point of a run, such as the resources
+        of a soak test, see soak.py
+
+        Args:
+            series (str): Name of the time series the sample belongs to
+            values (dict): Metric -> value, with 't' seconds from the start
+        """
+        self.__append({'type': 'sample', 'test': self.current_test, 'series': series, 'values': values})
+
+    def record_trend(self, series, trend):
+        """
+        Records the line fitted to a metric of a time series, as returned by
+        soak.find_leaks()
+        """
+        _record = dict(trend)
+        _record.update({'type': 'trend', 'test': self.current_test, 'series': series})
+        self.__append(_record)
+
+
+def open_run(results_dir, keep=DEFAULT_KEEP, **kwargs):
+    """
+    ResultsSink writing to a new file of results_dir, named after the time
+    the run started and its id. Removes the oldest files of the directory so
+    at most keep are left, this one included
+
+    Args:
+        keep (int): None to keep every file
+        kwargs: Passed to ResultsSink
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    if keep is not None:
+        _files = _results_files(results_dir)
+        for _name in _files[:max(0, len(_files) - keep + 1)]:
+            os.remove(os.path.join(results_dir, _name))
+    _run_id = uuid.uuid4().hex[:12]
+    _name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{_run_id}.ndjson"
+    return ResultsSink(os.path.join(results_dir, _name), run_id=_run_id, **kwargs)
+
+
+def _results_files(results_dir):
+    "Names of the results files of a directory, oldest first"
+    return sorted(_name for _name in os.listdir(results_dir) if _name.endswith('.ndjson'))
+
+
+def results_file(path):
+    """
+    path itself if it's a file, the newest results file in it if it's a
+    directory written by open_run()
+
+    Raises:
+        FileNotFoundError: If the directory has no results file
+    """
+    if not os.path.isdir(path):
+        return path
+    _files = _results_files(path)
+    if not _files:
+        raise FileNotFoundError(f"No results file in {path}")
+    return os.path.join(path, _files[-1])
+
+
+def read_records(path, run=None):
+    """
+    Iterates over the records of a results file, one line at a time
+
+    Args:
+        path (str): Results file, or directory of them to read the newest
+        run (str): Only yield the records of this run id
+    """
+    with open(results_file(path), 'r') as _f:
+        for _line in _f:
+            _line = _line.strip()
+            if not _line:
+                continue
+            try:
+                record = json.loads(_line)
+            except ValueError:
+                # Last line of a run that was killed while writing
+                continue
+            if run is None or record.get('run') == run:
+                yield record
+
+
+def last_run(path):
+    """
+    Id of the last run in a results file, None if there is none
+    """
+    run = None
+    for record in read_records(path):
+        if record.get('type') == 'run':
+            run = record['run']
+    return run
@@ -0,0 +1,143 @@
+"""
+Retry policy with exponential backoff, jitter and a retry budget
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header, either delay-seconds or an HTTP-date
+
+    Returns:
+        float: Seconds to wait, None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class RetryStats():
+    """
+    Counters for one test run. Shared between RestTester instances so the
+    numbers cover the whole run and not a single test.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0     # Logical requests sent
+        self.attempts = 0     # HTTP attempts, including retries
+        self.retries = 0      # Attempts after the first one
+        self.recovered = 0    # Requests that succeeded after a retry
+        self.exhausted = 0    # Requests still failing after max_retries
+        self.budget_denied = 0  # Retries skipped because the budget ran out
+        self.transient = {}   # Status code (or exception name) -> count
+
+    def record(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def record_transient(self, reason):
+        with self._lock:
+            self.transient[reason] = self.transient.get(reason, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'attempts': self.attempts,
+                'retries': self.retries,
+                'recovered': self.recovered,
+                'exhausted': self.exhausted,
+                'budget_denied': self.budget_denied,
+                'transient': dict(self.transient),
+            }
+
+    def summary(self):
+        _d = self.as_dict()
+        _transient = ", ".join(f"{k}: {v}" for k, v in sorted(_d['transient'].items(), key=str))
+        return (f"{_d['requests']} requests, {_d['attempts']} attempts, "
+                f"{_d['retries']} retries ({_d['recovered']} recovered, "
+                f"{_d['exhausted']} exhausted, {_d['budget_denied']} denied by budget)"
+                + (f". Transient failures: {_transient}" if _transient else ""))
+
+
+class RetryPolicy():
+    """
+    Decides whether and when a failed request is retried
+
+    Args:
+        max_retries (int): Retries per request on top of the first attempt
+        backoff_base (float): Backoff of the first retry, in seconds
+        backoff_cap (float): Upper bound of any single backoff, in seconds
+        budget_ratio (float): Retries allowed per request sent, run wide
+        budget_min (int): Retries always allowed, regardless of the ratio
+        retry_statuses (list): HTTP status codes considered transient
+        retry_after_cap (float): Longest Retry-After the client will honour,
+            in seconds. Longer ones are treated as a failure
+    """
+    # 500 is left out on purpose: for this API it usually means a bug that
+    # will fail the same way on every attempt
+    DEFAULT_RETRY_STATUSES = (408, 429, 502, 503, 504)
+
+    def __init__(self, max_retries=0, backoff_base=0.05, backoff_cap=2.0,
+                 budget_ratio=0.1, budget_min=10, retry_statuses=None,
+                 retry_after_cap=30.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+        if retry_statuses is None:
+            retry_statuses = self.DEFAULT_RETRY_STATUSES
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_after_cap = retry_after_cap
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds a policy from the 'retry' section of config.json
+        """
+        return cls(**(config or {}))
+
+    def is_transient(self, status_code):
+        return status_code in self.retry_statuses
+
+    def backoff(self, attempt):
+        """
+        Full jitter backoff: a random delay between 0 and base * 2^attempt,
+        capped at backoff_cap. Spreads retries from concurrent clients so they
+        don't hit the server in lockstep
+        """
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Time to wait before the next attempt. The server's Retry-After wins
+        over our own backoff when it asks for a longer wait
+
+        Returns:
+            float: Seconds to wait, None if Retry-After is above the cap
+        """
+        _backoff = self.backoff(attempt)
+        if retry_after is None:
+            return _backoff
+        if retry_after > self.retry_after_cap:
+            return None
+        return max(_backoff, retry_after)
+
+    def budget_allows(self, stats):
+        """
+        Checks if the run still has retries left. The budget grows with the
+        number of requests sent, so retries can never multiply the load on
+        the server by more than (1 + budget_ratio)
+        """
+        return stats.retries < self.budget_min + self.budget_ratio * stats.requests
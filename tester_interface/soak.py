@@ -0,0 +1,458 @@
+"""
+Soak test: a steady mixed workload for a long time, watching for leaks
+
+Leaks that take hours to matter, such as memory held by SQLAlchemy sessions
+or their identity maps, file descriptors of responses never closed, or a
+database journal that keeps growing, don't show in short tests. A soak run
+sends the same mix of requests at a fixed rate for its whole duration, and
+every interval samples:
+
+    * the server, from /api/diagnostics/resources: resident memory, open
+      file descriptors, threads, objects tracked by the garbage collector,
+      SQLAlchemy sessions alive and the objects in their identity maps,
+      pooled connections checked out, database and journal or WAL size
+    * the client, this process: open file descriptors, and TCP connections
+      to the server, read from /proc (None elsewhere)
+    * the requests of the interval: how many, errors and latency
+
+The workload only reads, except for each worker creating, renaming and
+deleting a category of its own, so the data stays the same size. Anything
+that keeps growing is a leak, or the change log, which grows by a row per
+write.
+
+Once done, a line is fitted to each metric by least squares, leaving out
+the warm up at the start, when caches and pools fill. A metric leaks when
+its line grows by more than its threshold over the run, and fits the
+samples well enough (r squared) that the growth is a trend, not noise.
+
+Long runs are started from the command line, against an API run with
+--diagnose-resources, samples and trends go to the results file for the HTML
+report:
+
+    python -m tester_interface.soak --base-url http://localhost:8888/
+        --duration 14400 [--rate 40] [--interval 30] [--results test_results]
+
+exits with 1 when a leak is found.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+from tester_interface.histogram import Histogram
+
+RESOURCES_PATH = "/api/diagnostics/resources"
+# Requests of the mix, with how often workers pick them. 'write' is the next
+# step of the worker's create, rename and delete cycle on its own category
+DEFAULT_MIX = {'categories': 3, 'category': 3, 'posts': 3, 'post': 2, 'write': 1}
+
+READS = {
+    'categories': "/api/blog/categories/",
+    'category':   "/api/blog/categories/1",
+    'posts':      "/api/blog/posts/?page=1&per_page=10",
+    'post':       "/api/blog/posts/1",
+}
+
+# Growth over a run, after the warm up, past which a steady trend is a leak
+DEFAULT_THRESHOLDS = {
+    'server_rss_bytes':        32 * 2 ** 20,
+    'server_open_fds':         16,
+    'server_threads':          16,
+    'server_gc_objects':       100000,
+    'server_sessions':         8,
+    'server_identity_map':     1000,
+    'server_pool_checked_out': 4,
+    'db_bytes':                16 * 2 ** 20,
+    'db_journal_bytes':        16 * 2 ** 20,
+    'client_open_fds':         16,
+    'client_connections':      16,
+}
+
+# Server metrics, from the fields of /api/diagnostics/resources
+SERVER_FIELDS = {
+    'server_rss_bytes':        'rss_bytes',
+    'server_open_fds':         'open_fds',
+    'server_threads':          'threads',
+    'server_gc_objects':       'gc_objects',
+    'server_sessions':         'sessions',
+    'server_identity_map':     'identity_map',
+    'server_pool_checked_out': 'pool_checked_out',
+    'db_bytes':                'db_bytes',
+    'db_journal_bytes':        'db_journal_bytes',
+}
+
+DIGITS = 3
+
+# Share of the run left out of the fits, and how well a line must fit the
+# samples for its growth to count
+DEFAULT_WARMUP = 0.2
+DEFAULT_MIN_R2 = 0.5
+
+
+###############################################################################
+# Client resources
+def _socket_inodes():
+    inodes = set()
+    for _fd in os.listdir('/proc/self/fd'):
+        try:
+            _link = os.readlink(f'/proc/self/fd/{_fd}')
+        except OSError:
+            continue
+        if _link.startswith('socket:['):
+            inodes.add(_link[8:-1])
+    return inodes
+
+
+def client_resources(port):
+    """
+    Open file descriptors of this process, and its TCP connections to port,
+    in any state but TIME_WAIT, which belongs to no process anymore
+
+    Returns:
+        dict: 'client_open_fds' and 'client_connections', None outside Linux
+    """
+    try:
+        _inodes = _socket_inodes()
+        _fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return {'client_open_fds': None, 'client_connections': None}
+    connections = 0
+    for _table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(_table, 'r') as _f:
+                _lines = _f.readlines()[1:]
+        except OSError:
+            continue
+        for _line in _lines:
+            _fields = _line.split()
+            if int(_fields[2].rsplit(':', 1)[1], 16) == port and _fields[9] in _inodes:
+                connections += 1
+    return {'client_open_fds': _fds, 'client_connections': connections}
+
+
+###############################################################################
+# Trends
+def fit_line(ts, values):
+    """
+    Least squares line through (ts, values)
+
+    Returns:
+        tuple: (slope, intercept, r squared). r squared is 1 when values
+            don't change, as a flat line fits them perfectly
+    """
+    n = len(ts)
+    _mean_t = sum(ts) / n
+    _mean_v = sum(values) / n
+    _stt = sum((_t - _mean_t) ** 2 for _t in ts)
+    _svv = sum((_v - _mean_v) ** 2 for _v in values)
+    _stv = sum((_t - _mean_t) * (_v - _mean_v) for _t, _v in zip(ts, values))
+    slope = _stv / _stt if _stt else 0.0
+    r2 = _stv * _stv / (_stt * _svv) if _stt and _svv else 1.0
+    return slope, _mean_v - slope * _mean_t, r2
+
+
+def find_leaks(samples, thresholds=None, warmup=DEFAULT_WARMUP, min_r2=DEFAULT_MIN_R2):
+    """
+    Fits a line to each metric with a threshold, over the samples after the
+    warm up
+
+    Args:
+        samples (list): Dicts with 't', seconds from the start, and metrics
+        thresholds (dict): Metric -> growth over the run that is a leak
+        warmup (float): Share of the run left out, from the start
+
+    Returns:
+        list: Per metric, dict of 'metric', 'start' and 'end' seconds of the
+            samples fitted, 'first' and 'last' fitted values, 'growth', 'per_hour', 'r2', 'threshold'
+            and 'leak'. Metrics with under 3 samples are left out
+    """
+    thresholds = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+    if not samples:
+        return []
+    _from = samples[-1]['t'] * warmup
+    trends = []
+    for metric, threshold in thresholds.items():
+        _points = [(_s['t'], _s[metric]) for _s in samples if _s['t'] >= _from and _s.get(metric) is not None]
+        if len(_points) < 3:
+            continue
+        ts, values = [_t for _t, _ in _points], [_v for _, _v in _points]
+        slope, intercept, r2 = fit_line(ts, values)
+        growth = slope * (ts[-1] - ts[0])
+        trends.append({
+            'metric': metric,
+            'start': ts[0],
+            'end': ts[-1],
+            'first': intercept + slope * ts[0],
+            'last': intercept + slope * ts[-1],
+            'growth': growth,
+            'per_hour': slope * 3600,
+            'r2': r2,
+            'threshold': threshold,
+            'leak': growth > threshold and r2 >= min_r2,
+        })
+    return trends
+
+
+###############################################################################
+# Workload
+class IntervalStats():
+    "Requests completed during one sampling interval"
+    def __init__(self):
+        self.latency = Histogram(DIGITS)  # us
+        self.requests = 0
+        self.errors = 0
+        self.statuses = {}
+
+    def add(self, latency_us, status, error):
+        self.requests += 1
+        self.latency.record(latency_us)
+        _key = error if error is not None else status
+        self.statuses[_key] = self.statuses.get(_key, 0) + 1
+        # 503 is load shedding, the request was turned away before any work
+        if error is not None or (status >= 500 and status != 503):
+            self.errors += 1
+
+
+class Worker():
+    """
+    Sends its share of the mix on a fixed cadence, over a session of its own
+    """
+    def __init__(self, base_url, run_id, mix, category_id, rng):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.category_id = category_id
+        self.names, self.weights = list(mix), list(mix.values())
+        self.rng = rng
+        self.__writes = itertools.cycle(('create', 'rename', 'delete'))
+        self.__run_id = run_id
+
+    def __write(self, timeout):
+        _step = next(self.__writes)
+        _url = urljoin(self.base_url, f"/api/blog/categories/{self.category_id}" if _step != 'create' else
+                       "/api/blog/categories/")
+        if _step == 'create':
+            return self.session.post(_url, json={'id': self.category_id, 'name': f"Soak {self.__run_id}"},
+                                     timeout=timeout)
+        if _step == 'rename':
+            return self.session.put(_url, json={'name': f"Soak {self.__run_id} renamed"}, timeout=timeout)
+        return self.session.delete(_url, timeout=timeout)
+
+    def send(self, timeout):
+        """
+        Sends a request of the mix, and reads the response in full
+
+        Returns:
+            int: Status code
+        """
+        _name = self.rng.choices(self.names, self.weights)[0]
+        if _name == 'write':
+            _response = self.__write(timeout)
+        else:
+            _response = self.session.get(urljoin(self.base_url, READS[_name]), timeout=timeout)
+        with _response:
+            _response.content
+            return _response.status_code
+
+    def close(self):
+        self.session.close()
+
+
+def sample_server(session, url, timeout):
+    "Server metrics, None each if the request failed"
+    try:
+        with session.get(url, timeout=timeout) as _response:
+            _resources = _response.json() if _response.status_code == 200 else {}
+    except (requests.exceptions.RequestException, ValueError):
+        _resources = {}
+    return {_metric: _resources.get(_field) for _metric, _field in SERVER_FIELDS.items()}
+
+
+class _Pacer():
+    """
+    Sends the requests of the workers of run() when due, one every period
+    seconds each, from start to end, and keeps the stats of the interval
+    """
+    def __init__(self, start, end, period, interval, timeout, stop):
+        self.start = start
+        self.end = end
+        self.period = period
+        self.interval = interval
+        self.timeout = timeout
+        self.stop = stop
+        self.late = 0
+        self.__current = IntervalStats()
+        self.__lock = threading.Lock()
+
+    def work(self, worker, offset):
+        "Sends the requests of worker, offset seconds into each period"
+        # Evenly spread over the period, so workers don't send in waves
+        _next = self.start + offset
+        while not self.stop.is_set():
+            _wait = _next - time.perf_counter()
+            if _wait > 0 and self.stop.wait(_wait):
+                break
+            if _next >= self.end:
+                break
+            _sent = time.perf_counter()
+            status = error = None
+            try:
+                status = worker.send(self.timeout)
+            except requests.exceptions.RequestException as e:
+                error = type(e).__name__
+            _latency = (time.perf_counter() - _sent) * 1e6
+            with self.__lock:
+                self.__current.add(_latency, status, error)
+            _next += self.period
+            if time.perf_counter() - _next > self.interval:
+                # Fell that far behind, skip ahead rather than burst
+                with self.__lock:
+                    self.late += 1
+                _next = time.perf_counter()
+
+    def take(self):
+        "IntervalStats since the last call, starting the next interval"
+        with self.__lock:
+            _stats, self.__current = self.__current, IntervalStats()
+        return _stats
+
+
+def run(base_url, duration, rate=40, workers=8, interval=10, mix=None, first_category_id=90000,
+        timeout=10, seed=None, on_sample=None, stop=None):
+    """
+    Sends the mix at rate requests per second for duration seconds, and
+    samples resources every interval seconds
+
+    Args:
+        rate (float): Requests per second, split evenly between the workers
+        first_category_id (int): Workers write to the categories from this
+            id on, one each
+        on_sample (callable): Called with each sample as it's taken
+        stop (threading.Event): Set to end the run early
+
+    Returns:
+        dict: 'samples' list of dicts with 't', seconds from the start,
+            'requests', 'errors', 'p50_ms', 'p99_ms' of the interval and the
+            metrics, 'statuses' of every request, 'requests', 'errors' and
+            'late', how many requests were sent over an interval late
+    """
+    mix = mix or DEFAULT_MIX
+    stop = stop or threading.Event()
+    _run_id = uuid.uuid4().hex[:8]
+    _rng = random.Random(seed)
+    _port = urlsplit(base_url).port or 80
+    _url_resources = urljoin(base_url, RESOURCES_PATH)
+    statuses = {}
+    _period = workers / rate
+
+    _workers = [Worker(base_url, _run_id, mix, first_category_id + _i, random.Random(_rng.random()))
+                for _i in range(workers)]
+    _start = time.perf_counter()
+    _end = _start + duration
+    pacer = _Pacer(_start, _end, _period, interval, timeout, stop)
+
+    samples = []
+    _sampler_session = requests.Session()
+    _threads = [threading.Thread(target=pacer.work, args=(_w, _period * _i / workers), daemon=True)
+                for _i, _w in enumerate(_workers)]
+    for _thread in _threads:
+        _thread.start()
+    try:
+        _next_sample = _start + interval
+        while True:
+            _last = _next_sample >= _end
+            if stop.wait(max(0.0, min(_next_sample, _end) - time.perf_counter())):
+                _last = True
+            if _last:
+                for _thread in _threads:
+                    _thread.join()
+            _stats = pacer.take()
+            sample = {
+                't': round(time.perf_counter() - _start, 3),
+                'requests': _stats.requests,
+                'errors': _stats.errors,
+                'p50_ms': _stats.latency.percentile(50) / 1000,
+                'p99_ms': _stats.latency.percentile(99) / 1000,
+            }
+            sample.update(sample_server(_sampler_session, _url_resources, timeout))
+            sample.update(client_resources(_port))
+            samples.append(sample)
+            for _key, _n in _stats.statuses.items():
+                statuses[_key] = statuses.get(_key, 0) + _n
+            if on_sample is not None:
+                on_sample(sample)
+            if _last:
+                break
+            _next_sample += interval
+    finally:
+        stop.set()
+        for _thread in _threads:
+            _thread.join()
+        for _worker in _workers:
+            _worker.close()
+        _sampler_session.close()
+    return {
+        'samples': samples,
+        'statuses': statuses,
+        'requests': sum(_s['requests'] for _s in samples),
+        'errors': sum(_s['errors'] for _s in samples),
+        'late': pacer.late,
+    }
+
+
+###############################################################################
+# Command line
+def format_value(metric, value):
+    if metric.endswith('_bytes'):
+        return f"{value / 2 ** 20:.2f} MiB"
+    return f"{round(value)}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs a soak test against an API, and looks for leaks')
+    parser.add_argument('--base-url', default='http://localhost:8888/')
+    parser.add_argument('--duration', type=float, default=3600, help='Seconds (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=40, help='Requests per second (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=8, help='Threads sending (default: %(default)s)')
+    parser.add_argument('--interval', type=float, default=30,
+                        help='Seconds between samples (default: %(default)s)')
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP,
+                        help='Share of the run left out of the trends (default: %(default)s)')
+    parser.add_argument('--results', help='Results directory to write the samples and trends to, in a new file')
+    args = parser.parse_args(argv)
+
+    sink = None
+    if args.results:
+        from tester_interface.results import open_run
+        sink = open_run(args.results, base_url=args.base_url)
+        sink.current_test = 'soak'
+
+    def _on_sample(sample):
+        print(f"{sample['t']:>8.0f} s  {sample['requests']:>6} requests  {sample['errors']:>4} errors  "
+              f"p99 {sample['p99_ms']:>7.1f} ms  server RSS "
+              f"{format_value('server_rss_bytes', sample['server_rss_bytes'] or 0)}  fds {sample['server_open_fds']}")
+        if sink is not None:
+            sink.record_sample('soak', sample)
+
+    result = run(args.base_url, args.duration, args.rate, args.workers, args.interval, on_sample=_on_sample)
+    trends = find_leaks(result['samples'], warmup=args.warmup)
+    print(f"{result['requests']} requests, {result['errors']} errors, statuses {result['statuses']}")
+    for _trend in trends:
+        print(f"  {_trend['metric']:<24} {format_value(_trend['metric'], _trend['first']):>12} -> "
+              f"{format_value(_trend['metric'], _trend['last']):>12}  r2 {_trend['r2']:.2f}"
+              f"{'  LEAK' if _trend['leak'] else ''}")
+        if sink is not None:
+            sink.record_trend('soak', _trend)
+    if sink is not None:
+        sink.close()
+    return 1 if any(_trend['leak'] for _trend in trends) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
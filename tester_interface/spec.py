@@ -0,0 +1,281 @@
+"""
+Swagger spec of the API, with response validators compiled once per model
+"""
+import re
+import requests
+from urllib.parse import urljoin
+
+
+class ApiSpec():
+    """
+    Loads swagger.json and compiles a validator for every model in it.
+
+    Validators are plain closures built once, so checking a response is a
+    few dict lookups and type checks per field. They are fast enough to run
+    on every response of a load run.
+
+    Models can be referred to by their Swagger name ('Blog post') or by the
+    name of the serializer on the API ('blog_post').
+    """
+    SPEC_PATH = "/api/swagger.json"
+
+    # Serializer name on the API -> model name in the spec
+    MODEL_ALIASES = {
+        'blog_post': 'Blog post',
+        'pagination': 'A page of results',
+        'page_of_blog_posts': 'Page of blog posts',
+        'category': 'Blog category',
+        'category_with_posts': 'Blog category with posts',
+    }
+
+    # Validation error kinds
+    MISSING = 'missing'
+    EXTRA = 'extra'
+    TYPE = 'type'
+
+    _DATE_TIME = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.base_path = spec.get('basePath', '')
+        self.paths = spec.get('paths', {})
+        self.definitions = spec.get('definitions', {})
+        self.__validators = {}
+        for _name in self.definitions:
+            self.__compile_ref(_name)
+
+    @classmethod
+    def load(cls, base_url, timeout=None):
+        """
+        Fetches and parses the spec served by the API at base_url
+        """
+        req = requests.get(urljoin(base_url, cls.SPEC_PATH), timeout=timeout)
+        req.raise_for_status()
+        return cls(req.json())
+
+    ###########################################################################
+    # Routes
+    def path(self, template, **params):
+        """
+        Full URL path of a route in the spec, e.g.
+        path('/blog/categories/{id}', id=4) -> '/api/blog/categories/4'
+
+        Raises:
+            KeyError: If the route is not in the spec
+        """
+        if template not in self.paths:
+            raise KeyError(f"Route {template} is not in the spec")
+        return self.base_path + template.format(**params)
+
+    def has_path(self, full_path):
+        """
+        Checks if a full path such as '/api/blog/categories/' is a route of
+        the spec
+        """
+        return full_path.startswith(self.base_path) and full_path[len(self.base_path):] in self.paths
+
+    def response_model(self, template, method, code='200'):
+        """
+        Name of the model returned by a route, None if it has no body
+        """
+        _schema = self.paths[template][method.lower()]['responses'].get(str(code), {}).get('schema')
+        if _schema is None:
+            return None
+        if _schema.get('type') == 'array':
+            _schema = _schema['items']
+        return _schema['$ref'].rsplit('/', 1)[-1]
+
+    ###########################################################################
+    # Request generation
+    def properties(self, model):
+        """
+        Returns:
+            tuple: (dict, set) properties of a model, with allOf merged, and
+                the names of the required ones
+        """
+        return self.__flatten(self.definitions[self.MODEL_ALIASES.get(model, model)])
+
+    def example(self, model, optional=False):
+        """
+        Builds a valid request body for a model
+
+        Args:
+            model (str): Model name or alias
+            optional (bool): Also fill in properties that are not required
+        """
+        _props, _required = self.properties(model)
+        return {_name: self.__example_value(_schema) for _name, _schema in _props.items()
+                if optional or _name in _required}
+
+    def __example_value(self, schema):
+        if '$ref' in schema:
+            return self.example(schema['$ref'].rsplit('/', 1)[-1])
+        _type = schema.get('type')
+        if _type == 'integer':
+            return 1
+        if _type == 'number':
+            return 1.5
+        if _type == 'boolean':
+            return True
+        if _type == 'array':
+            return [self.__example_value(schema['items'])]
+        if schema.get('format') == 'date-time':
+            return "2016-06-11T15:56:29"
+        return "string"
+
+    ###########################################################################
+    # Validation
+    def validate(self, model, value):
+        """
+        Validates a response body against a model
+
+        Returns:
+            list: (kind, path, message) tuples, empty if the body is valid.
+                kind is one of MISSING, EXTRA and TYPE
+        """
+        errors = []
+        self.__validators[self.MODEL_ALIASES.get(model, model)](value, '$', errors)
+        return errors
+
+    def validate_list(self, model, values):
+        """
+        Same as validate, for a response that is a list of models
+        """
+        errors = []
+        _check = self.__validators[self.MODEL_ALIASES.get(model, model)]
+        if type(values) is not list:
+            errors.append((self.TYPE, '$', f"expected array, got {type(values).__name__}"))
+            return errors
+        for idx, value in enumerate(values):
+            _check(value, f"$[{idx}]", errors)
+        return errors
+
+    def request_errors(self, model, body):
+        """
+        Checks a request body the way the API validates payloads (JSON
+        schema draft 4): an object, with the required properties, and every
+        property given of its declared type. null is not of any type, and
+        1.0 or true are not integers. Properties not in the model are
+        allowed
+
+        Returns:
+            list: Messages, empty if the API should accept the body
+        """
+        if type(body) is not dict:
+            return [f"body: expected object, got {type(body).__name__}"]
+        _props, _required = self.properties(model)
+        errors = [f"{_name}: missing" for _name in sorted(_required) if _name not in body]
+        for _name, _value in body.items():
+            _schema = _props.get(_name)
+            if _schema is not None and not self.__request_type_ok(_schema, _value):
+                errors.append(f"{_name}: expected {_schema.get('type', 'object')}, got {_value!r}")
+        return errors
+
+    @staticmethod
+    def __request_type_ok(schema, value):
+        _type = schema.get('type')
+        if '$ref' in schema or _type == 'object':
+            return type(value) is dict
+        if _type == 'integer':
+            return type(value) is int
+        if _type == 'number':
+            return type(value) in (int, float)
+        if _type == 'boolean':
+            return type(value) is bool
+        if _type == 'string':
+            return type(value) is str
+        if _type == 'array':
+            return type(value) is list
+        return True
+
+    def __flatten(self, schema):
+        """
+        Merges allOf sub-schemas into one set of properties
+        """
+        if '$ref' in schema:
+            return self.__flatten(self.definitions[schema['$ref'].rsplit('/', 1)[-1]])
+        _props = dict(schema.get('properties', {}))
+        _required = set(schema.get('required', ()))
+        for _sub in schema.get('allOf', ()):
+            _sub_props, _sub_required = self.__flatten(_sub)
+            _props.update(_sub_props)
+            _required.update(_sub_required)
+        return _props, _required
+
+    def __compile_ref(self, name):
+        if name not in self.__validators:
+            # Placeholder so that recursive models resolve to the same check
+            _compiled = []
+            self.__validators[name] = lambda value, path, errors: _compiled[0](value, path, errors)
+            _compiled.append(self.__compile(self.definitions[name]))
+            self.__validators[name] = _compiled[0]
+        return self.__validators[name]
+
+    def __compile(self, schema):
+        if '$ref' in schema:
+            _name = schema['$ref'].rsplit('/', 1)[-1]
+            if _name in self.__validators:
+                return self.__validators[_name]
+            return lambda value, path, errors: self.__compile_ref(_name)(value, path, errors)
+        if 'allOf' in schema or 'properties' in schema or schema.get('type') == 'object':
+            return self.__compile_object(schema)
+        _type = schema.get('type')
+        if _type == 'array':
+            return self.__compile_array(schema)
+        return self.__compile_scalar(_type, schema.get('format'))
+
+    def __compile_object(self, schema):
+        _props, _required = self.__flatten(schema)
+        _checks = {_name: self.__compile(_sub) for _name, _sub in _props.items()}
+        _required = frozenset(_required)
+        MISSING, EXTRA, TYPE = self.MISSING, self.EXTRA, self.TYPE
+
+        # Marshalled responses always carry every field of the model, set to
+        # null when there is no value. Only required fields must be non null
+        def check(value, path, errors):
+            if type(value) is not dict:
+                errors.append((TYPE, path, f"expected object, got {type(value).__name__}"))
+                return
+            for _name in _checks:
+                if _name not in value or (_name in _required and value[_name] is None):
+                    errors.append((MISSING, f"{path}.{_name}", f"Missing {_name} in response"))
+            for _name, _value in value.items():
+                _check = _checks.get(_name)
+                if _check is None:
+                    errors.append((EXTRA, f"{path}.{_name}", f"Invalid field: {_name}"))
+                elif _value is not None:
+                    _check(_value, f"{path}.{_name}", errors)
+        return check
+
+    def __compile_array(self, schema):
+        _item = self.__compile(schema.get('items', {}))
+        TYPE = self.TYPE
+
+        def check(value, path, errors):
+            if type(value) is not list:
+                errors.append((TYPE, path, f"expected array, got {type(value).__name__}"))
+                return
+            for idx, _value in enumerate(value):
+                _item(_value, f"{path}[{idx}]", errors)
+        return check
+
+    def __compile_scalar(self, _type, _format):
+        TYPE = self.TYPE
+        if _type == 'integer':
+            _ok = lambda value: type(value) is int
+        elif _type == 'number':
+            _ok = lambda value: type(value) in (int, float)
+        elif _type == 'boolean':
+            _ok = lambda value: type(value) is bool
+        elif _type == 'string' and _format == 'date-time':
+            _match = self._DATE_TIME.match
+            _ok = lambda value: type(value) is str and _match(value) is not None
+        elif _type == 'string':
+            _ok = lambda value: type(value) is str
+        else:
+            return lambda value, path, errors: None
+
+        def check(value, path, errors):
+            if not _ok(value):
+                errors.append((TYPE, path, f"expected {_format or _type}, got {value!r}"))
+        return check
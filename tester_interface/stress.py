@@ -0,0 +1,352 @@
+"""
+Concurrency stress of the category CRUD, checked for linearizability
+
+Several clients send interleaved POST, PUT, DELETE and GET requests on a
+small set of category ids, so they keep racing each other on the same rows.
+Every request is recorded in a history with the time it was sent, the time
+its response arrived, and what it returned.
+
+The history is then checked against a model of the category table: each id
+is either absent or holds a name. It is linearizable if every request can be
+placed at a single point between its send and its response, in an order
+where each response is what the model returns. Requests on different ids
+never interact, so each id is checked on its own.
+
+Requests that got a 5xx or no response may or may not have been applied,
+the checker tries both. They are reported as anomalies either way.
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Operations, with how often the clients pick them
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+READ = 'read'
+DEFAULT_MIX = {CREATE: 2, UPDATE: 3, DELETE: 2, READ: 3}
+
+# Rate limited and load shed responses, the request was never processed
+THROTTLED = (429, 503)
+
+# Complete time of requests that got no response
+NEVER = float('inf')
+
+
+def _unknown(record):
+    "Checks if a request may or may not have been applied"
+    return record['status'] is None or (record['status'] >= 500 and record['status'] not in THROTTLED)
+
+
+###############################################################################
+# Model
+def created_names(name):
+    """
+    Names a category created with name may end up with. The API drops the
+    first letter of new categories, a known bug, so both are accepted
+    """
+    return [name, name[1:]]
+
+
+def _applied(state, record):
+    "States after applying record to state, whatever its response was"
+    op = record['op']
+    if op == CREATE:
+        return created_names(record['name']) if state is None else [state]
+    if op == UPDATE:
+        return [record['name']] if state is not None else [state]
+    if op == DELETE:
+        return [None]
+    return [state]
+
+
+def step(state, record):
+    """
+    Applies a request to one state of an id: None when absent, else its name
+
+    Returns:
+        list: States the id may be in after the request, empty if its
+            response is impossible from state
+    """
+    status = record['status']
+    if status in THROTTLED:
+        return [state]
+    if _unknown(record):
+        return [state] + _applied(state, record)
+    op = record['op']
+    if op == CREATE:
+        if status == 201:
+            return created_names(record['name']) if state is None else []
+        return [state] if state is not None else []
+    if op == UPDATE:
+        if status == 204:
+            return [record['name']] if state is not None else []
+        return [state] if state is None else []
+    if op == DELETE:
+        if status == 204:
+            return [None] if state is not None else []
+        return [state] if state is None else []
+    if status == 200:
+        return [state] if state is not None and state == record['value'] else []
+    return [state] if state is None else []
+
+
+def _step_all(states, record):
+    "step() over every state the id may be in"
+    _next = set()
+    for _state in states:
+        _next.update(step(_state, record))
+    return frozenset(_next)
+
+
+###############################################################################
+# Checker
+class _Events():
+    """
+    Call and return events of the requests of a history in time order, as a
+    doubly linked list from node 0, the head. Calls go before returns sent at
+    the same time, they may be concurrent. Node n is a call if kind[n] is 0,
+    a return if 1, of the request records[op[n]], and match[n] is the return
+    of a call
+    """
+    def __init__(self, records):
+        _events = []
+        for _idx, _record in enumerate(records):
+            _events.append((_record['invoke'], 0, _idx))
+            _events.append((_record['complete'], 1, _idx))
+        _events.sort()
+        n_nodes = len(_events) + 1
+        self.nxt = list(range(1, n_nodes)) + [None]
+        self.prv = [None] + list(range(0, n_nodes - 1))
+        self.kind = [None] + [_event[1] for _event in _events]
+        self.op = [None] + [_event[2] for _event in _events]
+        self.match = [None] * n_nodes
+        _returns = {self.op[_node]: _node for _node in range(1, n_nodes) if self.kind[_node] == 1}
+        for _node in range(1, n_nodes):
+            if self.kind[_node] == 0:
+                self.match[_node] = _returns[self.op[_node]]
+
+    def lift(self, node):
+        "Takes the call node and its return out of the list"
+        nxt, prv = self.nxt, self.prv
+        nxt[prv[node]] = nxt[node]
+        if nxt[node] is not None:
+            prv[nxt[node]] = prv[node]
+        _ret = self.match[node]
+        nxt[prv[_ret]] = nxt[_ret]
+        if nxt[_ret] is not None:
+            prv[nxt[_ret]] = prv[_ret]
+
+    def unlift(self, node):
+        "Puts back the call node and its return, undoing lift()"
+        nxt, prv = self.nxt, self.prv
+        _ret = self.match[node]
+        nxt[prv[_ret]] = _ret
+        if nxt[_ret] is not None:
+            prv[nxt[_ret]] = _ret
+        nxt[prv[node]] = node
+        if nxt[node] is not None:
+            prv[nxt[node]] = node
+
+
+def check_key(records, initial=None, max_steps=1000000):
+    """
+    Checks the history of a single id, with the search of Wing and Gong:
+    try to linearize the first pending request that was sent, back track
+    when nothing fits, and skip (linearized requests, states) already tried
+
+    Args:
+        records (list): Requests on the id
+        initial (str): Name of the id before the run, None if absent
+        max_steps (int): Gives up after trying this many requests
+
+    Returns:
+        dict: 'ok' True, False or None when max_steps ran out, 'steps', and
+            'stuck', the first request of the longest linearization found
+            that could not be placed
+    """
+    events = _Events(records)
+    states = frozenset([initial])
+    linearized = 0
+    stack = []
+    tried = set()
+    steps = 0
+    best = (0, 0)
+    node = events.nxt[0]
+    while events.nxt[0] is not None:
+        if steps >= max_steps:
+            return {'ok': None, 'steps': steps, 'stuck': None}
+        if events.kind[node] == 0:
+            steps += 1
+            _next = _step_all(states, records[events.op[node]])
+            _linearized = linearized | (1 << events.op[node])
+            if _next and (_linearized, _next) not in tried:
+                tried.add((_linearized, _next))
+                stack.append((node, states))
+                states, linearized = _next, _linearized
+                if len(stack) > best[0]:
+                    best = (len(stack), linearized)
+                events.lift(node)
+                node = events.nxt[0]
+            else:
+                node = events.nxt[node]
+        else:
+            # A request returned before the ones pending could be placed
+            if not stack:
+                _stuck = min((_idx for _idx in range(len(records)) if not best[1] & (1 << _idx)),
+                             key=lambda _idx: records[_idx]['invoke'])
+                return {'ok': False, 'steps': steps, 'stuck': _stuck}
+            node, states = stack.pop()
+            linearized &= ~(1 << events.op[node])
+            events.unlift(node)
+            node = events.nxt[node]
+    return {'ok': True, 'steps': steps, 'stuck': None}
+
+
+def excerpt(records, stuck, before=3):
+    """
+    Requests of a history around the one that could not be placed: those
+    concurrent with it and the last few that completed before it was sent
+    """
+    _stuck = records[stuck]
+    _before = sorted((_r for _r in records if _r['complete'] < _stuck['invoke']),
+                     key=lambda _r: _r['complete'])[-before:]
+    _during = [_r for _r in records
+               if _r['complete'] >= _stuck['invoke'] and _r['invoke'] <= _stuck['complete']]
+    return sorted(_before + _during, key=lambda _r: _r['invoke'])
+
+
+def check_history(history, initial=None, max_steps=1000000):
+    """
+    Checks a whole history, one id at a time
+
+    Args:
+        initial (dict): id -> name before the run, ids not in it were absent
+
+    Returns:
+        dict: id -> check_key() result, with 'records' the requests on the id
+    """
+    initial = initial or {}
+    by_id = {}
+    for _record in history:
+        by_id.setdefault(_record['id'], []).append(_record)
+    results = {}
+    for _id, _records in sorted(by_id.items()):
+        _result = check_key(_records, initial.get(_id), max_steps)
+        _result['records'] = _records
+        results[_id] = _result
+    return results
+
+
+def format_record(record, start=0.0):
+    "One line description of a request of the history"
+    _complete = record['complete']
+    _complete = "..." if _complete == NEVER else f"{(_complete - start) * 1000:.1f}"
+    _sent = f" {record['name']!r}" if record['op'] in (CREATE, UPDATE) else ""
+    _value = f" -> {record['value']!r}" if record['op'] == READ and record['status'] == 200 else ""
+    return (f"[{(record['invoke'] - start) * 1000:.1f}, {_complete}] ms client {record['client']}"
+            f" {record['op']} {record['id']}{_sent}: {record['status']}{_value}")
+
+
+###############################################################################
+# Run
+class Stress():
+    """
+    Drives concurrent clients at a set of ids and records their history
+    """
+    def __init__(self, send, ids, n_clients=8, seed=None, mix=None):
+        """
+        Args:
+            send (callable): send(client, op, id, name) -> (status, name)
+                where name is the one returned by a successful read. status
+                is None when there was no response
+            ids (list): Ids the clients race on
+            n_clients (int): Concurrent clients
+            seed (int): Seed of the choices of the clients
+            mix (dict): op -> weight
+        """
+        self.send = send
+        self.ids = list(ids)
+        self.n_clients = n_clients
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.mix = mix or DEFAULT_MIX
+        self.history = []
+        self.__lock = threading.Lock()
+
+    def _client(self, client, deadline, max_ops):
+        rng = random.Random(self.seed * 1000003 + client)
+        _ops = list(self.mix)
+        _weights = [self.mix[_op] for _op in _ops]
+        history = []
+        seq = 0
+        while time.perf_counter() < deadline and (max_ops is None or seq < max_ops):
+            seq += 1
+            op = rng.choices(_ops, _weights)[0]
+            _id = rng.choice(self.ids)
+            # Unique per request, so every read tells which write it saw
+            name = f"s{client}-{seq}" if op in (CREATE, UPDATE) else None
+            _invoke = time.perf_counter()
+            status, value = self.send(client, op, _id, name)
+            _complete = time.perf_counter() if status is not None else NEVER
+            history.append({'client': client, 'op': op, 'id': _id, 'name': name,
+                            'invoke': _invoke, 'complete': _complete, 'status': status, 'value': value})
+        with self.__lock:
+            self.history.extend(history)
+
+    def run(self, duration, max_ops=None):
+        """
+        Runs the clients for duration seconds, or max_ops requests each
+
+        Returns:
+            dict: Figures of the run
+        """
+        self.history = []
+        _start = time.perf_counter()
+        _deadline = _start + duration
+        with ThreadPoolExecutor(max_workers=self.n_clients) as _pool:
+            list(_pool.map(lambda _client: self._client(_client, _deadline, max_ops),
+                           range(self.n_clients)))
+        _elapsed = time.perf_counter() - _start
+        self.history.sort(key=lambda _r: _r['invoke'])
+        return {
+            'seed': self.seed,
+            'start': _start,
+            'elapsed': _elapsed,
+            'ops': len(self.history),
+            'ops_per_s': len(self.history) / _elapsed if _elapsed else 0.0,
+        }
+
+
+def summary(history):
+    """
+    Returns:
+        dict: op -> {'count', 'latencies' (ms, sorted), 'statuses'}
+    """
+    _summary = {}
+    for _record in history:
+        _op = _summary.setdefault(_record['op'], {'count': 0, 'latencies': [], 'statuses': {}})
+        _op['count'] += 1
+        _op['statuses'][_record['status']] = _op['statuses'].get(_record['status'], 0) + 1
+        if _record['complete'] != NEVER:
+            _op['latencies'].append((_record['complete'] - _record['invoke']) * 1000)
+    for _op in _summary.values():
+        _op['latencies'].sort()
+    return _summary
+
+
+def anomalies(history):
+    """
+    Requests that were not answered, or got a 5xx other than load shedding
+    """
+    return [_record for _record in history if _unknown(_record)]
+
+
+def save_history(path, history, start=0.0):
+    "Writes a history as JSON lines, times in ms from start"
+    with open(path, 'w') as _f:
+        for _record in history:
+            _line = dict(_record, invoke=(_record['invoke'] - start) * 1000,
+                         complete=None if _record['complete'] == NEVER else (_record['complete'] - start) * 1000)
+            _f.write(json.dumps(_line) + '\n')
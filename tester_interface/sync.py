@@ -0,0 +1,139 @@
+"""
+Local mirror of the blog, kept up to date from the change log of the API
+
+GET /blog/changes/?since=<seq> returns the changes after seq, in order,
+each with its category or post as it is now (null if deleted since).
+Applying them in order brings a copy made at any earlier point up to date.
+
+A SyncClient starts from a full scan, taken after reading the last seq of
+the log, then follows the log from that seq. Changes made during the scan
+are applied again, which does no harm as each carries the current state.
+If the log is found behind the seq the client got to, the database was
+reset, and the client starts over with a scan.
+
+verify() compares a mirror with a full scan taken once writes stopped.
+"""
+import threading
+import time
+
+CATEGORY = 'category'
+POST = 'post'
+DELETE = 'delete'
+
+
+class Mirror():
+    """
+    Categories and posts by id, as dicts like the API returns them
+    """
+    def __init__(self):
+        self.items = {CATEGORY: {}, POST: {}}
+        self.seq = 0
+
+    def load(self, categories, posts, seq):
+        self.items = {
+            CATEGORY: {_c['id']: _c for _c in categories},
+            POST: {_p['id']: _p for _p in posts},
+        }
+        self.seq = seq
+
+    def apply(self, change):
+        _items = self.items[change['kind']]
+        _item = change.get(change['kind'])
+        if change['action'] == DELETE or _item is None:
+            _items.pop(change['id'], None)
+        else:
+            _items[change['id']] = _item
+        self.seq = change['seq']
+
+
+class SyncClient():
+    """
+    Keeps a Mirror up to date
+    """
+    def __init__(self, fetch_changes, fetch_scan, limit=100):
+        """
+        Args:
+            fetch_changes (callable): fetch_changes(since, limit, wait) ->
+                body of GET /blog/changes/ as a dict
+            fetch_scan (callable): fetch_scan() -> (categories, posts) as
+                lists of dicts
+            limit (int): Changes asked for per request
+        """
+        self.fetch_changes = fetch_changes
+        self.fetch_scan = fetch_scan
+        self.limit = limit
+        self.mirror = Mirror()
+        self.stats = {'scans': 0, 'polls': 0, 'changes': 0, 'resets': 0}
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def bootstrap(self):
+        "Loads the mirror from a full scan"
+        _seq = self.fetch_changes(0, 0, 0)['last_seq']
+        _categories, _posts = self.fetch_scan()
+        self.mirror.load(_categories, _posts, _seq)
+        self.stats['scans'] += 1
+
+    def poll(self, wait=0):
+        """
+        Applies the next page of changes, waiting up to wait seconds for one
+
+        Returns:
+            int: Changes applied
+        """
+        _page = self.fetch_changes(self.mirror.seq, self.limit, wait)
+        self.stats['polls'] += 1
+        if _page['last_seq'] < self.mirror.seq:
+            self.stats['resets'] += 1
+            self.bootstrap()
+            return 0
+        for _change in _page['changes']:
+            self.mirror.apply(_change)
+        self.stats['changes'] += len(_page['changes'])
+        return len(_page['changes'])
+
+    def catch_up(self):
+        "Applies changes until there are none left"
+        while self.poll() == self.limit:
+            pass
+
+    def start(self, wait=1):
+        "Follows the log from a thread until stop()"
+        self.__stop.clear()
+
+        def _follow():
+            while not self.__stop.is_set():
+                try:
+                    self.poll(wait)
+                except Exception:
+                    # Such as a timeout, the next poll starts from the same seq
+                    time.sleep(0.1)
+        self.__thread = threading.Thread(target=_follow, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+
+def verify(mirror, categories, posts):
+    """
+    Compares a mirror with a full scan
+
+    Returns:
+        list: One message per difference, empty if they match
+    """
+    errors = []
+    for _kind, _scanned in ((CATEGORY, categories), (POST, posts)):
+        _scanned = {_item['id']: _item for _item in _scanned}
+        _mirrored = mirror.items[_kind]
+        for _id in sorted(set(_scanned) | set(_mirrored)):
+            if _id not in _mirrored:
+                errors.append(f"{_kind} {_id} missing from the mirror")
+            elif _id not in _scanned:
+                errors.append(f"{_kind} {_id} is in the mirror but was deleted")
+            elif _mirrored[_id] != _scanned[_id]:
+                errors.append(f"{_kind} {_id} differs: mirror {_mirrored[_id]}, scan {_scanned[_id]}")
+    return errors
@@ -0,0 +1,181 @@
+"""
+Pre-built requests for the tester
+
+Building a request used to cost two urljoin calls for its URL and a
+json.dumps of a fresh dict for its body, and random payloads were built one
+random.choice call per character. At the rates of the load scenarios that
+is what limits how fast one client can go. Instead:
+
+    * UrlTemplate joins the base URL and the static part of a route once,
+      only the parameters are put in per request
+    * JsonTemplate encodes a body once, with holes for its fields. Only the
+      fields are encoded per request, the result is sent as is
+    * random_bytes and random_text build random payloads from random bytes,
+      mapped to an alphabet with bytes.translate
+
+See benchmarks/client_rate.py for how many requests one core builds and
+sends per second.
+"""
+import functools
+import json
+import random
+import re
+import string
+from json.encoder import encode_basestring_ascii
+from urllib.parse import urljoin
+
+LETTERS = string.ascii_lowercase + string.ascii_uppercase
+
+_PARAM = re.compile(r"{(\w+)}")
+
+
+class UrlTemplate():
+    """
+    URL of a route with parameters, such as "/api/blog/categories/{id}"
+
+    Parameters are put in with str(), as urljoin did with ids and names of
+    letters. They aren't quoted, so invalid values reach the API unchanged
+    """
+    def __init__(self, base_url, route):
+        """
+        Args:
+            base_url (str): Such as "http://localhost:8888/"
+            route (str): Path of the route, parameters in braces
+        """
+        self.route = route
+        _parts = _PARAM.split(route)
+        # Literals at even positions, parameter names at odd ones
+        self.params = tuple(_parts[1::2])
+        self.prefix = urljoin(base_url, _parts[0])
+        self.__literals = tuple(_parts[2::2])
+
+    def __call__(self, *args, **kwargs):
+        """
+        Returns:
+            str: URL with the parameters, by position or by name
+        """
+        if kwargs:
+            args = args + tuple(kwargs[_name] for _name in self.params[len(args):])
+        if len(args) != len(self.params):
+            raise TypeError(f"{self.route} takes {len(self.params)} parameters, got {len(args)}")
+        _url = self.prefix
+        for _value, _literal in zip(args, self.__literals):
+            _url += str(_value) + _literal
+        return _url
+
+    def __repr__(self):
+        return f"UrlTemplate({self.prefix!r}, {self.route!r})"
+
+
+class Field():
+    """
+    Hole of a JsonTemplate, filled in by name when rendering
+    """
+    def __init__(self, name):
+        self.name = name
+
+
+def _encode_value(value):
+    "JSON of a single field, with fast paths for strings and integers"
+    if value.__class__ is str:
+        return encode_basestring_ascii(value)
+    if value.__class__ is int:
+        return str(value)
+    return json.dumps(value, separators=(',', ':'))
+
+
+class JsonTemplate():
+    """
+    JSON body encoded once, with Field holes
+
+        body = JsonTemplate({'id': Field('id'), 'name': Field('name')})
+        body.render(id=4, name="Tech") == b'{"id":4,"name":"Tech"}'
+
+    Fields can have any JSON value, not only the types of the model, so
+    invalid bodies can be rendered too. Output is ASCII, as with json=
+    """
+    def __init__(self, template):
+        """
+        Args:
+            template: JSON serializable value, Field instances anywhere in it
+        """
+        self.fields = []
+        _markers = {}
+
+        def _mark(value):
+            if isinstance(value, Field):
+                _marker = f"\x00{len(_markers)}\x00"
+                _markers[_marker] = value.name
+                self.fields.append(value.name)
+                return _marker
+            if isinstance(value, dict):
+                return {_key: _mark(_value) for _key, _value in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [_mark(_value) for _value in value]
+            return value
+
+        _encoded = json.dumps(_mark(template), separators=(',', ':'))
+        # Markers end up as quoted strings, split on them
+        _split = re.compile('|'.join(re.escape(encode_basestring_ascii(_marker)) for _marker in _markers))
+        if _markers:
+            _literals = _split.split(_encoded)
+        else:
+            _literals = [_encoded]
+        self.__literals = tuple(_literal.encode('ascii') for _literal in _literals)
+        self.__order = tuple(_markers[json.loads(_match.group(0))] for _match in _split.finditer(_encoded)) \
+            if _markers else ()
+
+    def render(self, **fields):
+        """
+        Returns:
+            bytes: Body with every field filled in
+        """
+        _literals = self.__literals
+        _parts = [_literals[0]]
+        for _idx, _name in enumerate(self.__order):
+            _parts.append(_encode_value(fields[_name]).encode('ascii'))
+            _parts.append(_literals[_idx + 1])
+        return b"".join(_parts)
+
+
+###############################################################################
+# Random payloads
+@functools.lru_cache(maxsize=32)
+def _translation(alphabet):
+    """
+    Table mapping bytes to the alphabet, and the bytes to drop: those past
+    the last whole multiple of len(alphabet), so every character is as likely
+    """
+    _alphabet = alphabet.encode('ascii')
+    if not 0 < len(_alphabet) <= 256:
+        raise ValueError("Alphabet must have between 1 and 256 ASCII characters")
+    _usable = 256 - 256 % len(_alphabet)
+    _table = bytes(_alphabet[_byte % len(_alphabet)] if _byte < _usable else 0 for _byte in range(256))
+    return _table, bytes(range(_usable, 256))
+
+
+def random_bytes(size, alphabet=LETTERS, rng=None):
+    """
+    Random payload of size characters of alphabet
+
+    Args:
+        alphabet (str): ASCII characters to pick from
+        rng (random.Random): Source of randomness, the random module if None
+
+    Returns:
+        bytes
+    """
+    rng = rng or random
+    _table, _delete = _translation(alphabet)
+    out = bytearray()
+    while len(out) < size:
+        # A few more than needed, as some are dropped
+        _n = size - len(out) + (size - len(out)) // 4 + 8
+        out += rng.getrandbits(_n * 8).to_bytes(_n, 'little').translate(_table, _delete)
+    del out[size:]
+    return bytes(out)
+
+
+def random_text(size, alphabet=LETTERS, rng=None):
+    "random_bytes() as a str"
+    return random_bytes(size, alphabet, rng).decode('ascii')